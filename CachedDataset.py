@@ -71,7 +71,9 @@ class CachedDataset(Dataset):
       self._update_tag_idx()
       seq_index = [self._tag_idx[tag] for tag in seq_list]
     else:
-      seq_index = self.get_seq_order_for_epoch(epoch, self._num_seqs, lambda s: self._get_seq_length_by_real_idx(s)[0])
+      seq_index = self.get_seq_order_for_epoch(
+        epoch, self._num_seqs, lambda s: self._get_seq_length_by_real_idx(s)[0],
+        seq_lens=self._get_all_seq_lens_by_real_idx())
 
     old_index_map = self._index_map[:]
     self._index_map = range(len(seq_index))  # sorted seq idx -> seq_index idx
@@ -100,6 +102,14 @@ class CachedDataset(Dataset):
         return False
     return True
 
+  def _get_all_seq_lens_by_real_idx(self):
+    """
+    :return: real seq idx -> len of the input data, or None if this is not directly available.
+      See :func:`get_seq_order_for_epoch`.
+    :rtype: numpy.ndarray|None
+    """
+    return None
+
   def get_current_seq_order(self):
     assert self.cache_byte_size_limit_at_start == 0  # not implemented otherwise, we ignore _index_map
     return self._seq_index
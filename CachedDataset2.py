@@ -6,6 +6,8 @@ Provides :class:`CachedDataset2`.
 from Dataset import Dataset, DatasetSeq
 from threading import Condition
 import typing
+import sys
+import TaskSystem
 try:
   # noinspection PyCompatibility
   from _thread import interrupt_main
@@ -26,9 +28,21 @@ class CachedDataset2(Dataset):
   - handle seq ordering by overriding `init_seq_order`
   - you can set `_estimated_num_seqs`
   - you can set `_num_seqs` or `_num_timesteps` if you know them in advance
+  - you can override `_init_worker_proc` if you use `num_workers` and e.g. need to reopen files
+
+  With `num_workers` > 0, `_collect_single_seq` runs in forked sub processes.
+  Seq `seq_idx` is always collected by worker `seq_idx % num_workers`,
+  and the workers are forked after each `init_seq_order`,
+  so the result is deterministic and in order.
+  The arrays are transferred via :class:`TaskSystem.SharedNumpyArray`
+  if `TaskSystem.SharedMemNumpyConfig` is enabled (e.g. via the EnableAutoNumpySharedMemPickling option).
   """
 
-  def __init__(self, **kwargs):
+  def __init__(self, num_workers=0, num_prefetch_seqs=None, **kwargs):
+    """
+    :param int num_workers: if > 0, collect the seqs in this many sub processes
+    :param int|None num_prefetch_seqs: with num_workers, how many seqs to load ahead. 4 * num_workers by default
+    """
     super(CachedDataset2, self).__init__(**kwargs)
     self._num_timesteps = None
     self.epoch = None
@@ -36,6 +50,12 @@ class CachedDataset2(Dataset):
     self.added_data = []  # type: typing.List[DatasetSeq]
     self.expected_load_seq_start = 0
     self._num_timesteps_accumulated = 0
+    self.num_workers = num_workers
+    self.num_prefetch_seqs = num_prefetch_seqs or 4 * num_workers
+    assert self.num_prefetch_seqs >= num_workers >= 0
+    self._workers = None  # type: typing.Optional[typing.List[TaskSystem.AsyncTask]]
+    self._workers_recv_seq_idx = 0  # next seq idx we expect to receive
+    self._workers_request_seq_idx = 0  # next seq idx we would request
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -48,6 +68,8 @@ class CachedDataset2(Dataset):
     Call this when you reset the seq list.
     """
     super(CachedDataset2, self).init_seq_order(epoch=epoch, seq_list=seq_list)
+    # The workers are forked lazily, after the derived class has finished its init_seq_order.
+    self._exit_workers()
     if not epoch:
       epoch = 1
     self.expected_load_seq_start = 0
@@ -58,6 +80,13 @@ class CachedDataset2(Dataset):
     self.epoch = epoch
     return True
 
+  def finish_epoch(self):
+    """
+    Called at the end of the epoch.
+    """
+    self._exit_workers()
+    super(CachedDataset2, self).finish_epoch()
+
   def _cleanup_old_seqs(self, seq_idx_end):
     """
     :param int seq_idx_end:
@@ -114,7 +143,10 @@ class CachedDataset2(Dataset):
       self.expected_load_seq_start = start
     if self.added_data:
       start = max(self.added_data[-1].seq_idx + 1, start)
-    seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
+    if self.num_workers > 0:
+      seqs = self._collect_seqs_via_workers(start, end)
+    else:
+      seqs = [self._collect_single_seq(seq_idx=seq_idx) for seq_idx in range(start, end)]
     seqs = list(filter(None, seqs))  # We might not know the num seqs in advance.
     self._num_timesteps_accumulated += sum([seq.num_frames for seq in seqs])
     self.added_data += seqs
@@ -149,6 +181,116 @@ class CachedDataset2(Dataset):
     """
     raise NotImplementedError
 
+  def _init_worker_proc(self):
+    """
+    Called in the forked worker process (see `num_workers`), before any `_collect_single_seq`.
+    Override this e.g. to reopen file handles, which would otherwise share the file offset with the parent.
+    """
+
+  def _start_workers(self):
+    """
+    Forks the worker processes. The dataset state (e.g. the seq order) is copied that way.
+    """
+    assert self._workers is None
+    self._workers = [
+      TaskSystem.AsyncTask(
+        func=self._worker_proc_loop,
+        name="%s %s collect seq worker %i/%i" % (self.__class__.__name__, self.name, i + 1, self.num_workers))
+      for i in range(self.num_workers)]
+    self._workers_recv_seq_idx = self._workers_request_seq_idx = self.expected_load_seq_start
+
+  def _exit_workers(self):
+    """
+    Receives all pending seqs (such that the workers are not stuck in sending) and lets the workers exit.
+    """
+    if self._workers is None:
+      return
+    self._workers_recv_pending(self._workers_request_seq_idx, discard=True)
+    for worker in self._workers:
+      worker.put(("exit",))
+    for worker in self._workers:
+      worker.join()
+    self._workers = None
+
+  def _workers_recv_pending(self, end, discard=False):
+    """
+    :param int end: receive all pending seqs until this seq idx (exclusive)
+    :param bool discard: ignore the received seqs (and errors)
+    :return: received seqs, in order
+    :rtype: list[DatasetSeq|None]
+    """
+    seqs = []
+    while self._workers_recv_seq_idx < min(end, self._workers_request_seq_idx):
+      seq_idx = self._workers_recv_seq_idx
+      msg = self._workers[seq_idx % self.num_workers].get()
+      self._workers_recv_seq_idx += 1
+      if discard:
+        if msg[0] == "seq" and msg[1] is not None:
+          for value in msg[1].features.values():
+            TaskSystem.numpy_set_unused(value)
+        continue
+      if msg[0] == "error":
+        raise Exception("%s: worker failed to collect seq %i:\n%s" % (self, seq_idx, msg[1]))
+      assert msg[0] == "seq"
+      seq = msg[1]  # type: typing.Optional[DatasetSeq]
+      if seq is not None:
+        assert seq.seq_idx == seq_idx
+        # Copy out of the shared memory, such that the worker can reuse it.
+        seq.features = TaskSystem.numpy_copy_and_set_unused(seq.features)
+      seqs.append(seq)
+    return seqs
+
+  def _collect_seqs_via_workers(self, start, end):
+    """
+    :param int start: inclusive seq idx start
+    :param int end: exclusive seq idx end
+    :rtype: list[DatasetSeq|None]
+    """
+    if self._workers is None:
+      self._start_workers()
+    if start != self._workers_recv_seq_idx:
+      # Not a continuation of the prefetched seqs. Discard them.
+      self._workers_recv_pending(self._workers_request_seq_idx, discard=True)
+      self._workers_recv_seq_idx = self._workers_request_seq_idx = start
+    request_end = end + self.num_prefetch_seqs
+    if self._num_seqs is not None:
+      request_end = min(request_end, max(end, self._num_seqs))
+    while self._workers_request_seq_idx < request_end:
+      seq_idx = self._workers_request_seq_idx
+      self._workers[seq_idx % self.num_workers].put(("collect", seq_idx))
+      self._workers_request_seq_idx += 1
+    return self._workers_recv_pending(end)
+
+  def _worker_proc_loop(self, task):
+    """
+    Runs in the forked worker process.
+
+    :param TaskSystem.AsyncTask task:
+    """
+    # We are a copy of the parent dataset. Collect everything in this process.
+    self.num_workers = 0
+    self._workers = None
+    parent_shared_instances = set(TaskSystem.SharedNumpyArray.ServerInstances)
+    self._init_worker_proc()
+    try:
+      while True:
+        msg = task.get()
+        if msg[0] == "exit":
+          break
+        assert msg[0] == "collect"
+        # noinspection PyBroadException
+        try:
+          seq = self._collect_single_seq(seq_idx=msg[1])
+        except Exception:
+          import traceback
+          task.put(("error", "".join(traceback.format_exception(*sys.exc_info()))))
+        else:
+          task.put(("seq", seq))
+    finally:
+      # The process will exit via os._exit(), i.e. the atexit handlers of SharedMem would not run.
+      for inst in TaskSystem.SharedNumpyArray.ServerInstances - parent_shared_instances:
+        inst.mem.remove()
+
   def get_num_timesteps(self):
     """
     :rtype: int
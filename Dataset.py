@@ -89,7 +89,10 @@ class Dataset(object):
                seq_list_filter_file=None, unique_seq_tags=False,
                seq_order_seq_lens_file=None,
                shuffle_frames_of_nseqs=0, min_chunk_size=0, chunking_variance=0,
-               estimated_num_seqs=None):
+               estimated_num_seqs=None, vectorized_batching=False, seq_index_cache=None,
+               num_shards=1, shard_index=0,
+               bucket_batching=None, bucket_batching_window=10000,
+               packed_batching=None):
     """
     :param str name: e.g. "train" or "eval"
     :param int window: features will be of dimension window * feature_dim, as we add a context-window around.
@@ -108,6 +111,27 @@ class Dataset(object):
     :param str|None seq_order_seq_lens_file: for seq order, use the seq length given by this file
     :param int shuffle_frames_of_nseqs: shuffles the frames. not always supported
     :param None|int estimated_num_seqs: for progress reporting in case the real num_seqs is unknown
+    :param bool vectorized_batching: use :func:`plan_recurrent_batches` in :func:`_generate_batches`.
+      This results in exactly the same batches, but is much faster for a large number of seqs.
+    :param bool|str|None seq_index_cache: if enabled, datasets which support this (e.g. OggZipDataset)
+      store their parsed corpus meta information (seq tags, seq lens, ...) on disk via :class:`SeqIndexCache`
+      and reuse it in later runs. If this is a str, it is the cache directory.
+    :param int num_shards: if >1, :func:`get_seq_order_for_epoch` only returns the seqs of our shard.
+      E.g. with Horovod and ``horovod_dataset_distribution = "dataset_shard"``, this is set to the number of ranks.
+      See :func:`_apply_shard`.
+    :param int shard_index: our shard, 0 <= shard_index < num_shards. E.g. the Horovod rank.
+    :param int|list[int]|None bucket_batching: if set, :func:`_generate_batches` (recurrent case)
+      groups the seqs into length buckets, and builds the batches within each bucket, to minimize padding.
+      If this is an int, it is the number of buckets, with the bucket boundaries at the seq len quantiles.
+      Otherwise, it is the list of (inclusive) upper bucket boundaries (in frames, max over the data keys).
+      See :func:`_generate_batches_bucketed`.
+    :param int|None bucket_batching_window: bucket_batching is done within windows of this many seqs (or chunks)
+      in the order of the epoch. All seqs of a window are loaded at the same time. None means the whole epoch.
+    :param int|dict[str,int]|None packed_batching: if set, :func:`_generate_batches` (recurrent case)
+      concatenates multiple seqs into one batch row, up to this many frames per row.
+      The network can get the segment boundaries via the extra data keys "<key>_segment_ids"
+      and "<key>_segment_positions" (see :func:`get_packed_seqs_base_key`).
+      See :func:`_generate_batches_packed`.
     """
     self.name = name or ("dataset_id%s" % id(self))
     self.lock = RLock()  # Used when manipulating our data potentially from multiple threads.
@@ -122,6 +146,8 @@ class Dataset(object):
     self.partition_epoch = partition_epoch or 1
     self.repeat_epoch = repeat_epoch or 1
     self.seq_tags_filter = set(self._load_seq_list_file(seq_list_filter_file)) if seq_list_filter_file else None
+    # Seq tags to skip, e.g. set by Engine.search when resuming a partially written output file.
+    self.seq_tags_exclude = None  # type: typing.Optional[typing.Set[str]]
     self.unique_seq_tags = unique_seq_tags
     self._seq_order_seq_lens_file = seq_order_seq_lens_file
     self._seq_order_seq_lens_by_idx = None
@@ -166,6 +192,15 @@ class Dataset(object):
     assert isinstance(self.ctx_left, NumbersDict)
     assert isinstance(self.ctx_right, NumbersDict)
     self.shuffle_frames_of_nseqs = shuffle_frames_of_nseqs
+    self.vectorized_batching = vectorized_batching
+    self.seq_index_cache = seq_index_cache
+    self.num_shards = num_shards
+    self.shard_index = shard_index
+    self.bucket_batching = bucket_batching
+    self.bucket_batching_window = bucket_batching_window
+    self.packed_batching = packed_batching
+    assert not (bucket_batching and packed_batching), "%s: bucket_batching and packed_batching exclude each other" % self
+    assert 0 <= self.shard_index < self.num_shards
     self.epoch = None
 
   def __repr__(self):
@@ -361,7 +396,19 @@ class Dataset(object):
       self._seq_order_seq_lens_by_idx = [seq_lens[tag] for tag in all_tags]
     return self._seq_order_seq_lens_by_idx[seq_idx]
 
-  def get_seq_order_for_epoch(self, epoch, num_seqs, get_seq_len=None):
+  def _get_seq_index_cache(self, opts, files):
+    """
+    :param dict[str] opts: all dataset options which influence the cached content
+    :param list[str] files: all files which are read to get the cached content
+    :return: cache, if enabled via the seq_index_cache option
+    :rtype: SeqIndexCache|None
+    """
+    if not self.seq_index_cache:
+      return None
+    cache_dir = self.seq_index_cache if isinstance(self.seq_index_cache, str) else None
+    return SeqIndexCache(name=self.__class__.__name__, opts=opts, files=files, cache_dir=cache_dir)
+
+  def get_seq_order_for_epoch(self, epoch, num_seqs, get_seq_len=None, seq_lens=None):
     """
     Returns the order of the given epoch.
     This is mostly a static method, except that is depends on the configured type of ordering,
@@ -370,6 +417,9 @@ class Dataset(object):
     :param int epoch: for 'random', this determines the random seed
     :param int num_seqs:
     :param ((int) -> int)|None get_seq_len: function (originalSeqIdx: int) -> int
+    :param numpy.ndarray|list[int]|list[float]|None seq_lens: (num_seqs,), originalSeqIdx -> len.
+      Alternative to get_seq_len. The sorting is then done with numpy, which is much faster.
+      The resulting order is the same as with get_seq_len. Float lens (e.g. durations) are kept as floats.
     :return: the order for the given epoch. such that seq_idx -> underlying idx
     :rtype: list[int]
     """
@@ -383,7 +433,30 @@ class Dataset(object):
     assert num_seqs > 0
     seq_index = list(range(num_seqs))  # type: typing.List[int]  # the real seq idx after sorting
     if self._seq_order_seq_lens_file:
-      get_seq_len = self._get_seq_order_seq_lens_by_idx
+      self._get_seq_order_seq_lens_by_idx(0)  # init
+      get_seq_len = None
+      seq_lens = self._seq_order_seq_lens_by_idx
+    if seq_lens is not None:
+      seq_lens = numpy.asarray(seq_lens)
+      # Keep float lens (e.g. durations from seq_order_seq_lens_file), as truncating them would change the order.
+      seq_lens = seq_lens.astype("int64" if seq_lens.dtype.kind in "iub" else "float64")
+      assert seq_lens.shape[0] >= num_seqs
+
+    def sort_by_seq_len(index, reverse=False):
+      """
+      Stable sort, like list.sort(key=get_seq_len, reverse=reverse).
+
+      :param list[int] index:
+      :param bool reverse:
+      :rtype: list[int]
+      """
+      if seq_lens is None:
+        assert get_seq_len
+        return sorted(index, key=get_seq_len, reverse=reverse)
+      index = numpy.array(index, dtype="int64")
+      lens = seq_lens[index]
+      return index[numpy.argsort(-lens if reverse else lens, kind="stable")].tolist()
+
     if self.seq_ordering == 'default':
       pass  # Keep order as-is.
     elif self.seq_ordering.startswith("default_every_n:"):
@@ -398,14 +471,11 @@ class Dataset(object):
     elif self.seq_ordering == 'reverse':
       seq_index = list(reversed(seq_index))
     elif self.seq_ordering == 'sorted':
-      assert get_seq_len
-      seq_index.sort(key=get_seq_len)  # sort by length, starting with shortest
+      seq_index = sort_by_seq_len(seq_index)  # sort by length, starting with shortest
     elif self.seq_ordering == "sorted_reverse":
-      assert get_seq_len
-      seq_index.sort(key=get_seq_len, reverse=True)  # sort by length, in reverse, starting with longest
+      seq_index = sort_by_seq_len(seq_index, reverse=True)  # sort by length, in reverse, starting with longest
     elif self.seq_ordering.startswith('sort_bin_shuffle'):
       # Shuffle seqs, sort by length, and shuffle bins (then shuffle seqs within each bin if sort_bin_shuffle_x2).
-      assert get_seq_len
       tmp = self.seq_ordering.split(':')[1:]
       # Keep this deterministic! Use fixed seed.
       if len(tmp) <= 1:
@@ -415,7 +485,7 @@ class Dataset(object):
       rnd_seed = ((full_epoch - 1) // nth + 1) if full_epoch else 1
       rnd = Random(rnd_seed + self.random_seed_offset)
       rnd.shuffle(seq_index)  # Shuffle sequences.
-      seq_index.sort(key=get_seq_len)  # Sort by length, starting with shortest.
+      seq_index = sort_by_seq_len(seq_index)  # Sort by length, starting with shortest.
       if len(tmp) == 0:
         bins = 2
       else:
@@ -436,7 +506,6 @@ class Dataset(object):
         out_index += part
       seq_index = out_index
     elif self.seq_ordering.startswith('laplace'):
-      assert get_seq_len
       tmp = self.seq_ordering.split(':')[1:]
       if len(tmp) == 0:
         bins = 2
@@ -458,7 +527,7 @@ class Dataset(object):
           part = seq_index[i * len(seq_index) // bins:][:]
         else:
           part = seq_index[i * len(seq_index) // bins:(i + 1) * len(seq_index) // bins][:]
-        part.sort(key=get_seq_len, reverse=(i % 2 == 1))
+        part = sort_by_seq_len(part, reverse=(i % 2 == 1))
         out_index += part
       seq_index = out_index
     elif self.seq_ordering.startswith('random'):
@@ -491,8 +560,60 @@ class Dataset(object):
       seq_index = [i for i in seq_index if all_seq_tags[i] in self.seq_tags_filter]
       assert seq_index, "%s: empty after applying seq_list_filter_file. Example filter tags: %r, used tags: %r" % (
         self, sorted(self.seq_tags_filter)[:3], [all_seq_tags[i] for i in old_seq_index[:3]])
+    if self.seq_tags_exclude:
+      # Note: Like seq_tags_filter, this requires that get_all_tags is implemented.
+      all_seq_tags = self.get_all_tags()
+      seq_index = [i for i in seq_index if all_seq_tags[i] not in self.seq_tags_exclude]
+    if self.num_shards > 1:
+      shard_seq_lens = None
+      if seq_lens is not None:
+        shard_seq_lens = seq_lens[numpy.array(seq_index, dtype="int64")]
+      elif get_seq_len and self._seq_ordering_uses_seq_lens():
+        # The lens were already needed for the ordering, so this should be cheap.
+        shard_seq_lens = [get_seq_len(i) for i in seq_index]
+      seq_index = self._apply_shard(
+        seq_index, shard_index=self.shard_index, num_shards=self.num_shards, seq_lens=shard_seq_lens)
     return seq_index
 
+  def _seq_ordering_uses_seq_lens(self):
+    """
+    :return: whether :func:`get_seq_order_for_epoch` needs the seq lens for the current seq_ordering
+    :rtype: bool
+    """
+    return (
+      self.seq_ordering in ("sorted", "sorted_reverse") or
+      self.seq_ordering.startswith("sort_bin_shuffle") or self.seq_ordering.startswith("laplace"))
+
+  @classmethod
+  def _apply_shard(cls, seq_index, shard_index, num_shards, seq_lens=None):
+    """
+    Every shard gets a subsequence of seq_index, i.e. the order (e.g. sorted or laplace) is kept within each shard.
+    Every shard computes the same full seq_index, thus the split is consistent without any communication.
+
+    If the seq lens are given, we balance the total number of frames per shard:
+    We go through the seqs in order, and each seq goes to the shard with the least frames so far.
+    This is what matters for the number of steps, when the batches are limited by ``batch_size`` in frames.
+    Otherwise, the number of seqs per shard is balanced.
+
+    :param list[int] seq_index: full list of ordered sequence indices
+    :param int shard_index:
+    :param int num_shards:
+    :param numpy.ndarray|list[int]|None seq_lens: len of seq_index[i]
+    :return: seq indices of our shard
+    :rtype: list[int]
+    """
+    if seq_lens is None:
+      return seq_index[shard_index::num_shards]
+    assert len(seq_lens) == len(seq_index)
+    shard_num_frames = [0] * num_shards
+    out_index = []
+    for seq_idx, seq_len in zip(seq_index, seq_lens):
+      shard = shard_num_frames.index(min(shard_num_frames))
+      shard_num_frames[shard] += int(seq_len)
+      if shard == shard_index:
+        out_index.append(seq_idx)
+    return out_index
+
   @classmethod
   def _apply_partition_epoch(cls, seq_index, partition_epoch, epoch):
     """
@@ -939,6 +1060,9 @@ class Dataset(object):
     chunk_step = NumbersDict(chunk_step)
     chunk_size_orig = chunk_size.copy()
     chunk_step_orig = chunk_step.copy()
+    if used_data_keys is not None and self.packed_batching:
+      # The packed seqs keys are not provided by the dataset itself, see get_packed_seqs_base_key.
+      used_data_keys = {k for k in used_data_keys if not get_packed_seqs_base_key(k)}
 
     s = 0
     while self.is_less_than_num_seqs(s):
@@ -1080,6 +1204,30 @@ class Dataset(object):
       if chunk_size != 0:
         print("Non-recurrent network, chunk size %s:%s ignored" % (chunk_size, chunk_step), file=log.v4)
         chunk_size = 0
+    if self.packed_batching and recurrent_net:
+      assert not self.weights and not self.chunking_variance, "%s: packed_batching not supported with this" % self
+      for batch in self._generate_batches_packed(
+            batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+            min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+            chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+        yield batch
+      return
+    if self.bucket_batching and recurrent_net:
+      assert not self.weights and not self.chunking_variance, "%s: bucket_batching not supported with this" % self
+      for batch in self._generate_batches_bucketed(
+            batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+            min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+            chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+        yield batch
+      return
+    if self.vectorized_batching and recurrent_net and not self.weights and not self.chunking_variance:
+      # Note: With weights or chunking_variance, we would need the exact same interleaving of the random calls.
+      for batch in self._generate_batches_vectorized(
+            batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+            min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+            chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys):
+        yield batch
+      return
     batch = Batch()
     total_num_seqs = 0
     last_seq_idx = -1
@@ -1136,6 +1284,327 @@ class Dataset(object):
     if batch.get_all_slices_num_frames().max_value() > 0:
       yield batch
 
+  def _generate_batches_vectorized(self, batch_size, max_seqs, max_seq_length, max_pad_size, min_seq_length,
+                                   seq_drop, max_total_num_seqs, chunk_size, chunk_step, used_data_keys,
+                                   block_size=1000):
+    """
+    Like :func:`_generate_batches` for the recurrent case, and gives exactly the same batches,
+    but the batch boundaries are calculated by :func:`plan_recurrent_batches`.
+    We read the seq lengths in blocks of block_size, so this is still lazy.
+    All arguments are already normalized by :func:`_generate_batches`.
+
+    :param NumbersDict batch_size:
+    :param int|float max_seqs:
+    :param NumbersDict max_seq_length:
+    :param NumbersDict max_pad_size:
+    :param NumbersDict min_seq_length:
+    :param float seq_drop:
+    :param int|float max_total_num_seqs:
+    :param NumbersDict chunk_size:
+    :param NumbersDict chunk_step:
+    :param set(str)|None used_data_keys:
+    :param int block_size:
+    :rtype: typing.Generator[Batch]
+    """
+    rows = []  # type: typing.List[typing.Tuple[int,NumbersDict,NumbersDict]]  # seq_idx, start, length
+    seq_lens = None  # type: typing.Optional[numpy.ndarray]  # (len(rows), len(keys) + 1)
+    for block_rows, block_seq_lens, keys, with_value, limits, finished in self._iterate_recurrent_row_blocks(
+          batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+          min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+          chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys, block_size=block_size):
+      rows.extend(block_rows)
+      if seq_lens is None:
+        seq_lens = block_seq_lens
+      else:
+        seq_lens = numpy.concatenate([seq_lens, block_seq_lens], axis=0)
+      if not rows:
+        continue
+      batch_ends = plan_recurrent_batches(
+        seq_lens, batch_size=limits["batch_size"], max_seqs=max_seqs, max_pad_size=limits["max_pad_size"])
+      if not finished:
+        batch_ends = batch_ends[:-1]  # The last batch might get more seqs from the next block.
+      batch_start = 0
+      for batch_end in batch_ends:
+        batch = self._make_recurrent_batch(
+          rows[batch_start:batch_end], seq_lens[batch_start:batch_end], keys=keys, with_value=with_value)
+        if not finished or batch_end < len(rows) or batch.get_all_slices_num_frames().max_value() > 0:
+          yield batch
+        batch_start = batch_end
+      rows = rows[batch_start:]
+      seq_lens = seq_lens[batch_start:]
+
+  def _generate_batches_bucketed(self, batch_size, max_seqs, max_seq_length, max_pad_size, min_seq_length,
+                                 seq_drop, max_total_num_seqs, chunk_size, chunk_step, used_data_keys):
+    """
+    Bucketing variant of :func:`_generate_batches` for the recurrent case, see ``bucket_batching``.
+    For each window of ``bucket_batching_window`` seqs (in the order of the epoch),
+    the seqs are grouped into length buckets, and sorted by length within each bucket.
+    The batches are built within each bucket by :func:`plan_recurrent_batches`,
+    i.e. with the same limits (batch_size, max_seqs, max_pad_size).
+    The batches of a window are then shuffled, deterministically for the epoch.
+    As the seqs of a batch are not consecutive anymore, every batch of a window
+    loads the window from its start (see :func:`Batch.get_load_seqs_range`).
+    All arguments are already normalized by :func:`_generate_batches`.
+
+    :param NumbersDict batch_size:
+    :param int|float max_seqs:
+    :param NumbersDict max_seq_length:
+    :param NumbersDict max_pad_size:
+    :param NumbersDict min_seq_length:
+    :param float seq_drop:
+    :param int|float max_total_num_seqs:
+    :param NumbersDict chunk_size:
+    :param NumbersDict chunk_step:
+    :param set(str)|None used_data_keys:
+    :rtype: typing.Generator[Batch]
+    """
+    rnd = Random(self._get_random_seed_for_epoch(self.epoch))
+    for window_idx, (rows, seq_lens, keys, with_value, limits, _) in enumerate(self._iterate_recurrent_row_blocks(
+          batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+          min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+          chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys,
+          block_size=self.bucket_batching_window or sys.maxsize)):
+      if not rows:
+        continue
+      lens = numpy.max(seq_lens, axis=1)
+      if isinstance(self.bucket_batching, int):
+        boundaries = numpy.quantile(lens, numpy.linspace(0., 1., self.bucket_batching + 1)[1:-1])
+      else:
+        boundaries = numpy.array(sorted(self.bucket_batching))
+      buckets = numpy.searchsorted(boundaries, lens, side="left")  # bucket i: boundaries[i-1] < len <= boundaries[i]
+      order = numpy.lexsort((lens, buckets))  # by bucket, then by len. stable
+      batches = []
+      for bucket in numpy.unique(buckets):
+        bucket_order = order[buckets[order] == bucket]
+        bucket_seq_lens = seq_lens[bucket_order]
+        batch_ends = plan_recurrent_batches(
+          bucket_seq_lens, batch_size=limits["batch_size"], max_seqs=max_seqs, max_pad_size=limits["max_pad_size"])
+        batch_start = 0
+        for batch_end in batch_ends:
+          batch = self._make_recurrent_batch(
+            [rows[i] for i in bucket_order[batch_start:batch_end]], bucket_seq_lens[batch_start:batch_end],
+            keys=keys, with_value=with_value)
+          batches.append(batch)
+          batch_start = batch_end
+      window_start_seq = min([row[0] for row in rows])
+      for batch in batches:
+        batch.load_seqs_start = window_start_seq
+      rnd.shuffle(batches)
+      for batch in batches:
+        yield batch
+
+  def _generate_batches_packed(self, batch_size, max_seqs, max_seq_length, max_pad_size, min_seq_length,
+                               seq_drop, max_total_num_seqs, chunk_size, chunk_step, used_data_keys,
+                               block_size=1000):
+    """
+    Packing variant of :func:`_generate_batches` for the recurrent case, see ``packed_batching``.
+    Going through the seqs in the order of the epoch, each seq is appended to the first row of the current batch
+    where it fits (up to ``packed_batching`` frames per row, and the batch stays within
+    batch_size (max row len * num rows) and max_pad_size), or otherwise starts a new row.
+    If a new row would exceed batch_size, max_seqs (num rows) or max_pad_size, the current batch is finished.
+    The seq order within each batch is kept, i.e. the batches load consecutive seqs.
+    All arguments are already normalized by :func:`_generate_batches`.
+
+    :param NumbersDict batch_size:
+    :param int|float max_seqs: here the max num of rows
+    :param NumbersDict max_seq_length:
+    :param NumbersDict max_pad_size:
+    :param NumbersDict min_seq_length:
+    :param float seq_drop:
+    :param int|float max_total_num_seqs:
+    :param NumbersDict chunk_size:
+    :param NumbersDict chunk_step:
+    :param set(str)|None used_data_keys:
+    :param int block_size:
+    :rtype: typing.Generator[Batch]
+    """
+    from EngineBatch import BatchSeqCopyPart
+    row_limit = None  # type: typing.Optional[numpy.ndarray]
+    batch_rows = []  # type: typing.List[numpy.ndarray]  # per row: current len, (len(keys) + 1,)
+    batch_parts = []  # type: typing.List[typing.Tuple[int,NumbersDict,NumbersDict,int,numpy.ndarray]]
+    keys = with_value = None
+
+    def make_batch():
+      """
+      :rtype: Batch
+      """
+      batch = Batch()
+      max_lens = numpy.max(batch_rows, axis=0)
+      batch.max_num_frames_per_slice = NumbersDict(
+        numbers_dict={key: int(max_lens[i]) for (i, key) in enumerate(keys)},
+        broadcast_value=int(max_lens[-1]) if with_value else 0)
+      batch.num_slices = len(batch_rows)
+      batch.seqs = [
+        BatchSeqCopyPart(
+          seq_idx=seq_idx, seq_start_frame=t_start, seq_end_frame=t_start + length, batch_slice=row,
+          batch_frame_offset=NumbersDict(
+            numbers_dict={key: int(offset[i]) for (i, key) in enumerate(keys)},
+            broadcast_value=int(offset[-1]) if with_value else 0))
+        for (seq_idx, t_start, length, row, offset) in batch_parts]
+      return batch
+
+    def within_limits(num_rows, max_lens, num_frames):
+      """
+      :param int num_rows:
+      :param numpy.ndarray max_lens: (len(keys) + 1,)
+      :param numpy.ndarray num_frames: (len(keys) + 1,), sum over all rows
+      :rtype: bool
+      """
+      return bool(
+        num_rows <= max_seqs and
+        numpy.all(max_lens * num_rows <= limits["batch_size"]) and
+        numpy.all(max_lens * num_rows - num_frames <= limits["max_pad_size"]))
+
+    for rows, seq_lens, keys, with_value, limits, _ in self._iterate_recurrent_row_blocks(
+          batch_size=batch_size, max_seqs=max_seqs, max_seq_length=max_seq_length, max_pad_size=max_pad_size,
+          min_seq_length=min_seq_length, seq_drop=seq_drop, max_total_num_seqs=max_total_num_seqs,
+          chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys, block_size=block_size):
+      if row_limit is None:
+        row_limit = self._numbers_dict_as_limits(NumbersDict(self.packed_batching), keys, True, numpy.inf)
+      for (seq_idx, t_start, length), seq_len in zip(rows, seq_lens):
+        row = None  # type: typing.Optional[int]
+        if batch_rows:
+          num_frames = numpy.sum(batch_rows, axis=0) + seq_len
+          max_lens = numpy.max(batch_rows, axis=0)
+          for row_, row_len in enumerate(batch_rows):
+            if (numpy.all(row_len + seq_len <= row_limit) and
+                    within_limits(len(batch_rows), numpy.maximum(max_lens, row_len + seq_len), num_frames)):
+              row = row_
+              break
+          else:
+            if not within_limits(len(batch_rows) + 1, numpy.maximum(max_lens, seq_len), num_frames):
+              yield make_batch()
+              batch_rows, batch_parts = [], []
+        if row is None:
+          row = len(batch_rows)
+          batch_rows.append(numpy.zeros_like(seq_len))
+        batch_parts.append((seq_idx, t_start, length, row, batch_rows[row].copy()))
+        batch_rows[row] = batch_rows[row] + seq_len
+    if batch_rows:
+      yield make_batch()
+
+  def _iterate_recurrent_row_blocks(self, batch_size, max_seqs, max_seq_length, max_pad_size, min_seq_length,
+                                    seq_drop, max_total_num_seqs, chunk_size, chunk_step, used_data_keys,
+                                    block_size):
+    """
+    Reads the seqs (or chunks) of the epoch in blocks of block_size,
+    and filters them like :func:`_generate_batches` in the recurrent case
+    (max_seq_length, min_seq_length, seq_drop, max_total_num_seqs).
+    All arguments are already normalized by :func:`_generate_batches`.
+
+    :param NumbersDict batch_size:
+    :param int|float max_seqs:
+    :param NumbersDict max_seq_length:
+    :param NumbersDict max_pad_size:
+    :param NumbersDict min_seq_length:
+    :param float seq_drop:
+    :param int|float max_total_num_seqs:
+    :param NumbersDict chunk_size:
+    :param NumbersDict chunk_step:
+    :param set(str)|None used_data_keys:
+    :param int block_size:
+    :return: yields (rows, seq_lens, keys, with_value, limits, finished) per block,
+      where rows are (seq_idx, start, length), seq_lens is (len(rows), len(keys) + 1),
+      limits are the arguments as arrays (see :func:`_numbers_dict_as_limits`),
+      and finished is True for the last block
+    :rtype: typing.Generator[(list[(int,NumbersDict,NumbersDict)],numpy.ndarray,list[str],bool,dict[str,numpy.ndarray],bool)]
+    """
+    from itertools import islice
+    seq_iter = self.iterate_seqs(chunk_size=chunk_size, chunk_step=chunk_step, used_data_keys=used_data_keys)
+    keys = None  # type: typing.Optional[typing.List[str]]
+    with_value = None  # type: typing.Optional[bool]
+    limits = None  # type: typing.Optional[typing.Dict[str,numpy.ndarray]]
+    total_num_seqs = 0
+    last_seq_idx = -1
+    finished = False
+    while not finished:
+      block = list(islice(seq_iter, block_size))
+      if len(block) < block_size:
+        finished = True
+      block_rows = []
+      block_seq_lens = []
+      for seq_idx, t_start, t_end in block:
+        t_start -= self.ctx_left
+        t_end += self.ctx_right
+        length = t_end - t_start
+        if keys is None:
+          keys = sorted(length.keys())
+          with_value = length.value is not None
+          limits = {
+            "max_seq_length": self._numbers_dict_as_limits(max_seq_length, keys, with_value, numpy.inf),
+            "min_seq_length": self._numbers_dict_as_limits(min_seq_length, keys, with_value, -numpy.inf),
+            "batch_size_warn": self._numbers_dict_as_limits(batch_size, keys, with_value, numpy.inf),
+            "batch_size": self._numbers_dict_as_limits(batch_size, keys, True, numpy.inf),
+            "max_pad_size": self._numbers_dict_as_limits(max_pad_size, keys, True, numpy.inf)}
+        assert sorted(length.keys()) == keys and (length.value is not None) == with_value, (
+          "%s: vectorized_batching needs consistent data keys, got %r, expected keys %r" % (self, length, keys))
+        block_rows.append((seq_idx, t_start, length))
+        block_seq_lens.append([length.dict[key] for key in keys] + [length.value or 0])
+      if not block_rows:
+        if keys is not None:
+          yield [], numpy.zeros((0, len(keys) + 1), dtype="int64"), keys, with_value, limits, finished
+        continue
+      block_seq_lens = numpy.array(block_seq_lens, dtype="int64")
+      valid = numpy.logical_not(
+        numpy.any(block_seq_lens > limits["max_seq_length"], axis=1) |
+        numpy.any(block_seq_lens < limits["min_seq_length"], axis=1))
+      for i in numpy.flatnonzero(valid & numpy.any(block_seq_lens > limits["batch_size_warn"], axis=1)):
+        print("warning: sequence length (%r) larger than limit (%r)" % (block_rows[i][2], batch_size), file=log.v4)
+      accepted = []
+      for i in numpy.flatnonzero(valid):
+        if total_num_seqs > max_total_num_seqs:
+          finished = True
+          break
+        if self.rnd_seq_drop.random() < seq_drop:
+          continue
+        accepted.append(i)
+        if block_rows[i][0] != last_seq_idx:
+          last_seq_idx = block_rows[i][0]
+          total_num_seqs += 1
+      yield [block_rows[i] for i in accepted], block_seq_lens[accepted], keys, with_value, limits, finished
+
+  @staticmethod
+  def _numbers_dict_as_limits(limit, keys, with_value, default):
+    """
+    This is for the vectorized variant of :func:`NumbersDict.any_compare`,
+    where the seq lengths (with keys and broadcast value as last column) are compared to this limit.
+
+    :param NumbersDict limit:
+    :param list[str] keys:
+    :param bool with_value: whether the broadcast value of the compared NumbersDict is set
+    :param float default: value for entries which should never match
+    :return: shape (len(keys) + 1,)
+    :rtype: numpy.ndarray
+    """
+    res = [limit.dict[key] if key in limit.dict else limit.value for key in keys]
+    res.append(limit.value if with_value else None)
+    return numpy.array([default if v is None else v for v in res], dtype="float64")
+
+  @staticmethod
+  def _make_recurrent_batch(rows, seq_lens, keys, with_value):
+    """
+    Same as :func:`Batch.add_sequence_as_slice` for every row, but without the NumbersDict overhead.
+
+    :param list[(int,NumbersDict,NumbersDict)] rows: seq_idx, start, length
+    :param numpy.ndarray seq_lens: (len(rows), len(keys) + 1)
+    :param list[str] keys:
+    :param bool with_value:
+    :rtype: Batch
+    """
+    from EngineBatch import BatchSeqCopyPart
+    batch = Batch()
+    max_lens = numpy.maximum(numpy.max(seq_lens, axis=0), 0)
+    batch.max_num_frames_per_slice = NumbersDict(
+      numbers_dict={key: int(max_lens[i]) for (i, key) in enumerate(keys)},
+      broadcast_value=int(max_lens[-1]) if with_value else 0)
+    batch.num_slices = len(rows)
+    batch.seqs = [
+      BatchSeqCopyPart(
+        seq_idx=seq_idx, seq_start_frame=t_start, seq_end_frame=t_start + length,
+        batch_slice=i, batch_frame_offset=0)
+      for (i, (seq_idx, t_start, length)) in enumerate(rows)]
+    return batch
+
   def batch_set_generator_cache_whole_epoch(self):
     """
     The BatchSetGenerator can cache the list of batches which we generated across epochs.
@@ -1159,10 +1628,34 @@ class Dataset(object):
     """
     return BatchSetGenerator(
       dataset=self,
-      generator=self._generate_batches(**kwargs),
+      generator=self._iterate_batches_with_padding_stats(self._generate_batches(**kwargs)),
       shuffle_batches=shuffle_batches,
       cache_whole_epoch=self.batch_set_generator_cache_whole_epoch())
 
+  def _iterate_batches_with_padding_stats(self, batches):
+    """
+    Passes the batches through, and when all batches were generated,
+    logs how much of the batches (incl. zero-padding) is real data.
+
+    :param typing.Iterator[Batch] batches:
+    :rtype: typing.Generator[Batch]
+    """
+    num_batches = 0
+    num_frames = NumbersDict(0)
+    num_padded_frames = NumbersDict(0)
+    for batch in batches:
+      num_batches += 1
+      num_frames += batch.get_total_num_frames()
+      num_padded_frames += batch.get_all_slices_num_frames()
+      yield batch
+    if not num_batches:
+      return
+    print("%s, generated %i batches%s, padding efficiency (real frames / frames incl. padding): %s" % (
+      self, num_batches, " (bucket_batching)" if self.bucket_batching else "",
+      ", ".join([
+        "%s %.1f%%" % (key, 100. * num_frames[key] / num_padded_frames[key])
+        for key in sorted(num_padded_frames.keys()) if num_padded_frames[key] > 0])), file=log.v4)
+
   @classmethod
   def index_shape_for_batches(cls, batches, data_key="data"):
     """
@@ -1177,6 +1670,86 @@ class Dataset(object):
     return tuple(shape)
 
 
+class SeqIndexCache(object):
+  """
+  On-disk cache for the parsed meta information of a dataset (e.g. seq tags, seq lengths, transcriptions),
+  such that restarted or resumed jobs do not need to parse all the corpus files again.
+  The cache entry is identified by a hash over the relevant dataset options
+  and the names, sizes and modification times of the files.
+  Also see :func:`Dataset._get_seq_index_cache`.
+  """
+
+  CacheDirName = "returnn_dataset_index_cache"
+
+  def __init__(self, name, opts, files, cache_dir=None):
+    """
+    :param str name: e.g. the dataset class name
+    :param dict[str] opts: all options which influence the content. should have a deterministic repr
+    :param list[str] files: all files which are read to get the content
+    :param str|None cache_dir: if not given, some dir in :func:`Util.get_temp_dir`
+    """
+    if not cache_dir:
+      from Util import get_temp_dir
+      cache_dir = "%s/%s" % (get_temp_dir(), self.CacheDirName)
+    self.cache_dir = cache_dir
+    self.name = name
+    self.opts = opts
+    self.files = files
+    self.filename = "%s/%s-%s.pkl" % (cache_dir, name, self._make_hash())
+
+  def __repr__(self):
+    return "<%s %r>" % (self.__class__.__name__, self.filename)
+
+  def _make_hash(self):
+    """
+    :rtype: str
+    """
+    import hashlib
+    files_info = []
+    for fn in self.files:
+      st = os.stat(fn)
+      files_info.append((os.path.abspath(fn), st.st_size, st.st_mtime))
+    info = {"name": self.name, "opts": sorted(self.opts.items()), "files": files_info}
+    return hashlib.md5(repr(info).encode("utf8")).hexdigest()
+
+  def load(self):
+    """
+    :return: the content as it was given to :func:`save`, or None if not cached (or the cache is broken)
+    :rtype: dict[str]|None
+    """
+    if not os.path.exists(self.filename):
+      return None
+    import pickle
+    try:
+      with open(self.filename, "rb") as f:
+        content = pickle.load(f)
+    except Exception as exc:
+      print("%s: cannot load, will ignore the cache: %s" % (self, exc), file=log.v3)
+      return None
+    assert isinstance(content, dict)
+    print("Loaded dataset index from cache %r." % self.filename, file=log.v4)
+    return content
+
+  def save(self, content):
+    """
+    The file is written atomically (via rename), so concurrent readers see either nothing or the full content.
+
+    :param dict[str] content:
+    """
+    import pickle
+    from Util import maybe_make_dirs
+    tmp_filename = "%s.tmp.%i" % (self.filename, os.getpid())
+    try:
+      maybe_make_dirs(self.cache_dir)
+      with open(tmp_filename, "wb") as f:
+        pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_filename, self.filename)
+    except (OSError, IOError) as exc:
+      print("%s: cannot save, will ignore: %s" % (self, exc), file=log.v3)
+      return
+    print("Saved dataset index to cache %r." % self.filename, file=log.v4)
+
+
 class DatasetSeq:
   """
   Encapsulates all data for one sequence.
@@ -1379,6 +1952,74 @@ def convert_data_dims(data_dims, leave_dict_as_is=False):
   return data_dims
 
 
+def plan_recurrent_batches(seq_lens, batch_size, max_seqs=float("inf"), max_pad_size=None):
+  """
+  Vectorized variant of the greedy batch construction of :func:`Dataset._generate_batches` (recurrent case).
+  A seq is added to the current batch unless, including this seq,
+  (max seq len * num seqs) would exceed batch_size (for any key),
+  the num of seqs would exceed max_seqs,
+  or the num of zero-padded frames would exceed max_pad_size (for any key).
+
+  :param numpy.ndarray seq_lens: (num_seqs, num_keys), seq (or chunk) lengths, in the order of the epoch
+  :param numpy.ndarray batch_size: (num_keys,), max num of frames (incl. padding) in one batch. inf to ignore
+  :param int|float max_seqs: max num of seqs in one batch
+  :param numpy.ndarray|None max_pad_size: (num_keys,), max num of zero-padded frames in one batch. inf to ignore
+  :return: (num_batches,), end seq idx (exclusive) of each batch. the last one is always num_seqs
+  :rtype: numpy.ndarray
+  """
+  num_seqs = seq_lens.shape[0]
+  batch_ends = []
+  start = 0
+  window = 64
+  while start < num_seqs:
+    while True:
+      if max_seqs != float("inf"):
+        window = min(window, int(max_seqs) + 1)
+      end = min(start + window, num_seqs)
+      lens = seq_lens[start:end]
+      num = numpy.arange(1, end - start + 1)
+      # Like Batch.try_sequence_as_slice, the max starts with 0.
+      padded_frames = numpy.maximum.accumulate(numpy.maximum(lens, 0), axis=0) * num[:, None]
+      split = numpy.any(padded_frames > batch_size, axis=1)
+      split |= num > max_seqs
+      if max_pad_size is not None:
+        split |= numpy.any(padded_frames - numpy.cumsum(lens, axis=0) > max_pad_size, axis=1)
+      split[0] = False  # never split before the first seq of a batch
+      split_idxs = numpy.flatnonzero(split)
+      if len(split_idxs) > 0:
+        batch_end = start + int(split_idxs[0])
+        break
+      if end == num_seqs:
+        batch_end = num_seqs
+        break
+      window *= 2
+    batch_ends.append(batch_end)
+    window = max(64, 2 * (batch_end - start))
+    start = batch_end
+  return numpy.array(batch_ends, dtype="int64")
+
+
+PackedSeqsKeySuffixes = ("_segment_ids", "_segment_positions")
+
+
+def get_packed_seqs_base_key(key):
+  """
+  With ``packed_batching``, one batch row can contain multiple seqs.
+  For every data key with a time axis, e.g. "data", the data provider can then also provide
+  "data_segment_ids" (1, 2, ... for the seqs in the row, 0 for padding)
+  and "data_segment_positions" (0, 1, ... within each seq),
+  e.g. to reset the attention or RNN state at the seq boundaries.
+
+  :param str key: data key
+  :return: the base data key if key is one of these extra keys, otherwise None
+  :rtype: str|None
+  """
+  for suffix in PackedSeqsKeySuffixes:
+    if key.endswith(suffix) and len(key) > len(suffix):
+      return key[:-len(suffix)]
+  return None
+
+
 def shapes_for_batches(batches, data_keys, dataset=None, extern_data=None, enforce_min_len1=False):
   """
   :param list[EngineBatch.Batch] batches:
@@ -1412,7 +2053,7 @@ def shapes_for_batches(batches, data_keys, dataset=None, extern_data=None, enfor
       data_shape = list(extern_data.data[k].batch_shape)
       data_shape[extern_data.data[k].batch_dim_axis] = shape[1]
       if extern_data.data[k].have_time_axis():
-        data_shape[extern_data.data[k].time_dim_axis] = shape[0][k]
+        data_shape[extern_data.data[k].time_dim_axis] = shape[0][get_packed_seqs_base_key(k) or k]
       assert all([n is not None for n in data_shape]), "data %r" % extern_data.data[k]
       d[k] = data_shape
   else:  # shape via dataset
@@ -63,6 +63,9 @@ class Batch:
     # original data_shape = [0, 0], format (time,batch/slice)
     #          data_shape = [max_num_frames_per_slice, num_slices]
     self.seqs = []  # type: typing.List[BatchSeqCopyPart]
+    # If set, load_seqs for this batch starts here instead of self.start_seq.
+    # E.g. with bucket_batching, the batches of one window are not in seq order, but all load the window start.
+    self.load_seqs_start = None  # type: typing.Optional[int]
 
   def __repr__(self):
     return "<Batch start_seq:%r, len(seqs):%i>" % (self.start_seq, len(self.seqs))
@@ -155,6 +158,16 @@ class Batch:
       return None
     return max([s.seq_idx for s in self.seqs]) + 1
 
+  def get_load_seqs_range(self):
+    """
+    :return: (start, end) for :func:`Dataset.load_seqs`
+    :rtype: (int, int)
+    """
+    start = self.start_seq
+    if self.load_seqs_start is not None:
+      start = min(start, self.load_seqs_start)
+    return start, self.end_seq
+
   def get_num_seqs(self):
     """
     :rtype: int
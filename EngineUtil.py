@@ -29,7 +29,7 @@ def assign_dev_data(device, dataset, batches, load_seqs=True):
 
   for batch in batches:
     if load_seqs:
-      dataset.load_seqs(batch.start_seq, batch.end_seq)
+      dataset.load_seqs(*batch.get_load_seqs_range())
     device.num_frames += batch.get_total_num_frames()
     with dataset.lock:
       for seq in batch.seqs:
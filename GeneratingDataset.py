@@ -923,7 +923,8 @@ class ExtractAudioFeatures:
                features="mfcc", feature_options=None, random_permute=None, random_state=None, raw_ogg_opts=None,
                pre_process=None, post_process=None,
                sample_rate=None,
-               peak_normalization=True, preemphasis=None, join_frames=None):
+               peak_normalization=True, preemphasis=None, join_frames=None,
+               cache_dir=None, cache_byte_size_limit=10 * 1024 ** 3):
     """
     :param float window_len: in seconds
     :param float step_len: in seconds
@@ -942,6 +943,9 @@ class ExtractAudioFeatures:
     :param bool peak_normalization: set to False to disable the peak normalization for audio files
     :param float|None preemphasis: set a preemphasis filter coefficient
     :param int|None join_frames: concatenate multiple frames together to a superframe
+    :param str|None cache_dir: if set, cache the features per seq tag on disk, see :class:`AudioFeaturesCache`.
+      Not used with random_permute, or if any of features/pre_process/post_process is a function.
+    :param int cache_byte_size_limit: for the cache. least recently used entries are removed
     :return: (audio_len // int(step_len * sample_rate), (with_delta + 1) * num_feature_filters), float32
     :rtype: numpy.ndarray
     """
@@ -981,6 +985,41 @@ class ExtractAudioFeatures:
     self.sample_rate = sample_rate
     self.raw_ogg_opts = raw_ogg_opts
     self.peak_normalization = peak_normalization
+    self.cache = None  # type: typing.Optional[AudioFeaturesCache]
+    if cache_dir and not callable(features) and not pre_process and not post_process:
+      self.cache = AudioFeaturesCache(
+        cache_dir=cache_dir, opts_hash=self._get_opts_hash(), byte_size_limit=cache_byte_size_limit)
+
+  def _get_opts_hash(self):
+    """
+    :return: hash over all options which influence the features, except random_permute
+    :rtype: str
+    """
+    import hashlib
+
+    def _value_repr(value):
+      if isinstance(value, numpy.ndarray):
+        return "array(%r,%s)" % (str(value.dtype), hashlib.md5(value.tobytes()).hexdigest())
+      if isinstance(value, dict):
+        return "{%s}" % ",".join(["%r:%s" % (k, _value_repr(v)) for (k, v) in sorted(value.items())])
+      return repr(value)
+
+    opts = [
+      self.window_len, self.step_len, self.num_feature_filters, self.preemphasis, self.with_delta, self.join_frames,
+      self.norm_mean, self.norm_std_dev, self.features, self.feature_options, self.sample_rate, self.raw_ogg_opts,
+      self.peak_normalization]
+    return hashlib.md5(",".join(map(_value_repr, opts)).encode("utf8")).hexdigest()
+
+  def _is_cache_used(self, seq_name):
+    """
+    :param str|None seq_name:
+    :rtype: bool
+    """
+    if not self.cache or seq_name is None:
+      return False
+    if self.random_permute_opts and self.random_permute_opts.truth_value:
+      return False  # not deterministic
+    return True
 
   def _load_feature_vec(self, value):
     """
@@ -999,6 +1038,21 @@ class ExtractAudioFeatures:
     return value.astype("float32")
 
   def get_audio_features_from_raw_bytes(self, raw_bytes, seq_name=None):
+    """
+    :param io.BytesIO raw_bytes:
+    :param str|None seq_name:
+    :return: shape (time,feature_dim)
+    :rtype: numpy.ndarray
+    """
+    if self._is_cache_used(seq_name):
+      feature_data = self.cache.get(seq_name)
+      if feature_data is None:
+        feature_data = self._get_audio_features_from_raw_bytes(raw_bytes=raw_bytes, seq_name=seq_name)
+        self.cache.put(seq_name, feature_data)
+      return feature_data
+    return self._get_audio_features_from_raw_bytes(raw_bytes=raw_bytes, seq_name=seq_name)
+
+  def _get_audio_features_from_raw_bytes(self, raw_bytes, seq_name=None):
     """
     :param io.BytesIO raw_bytes:
     :param str|None seq_name:
@@ -1027,9 +1081,25 @@ class ExtractAudioFeatures:
     import soundfile  # pip install pysoundfile
     # integer audio formats are automatically transformed in the range [-1,1]
     audio, sample_rate = soundfile.read(raw_bytes)
-    return self.get_audio_features(audio=audio, sample_rate=sample_rate, seq_name=seq_name)
+    return self._get_audio_features(audio=audio, sample_rate=sample_rate, seq_name=seq_name)
 
   def get_audio_features(self, audio, sample_rate, seq_name=None):
+    """
+    :param numpy.ndarray audio: raw audio samples, shape (audio_len,)
+    :param int sample_rate: e.g. 22050
+    :param str|None seq_name:
+    :return: array (time,dim), dim == self.get_feature_dimension()
+    :rtype: numpy.ndarray
+    """
+    if self._is_cache_used(seq_name):
+      feature_data = self.cache.get(seq_name)
+      if feature_data is None:
+        feature_data = self._get_audio_features(audio=audio, sample_rate=sample_rate, seq_name=seq_name)
+        self.cache.put(seq_name, feature_data)
+      return feature_data
+    return self._get_audio_features(audio=audio, sample_rate=sample_rate, seq_name=seq_name)
+
+  def _get_audio_features(self, audio, sample_rate, seq_name=None):
     """
     :param numpy.ndarray audio: raw audio samples, shape (audio_len,)
     :param int sample_rate: e.g. 22050
@@ -1140,6 +1210,109 @@ class ExtractAudioFeatures:
     return (self.with_delta + 1) * self.num_feature_filters * (self.join_frames or 1)
 
 
+class AudioFeaturesCache(object):
+  """
+  On-disk cache for :class:`ExtractAudioFeatures`.
+  The key is the seq tag together with the hash of the feature options.
+  Every entry is a separate .npy file, in sub directories by the key prefix,
+  and is loaded memory-mapped.
+  If the total size of the cache dir exceeds the limit, the least recently used entries are removed.
+  """
+
+  EvictToFraction = 0.9
+
+  def __init__(self, cache_dir, opts_hash, byte_size_limit):
+    """
+    :param str cache_dir:
+    :param str opts_hash:
+    :param int byte_size_limit:
+    """
+    self.cache_dir = cache_dir
+    self.opts_hash = opts_hash
+    self.byte_size_limit = byte_size_limit
+    self._byte_size = None  # type: typing.Optional[int]  # estimate, see _evict
+
+  def _get_filename(self, seq_tag):
+    """
+    :param str seq_tag:
+    :rtype: str
+    """
+    import hashlib
+    key = hashlib.md5(("%s:%s" % (self.opts_hash, seq_tag)).encode("utf8")).hexdigest()
+    return "%s/%s/%s.npy" % (self.cache_dir, key[:2], key)
+
+  def get(self, seq_tag):
+    """
+    :param str seq_tag:
+    :return: features, memory-mapped, or None if not in the cache
+    :rtype: numpy.ndarray|None
+    """
+    import os
+    filename = self._get_filename(seq_tag)
+    try:
+      feature_data = numpy.load(filename, mmap_mode="r")
+      os.utime(filename, None)  # mark as recently used
+    except (IOError, OSError, ValueError):  # not existing, or removed in the meantime, or broken
+      return None
+    return feature_data
+
+  def put(self, seq_tag, feature_data):
+    """
+    :param str seq_tag:
+    :param numpy.ndarray feature_data:
+    """
+    import os
+    import tempfile
+    from Util import maybe_make_dirs
+    filename = self._get_filename(seq_tag)
+    try:
+      maybe_make_dirs(os.path.dirname(filename))
+      # Write to a temp file and rename, such that concurrent readers never see a partial file.
+      fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".npy.tmp")
+      with os.fdopen(fd, "wb") as f:
+        numpy.save(f, numpy.ascontiguousarray(feature_data))
+      os.rename(tmp_filename, filename)
+    except (IOError, OSError) as exc:
+      print("%s: cannot write %r: %s" % (self.__class__.__name__, filename, exc), file=log.v3)
+      return
+    if self._byte_size is None:
+      self._evict()
+    else:
+      self._byte_size += os.path.getsize(filename)
+      if self._byte_size > self.byte_size_limit:
+        self._evict()
+
+  def _evict(self):
+    """
+    Scans the cache dir, and removes the least recently used entries if we are above the limit.
+    The cache dir can be shared by multiple processes, thus we always scan.
+    """
+    import os
+    entries = []  # list of (mtime, size, filename)
+    for dir_name, _, filenames in os.walk(self.cache_dir):
+      for filename in filenames:
+        if not filename.endswith(".npy"):
+          continue
+        filename = "%s/%s" % (dir_name, filename)
+        try:
+          stat = os.stat(filename)
+        except OSError:  # removed in the meantime
+          continue
+        entries.append((stat.st_mtime, stat.st_size, filename))
+    self._byte_size = sum([size for (_, size, _) in entries])
+    if self._byte_size <= self.byte_size_limit:
+      return
+    entries.sort()
+    for _, size, filename in entries:
+      if self._byte_size <= self.byte_size_limit * self.EvictToFraction:
+        break
+      try:
+        os.remove(filename)
+      except OSError:  # removed in the meantime
+        pass
+      self._byte_size -= size
+
+
 def _get_audio_linear_spectrogram(audio, sample_rate, window_len=0.025, step_len=0.010, num_feature_filters=512):
   """
   Computes linear spectrogram features from an audio signal.
@@ -1885,6 +2058,14 @@ class Vocabulary(object):
     segments = sentence.split()
     return self.get_seq_indices(segments) + self.seq_postfix
 
+  def get_seqs(self, sentences):
+    """
+    :param list[str] sentences:
+    :return: like :func:`get_seq` for every sentence
+    :rtype: list[list[int]]
+    """
+    return [self.get_seq(sentence) for sentence in sentences]
+
   def get_seq_indices(self, seq):
     """
     :param list[str] seq:
@@ -1916,103 +2097,222 @@ class BytePairEncoding(Vocabulary):
   Proceedings of the 54th Annual Meeting of the Association for Computational Linguistics (ACL 2016). Berlin, Germany.
   """
 
-  def __init__(self, vocab_file, bpe_file, seq_postfix=None, unknown_label="UNK"):
+  _bpe_codes_cache = {}  # bpe_file -> (mtime, version, codes, codes reverse), see _parse_bpe_codes
+  _cache_files_to_save = None  # type: typing.Optional[typing.MutableMapping[str,BytePairEncoding]]  # weak values
+
+  def __init__(self, vocab_file, bpe_file, seq_postfix=None, unknown_label="UNK",
+               cache_size=1000000, cache_file=None):
     """
     :param str vocab_file:
     :param str bpe_file:
     :param list[int]|None seq_postfix: labels will be added to the seq in self.get_seq
     :param str|None unknown_label:
+    :param int|None cache_size: max number of words in the word cache (least recently used are removed).
+      None means unlimited
+    :param str|None cache_file: if given, the word cache is loaded from this file (if it exists),
+      and stored there at exit (or via :func:`save_cache`). Can be shared by multiple processes.
     """
     super(BytePairEncoding, self).__init__(vocab_file=vocab_file, seq_postfix=seq_postfix, unknown_label=unknown_label)
+    self.bpe_file = bpe_file
+    self._bpe_file_version, self._bpe_codes, self._bpe_codes_reverse = self._parse_bpe_codes(bpe_file)
+    self._bpe_separator = '@@'
+    from collections import OrderedDict
+    import threading
+    self._bpe_encode_cache = OrderedDict()  # type: typing.Dict[str,typing.Tuple[str,...]]  # word -> segments
+    self._bpe_encode_cache_lock = threading.Lock()
+    self.cache_size = cache_size
+    self.cache_file = cache_file
+    self._cache_is_dirty = False
+    if cache_file:
+      self.load_cache()
+      self._register_save_cache_at_exit()
+
+  def _register_save_cache_at_exit(self):
+    """
+    At exit, the cache file is stored (once) by the last alive instance which uses it.
+    This does not keep the instance alive.
+    """
+    cls = BytePairEncoding
+    if cls._cache_files_to_save is None:
+      import atexit
+      import weakref
+      cls._cache_files_to_save = weakref.WeakValueDictionary()
+      atexit.register(cls._save_caches_at_exit)
+    cls._cache_files_to_save[self.cache_file] = self
+
+  @classmethod
+  def _save_caches_at_exit(cls):
+    for instance in list(cls._cache_files_to_save.values()):
+      instance.save_cache()
+
+  @classmethod
+  def _parse_bpe_codes(cls, bpe_file):
+    """
+    :param str bpe_file:
+    :return: version, merge pair -> rank, merged -> merge pair
+    :rtype: (tuple[int], dict[(str,str),int], dict[str,(str,str)])
+    """
+    import os
+    mtime = os.path.getmtime(bpe_file)
+    if bpe_file in cls._bpe_codes_cache:
+      cached_mtime, version, bpe_codes, bpe_codes_reverse = cls._bpe_codes_cache[bpe_file]
+      if cached_mtime == mtime:
+        return version, bpe_codes, bpe_codes_reverse
     # check version information
     bpe_file_first_line = open(bpe_file, "r").readline()
     if bpe_file_first_line.startswith('#version:'):
-      self._bpe_file_version = tuple(
+      version = tuple(
         [int(x) for x in re.sub(r'(\.0+)*$', '', bpe_file_first_line.split()[-1]).split(".")])
     else:
-      self._bpe_file_version = (0, 1)
-    self._bpe_codes = [tuple(item.split()) for item in open(bpe_file, "rb").read().decode("utf8").splitlines()]
+      version = (0, 1)
+    bpe_codes = [tuple(item.split()) for item in open(bpe_file, "rb").read().decode("utf8").splitlines()]
     # some hacking to deal with duplicates (only consider first instance)
-    self._bpe_codes = dict([(code, i) for (i, code) in reversed(list(enumerate(self._bpe_codes)))])
-    self._bpe_codes_reverse = dict([(pair[0] + pair[1], pair) for pair, i in self._bpe_codes.items()])
-    self._bpe_encode_cache = {}
-    self._bpe_separator = '@@'
+    bpe_codes = dict([(code, i) for (i, code) in reversed(list(enumerate(bpe_codes)))])
+    bpe_codes_reverse = dict([(pair[0] + pair[1], pair) for pair, i in bpe_codes.items()])
+    cls._bpe_codes_cache[bpe_file] = (mtime, version, bpe_codes, bpe_codes_reverse)
+    return version, bpe_codes, bpe_codes_reverse
 
-  @staticmethod
-  def _get_pairs(word):
+  def _get_cache_opts_hash(self):
+    """
+    :return: hash over everything which influences the segmentation, to verify a stored cache
+    :rtype: str
+    """
+    import hashlib
+    h = hashlib.md5(open(self.bpe_file, "rb").read())
+    h.update("\n".join(self.labels).encode("utf8"))
+    return h.hexdigest()
+
+  def load_cache(self):
+    """
+    Loads the word cache from self.cache_file, if it exists and was created with the same BPE codes and vocab.
+    """
+    import os
+    import pickle
+    if not os.path.exists(self.cache_file):
+      return
+    try:
+      with open(self.cache_file, "rb") as f:
+        d = pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError) as exc:
+      print("%s: cannot read cache %r: %s" % (self.__class__.__name__, self.cache_file, exc), file=log.v3)
+      return
+    if d.get("opts_hash") != self._get_cache_opts_hash():
+      print("%s: ignoring outdated cache %r" % (self.__class__.__name__, self.cache_file), file=log.v3)
+      return
+    with self._bpe_encode_cache_lock:
+      for word, segments in d["words"]:
+        self._bpe_encode_cache[word] = segments
+      self._cache_evict()
+    print("%s: loaded %i words from cache %r" % (
+      self.__class__.__name__, len(self._bpe_encode_cache), self.cache_file), file=log.v4)
+
+  def save_cache(self, filename=None):
     """
-    :param tuple[str] word: represented as tuple of symbols (symbols being variable-length strings)
-    :return: set of symbol pairs in a word
-    :rtype: set[(str,str)]
+    Stores the word cache. The file is written atomically, so concurrent readers never see a partial file.
+
+    :param str|None filename: by default self.cache_file
     """
-    pairs = set()
-    prev_char = word[0]
-    for char in word[1:]:
-      pairs.add((prev_char, char))
-      prev_char = char
-    return pairs
+    import os
+    import pickle
+    import tempfile
+    filename = filename or self.cache_file
+    assert filename
+    if filename == self.cache_file and not self._cache_is_dirty:
+      return
+    with self._bpe_encode_cache_lock:
+      words = list(self._bpe_encode_cache.items())
+    try:
+      fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix=".tmp")
+      with os.fdopen(fd, "wb") as f:
+        pickle.dump({"opts_hash": self._get_cache_opts_hash(), "words": words}, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_filename, filename)
+    except (IOError, OSError) as exc:
+      print("%s: cannot write cache %r: %s" % (self.__class__.__name__, filename, exc), file=log.v3)
+      return
+    if filename == self.cache_file:
+      self._cache_is_dirty = False
+
+  def _cache_evict(self):
+    """
+    Removes the least recently used words, if above self.cache_size. Expects that we hold the lock.
+    """
+    if self.cache_size is None:
+      return
+    while len(self._bpe_encode_cache) > self.cache_size:
+      self._bpe_encode_cache.popitem(last=False)
 
   def _encode_word(self, orig):
     """
     Encode word based on list of BPE merge operations, which are applied consecutively.
+    Uses the word cache.
+
     :param str orig:
     :rtype: tuple[str]
     """
+    with self._bpe_encode_cache_lock:
+      word = self._bpe_encode_cache.pop(orig, None)
+      if word is not None:
+        self._bpe_encode_cache[orig] = word  # mark as most recently used
+        return word
+    word = self._encode_word_uncached(orig)
+    with self._bpe_encode_cache_lock:
+      self._bpe_encode_cache[orig] = word
+      self._cache_evict()
+      self._cache_is_dirty = True
+    return word
 
-    if orig in self._bpe_encode_cache:
-      return self._bpe_encode_cache[orig]
+  def _encode_word_uncached(self, orig):
+    """
+    Encode word based on list of BPE merge operations, which are applied consecutively.
+    In every iteration, the adjacent pair with the lowest rank in the merge table is merged (all occurrences).
 
+    :param str orig:
+    :rtype: tuple[str]
+    """
     if self._bpe_file_version == (0, 1):
-      word = tuple(orig) + ('</w>',)
+      word = list(orig) + ['</w>']
     elif self._bpe_file_version == (0, 2):  # more consistent handling of word-final segments
-      word = tuple(orig[:-1]) + (orig[-1] + '</w>',)
+      word = list(orig[:-1]) + [orig[-1] + '</w>']
     else:
       raise NotImplementedError
 
-    pairs = self._get_pairs(word)
-    if not pairs:
-      return orig
-
-    while True:
-      bigram = min(pairs, key=lambda pair: self._bpe_codes.get(pair, float('inf')))
-      if bigram not in self._bpe_codes:
+    if len(word) == 1:
+      return (orig,)
+
+    bpe_codes = self._bpe_codes
+    while len(word) > 1:
+      best_rank = None
+      best_pair = None
+      for pair in zip(word[:-1], word[1:]):
+        rank = bpe_codes.get(pair)
+        if rank is not None and (best_rank is None or rank < best_rank):
+          best_rank, best_pair = rank, pair
+      if best_pair is None:
         break
-      first, second = bigram
+      first, second = best_pair
+      merged = first + second
       new_word = []
       i = 0
-      while i < len(word):
-        try:
-          j = word.index(first, i)
-          new_word.extend(word[i:j])
-          i = j
-        except ValueError:
-          new_word.extend(word[i:])
-          break
-
-        if word[i] == first and i < len(word) - 1 and word[i + 1] == second:
-          new_word.append(first + second)
+      n = len(word)
+      while i < n:
+        if i < n - 1 and word[i] == first and word[i + 1] == second:
+          new_word.append(merged)
           i += 2
         else:
           new_word.append(word[i])
           i += 1
-      new_word = tuple(new_word)
       word = new_word
-      if len(word) == 1:
-        break
-      else:
-        pairs = self._get_pairs(word)
 
     # don't print end-of-word symbols
     if word[-1] == '</w>':
       word = word[:-1]
     elif word[-1].endswith('</w>'):
-      word = word[:-1] + (word[-1].replace('</w>', ''),)
+      word = word[:-1] + [word[-1].replace('</w>', '')]
 
     if self.labels:
-      word = self.check_vocab_and_split(word, self._bpe_codes_reverse, self.labels, self._bpe_separator)
+      word = self.check_vocab_and_split(word, self._bpe_codes_reverse, self.vocab, self._bpe_separator)
 
-    self._bpe_encode_cache[orig] = word
-    return word
+    return tuple(word)
 
   def check_vocab_and_split(self, orig, bpe_codes, vocab, separator):
     """Check for each segment in word if it is in-vocabulary,
@@ -2066,10 +2366,11 @@ class BytePairEncoding(Vocabulary):
       for item in self.recursive_split(right, bpe_codes, vocab, separator, final):
         yield item
 
-  def _segment_sentence(self, sentence):
+  def _segment_sentence(self, sentence, encoded_words=None):
     """
     Segment single sentence (whitespace-tokenized string) with BPE encoding.
     :param str sentence:
+    :param dict[str,tuple[str]]|None encoded_words: local word cache, in addition to the (LRU) word cache
     :rtype: list[str]
     """
 
@@ -2090,7 +2391,12 @@ class BytePairEncoding(Vocabulary):
       else:
         found_category = False
         skip_category = False
-        new_word = self._encode_word(word)
+        if encoded_words is None:
+          new_word = self._encode_word(word)
+        else:
+          new_word = encoded_words.get(word)
+          if new_word is None:
+            new_word = encoded_words[word] = self._encode_word(word)
 
         for item in new_word[:-1]:
           output.append(item + self._bpe_separator)
@@ -2107,6 +2413,17 @@ class BytePairEncoding(Vocabulary):
     seq = self.get_seq_indices(segments)
     return seq + self.seq_postfix
 
+  def get_seqs(self, sentences):
+    """
+    :param list[str] sentences:
+    :return: like :func:`get_seq` for every sentence. every distinct word is looked up only once
+    :rtype: list[list[int]]
+    """
+    encoded_words = {}  # type: typing.Dict[str,typing.Tuple[str,...]]
+    return [
+      self.get_seq_indices(self._segment_sentence(sentence, encoded_words=encoded_words)) + self.seq_postfix
+      for sentence in sentences]
+
 
 class CharacterTargets(Vocabulary):
   """
@@ -2375,7 +2692,8 @@ class LibriSpeechCorpus(CachedDataset2):
       self.num_outputs["classes"] = [self.targets.num_labels, 1]
     if self.feature_extractor:
       self.num_outputs["data"] = [self.num_inputs, 2]
-    self.transs = self._collect_trans()
+    self._orth_post_process_opt = orth_post_process
+    self.transs = self._collect_trans_maybe_cached()
     self._reference_seq_order = sorted(self.transs.keys())
     if fixed_random_subset:
       if 0 < fixed_random_subset < 1:
@@ -2387,10 +2705,37 @@ class LibriSpeechCorpus(CachedDataset2):
       seqs = seqs[:fixed_random_subset]
       self._reference_seq_order = seqs
       self.transs = {s: self.transs[s] for s in seqs}
+    self._seq_lens = numpy.array([len(self.transs[key]) for key in self._reference_seq_order], dtype="int64")
     self.epoch_wise_filter = epoch_wise_filter
     self._seq_order = None  # type: typing.Optional[typing.List[int]]
     self.init_seq_order()
 
+  def _collect_trans_maybe_cached(self):
+    """
+    Like :func:`_collect_trans`, but uses the :class:`Dataset.SeqIndexCache` if enabled (seq_index_cache option).
+
+    :rtype: dict[(str,int,int,int),str]
+    """
+    from glob import glob
+    cache = None
+    if self.seq_index_cache and not callable(self._orth_post_process_opt):
+      if self.use_zip:
+        files = sorted(zip_file.filename for zip_file in self._zip_files.values())
+      else:
+        files = sorted(glob("%s/%s*/*/*/*.trans.txt" % (self.path, self.prefix)))
+      cache = self._get_seq_index_cache(
+        opts={"path": self.path, "prefix": self.prefix, "use_zip": self.use_zip,
+              "orth_post_process": self._orth_post_process_opt},
+        files=files)
+    if cache:
+      content = cache.load()
+      if content:
+        return content["transs"]
+    transs = self._collect_trans()
+    if cache:
+      cache.save({"transs": transs})
+    return transs
+
   def _collect_trans(self):
     from glob import glob
     import os
@@ -2452,7 +2797,7 @@ class LibriSpeechCorpus(CachedDataset2):
       :param int i:
       :rtype: int
       """
-      return len(self.transs[self._reference_seq_order[i]])
+      return int(self._seq_lens[i])
 
     if seq_list is not None:
       seqs = [i for i in range(len(self._reference_seq_order)) if self._get_tag(i) in seq_list]
@@ -2464,7 +2809,7 @@ class LibriSpeechCorpus(CachedDataset2):
     else:
       num_seqs = len(self._reference_seq_order)
       self._seq_order = self.get_seq_order_for_epoch(
-        epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len)
+        epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len, seq_lens=self._seq_lens)
       self._num_seqs = len(self._seq_order)
     if self.epoch_wise_filter:
       # Note: A more generic variant of this code is :class:`MetaDataset.EpochWiseFilter`.
@@ -2584,6 +2929,15 @@ class LibriSpeechCorpus(CachedDataset2):
     targets_txt = self.transs[seq_key]
     return self.targets.get_seq(targets_txt) if self.targets else None, targets_txt
 
+  def _init_worker_proc(self):
+    """
+    Reopen the zip files, such that we do not share the file offset with the parent process.
+    """
+    import zipfile
+    if self._zip_files is not None:
+      self._zip_files = {
+        name: zipfile.ZipFile(zip_file.filename) for (name, zip_file) in self._zip_files.items()}
+
   def _open_audio_file(self, seq_idx):
     """
     :param int seq_idx:
@@ -2712,6 +3066,7 @@ class OggZipDataset(CachedDataset2):
         self._names.append(name)
       self._zip_files = [zipfile.ZipFile(path) for path in self.paths]
     self.segments = None  # type: typing.Optional[typing.Set[str]]
+    self._segment_file = segment_file
     if segment_file:
       self._read_segment_list(segment_file)
     self.zip_audio_files_have_name_as_prefix = zip_audio_files_have_name_as_prefix
@@ -2745,9 +3100,11 @@ class OggZipDataset(CachedDataset2):
       self.num_outputs["classes"] = [self.targets.num_labels, 1]
     if self.feature_extractor:
       self.num_outputs["data"] = [self.num_inputs, 2]
-    self._data = self._collect_data()
+    self._data = self._collect_data_maybe_cached()
     if fixed_random_subset:
       self._filter_fixed_random_subset(fixed_random_subset)
+    # Based on the duration, multiplied by 100 to avoid similar rounded durations.
+    self._seq_lens = numpy.array([int(entry["duration"] * 100) for entry in self._data], dtype="int64")
     self.epoch_wise_filter = EpochWiseFilter(epoch_wise_filter) if epoch_wise_filter else None
     self._seq_order = None  # type: typing.Optional[typing.List[int]]
     self.init_seq_order()
@@ -2769,6 +3126,14 @@ class OggZipDataset(CachedDataset2):
       return self._zip_files[zip_index].read(filename)
     return open("%s/%s" % (self.paths[0], filename), "rb").read()
 
+  def _init_worker_proc(self):
+    """
+    Reopen the zip files, such that we do not share the file offset with the parent process.
+    """
+    import zipfile
+    if self._zip_files is not None:
+      self._zip_files = [zipfile.ZipFile(path) for path in self.paths]
+
   def _collect_data_part(self, zip_index):
     """
     collect all the entries of a single zip-file or txt file
@@ -2810,6 +3175,31 @@ class OggZipDataset(CachedDataset2):
       data = self._collect_data_part(0)
     return data
 
+  def _collect_data_maybe_cached(self):
+    """
+    Like :func:`_collect_data`, but uses the :class:`Dataset.SeqIndexCache` if enabled (seq_index_cache option).
+
+    :return: entries
+    :rtype: list[dict[str]]
+    """
+    files = list(self.paths) + sorted(self._separate_txt_files.values())
+    if self._zip_files is None:
+      files.append("%s/%s.txt" % (self.paths[0], self._names[0]))
+    if self._segment_file:
+      files.append(self._segment_file)
+    cache = self._get_seq_index_cache(
+      opts={"names": self._names, "separate_txt_files": sorted(self._separate_txt_files.items()),
+            "segment_file": self._segment_file, "with_audio": bool(self.feature_extractor)},
+      files=files)
+    if cache:
+      content = cache.load()
+      if content:
+        return content["data"]
+    data = self._collect_data()
+    if cache:
+      cache.save({"data": data})
+    return data
+
   def _read_segment_list(self, segment_file):
     """
     read a list of segment names in either plain text or gzip
@@ -2860,7 +3250,7 @@ class OggZipDataset(CachedDataset2):
       :param int i:
       :rtype: int
       """
-      return int(self._data[i]["duration"] * 100)
+      return int(self._seq_lens[i])
 
     if seq_list is not None:
       seqs = {
@@ -2874,7 +3264,7 @@ class OggZipDataset(CachedDataset2):
     else:
       num_seqs = len(self._data)
       self._seq_order = self.get_seq_order_for_epoch(
-        epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len)
+        epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len, seq_lens=self._seq_lens)
       if self.epoch_wise_filter:
         self.epoch_wise_filter.debug_msg_prefix = str(self)
         self._seq_order = self.epoch_wise_filter.filter(epoch=epoch, seq_order=self._seq_order, get_seq_len=get_seq_len)
@@ -30,21 +30,29 @@ class HDFDataset(CachedDataset):
   This was the main original dataset format of RETURNN.
   """
 
-  def __init__(self, files=None, use_cache_manager=False, **kwargs):
+  def __init__(self, files=None, use_cache_manager=False, use_mmap=False, **kwargs):
     """
     :param None|list[str] files:
     :param bool use_cache_manager: uses :func:`Util.cf` for files
+    :param bool use_mmap: memory-map the contiguous (non-chunked, uncompressed) HDF datasets
+      ("inputs", "targets/data/*") via their file offsets, and return views on them in :func:`get_data`.
+      This avoids the copy into the cache, and multiple processes on one node share the page cache.
+      Requires cache_byte_size=0.
     """
     super(HDFDataset, self).__init__(**kwargs)
     assert self.partition_epoch == 1 or self.cache_byte_size_total_limit == 0, \
       "To use partition_epoch in HDFDatasets, disable caching by setting cache_byte_size=0"
+    assert not use_mmap or self.cache_byte_size_total_limit == 0, \
+      "To use use_mmap in HDFDatasets, disable caching by setting cache_byte_size=0"
     self._use_cache_manager = use_cache_manager
+    self._use_mmap = use_mmap
     self.files = []  # type: typing.List[str]  # file names
     self.h5_files = []  # type: typing.List[h5py.File]
     self.file_start = [0]
     self.file_seq_start = []  # type: typing.List[numpy.ndarray]
     self.data_dtype = {}  # type: typing.Dict[str,str]
     self.data_sparse = {}  # type: typing.Dict[str,bool]
+    self._mmap_data = []  # type: typing.List[typing.Dict[str,numpy.ndarray]]  # per file, key -> mmap array
     if files:
       for fn in files:
         self.add_file(fn)
@@ -58,6 +66,7 @@ class HDFDataset(CachedDataset):
         pass
     del self.h5_files[:]
     del self.file_seq_start[:]
+    del self._mmap_data[:]
 
   @staticmethod
   def _decode(s):
@@ -196,6 +205,49 @@ class HDFDataset(CachedDataset):
           self.num_outputs[str(name)] = (dim, ndim)
     self.data_dtype["data"] = str(fin['inputs'].dtype)
     assert len(self.target_keys) == len(self.file_seq_start[0][0]) - 1
+    if self._use_mmap:
+      self._mmap_data.append(self._mmap_file_datasets(filename, fin))
+
+  def _mmap_file_datasets(self, filename, fin):
+    """
+    :param str filename:
+    :param h5py.File fin:
+    :return: key -> memory-mapped array, for all datasets which are stored contiguously in the file
+    :rtype: dict[str,numpy.ndarray]
+    """
+    datasets = {"data": fin['inputs']}
+    if 'targets' in fin:
+      for name in self.target_keys:
+        if name in fin['targets/data']:
+          datasets[str(name)] = fin['targets/data'][name]
+    res = {}
+    for key, dset in sorted(datasets.items()):
+      arr = self._mmap_h5_dataset(filename, dset)
+      if arr is None:
+        print("%s: cannot mmap %r in %s (chunked or compressed), will read it via h5py" % (
+          self, dset.name, filename), file=log.v4)
+        continue
+      res[key] = arr
+    return res
+
+  @staticmethod
+  def _mmap_h5_dataset(filename, dset):
+    """
+    :param str filename:
+    :param h5py.Dataset dset:
+    :return: memory-mapped array with the same content as dset, or None if this is not possible
+    :rtype: numpy.ndarray|None
+    """
+    if dset.chunks is not None or dset.compression is not None:
+      return None
+    if dset.dtype.hasobject:
+      return None
+    if dset.size == 0:
+      return numpy.zeros(dset.shape, dtype=dset.dtype)
+    offset = dset.id.get_offset()
+    if offset is None:  # not allocated in the file
+      return None
+    return numpy.memmap(filename, mode="r", dtype=dset.dtype, offset=offset, shape=dset.shape)
 
   def _load_seqs(self, start, end):
     """
@@ -269,6 +321,14 @@ class HDFDataset(CachedDataset):
     start_pos = self.file_seq_start[file_idx][real_file_seq_idx]
     end_pos = self.file_seq_start[file_idx][real_file_seq_idx + 1]
 
+    if self._use_mmap and key in self._mmap_data[file_idx]:
+      ldx = 0 if key == "data" else self.target_keys.index(key) + 1
+      # This is a view on the memory-mapped file, i.e. no copy.
+      data = self._mmap_data[file_idx][key][start_pos[ldx]:end_pos[ldx]]
+      if key == "data" and self.window > 1:
+        data = self._sliding_window(data)
+      return data
+
     if key == "data":
       inputs = fin['inputs']
       data = inputs[start_pos[0]:end_pos[0]]
@@ -314,6 +374,15 @@ class HDFDataset(CachedDataset):
 
     return end_pos - start_pos
 
+  def _get_all_seq_lens_by_real_idx(self):
+    """
+    :return: real seq idx -> len of the input data
+    :rtype: numpy.ndarray|None
+    """
+    if not self.file_seq_start:
+      return None
+    return numpy.concatenate([numpy.diff(seq_start[:, 0]) for seq_start in self.file_seq_start])
+
   def _get_tag_by_real_idx(self, real_seq_idx):
     file_idx = self._get_file_index(real_seq_idx)
     real_file_seq_idx = real_seq_idx - self.file_start[file_idx]
@@ -879,9 +948,12 @@ class SimpleHDFWriter:
   which can be read later by :class:`HDFDataset`.
 
   Note that we dump to a temp file first, and only at :func:`close` we move it over to the real destination.
+  With ``partial_file``, the temp file is ``filename + ".partial"``, which is kept in case of a crash,
+  and which can be continued via ``resume``.
   """
 
-  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False):
+  def __init__(self, filename, dim, labels=None, ndim=None, extra_type=None, swmr=False,
+               partial_file=False, resume=False):
     """
     :param str filename: Create file, truncate if exists
     :param int|None dim:
@@ -889,6 +961,8 @@ class SimpleHDFWriter:
     :param list[str]|None labels:
     :param dict[str,(int,int,str)]|None extra_type: key -> (dim,ndim,dtype)
     :param bool swmr: see http://docs.h5py.org/en/stable/swmr.html
+    :param bool partial_file: write to ``filename + ".partial"`` instead of a temp file, and flush after each batch
+    :param bool resume: implies ``partial_file``. if the partial file exists, continue it. see :func:`get_seq_tags`
     """
     from Util import hdf5_strings, unicode
     import tempfile
@@ -907,8 +981,20 @@ class SimpleHDFWriter:
     # By default, we should not override existing data.
     # If we want that at some later point, we can introduce an option for it.
     assert not os.path.exists(self.filename)
-    tmp_fd, self.tmp_filename = tempfile.mkstemp(suffix=".hdf")
-    os.close(tmp_fd)
+    self.partial_file = partial_file or resume
+    if self.partial_file:
+      self.tmp_filename = filename + ".partial"
+    else:
+      tmp_fd, self.tmp_filename = tempfile.mkstemp(suffix=".hdf")
+      os.close(tmp_fd)
+    self._datasets = {}  # type: typing.Dict[str, h5py.Dataset]  # key -> data
+    self._extra_num_time_steps = {}  # type: typing.Dict[str,int]  # key -> num-steps
+    self._prepared_extra = set()
+    if resume and os.path.exists(self.tmp_filename):
+      assert not swmr
+      self._file = h5py.File(self.tmp_filename, "a")
+      self._init_from_partial_file()
+      return
     self._file = h5py.File(self.tmp_filename, "w", libver='latest' if swmr else None)
 
     self._file.attrs['numTimesteps'] = 0  # we will increment this on-the-fly
@@ -921,7 +1007,6 @@ class SimpleHDFWriter:
     else:
       self._file.create_dataset('labels', (0,), dtype="S5")  # dtype string length does not matter
 
-    self._datasets = {}  # type: typing.Dict[str, h5py.Dataset]  # key -> data
     # seq_length idx represents (seq_idx,data_key_idx),
     # where data_key_idx == 0 is for the main input data,
     # and otherwise data_key_idx == 1 + sorted(self._prepared_extra).index(data_key).
@@ -933,8 +1018,6 @@ class SimpleHDFWriter:
     dt = h5py.special_dtype(vlen=unicode)
     self._seq_tags = self._file.create_dataset('seqTags', (0,), dtype=dt, maxshape=(None,))
 
-    self._extra_num_time_steps = {}  # type: typing.Dict[str,int]  # key -> num-steps
-    self._prepared_extra = set()
     if extra_type:
       self._prepare_extra(extra_type)
 
@@ -949,6 +1032,40 @@ class SimpleHDFWriter:
       self._file.close()
       self._file = None
 
+  def _init_from_partial_file(self):
+    """
+    For ``resume``. Restores the state from the existing partial file.
+    Drops everything after the last completely written batch (e.g. after a crash in :func:`insert_batch`).
+    """
+    self._seq_lengths = self._file["seqLengths"]
+    self._seq_tags = self._file["seqTags"]
+    if "inputs" in self._file:
+      self._datasets["inputs"] = self._file["inputs"]
+    if "targets/data" in self._file:
+      for data_key in self._file["targets/data"]:
+        self._datasets[data_key] = self._file["targets/data"][data_key]
+        self._prepared_extra.add(data_key)
+    num_seqs = int(self._file.attrs.get("numSeqsComplete", 0))
+    seq_lengths = self._seq_lengths[:num_seqs]
+    self._file.attrs['numSeqs'] = num_seqs
+    self._file.attrs['numTimesteps'] = int(numpy.sum(seq_lengths[:, 0])) if num_seqs else 0
+    if "inputs" in self._datasets:
+      self._datasets["inputs"].resize(self._file.attrs['numTimesteps'], axis=0)
+    for data_key_idx_0, data_key in enumerate(sorted(self._prepared_extra)):
+      num_steps = int(numpy.sum(seq_lengths[:, data_key_idx_0 + 1])) if num_seqs else 0
+      self._extra_num_time_steps[data_key] = num_steps
+      self._datasets[data_key].resize(num_steps, axis=0)
+    self._seq_lengths.resize(num_seqs, axis=0)
+    self._seq_tags.resize(num_seqs, axis=0)
+    print("%s: resume %r with %i seqs." % (self.__class__.__name__, self.tmp_filename, num_seqs), file=log.v3)
+
+  def get_seq_tags(self):
+    """
+    :return: the seq tags written so far (incl. the ones from the partial file in case of ``resume``)
+    :rtype: list[str]
+    """
+    return [tag.decode("utf8") if isinstance(tag, bytes) else tag for tag in self._seq_tags[:]]
+
   def _prepare_extra(self, extra_type):
     """
     :param dict[str,(int,int,str)] extra_type: key -> (dim,ndim,dtype)
@@ -1031,7 +1148,7 @@ class SimpleHDFWriter:
     assert self._file.attrs['numSeqs'] > 0 and self._seq_lengths.shape[0] > 0
     seq_idx = self._file.attrs['numSeqs'] - 1
 
-    if raw_data.dtype == numpy.object:
+    if raw_data.dtype == object:
       # Is this a string?
       assert isinstance(raw_data.flat[0], (str, bytes))
       dtype = "string"
@@ -1125,6 +1242,11 @@ class SimpleHDFWriter:
             file=log.v3)
           raise
 
+    if self.partial_file:
+      # Mark everything so far as complete (see _init_from_partial_file), and make sure it is on disk.
+      self._file.attrs["numSeqsComplete"] = self._file.attrs['numSeqs']
+      self._file.flush()
+
   def close(self):
     """
     Closes the file.
@@ -1136,8 +1258,11 @@ class SimpleHDFWriter:
       self._file = None
     if self.tmp_filename:
       assert not os.path.exists(self.filename)
-      shutil.copyfile(self.tmp_filename, self.filename)
-      os.remove(self.tmp_filename)
+      if self.partial_file:  # same directory, thus we can just rename it
+        os.rename(self.tmp_filename, self.filename)
+      else:
+        shutil.copyfile(self.tmp_filename, self.filename)
+        os.remove(self.tmp_filename)
       self.tmp_filename = None
 
 
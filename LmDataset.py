@@ -66,6 +66,8 @@ class LmDataset(CachedDataset2):
     mapping from symbol to integer index (in case ``phone_info`` is not set).
 
     :param str|()->str|list[str]|()->list[str] corpus_file: Bliss XML or line-based txt. optionally can be gzip.
+      Or a binary pre-tokenized corpus (filename ending with ".tokens", see :class:`TokenCorpus`),
+      which already contains the final label indices (created with the same vocabulary options).
     :param str|()->str|None orth_symbols_file: a text file containing a list of orthography symbols
     :param str|()->str|None orth_symbols_map_file: either a list of orth symbols, each line: "<symbol> <index>",
                                                    or a pickled dictionary
@@ -123,7 +125,7 @@ class LmDataset(CachedDataset2):
       self.orth_symbols = orth_symbols
       self.labels["data"] = orth_symbols
       self.seq_gen = None
-    if orth_symbols_map_file and orth_symbols_map_file.endswith('.pkl'):
+    elif orth_symbols_map_file and orth_symbols_map_file.endswith('.pkl'):
       import pickle
       with open(orth_symbols_map_file, 'rb') as f:
         self.orth_symbols_map = pickle.load(f)
@@ -199,21 +201,54 @@ class LmDataset(CachedDataset2):
       self.num_outputs["delayed"] = self.num_outputs["data"]
       self.labels["delayed"] = self.labels["data"]
 
+    self.token_corpus = None  # type: typing.Optional[TokenCorpus]
     if isinstance(corpus_file, list):  # If a list of files is provided, concatenate all.
       self.orths = []
       for file_name in corpus_file:
         self.orths += read_corpus(file_name)
+    elif corpus_file.endswith(".tokens"):
+      self.token_corpus = TokenCorpus(corpus_file)
+      self.orths = None
     else:
       self.orths = read_corpus(corpus_file)
     # It's only estimated because we might filter some out or so.
-    self._estimated_num_seqs = len(self.orths) // self.partition_epoch
-    print("  done, loaded %i sequences" % len(self.orths), file=log.v4)
+    self._estimated_num_seqs = self._get_corpus_len() // self.partition_epoch
+    print("  done, loaded %i sequences" % self._get_corpus_len(), file=log.v4)
 
     self.next_orth_idx = 0
     self.next_seq_idx = 0
     self.num_skipped = 0
     self.num_unknown = 0
 
+  def _get_corpus_len(self):
+    """
+    :return: number of seqs in the corpus (before filtering)
+    :rtype: int
+    """
+    if self.token_corpus is not None:
+      return len(self.token_corpus)
+    return len(self.orths)
+
+  def get_total_num_seqs(self):
+    """
+    :return: number of seqs in the corpus, including those which would be skipped
+    :rtype: int
+    """
+    return self._get_corpus_len()
+
+  def have_corpus_seq_idx(self):
+    """
+    :rtype: bool
+    """
+    return True
+
+  def get_corpus_seq_idx(self, seq_idx):
+    """
+    :param int seq_idx: must be loaded
+    :rtype: int
+    """
+    return int(self.get_tag(seq_idx)[len(self._tag_prefix):])
+
   def get_data_keys(self):
     """
     :rtype: list[str]
@@ -258,6 +293,9 @@ class LmDataset(CachedDataset2):
 
     if seq_list is not None:
       self.seq_order = [int(s[len(self._tag_prefix):]) for s in seq_list]
+    elif self.token_corpus is not None:
+      self.seq_order = self.get_seq_order_for_epoch(
+        epoch=epoch, num_seqs=len(self.token_corpus), get_seq_len=self.token_corpus.get_seq_len)
     else:
       self.seq_order = self.get_seq_order_for_epoch(
         epoch=epoch, num_seqs=len(self.orths), get_seq_len=lambda i: len(self.orths[i]))
@@ -301,13 +339,22 @@ class LmDataset(CachedDataset2):
         return None
       assert self.next_seq_idx == seq_idx, "We expect that we iterate through all seqs."
       true_idx = self.seq_order[self.next_orth_idx]
-      orth = self.orths[true_idx]  # get sequence for the next index given by seq_order
       seq_tag = (self._tag_prefix + str(true_idx))
       self.next_orth_idx += 1
-      if orth == "</s>":
-        continue  # special sentence end symbol. empty seq, ignore.
+      if self.token_corpus is not None:
+        data = self.token_corpus.get_seq(true_idx).astype(self.dtype)
+        if len(data) == 0:
+          continue  # skipped when the corpus was created
+        orth = None
+      else:
+        orth = self.orths[true_idx]  # get sequence for the next index given by seq_order
+        if orth == "</s>":
+          continue  # special sentence end symbol. empty seq, ignore.
+
+      if orth is None:
+        pass  # already have data
 
-      if self.seq_gen:
+      elif self.seq_gen:
         try:
           phones = self.seq_gen.generate_seq(orth)
         except KeyError as e:
@@ -481,6 +528,134 @@ def read_corpus(filename):
   return out_list
 
 
+class TokenCorpus(object):
+  """
+  Binary pre-tokenized corpus, as written by :class:`TokenCorpusWriter` (e.g. via ``tools/dump-token-corpus.py``).
+  It consists of two files:
+
+    - ``<filename>`` (by convention ending with ".tokens"): the token indices of all seqs, concatenated, int32.
+    - ``<filename>.offsets``: num_seqs + 1 entries, int64. Seq i is ``tokens[offsets[i]:offsets[i + 1]]``.
+
+  Both are memory-mapped, so opening the corpus is instant, and the memory is shared with other processes.
+  Seqs and seq lengths are accessed in O(1), without any per-token Python objects.
+  """
+
+  TokensDtype = "<i4"
+  OffsetsDtype = "<i8"
+
+  def __init__(self, filename, offsets_filename=None):
+    """
+    :param str filename:
+    :param str|None offsets_filename: by default filename + ".offsets"
+    """
+    self.filename = filename
+    self.tokens = self._memmap(filename, dtype=self.TokensDtype)
+    self.offsets = self._memmap(offsets_filename or (filename + ".offsets"), dtype=self.OffsetsDtype)
+    assert len(self.offsets) >= 1 and self.offsets[0] == 0, "%s: invalid offsets" % self
+    assert self.offsets[-1] == len(self.tokens), "%s: offsets do not match tokens, incomplete file?" % self
+
+  def __repr__(self):
+    return "<%s %r, %i seqs, %i tokens>" % (self.__class__.__name__, self.filename, len(self), len(self.tokens))
+
+  @staticmethod
+  def _memmap(filename, dtype):
+    """
+    :param str filename:
+    :param str dtype:
+    :rtype: numpy.ndarray
+    """
+    if os.path.getsize(filename) == 0:
+      return numpy.zeros((0,), dtype=dtype)  # cannot mmap an empty file
+    return numpy.memmap(filename, dtype=dtype, mode="r")
+
+  @staticmethod
+  def exists(filename):
+    """
+    :param str filename:
+    :rtype: bool
+    """
+    return os.path.exists(filename) and os.path.exists(filename + ".offsets")
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, seq_idx):
+    return self.get_seq(seq_idx)
+
+  def get_seq(self, seq_idx):
+    """
+    :param int seq_idx:
+    :return: token indices, int32, read-only view into the memory-mapped file
+    :rtype: numpy.ndarray
+    """
+    return self.tokens[self.offsets[seq_idx]:self.offsets[seq_idx + 1]]
+
+  def get_seq_len(self, seq_idx):
+    """
+    :param int seq_idx:
+    :rtype: int
+    """
+    return int(self.offsets[seq_idx + 1] - self.offsets[seq_idx])
+
+  def get_seq_lens(self):
+    """
+    :return: all seq lengths, shape (num_seqs,)
+    :rtype: numpy.ndarray
+    """
+    return numpy.diff(self.offsets)
+
+
+class TokenCorpusWriter(object):
+  """
+  Writes a :class:`TokenCorpus`, seq by seq, without keeping it in memory.
+  The files are written under a temporary name and renamed in :func:`close`,
+  so a reader never sees an incomplete corpus.
+  """
+
+  def __init__(self, filename):
+    """
+    :param str filename: by convention ending with ".tokens"
+    """
+    self.filename = filename
+    self.num_seqs = 0
+    self.num_tokens = 0
+    self._tokens_file = open(filename + ".tmp", "wb")
+    self._offsets_file = open(filename + ".offsets.tmp", "wb")
+    self._offsets_file.write(numpy.array([0], dtype=TokenCorpus.OffsetsDtype).tobytes())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    if exc_type:
+      self._tokens_file.close()
+      self._offsets_file.close()
+    else:
+      self.close()
+
+  def add_seq(self, seq):
+    """
+    :param numpy.ndarray|list[int] seq: token indices
+    """
+    seq = numpy.asarray(seq)
+    assert seq.ndim == 1
+    if len(seq):
+      assert 0 <= seq.min() and seq.max() < 2 ** 31
+    self._tokens_file.write(seq.astype(TokenCorpus.TokensDtype).tobytes())
+    self.num_tokens += len(seq)
+    self.num_seqs += 1
+    self._offsets_file.write(numpy.array([self.num_tokens], dtype=TokenCorpus.OffsetsDtype).tobytes())
+
+  def close(self):
+    """
+    Finishes the files.
+    """
+    self._tokens_file.close()
+    self._offsets_file.close()
+    os.rename(self.filename + ".offsets.tmp", self.filename + ".offsets")
+    os.rename(self.filename + ".tmp", self.filename)
+
+
 class AllophoneState:
   """
   Represents one allophone (phone with context) state (number, boundary).
@@ -1056,6 +1231,11 @@ class TranslationDataset(CachedDataset2):
   file_postfix can be used. The target file and vocabulary do not have to exists when setting ``source_only``.
   It is also automatically checked if a gzip version of the file exists.
 
+  If a binary pre-tokenized corpus (see :class:`TokenCorpus`) exists for all files which are read,
+  i.e. ``source.<file_postfix>.tokens`` etc. (e.g. created via ``tools/dump-token-corpus.py``),
+  it is used instead of the text files. It must already include the ``source_postfix``/``target_postfix``.
+  It is memory-mapped, thus there is no reading thread and the seq lengths are available instantly.
+
   To follow the RETURNN conventions on data input and output, the source text is mapped to the "data" key,
   and the target text to the "classes" data key. Both are index sequences.
 
@@ -1065,6 +1245,7 @@ class TranslationDataset(CachedDataset2):
   target_file_prefix = "target"
   main_source_data_key = "data"
   main_target_data_key = "classes"
+  _token_corpus_supported = True  # whether the data keys are exactly the main data keys (see _get_token_corpora)
 
   def __init__(self, path, file_postfix, source_postfix="", target_postfix="",
                source_only=False,
@@ -1109,12 +1290,23 @@ class TranslationDataset(CachedDataset2):
 
     self._files_to_read = [prefix for prefix in self._main_data_key_map.keys()
       if not (prefix == self.target_file_prefix and search_without_reference)]
-    self._data_files = {prefix: self._get_data_file(prefix) for prefix in self._files_to_read}
+    self._token_corpora = self._get_token_corpora()
+    if self._token_corpora:
+      self._data_files = {}
+    else:
+      self._data_files = {prefix: self._get_data_file(prefix) for prefix in self._files_to_read}
 
     self._data_keys = self._source_data_keys + self._target_data_keys
     self._data = {
-      data_key: [] for data_key in self._data_keys}  # type: typing.Dict[str,typing.List[numpy.ndarray]]
+      data_key: [] for data_key in self._data_keys
+    }  # type: typing.Dict[str,typing.Union[typing.List[numpy.ndarray],TokenCorpus]]
     self._data_len = None  # type: typing.Optional[int]
+    if self._token_corpora:
+      for prefix, token_corpus in self._token_corpora.items():
+        self._data[self._main_data_key_map[prefix]] = token_corpus
+      self._data_len = len(self._token_corpora[self.source_file_prefix])
+      assert all([len(token_corpus) == self._data_len for token_corpus in self._token_corpora.values()]), (
+        "%s: token corpora have different lengths: %r" % (self, self._token_corpora))
 
     self._vocabs = self._get_vocabs()
     self.num_outputs = {k: [max(self._vocabs[k].values()) + 1, 1] for k in self._vocabs.keys()}  # all sparse
@@ -1132,9 +1324,11 @@ class TranslationDataset(CachedDataset2):
 
     self._seq_order = None  # type: typing.Optional[typing.List[int]]  # seq_idx -> line_nr
     self._tag_prefix = "line-"  # sequence tag is "line-n", where n is the line number
-    self._thread = Thread(name="%r reader" % self, target=self._thread_main)
-    self._thread.daemon = True
-    self._thread.start()
+    self._thread = None  # type: typing.Optional[Thread]
+    if not self._token_corpora:
+      self._thread = Thread(name="%r reader" % self, target=self._thread_main)
+      self._thread.daemon = True
+      self._thread.start()
 
   @property
   def _source_data_keys(self):
@@ -1227,6 +1421,23 @@ class TranslationDataset(CachedDataset2):
       return gzip.GzipFile(self._transform_filename(filename + ".gz"), "rb")
     raise Exception("Data file not found: %r (.gz)?" % filename)
 
+  def _get_token_corpora(self):
+    """
+    :return: file prefix -> token corpus, if there is a token corpus for every file to read, otherwise None
+    :rtype: dict[str,TokenCorpus]|None
+    """
+    if not self._token_corpus_supported:
+      return None
+    token_corpora = {}
+    for prefix in self._files_to_read:
+      filename = "%s/%s.%s.tokens" % (self.path, prefix, self.file_postfix)
+      if not TokenCorpus.exists(filename):
+        return None
+      token_corpora[prefix] = TokenCorpus(
+        self._transform_filename(filename), offsets_filename=self._transform_filename(filename + ".offsets"))
+    print("%r: using token corpora %r" % (self, sorted(token_corpora.values(), key=repr)), file=log.v4)
+    return token_corpora
+
   def _get_vocabs(self):
     """
     :return: vocabularies for main data keys ("data" and "classes") as a dict data_key -> vocabulary
@@ -1375,6 +1586,10 @@ class TranslationDataset(CachedDataset2):
       seq_list = self.seq_list
     if seq_list is not None:
       self._seq_order = [int(s[len(self._tag_prefix):]) for s in seq_list]
+    elif self._token_corpora:
+      source_corpus = self._token_corpora[self.source_file_prefix]
+      self._seq_order = self.get_seq_order_for_epoch(
+        epoch=epoch, num_seqs=len(source_corpus), get_seq_len=source_corpus.get_seq_len)
     else:
       num_seqs = self._get_data_len()
       self._seq_order = self.get_seq_order_for_epoch(
@@ -1415,6 +1630,8 @@ class TranslationFactorsDataset(TranslationDataset):
   (see the 'source_factors' parameter).
   """
 
+  _token_corpus_supported = False
+
   def __init__(self, source_factors=None, target_factors=None, factor_separator='|', **kwargs):
     """
     :param list[str]|None source_factors: Data keys for the source factors (excluding first factor, which is always
@@ -1540,6 +1757,7 @@ class ConfusionNetworkDataset(TranslationDataset):
   """
 
   main_source_data_key = "sparse_inputs"
+  _token_corpus_supported = False
 
   def __init__(self, max_density=20, **kwargs):
     """
@@ -28,7 +28,9 @@ from CachedDataset2 import CachedDataset2
 from Util import NumbersDict, load_json
 from Log import log
 from random import Random
+from multiprocessing.pool import ThreadPool
 import numpy
+import os
 import sys
 import typing
 
@@ -108,6 +110,48 @@ class EpochWiseFilter:
     return seq_order
 
 
+class SeqTagIndex:
+  """
+  Compact representation of a seq list (list of seq tags), with fast lookup in both directions.
+  The tags are stored in a single Numpy array, i.e. there are no per-tag Python objects,
+  and the tag -> idx lookup is a binary search in the sorted tags.
+  """
+
+  def __init__(self, tags):
+    """
+    :param list[str] tags:
+    """
+    self.tags = numpy.array(tags) if tags else numpy.zeros((0,), dtype="U1")
+    self._sorted_idxs = numpy.argsort(self.tags, kind="mergesort")
+    self._sorted_tags = self.tags[self._sorted_idxs]
+
+  def __len__(self):
+    return len(self.tags)
+
+  def get_idxs(self, tags):
+    """
+    :param list[str] tags:
+    :return: indices into the original seq list, shape (len(tags),)
+    :rtype: numpy.ndarray
+    """
+    tags = numpy.array(tags, dtype=self.tags.dtype.kind)
+    if len(tags) and not len(self.tags):
+      raise KeyError("seq tag %r not found" % tags[0])
+    pos = numpy.searchsorted(self._sorted_tags, tags)
+    pos_ = numpy.minimum(pos, len(self._sorted_tags) - 1)
+    found = (pos < len(self._sorted_tags)) & (self._sorted_tags[pos_] == tags)
+    if not numpy.all(found):
+      raise KeyError("seq tag %r not found" % tags[numpy.argmin(found)])
+    return self._sorted_idxs[pos_]
+
+  def get_tags(self, idxs):
+    """
+    :param list[int]|numpy.ndarray idxs:
+    :rtype: list[str]
+    """
+    return self.tags[numpy.array(idxs, dtype="int64")].tolist()
+
+
 class MetaDataset(CachedDataset2):
   """
   The MetaDataset is to be used in the case of **Multimodality**.
@@ -171,6 +215,12 @@ class MetaDataset(CachedDataset2):
   The desired sorting needs to be set as parameter in this sub-daset, setting ``seq_ordering`` for the MetaDataset
   will be ignored.
 
+  **Threading:**
+
+  The sub-datasets are initialized in parallel (while the seq list file is being loaded),
+  and ``load_seqs`` is also done in parallel for all sub-datasets, using ``num_threads`` threads.
+  Set ``num_threads=1`` to do everything sequentially in the main thread.
+
 
   """
 
@@ -182,6 +232,7 @@ class MetaDataset(CachedDataset2):
                seq_lens_file=None,
                data_dims=None,
                data_dtypes=None,
+               num_threads=None,
                window=1, **kwargs):
     """
     :param dict[str,dict[str]] datasets: dataset-key -> dataset-kwargs. including keyword 'class' and maybe 'files'
@@ -200,6 +251,7 @@ class MetaDataset(CachedDataset2):
     :param dict[str,(int,int)] data_dims: self-data-key -> data-dimension, len(shape) (1 ==> sparse repr).
        Deprecated/Only to double check. Read from data if not specified.
     :param dict[str,str] data_dtypes: self-data-key -> dtype. Read from data if not specified.
+    :param int|None num_threads: for sub-dataset initialization and loading. by default one per sub-dataset
     """
     assert window == 1  # not implemented
     super(MetaDataset, self).__init__(**kwargs)
@@ -213,17 +265,31 @@ class MetaDataset(CachedDataset2):
     self.default_dataset_key = seq_order_control_dataset or self.data_map["data"][0]
     self.seq_order_control_dataset = seq_order_control_dataset
 
-    # This will only initialize datasets needed for features occuring in data_map
-    self.datasets = {
-      key: init_dataset(datasets[key], extra_kwargs={"name": "%s_%s" % (self.name, key)})
-      for key in self.dataset_keys}  # type: typing.Dict[str,Dataset]
+    self.num_threads = num_threads or len(self.dataset_keys)
+    self._thread_pool = None  # type: typing.Optional[ThreadPool]
+    self._thread_pool_pid = None  # type: typing.Optional[int]
 
-    self.seq_list_original = self._load_seq_list(seq_list_file)
+    # This will only initialize datasets needed for features occuring in data_map.
+    # The seq list file does not depend on the datasets, so we can load it at the same time.
+    dataset_keys = sorted(self.dataset_keys)
+    seq_list_file_res = None
+    if seq_list_file:
+      seq_list_file_res = self._get_thread_pool().apply_async(
+        Dataset._load_seq_list_file, (seq_list_file,), {"expect_list": False})
+    datasets = self._map_parallel(
+      lambda key: init_dataset(datasets[key], extra_kwargs={"name": "%s_%s" % (self.name, key)}), dataset_keys)
+    self.datasets = dict(zip(dataset_keys, datasets))  # type: typing.Dict[str,Dataset]
+
+    if seq_list_file_res:
+      self.seq_list_original = self._load_seq_list(seq_list=seq_list_file_res.get())
+    else:
+      self.seq_list_original = self._load_seq_list()
     self.num_total_seqs = len(self.seq_list_original[self.default_dataset_key])
     for key in self.dataset_keys:
       assert len(self.seq_list_original[key]) == self.num_total_seqs
 
-    self.tag_idx = {tag: idx for (idx, tag) in enumerate(self.seq_list_original[self.default_dataset_key])}
+    # dataset key -> SeqTagIndex. Shared between datasets which use the same seq list. Created on demand.
+    self._seq_tag_indices = None  # type: typing.Optional[typing.Dict[str,SeqTagIndex]]
 
     self._seq_lens = None  # type: typing.Optional[typing.Dict[str,NumbersDict]]
     self._num_timesteps = None  # type: typing.Optional[NumbersDict]
@@ -257,6 +323,48 @@ class MetaDataset(CachedDataset2):
     self.orig_seq_order_is_initialized = False
     self.seq_list_ordered = None  # type: typing.Optional[typing.Dict[str,typing.List[str]]]
 
+  def __getstate__(self):
+    # The thread pool cannot be pickled (e.g. with CachedDataset2 num_workers), and it is recreated on demand.
+    state = self.__dict__.copy()
+    state["_thread_pool"] = None
+    state["_thread_pool_pid"] = None
+    return state
+
+  def _get_thread_pool(self):
+    """
+    :return: thread pool. recreated after a fork, as the threads do not exist in the child process
+    :rtype: ThreadPool
+    """
+    if self._thread_pool is None or self._thread_pool_pid != os.getpid():
+      self._thread_pool = ThreadPool(self.num_threads)
+      self._thread_pool_pid = os.getpid()
+    return self._thread_pool
+
+  def _map_parallel(self, func, keys):
+    """
+    :param ((str)->T) func:
+    :param list[str] keys: dataset keys
+    :return: [func(key) for key in keys], run in parallel if we have multiple threads
+    :rtype: list[T]
+    """
+    if self.num_threads <= 1 or len(keys) <= 1:
+      return [func(key) for key in keys]
+    return self._get_thread_pool().map(func, keys)
+
+  def _get_seq_tag_indices(self):
+    """
+    :return: dataset key -> seq tag index of seq_list_original
+    :rtype: dict[str,SeqTagIndex]
+    """
+    if self._seq_tag_indices is None:
+      indices_by_list_id = {}  # type: typing.Dict[int,SeqTagIndex]
+      self._seq_tag_indices = {}
+      for key, seq_list in sorted(self.seq_list_original.items()):
+        if id(seq_list) not in indices_by_list_id:
+          indices_by_list_id[id(seq_list)] = SeqTagIndex(seq_list)
+        self._seq_tag_indices[key] = indices_by_list_id[id(seq_list)]
+    return self._seq_tag_indices
+
   def _is_same_seq_name_for_each_dataset(self):
     """
     This should be fast.
@@ -269,15 +377,13 @@ class MetaDataset(CachedDataset2):
         return False
     return True
 
-  def _load_seq_list(self, seq_list_file=None):
+  def _load_seq_list(self, seq_list=None):
     """
-    :param str seq_list_file:
+    :param list[str]|dict[str,list[str]]|None seq_list: as loaded from the seq list file, if given
     :return: dict: dataset key -> seq list
     :rtype: dict[str,list[str]]
     """
-    if seq_list_file:
-      seq_list = Dataset._load_seq_list_file(seq_list_file, expect_list=False)
-    else:
+    if seq_list is None:
       # We create a sequence list from all the sequences of the default dataset and hope that it also applies to the
       # other datasets. This can only work if all datasets have the same tag format and the sequences in the other
       # datasets are a subset of those in the default dataset.
@@ -341,12 +447,15 @@ class MetaDataset(CachedDataset2):
 
     seq_order_dataset = None
     if seq_list:
-      seq_index = [self.tag_idx[tag] for tag in seq_list]
+      seq_index = self._get_seq_tag_indices()[self.default_dataset_key].get_idxs(seq_list)
     elif self.seq_order_control_dataset:
       seq_order_dataset = self.datasets[self.seq_order_control_dataset]
       assert isinstance(seq_order_dataset, Dataset)
       seq_order_dataset.init_seq_order(epoch=epoch)
       seq_index = seq_order_dataset.get_current_seq_order()
+      if self.num_shards > 1:
+        seq_index = self._apply_shard(seq_index, shard_index=self.shard_index, num_shards=self.num_shards)
+        seq_order_dataset = None  # needs init with the seq list of our shard, like the others
     else:
       if self._seq_lens:
         def get_seq_len(s):
@@ -362,13 +471,21 @@ class MetaDataset(CachedDataset2):
         get_seq_len = self._get_dataset_seq_length
       seq_index = self.get_seq_order_for_epoch(epoch, self.num_total_seqs, get_seq_len)
     self._num_seqs = len(seq_index)
-    self.seq_list_ordered = {key: [ls[s] for s in seq_index] for (key, ls) in self.seq_list_original.items()}
-
-    for dataset_key, dataset in self.datasets.items():
+    seq_lists_ordered_by_index_id = {}  # type: typing.Dict[int,typing.List[str]]
+    self.seq_list_ordered = {}
+    for key, seq_tag_index in self._get_seq_tag_indices().items():
+      if id(seq_tag_index) not in seq_lists_ordered_by_index_id:
+        seq_lists_ordered_by_index_id[id(seq_tag_index)] = seq_tag_index.get_tags(seq_index)
+      self.seq_list_ordered[key] = seq_lists_ordered_by_index_id[id(seq_tag_index)]
+
+    def _init_dataset_seq_order(dataset_key):
+      dataset = self.datasets[dataset_key]
       assert isinstance(dataset, Dataset)
-      if dataset is seq_order_dataset:
-        continue
       dataset.init_seq_order(epoch=epoch, seq_list=self.seq_list_ordered[dataset_key])
+
+    self._map_parallel(
+      _init_dataset_seq_order,
+      [key for key in sorted(self.dataset_keys) if self.datasets[key] is not seq_order_dataset])
     return True
 
   def get_all_tags(self):
@@ -400,10 +517,12 @@ class MetaDataset(CachedDataset2):
     if self.added_data:
       start_ = max(self.added_data[-1].seq_idx + 1, start)
     if start_ < end:
-      for dataset_key in self.dataset_keys:
+      def _load_dataset_seqs(dataset_key):
         self.datasets[dataset_key].load_seqs(start_, end)
         for seq_idx in range(start_, end):
           self._check_dataset_seq(dataset_key, seq_idx)
+
+      self._map_parallel(_load_dataset_seqs, sorted(self.dataset_keys))
     super(MetaDataset, self)._load_seqs(start=start, end=end)
 
   def _check_dataset_seq(self, dataset_key, seq_idx):
@@ -1318,7 +1437,7 @@ class ChunkShuffleDataset(CachedDataset2):
     for batch in batches:
       assert batch.seqs
       if batch.end_seq > self.dataset_last_load_seq_end:
-        self.dataset.load_seqs(batch.start_seq, batch.end_seq)
+        self.dataset.load_seqs(*batch.get_load_seqs_range())
         self.dataset_last_load_seq_end = batch.end_seq
 
       used_data_keys = self.get_data_keys()
@@ -1,13 +1,27 @@
 """
 The Server module manages connections via HTTP. It is especially
-tuned to work well with multiple engine instances at once. Initiated
+tuned to work well with multiple models at once. Initiated
 via rnn.py with a Server config. Here's a basic config:
 
 #!returnn/rnn.py
 task = "server"
+use_tensorflow = True
 port = 10687
 max_engines = 2
 network = {"out" : { "class" : "softmax", "loss" : "ce", "target":"classes" }}
+server_models = {"my-model": "/path/to/model.config"}  # optional, loaded at startup
+
+Every model (config + checkpoint) gets its own TF engine (:class:`TFEngine.Engine`).
+The requests to a model are queued and grouped into batches (see :class:`Util.RequestBatcher`),
+and processed by a pool of worker threads (``server_num_workers`` in the model config).
+The HTTP handling runs in the Tornado IO loop and never blocks on the computation.
+
+Endpoints:
+
+  - POST /classify?engine_hash=...: classify the data in the body
+  - POST /loadconfig: load a new model, see :class:`ConfigHandler`
+  - POST /warmup?engine_hash=...: run the model once on dummy data
+  - GET /health: status of all models, and their batching and latency stats
 """
 
 from __future__ import print_function
@@ -18,140 +32,212 @@ import datetime
 import hashlib
 import json
 import os
-import re
 import struct
 import sys
+import threading
 import time
+import typing
 import urllib
 import urllib.request
 
 import numpy as np
 from tornado import locks
 from tornado.concurrent import Future
+import tornado.gen
 from tornado.ioloop import IOLoop
-from tornado.queues import Queue, QueueEmpty
 import tornado.web
 
 from Log import log
 from GeneratingDataset import StaticDataset
-from Device import Device
-from Util import TheanoFlags
-from Config import get_devices_init_args
-from EngineTask import ForwardTaskThread
-import Engine
+from Util import RequestBatcher, BatchedRequest, RequestQueueFullException, RequestCancelledException
 import Config
 
 # TODO: Look into making these non-global.
 _max_amount_engines = 4
 
 
-class ClassificationRequest:
-  def __init__(self, data):
-    self.data = data
-    self.future = Future()
+class Model:
+  """
+  A model loaded from some config (and the checkpoint specified there), served via a :class:`RequestBatcher`.
+  The status is "loading", "ready" or "failed".
+  """
 
+  # Creating the TF engine resets and uses the global default graph. Thus only one model is initialized at a time.
+  _init_engine_lock = threading.Lock()
 
-class Model:
   def __init__(self, config_file):
-    self.lock = locks.Lock()
-    self.classification_queue = Queue()
+    """
+    :param str config_file:
+    """
+    self.config_file = config_file
+    self.status = "loading"
+    self.error = None  # type: typing.Optional[str]
+    self.engine = None  # type: typing.Optional[TFEngine.Engine]
+    self.batcher = None  # type: typing.Optional[RequestBatcher]
+    self.graph = None
+    self.output_t = None
+    self.output_seq_lens_t = None
+    self.warm_up_time = None  # type: typing.Optional[float]
 
     print('loading config %s' % config_file, file=log.v5)
     # Load and setup config
     try:
       self.config = Config.Config()
       self.config.load_file(config_file)
+      if not self.config.has("task"):
+        self.config.set("task", "forward")
       self.pause_after_first_seq = self.config.float('pause_after_first_seq', 0.2)
       self.batch_size = self.config.int('batch_size', 5000)
       self.max_seqs = self.config.int('max_seqs', -1)
+      self.num_workers = self.config.int('server_num_workers', 1)
+      self.max_queue_size = self.config.int('server_max_queue_size', 0) or None
     except Exception:
       print('Error: loading config %s failed' % config_file, file=log.v1)
       raise
 
-    try:
-      self.devices = self._init_devices()
-    except Exception:
-      print('Error: Loading devices for config %s failed' % config_file, file=log.v1)
-      raise
+    self.last_used = datetime.datetime.now()
 
-    print('Starting engine for config %s' % config_file, file=log.v5)
-    self.engine = Engine.Engine(self.devices)
+  def load(self):
+    """
+    Creates the engine, loads the network and checkpoint, warms up the model and starts the workers.
+    This blocks, so run it in some executor.
+    """
     try:
-      self.engine.init_network_from_config(config=self.config)
-    except Exception:
-      print('Error: Loading network for config %s failed' % config_file, file=log.v1)
+      import TFEngine
+      print('Starting engine for config %s' % self.config_file, file=log.v5)
+      with self._init_engine_lock:
+        self.engine = TFEngine.Engine(config=self.config)
+        self.engine.init_network_from_config(config=self.config)
+        self.graph = self.engine.tf_session.graph
+        # Create all needed tensors now, such that we do not extend the graph later.
+        # noinspection PyProtectedMember
+        output = self.engine._get_output_layer(self.config.value("extract_output_layer_name", None)).output
+        self.output_t = output.get_placeholder_as_batch_major()
+        self.output_seq_lens_t = output.get_sequence_lengths() if output.have_time_axis() else None
+      self.warm_up()
+      self.batcher = RequestBatcher(
+        process_batch=self._process_batch,
+        max_batch_seqs=self.max_seqs if self.max_seqs > 0 else sys.maxsize,
+        max_batch_frames=self.batch_size or None,
+        max_wait_time=self.pause_after_first_seq,
+        num_threads=self.num_workers,
+        max_queue_size=self.max_queue_size,
+        name="Server model %s" % os.path.basename(self.config_file))
+    except Exception as exc:
+      print('Error: loading model for config %s failed: %s' % (self.config_file, exc), file=log.v1)
+      sys.excepthook(*sys.exc_info())
+      self.status = "failed"
+      self.error = str(exc)
       raise
+    self.status = "ready"
 
-    IOLoop.current().spawn_callback(self.classify_in_background)
-
-    self.last_used = datetime.datetime.now()
+  def get_dummy_data(self, num_frames=10):
+    """
+    :param int num_frames:
+    :return: data for a single seq with zeros for the default input, e.g. for the warm-up
+    :rtype: dict[str,numpy.ndarray]
+    """
+    input_data = self.engine.network.extern_data.get_default_input_data()
+    shape = [num_frames if dim is None else dim for dim in input_data.shape]
+    return {input_data.name: np.zeros(shape, dtype=input_data.dtype)}
 
-  def _init_devices(self):
-    """
-    Initiates the required devices for a config. Same as the funtion initDevices in
-    rnn.py.
-    :param config:
-    :return: A list with the devices used.
-    """
-    oldDeviceConfig = ",".join(self.config.list('device', ['default']))
-    if "device" in TheanoFlags:
-      # This is important because Theano likely already has initialized that device.
-      config.set("device", TheanoFlags["device"])
-      print("Devices: Use %s via THEANO_FLAGS instead of %s." % (TheanoFlags["device"], oldDeviceConfig), file=log.v4)
-    devArgs = get_devices_init_args(self.config)
-    assert len(devArgs) > 0
-    devices = [Device(**kwargs) for kwargs in devArgs]
-    for device in devices:
-      while not device.initialized:
-        time.sleep(0.25)
-    if devices[0].blocking:
-      print("Devices: Used in blocking / single proc mode.", file=log.v4)
-    else:
-      print("Devices: Used in multiprocessing mode.", file=log.v4)
-    return devices
+  def warm_up(self):
+    """
+    Runs the model on dummy data, with a single seq and with a full batch,
+    such that everything is initialized before the first real request.
 
-  @tornado.gen.coroutine
-  def classify_in_background(self):
-    while True:
-      requests = []
-      # fetch first request
-      r = yield self.classification_queue.get()
-      requests.append(r)
-      # grab all other waiting requests
-      try:
-        while True:
-          requests.append(self.classification_queue.get_nowait())
-      except QueueEmpty:
-        pass
+    :return: time in secs
+    :rtype: float
+    """
+    start_time = time.time()
+    for num_seqs in sorted({1, min(self.max_seqs if self.max_seqs > 0 else 10, 10)}):
+      self._process_batch([self.get_dummy_data() for _ in range(num_seqs)])
+    self.warm_up_time = time.time() - start_time
+    print('Warm-up for config %s took %.3f secs' % (self.config_file, self.warm_up_time), file=log.v4)
+    return self.warm_up_time
+
+  def _process_batch(self, data_list):
+    """
+    Called by the batcher worker threads.
 
-      output_dim = {}
-      # Do dataset creation and classification.
-      dataset = StaticDataset(data=[r.data for r in requests], output_dim=output_dim)
-      dataset.init_seq_order()
-      batches = dataset.generate_batches(recurrent_net=self.engine.network.recurrent,
-                                         batch_size=self.batch_size, max_seqs=self.max_seqs)
+    :param list[dict[str,numpy.ndarray]] data_list: data key -> data, for every request
+    :return: for every request, the output of the output layer, shape (time,dim) (or without time)
+    :rtype: list[numpy.ndarray]
+    """
+    extern_data = self.engine.network.extern_data
+    results = [None] * len(data_list)  # type: typing.List[typing.Optional[np.ndarray]]
+    # The StaticDataset needs the same data keys for every seq.
+    groups = {}  # type: typing.Dict[typing.Tuple[str,...],typing.List[int]]
+    for i, data in enumerate(data_list):
+      groups.setdefault(tuple(sorted(data.keys())), []).append(i)
+    for keys, indices in sorted(groups.items()):
+      dataset = StaticDataset(
+        data=[data_list[i] for i in indices],
+        output_dim={key: [extern_data.data[key].dim, extern_data.data[key].ndim] for key in keys})
+      dataset.init_seq_order(epoch=1)
+      with self.graph.as_default():
+        output_d = self.engine.run_single(
+          dataset=dataset, seq_idx=-1, output_dict={"output": self.output_t, "seq_lens": self.output_seq_lens_t})
+      for j, i in enumerate(indices):
+        if output_d["seq_lens"] is not None:
+          results[i] = output_d["output"][j][:output_d["seq_lens"][j]]
+        else:
+          results[i] = output_d["output"][j]
+    return results
+
+  def add_request(self, data):
+    """
+    Must be called from the IO loop.
 
-      with (yield self.lock.acquire()):
-        ctt = ForwardTaskThread(self.engine.network, self.devices, dataset, batches)
-        yield ctt.join()
+    :param dict[str,numpy.ndarray] data: data key -> data, for a single seq
+    :return: the request (can be cancelled via self.batcher.cancel), and a future for its output,
+      which is of shape (time,dim) (or without time)
+    :rtype: (BatchedRequest, Future)
+    :raises RequestQueueFullException: if too many requests are pending
+    """
+    assert self.status == "ready"
+    self.last_used = datetime.datetime.now()
+    io_loop = IOLoop.current()
+    future = Future()
+    request = self.batcher.add_request(data, num_frames=len(data["data"]) if "data" in data else 1)
+
+    def set_future_result(request_):
+      """
+      :param BatchedRequest request_:
+      """
+      if request_.exception is not None:
+        future.set_exception(request_.exception)
+      else:
+        future.set_result(request_.result)
 
-      try:
-        for i in range(dataset.num_seqs):
-          requests[i].future.set_result(ctt.result[i])
-          self.classification_queue.task_done()
-      except Exception as e:
-        print('exception', e)
-        raise
+    # add_callback is thread-safe. The callback is called in the worker thread of the batcher.
+    request.add_done_callback(lambda request_: io_loop.add_callback(set_future_result, request_))
+    return request, future
 
   @tornado.gen.coroutine
   def classify(self, data):
-    self.last_used = datetime.datetime.now()
-    request = ClassificationRequest(data)
-
-    yield self.classification_queue.put(request)
-    yield request.future
+    """
+    :param dict[str,numpy.ndarray] data: data key -> data, for a single seq
+    :return: output, shape (time,dim) (or without time)
+    :rtype: numpy.ndarray
+    :raises RequestQueueFullException: if too many requests are pending
+    """
+    _, future = self.add_request(data)
+    result = yield future
+    raise tornado.gen.Return(result)
 
-    # return request.future.result()
+  def get_info(self):
+    """
+    :return: status, stats, etc. for the health endpoint
+    :rtype: dict[str]
+    """
+    return {
+      "config_file": self.config_file,
+      "status": self.status,
+      "error": self.error,
+      "warm_up_time": self.warm_up_time,
+      "last_used": str(self.last_used),
+      "stats": self.batcher.get_stats() if self.batcher else None}
 
 
 class Server:
@@ -173,27 +259,58 @@ class Server:
         pass
 
     self.models = {}
+    # For loading the models (blocking). The computation itself happens in the workers of every model.
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+    self.preload_models = global_config.typed_value('server_models', {})  # type: typing.Dict[str,str]
 
     self.application = tornado.web.Application([
       (r"/classify", ClassifyHandler, {'models': self.models}),
-      (r"/loadconfig", ConfigHandler, {'config_dir': self.config_dir, 'models': self.models})
+      (r"/loadconfig", ConfigHandler, {'config_dir': self.config_dir, 'models': self.models,
+                                       'executor': self.executor}),
+      (r"/warmup", WarmupHandler, {'models': self.models, 'executor': self.executor}),
+      (r"/health", HealthHandler, {'models': self.models}),
     ], debug=True, autoreload=False)
 
     self.port = int(global_config.value('port', '3033'))
     global _max_amount_engines
     _max_amount_engines = int(global_config.value('max_engines', '5'))
 
+  @tornado.gen.coroutine
+  def _load_model(self, name, config_file):
+    """
+    :param str name: used as engine_hash
+    :param str config_file:
+    """
+    model = Model(config_file)
+    self.models[name] = model
+    try:
+      yield self.executor.submit(model.load)
+    except Exception:
+      pass  # already reported, and the status is "failed"
+
   def run(self):
     print("Starting server on port: %d" % self.port, file=log.v3)
     self.application.listen(self.port)
-    IOLoop.instance().start()
+    for name, config_file in sorted(self.preload_models.items()):
+      IOLoop.current().spawn_callback(self._load_model, name, config_file)
+    IOLoop.current().start()
 
 
 class ClassifyHandler(tornado.web.RequestHandler):
   def initialize(self, models, **kwargs):
     self.models = models
+    self._model = None  # type: typing.Optional[Model]
+    self._request = None  # type: typing.Optional[BatchedRequest]
+    self._connection_closed = False
+
+  def on_connection_close(self):
+    """
+    The client has gone, so we can cancel the pending request.
+    """
+    self._connection_closed = True
+    if self._request and not self._request.done.is_set():
+      self._model.batcher.cancel(self._request)
 
-  @tornado.web.asynchronous
   @tornado.gen.coroutine
   def post(self, *args, **kwargs):
     # TODO: Write formal documentation
@@ -203,13 +320,12 @@ class ClassifyHandler(tornado.web.RequestHandler):
     engine to use), and the data itself in the body. If using binary data, the following
     URL paramaters must also be supplied: data_format='binary', data_shape=(<dim1,dim2>).
     If using a specific data type, you can supply it as the url parameter data_type.
+    If too many requests are pending for the model, this returns with status 503.
     :param args:
     :param kwargs:
     :return: Either JSON with error or JSON list of generated outputs.
     """
     url_params = self.request.arguments
-    output_dim = {}
-    ret = {}
     data = {}
     data_format = 'json'
     data_type = 'float32'
@@ -235,35 +351,50 @@ class ClassifyHandler(tornado.web.RequestHandler):
       print('Error: Received request with unknown engine_hash %s' % engine_hash, file=log.v1)
       self.set_status(499, 'Unknown engine_hash')
       return
-    network = model.engine.network
+    if model.status != "ready":
+      self.set_status(503, 'Model is %s' % model.status)
+      return
+    extern_data = model.engine.network.extern_data
 
     # Pre-process the data
     if data_format == 'json':
       data = json.loads(self.request.body)
       for k in data:
+        if k not in extern_data.data:
+          self.set_status(499, 'unknown target: %s' % k)
+          return
         try:
-          data[k] = np.asarray(data[k], dtype=data_type)
-          if k != 'data':
-            output_dim[k] = network.n_out[k]  # = [network.n_in,2] if k == 'data' else network.n_out[k]
+          data[k] = np.asarray(data[k], dtype=data_type if k == 'data' else extern_data.data[k].dtype)
         except Exception:
-          if k != 'data' and k not in network.n_out:
-            self.set_status(499, 'unknown target: %s' % k)
-          else:
-            self.set_status(499, 'unable to convert %s to an array from value %s' % (k, str(data[k])))
+          self.set_status(499, 'unable to convert %s to an array from value %s' % (k, str(data[k])))
           return
     elif data_format == 'binary':
       float_array = array(self._get_type_code(data_type))
       try:
         float_array.frombytes(self.request.body)
       except Exception as e:
-        print('Binary data error: %s' % str(e.message), file=log.v4)
-        self.set_status(499, 'Error during binary data conversion: ' + e.message)
+        print('Binary data error: %s' % str(e), file=log.v4)
+        self.set_status(499, 'Error during binary data conversion: ' + str(e))
         return
       shape = tuple(map(int, data_shape.split(',')))
       data['data'] = np.asarray(float_array.tolist(), dtype=data_type).reshape(shape)
 
-    result = yield model.classify(data)
-    print('writing results for request with shape %s' % data_shape)
+    try:
+      self._request, future = model.add_request(data)
+    except RequestQueueFullException as exc:
+      print('Rejected request for engine hash %s: %s' % (engine_hash, exc), file=log.v3)
+      self.set_status(503, 'Too many pending requests')
+      self.set_header('Retry-After', '1')
+      return
+    self._model = model
+    try:
+      result = yield future
+    except RequestCancelledException:
+      print('Request for engine hash %s was cancelled' % engine_hash, file=log.v4)
+      return
+    if self._connection_closed:  # it was already being processed when the client has gone
+      return
+    print('writing results for request with shape %s' % data_shape, file=log.v5)
     if data_format == 'json':
       self.write({'result': result.tolist()})
     elif data_format == 'binary':
@@ -271,7 +402,6 @@ class ClassifyHandler(tornado.web.RequestHandler):
       self.write(size_info)
       self.write(result.tobytes())
 
-
   def _get_type_code(self, format_to_convert):
     """
     Converts from Numpy format to python internal array format.
@@ -290,17 +420,18 @@ class ClassifyHandler(tornado.web.RequestHandler):
 class ConfigHandler(tornado.web.RequestHandler):
   load_config_lock = locks.Lock()
 
-  def initialize(self, config_dir, models, **kwargs):
+  def initialize(self, config_dir, models, executor, **kwargs):
     self.config_dir = config_dir
     self.models     = models
+    self.executor   = executor
 
-  @tornado.web.asynchronous
   @tornado.gen.coroutine
   def post(self, *args, **kwargs):
     """
     Handles the creation of a new engine based on a slightly modified config, supplied
     via HTTP Post. The request requires 1 URL parameter: new_config_url, which points
-    to a URL (can be local) from where to download the config. This call is blocking.
+    to a URL (can be local) from where to download the config.
+    This returns when the model is loaded and warmed up, but it does not block other requests.
 
     WARNING All configs must have the following added:
     extract_output_layer_name = "<OUTPUT LAYER ID>"
@@ -321,6 +452,9 @@ class ConfigHandler(tornado.web.RequestHandler):
         print('Using existing model with hash %s' % hash_val, file=log.v3)
         self.write(hash_val)
         return
+      if len(self.models) >= _max_amount_engines:
+        self.set_status(499, 'Too many models loaded already (max_engines %i)' % _max_amount_engines)
+        return
 
       # Download new config file and save to temp folder.
       print('loading config %s' % config_url, file=log.v5)
@@ -332,12 +466,70 @@ class ConfigHandler(tornado.web.RequestHandler):
         return
 
       try:
-        self.models[hash_val] = Model(config_file)
+        model = Model(config_file)
       except Exception as e:
-        print('Error: loading model failed %s' % str(e), file=log.v1)
         self.set_status(499, str(e))
-      else:
-        self.write(hash_val)
+        return
+      # Register it already now, such that its status is visible via the health endpoint.
+      self.models[hash_val] = model
+
+    try:
+      yield self.executor.submit(model.load)
+    except Exception as e:
+      print('Error: loading model failed %s' % str(e), file=log.v1)
+      del self.models[hash_val]
+      self.set_status(499, str(e))
+    else:
+      self.write(hash_val)
+
+
+class WarmupHandler(tornado.web.RequestHandler):
+  def initialize(self, models, executor, **kwargs):
+    self.models   = models
+    self.executor = executor
+
+  @tornado.gen.coroutine
+  def post(self, *args, **kwargs):
+    """
+    Runs the model given by the URL parameter engine_hash on dummy data.
+    Models are warmed up automatically when they are loaded, but this can be used e.g. after some idle time.
+    If too many requests are pending for the model, this returns with status 503.
+    :return: JSON with the warm-up time in secs
+    """
+    url_params = self.request.arguments
+    engine_hash = url_params['engine_hash'][0].decode('utf8') if 'engine_hash' in url_params else ''
+    model = self.models.get(engine_hash)
+    if not model:
+      self.set_status(499, 'Unknown engine_hash')
+      return
+    if model.status != "ready":
+      self.set_status(503, 'Model is %s' % model.status)
+      return
+    # Go through the batcher, such that this does not run concurrently to the initialization of the workers.
+    start_time = time.time()
+    try:
+      yield model.classify(model.get_dummy_data())
+    except RequestQueueFullException as exc:
+      print('Rejected warm-up for engine hash %s: %s' % (engine_hash, exc), file=log.v3)
+      self.set_status(503, 'Too many pending requests')
+      self.set_header('Retry-After', '1')
+      return
+    self.write({'warm_up_time': time.time() - start_time})
+
+
+class HealthHandler(tornado.web.RequestHandler):
+  def initialize(self, models, **kwargs):
+    self.models = models
+
+  def get(self, *args, **kwargs):
+    """
+    :return: JSON with the status of every model. HTTP status 503 if some model is not ready
+    """
+    infos = {engine_hash: model.get_info() for (engine_hash, model) in self.models.items()}
+    all_ready = all([info["status"] == "ready" for info in infos.values()])
+    if not all_ready:
+      self.set_status(503)
+    self.write({'status': 'ok' if all_ready else 'not ready', 'models': infos})
 
 
 # There used to be a training handler, but it was not finished and the server needed refactoring, so it was deleted to save some time. If you wish to revive it look in the VCS history for its code
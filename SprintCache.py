@@ -119,11 +119,13 @@ class FileArchive:
     return res
 
   # write routines
-  def write_str(self, s):
+  def write_str(self, s, enc='ascii'):
     """
-    :param str s:
+    :param str|bytes s:
     :rtype: int
     """
+    if not isinstance(s, bytes):
+      s = s.encode(enc)
     return self.f.write(pack("%ds" % len(s), s))
 
   def write_char(self, i):
@@ -173,20 +175,34 @@ class FileArchive:
   start_recovery_tag = 0xaa55aa55
   end_recovery_tag = 0x55aa55aa
 
-  def __init__(self, filename, must_exists=True):
+  IndexVersion = 1
 
+  def __init__(self, filename, must_exists=True, use_mmap=False, index_cache_dir=None):
+    """
+    :param str filename:
+    :param bool must_exists:
+    :param bool use_mmap: read via mmap. this is also safe to use in forked sub processes
+    :param str|None index_cache_dir: if set, persist the file info table (index) in this dir,
+      such that we do not need to read (or even scan) it again the next time
+    """
+    self.filename = filename
+    self.use_mmap = use_mmap
     self.ft = {}  # type: typing.Dict[str,FileInfo]
     if os.path.exists(filename):
       self.allophones = []
-      self.f = open(filename, 'rb')
+      self._open_for_reading()
       header = self.read_str(len(self.SprintCacheHeader))
       assert header == self.SprintCacheHeader
 
-      ft = bool(self.read_char())
-      if ft:
-        self.read_file_info_table()
-      else:
-        self.scan_archive()
+      index_filename = self._get_index_filename(index_cache_dir) if index_cache_dir else None
+      if not index_filename or not self._load_index(index_filename):
+        ft = bool(self.read_char())
+        if ft:
+          self.read_file_info_table()
+        else:
+          self.scan_archive()
+        if index_filename:
+          self._save_index(index_filename)
 
     else:
       assert not must_exists, "File does not exist: %r" % filename
@@ -202,6 +218,82 @@ class FileArchive:
   def __del__(self):
     self.f.close()
 
+  def _open_for_reading(self):
+    if self.use_mmap:
+      with open(self.filename, 'rb') as f:
+        self.f = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+      self.f = open(self.filename, 'rb')
+
+  def reopen(self):
+    """
+    Reopens the file for reading, e.g. after a fork, such that we do not share the file offset
+    with the parent process. Not needed with use_mmap.
+    """
+    if self.use_mmap:
+      return
+    self.f = open(self.filename, 'rb')
+
+  def _get_index_filename(self, index_cache_dir):
+    """
+    :param str index_cache_dir:
+    :rtype: str
+    """
+    import hashlib
+    name = hashlib.md5(os.path.abspath(self.filename).encode("utf8")).hexdigest()
+    return "%s/%s-%s.index" % (index_cache_dir, os.path.basename(self.filename), name)
+
+  def _get_index_file_stat(self):
+    """
+    :return: what must match to be able to use the persisted index
+    :rtype: dict[str]
+    """
+    stat = os.stat(self.filename)
+    return {"version": self.IndexVersion, "size": stat.st_size, "mtime": stat.st_mtime}
+
+  def _load_index(self, index_filename):
+    """
+    :param str index_filename:
+    :return: whether the index was loaded
+    :rtype: bool
+    """
+    import pickle
+    try:
+      with open(index_filename, 'rb') as f:
+        content = pickle.load(f)
+    except (IOError, OSError):  # does not exist (yet)
+      return False
+    except Exception as exc:  # broken file
+      print("SprintCache: cannot load index %r: %s" % (index_filename, exc), file=sys.stderr)
+      return False
+    if content.get("stat") != self._get_index_file_stat():
+      return False
+    self.ft = {
+      name: FileInfo(name, pos, size, comp, i)
+      for i, (name, pos, size, comp) in enumerate(content["ft"])}
+    return True
+
+  def _save_index(self, index_filename):
+    """
+    :param str index_filename:
+    """
+    import pickle
+    import tempfile
+    content = {
+      "stat": self._get_index_file_stat(),
+      "ft": [(fi.name, fi.pos, fi.size, fi.compressed) for fi in sorted(self.ft.values(), key=lambda fi: fi.index)]}
+    index_dir = os.path.dirname(index_filename)
+    try:
+      if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+      # Write to a temp file and rename, such that concurrent readers never see a partial file.
+      fd, tmp_filename = tempfile.mkstemp(dir=index_dir, suffix=".tmp")
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(content, f, protocol=pickle.HIGHEST_PROTOCOL)
+      os.rename(tmp_filename, index_filename)
+    except (IOError, OSError) as exc:
+      print("SprintCache: cannot save index %r: %s" % (index_filename, exc), file=sys.stderr)
+
   def file_list(self):
     """
     :rtype: list[str]
@@ -281,15 +373,18 @@ class FileArchive:
   def _raw_read(self, size, typ):
     """
     :param int|None size: needed for typ == "str"
-    :param str typ: "str", "feat" or "align"
+    :param str typ: "str", "feat", "align" or "align_raw"
     :return: depending on typ, "str" -> string, "feat" -> (time, data), "align" -> align,
       where string is a str,
-      time is list of time-stamp tuples (start-time,end-time) in millisecs,
-        data is a list of features, each a numpy vector,
-      align is a list of (time, allophone, state), time is an int from 0 to len of align,
-        allophone is some int, state is e.g. in [0,1,2].
-    :rtype: str|(list[numpy.ndarray],list[numpy.ndarray])|list[(int,int,int)]
+      time is an array of shape (T,2), float64, the time-stamps (start-time,end-time) in millisecs,
+        data is an array of shape (T,D), float32, the features,
+        or, if the frames have variable size, a list of T arrays of shape (D_t,), float32,
+      align is an array of shape (T,3), int32, with rows (time, allophone, state),
+        time is an int from 0 to len of align, allophone is some int, state is e.g. in [0,1,2].
+        For "align_raw", allophone is the raw allophone-state index, and state is -1.
+    :rtype: str|(numpy.ndarray,numpy.ndarray|list[numpy.ndarray])|numpy.ndarray
     """
+    start_pos = self.f.tell()
 
     if typ == "str":
       return self.read_str(size)
@@ -300,8 +395,23 @@ class FileArchive:
       # print(typ)
       assert typ == "vector-f32"
       count = self.read_U32()
+      if count == 0:
+        return numpy.zeros((0, 2), dtype="float64"), numpy.zeros((0, 0), dtype="float32")
+      # Each frame is: size (u32), size x f32, 2 x f64.
+      # Usually all frames have the same size, then we can decode all frames at once.
+      dim = self.read_U32()
+      self.f.seek(-4, os.SEEK_CUR)
+      frame_dtype = numpy.dtype([("size", "u4"), ("data", "f4", (dim,)), ("time", "f8", (2,))])
+      buf = self.f.read(count * frame_dtype.itemsize)
+      if len(buf) == count * frame_dtype.itemsize:
+        frames = numpy.frombuffer(buf, dtype=frame_dtype, count=count)
+        if numpy.all(frames["size"] == dim):
+          return frames["time"].copy(), frames["data"].copy()
+      # Variable size frames. Fallback to reading frame by frame.
+      # The features cannot be stacked into a dense array then, thus they stay a list of arrays.
+      self.f.seek(-len(buf), os.SEEK_CUR)
       data = [None] * count  # type: typing.List[typing.Optional[numpy.ndarray]]
-      time_ = [None] * count  # type: typing.List[typing.Optional[numpy.ndarray]]
+      time_ = numpy.zeros((count, 2), dtype="float64")
       for i in range(count):
         size = self.read_U32()
         data[i] = self.read_v("f", size)  # size x f32
@@ -309,6 +419,7 @@ class FileArchive:
       return time_, data
 
     elif typ in ["align", "align_raw"]:
+      raw = typ == "align_raw"
       type_len = self.read_U32()
       typ = self.read_str(type_len)
       assert typ == "flow-alignment"
@@ -317,44 +428,76 @@ class FileArchive:
       if typ in ["ALIGNRLE", "AALPHRLE"]:
         # In case of AALPHRLE, after the alignment, we include the alphabet of the used labels.
         # We ignore this at the moment.
-        size = self.read_U32()
-        if size < (1 << 31):
-          # RLE scheme
-          time = 0
-          alignment = []
-          while len(alignment) < size:
-            n = self.read_char()
-            # print(n)
-            if n > 0:
-              while n > 0:
-                mix, state = self.read_u32(), None
-                if typ != "align_raw":
-                  mix, state = self.get_state(mix)
-                # print(mix, state)
-                # print(time, self.allophones[mix])
-                alignment.append((time, mix, state))
-                time += 1
-                n -= 1
-            elif n < 0:
-              mix, state = self.read_u32(), None
-              if typ != "align_raw":
-                mix, state = self.get_state(mix)
-              while n < 0:
-                # print(mix, state)
-                # print(time, self.allophones[mix])
-                alignment.append((time, mix, state))
-                time += 1
-                n += 1
-            else:
-              time = self.read_u32()
-              # print("time", time)
-          return alignment
+        num_frames = self.read_U32()
+        if num_frames < (1 << 31):
+          # Read the whole remaining entry at once.
+          pos = self.f.tell()
+          remaining = size - (pos - start_pos)
+          if isinstance(self.f, mmap.mmap):
+            buf = self.f[pos:pos + remaining]
+          else:
+            buf = self.f.read(remaining)
+          return self._decode_rle_alignment(buf, num_frames=num_frames, raw=raw)
         else:
           raise NotImplementedError("No support for weighted "
                                     "alignments yet.")
       else:
         raise Exception("No valid alignment header found (found: %r). Wrong cache?" % typ)
 
+  def _decode_rle_alignment(self, buf, num_frames, raw=False):
+    """
+    The RLE scheme is a sequence of records, each starting with a signed char n:
+    n > 0: n frames follow, each with its own mix (u32),
+    n < 0: -n frames follow, all with the same mix (u32),
+    n == 0: the time (u32) is set.
+
+    :param bytes buf: the remaining bytes of the entry
+    :param int num_frames:
+    :param bool raw: if True, do not split the mix into allophone and state
+    :return: (T,3), int32, rows (time, allophone, state). see :func:`_raw_read`
+    :rtype: numpy.ndarray
+    """
+    # The records have variable size, thus we need to find the record boundaries sequentially.
+    # But this is cheap, and we decode all the frames at once afterwards.
+    bs = bytearray(buf)
+    run_pos, run_lens, run_steps, run_times = [], [], [], []
+    pos, time, total = 0, 0, 0
+    while total < num_frames:
+      n = bs[pos]
+      if n >= 128:
+        n -= 256  # signed char
+      if n == 0:
+        time = unpack("i", buf[pos + 1:pos + 5])[0]
+        pos += 5
+        continue
+      run_pos.append(pos + 1)
+      run_times.append(time)
+      if n > 0:
+        run_lens.append(n)
+        run_steps.append(4)
+        pos += 1 + 4 * n
+      else:
+        run_lens.append(-n)
+        run_steps.append(0)
+        pos += 5
+      time += abs(n)
+      total += abs(n)
+    run_lens = numpy.array(run_lens, dtype="int64")
+    run_offsets = numpy.cumsum(run_lens) - run_lens
+    frame_in_run = numpy.arange(total) - numpy.repeat(run_offsets, run_lens)
+    frame_pos = numpy.repeat(numpy.array(run_pos, dtype="int64"), run_lens)
+    frame_pos += numpy.repeat(numpy.array(run_steps, dtype="int64"), run_lens) * frame_in_run
+    byte_pos = frame_pos[:, None] + numpy.arange(4)[None, :]  # (T,4)
+    mix = numpy.frombuffer(buf, dtype="uint8")[byte_pos].copy().view("i4")[:, 0]
+    alignment = numpy.zeros((total, 3), dtype="int32")
+    alignment[:, 0] = numpy.repeat(numpy.array(run_times, dtype="int64"), run_lens) + frame_in_run
+    if raw:
+      alignment[:, 1] = mix
+      alignment[:, 2] = -1
+    else:
+      alignment[:, 1], alignment[:, 2] = self.get_states(mix)
+    return alignment
+
   def has_entry(self, filename):
     """
     :param str filename: argument for self.read()
@@ -365,14 +508,15 @@ class FileArchive:
   def read(self, filename, typ):
     """
     :param str filename: the entry-name in the archive
-    :param str typ: "str", "feat" or "align"
+    :param str typ: "str", "feat", "align" or "align_raw"
     :return: depending on typ, "str" -> string, "feat" -> (time, data), "align" -> align,
       where string is a str,
-      time is list of time-stamp tuples (start-time,end-time) in millisecs,
-        data is a list of features, each a numpy vector,
-      align is a list of (time, allophone, state), time is an int from 0 to len of align,
+      time is an array of shape (T,2) of time-stamps (start-time,end-time) in millisecs,
+        data is an array of shape (T,D) of features,
+      align is an array of shape (T,3) of (time, allophone, state), time is an int from 0 to len of align,
         allophone is some int, state is e.g. in [0,1,2].
-    :rtype: str|(list[numpy.ndarray],list[numpy.ndarray])|list[(int,int,int)]
+      See :func:`FileArchive._raw_read` for details.
+    :rtype: str|(numpy.ndarray,numpy.ndarray)|numpy.ndarray
     """
 
     if filename not in self.ft:
@@ -388,11 +532,8 @@ class FileArchive:
       return None
 
     if comp > 0:
-      # read compressed bytes into memory as 'bytearray'
-      a = array.array('b')
-      a.fromfile(self.f, comp)
-      # unpack
-      b = zlib.decompress(a.tostring(), 15+32)
+      # read compressed bytes into memory and unpack
+      b = zlib.decompress(self.f.read(comp), 15+32)
       # substitute self.f by an anonymous memmap file object
       # restore original file handle after we're done
       backup_f = self.f
@@ -424,6 +565,28 @@ class FileArchive:
     assert mix >= 0
     return mix, state
 
+  def get_states(self, mix):
+    """
+    Like :func:`get_state`, but for multiple mixes at once.
+
+    :param numpy.ndarray mix: int32
+    :return: (mix, state)
+    :rtype: (numpy.ndarray,numpy.ndarray)
+    """
+    assert self.allophones
+    max_states = 6
+    mix = mix.copy()
+    state = numpy.zeros_like(mix)
+    for _ in range(max_states):
+      mask = mix >= len(self.allophones)
+      if not numpy.any(mask):
+        break
+      mix[mask] -= (1 << 26)
+      state[mask] += 1
+    state = numpy.minimum(state, max_states - 1)
+    assert numpy.all(mix >= 0)
+    return mix, state
+
   def set_allophones(self, f):
     """
     :param str f: allophone filename. line-separated. will ignore lines starting with "#"
@@ -496,10 +659,16 @@ class FileArchiveBundle:
   File archive bundle.
   """
 
-  def __init__(self, filename=None):
+  def __init__(self, filename=None, use_mmap=False, index_cache_dir=None, num_open_threads=8):
     """
     :param str|None filename: .bundle file
+    :param bool use_mmap: see :class:`FileArchive`
+    :param str|None index_cache_dir: see :class:`FileArchive`
+    :param int num_open_threads: open the archives of a bundle concurrently with this many threads
     """
+    self.use_mmap = use_mmap
+    self.index_cache_dir = index_cache_dir
+    self.num_open_threads = num_open_threads
     # filename -> FileArchive
     self.archives = {}  # type: typing.Dict[str,FileArchive]
     # archive content file -> FileArchive
@@ -512,21 +681,57 @@ class FileArchiveBundle:
     """
     :param str filename: bundle
     """
+    filenames = []
     for line in open(filename).read().splitlines():
-      self.add_archive(filename=line)
+      if line not in self.archives and line not in filenames:
+        filenames.append(line)
+    if self.num_open_threads > 1 and len(filenames) > 1:
+      # Opening is mostly I/O bound (e.g. over NFS), thus threads are fine.
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(min(self.num_open_threads, len(filenames)))
+      try:
+        archives = pool.map(self._open_archive, filenames)
+      finally:
+        pool.close()
+    else:
+      archives = [self._open_archive(fn) for fn in filenames]
+    # Add them in the original order, such that the lookup is the same as when we open them sequentially.
+    for fn, a in zip(filenames, archives):
+      self._add_opened_archive(fn, a)
 
-  def add_archive(self, filename):
+  def _open_archive(self, filename):
     """
     :param str filename: single archive
+    :rtype: FileArchive
     """
-    if filename in self.archives:
-      return
-    self.archives[filename] = a = FileArchive(filename, must_exists=True)
+    return FileArchive(filename, must_exists=True, use_mmap=self.use_mmap, index_cache_dir=self.index_cache_dir)
+
+  def _add_opened_archive(self, filename, a):
+    """
+    :param str filename: single archive
+    :param FileArchive a:
+    """
+    self.archives[filename] = a
     for f in a.ft.keys():
       self.files[f] = a
     # noinspection PyProtectedMember
     self._short_seg_names.update(a._short_seg_names)
 
+  def add_archive(self, filename):
+    """
+    :param str filename: single archive
+    """
+    if filename in self.archives:
+      return
+    self._add_opened_archive(filename, self._open_archive(filename))
+
+  def reopen(self):
+    """
+    See :func:`FileArchive.reopen`.
+    """
+    for a in self.archives.values():
+      a.reopen()
+
   def add_bundle_or_archive(self, filename):
     """
     :param str filename:
@@ -553,14 +758,15 @@ class FileArchiveBundle:
   def read(self, filename, typ):
     """
     :param str filename: the entry-name in the archive
-    :param str typ: "str", "feat" or "align"
+    :param str typ: "str", "feat", "align" or "align_raw"
     :return: depending on typ, "str" -> string, "feat" -> (time, data), "align" -> align,
       where string is a str,
-      time is list of time-stamp tuples (start-time,end-time) in millisecs,
-        data is a list of features, each a numpy vector,
-      align is a list of (time, allophone, state), time is an int from 0 to len of align,
+      time is an array of shape (T,2) of time-stamps (start-time,end-time) in millisecs,
+        data is an array of shape (T,D) of features,
+      align is an array of shape (T,3) of (time, allophone, state), time is an int from 0 to len of align,
         allophone is some int, state is e.g. in [0,1,2].
-    :rtype: str|(list[numpy.ndarray],list[numpy.ndarray])|list[(int,int,int)]
+      See :func:`FileArchive._raw_read` for details.
+    :rtype: str|(numpy.ndarray,numpy.ndarray)|numpy.ndarray
 
     Uses FileArchive.read().
     """
@@ -577,17 +783,18 @@ class FileArchiveBundle:
       a.set_allophones(filename)
 
 
-def open_file_archive(archive_filename, must_exists=True):
+def open_file_archive(archive_filename, must_exists=True, **kwargs):
   """
   :param str archive_filename:
   :param bool must_exists:
+  :param kwargs: passed to :class:`FileArchiveBundle` or :class:`FileArchive`, e.g. use_mmap, index_cache_dir
   :rtype: FileArchiveBundle|FileArchive
   """
   if archive_filename.endswith(".bundle"):
     assert must_exists
-    return FileArchiveBundle(archive_filename)
+    return FileArchiveBundle(archive_filename, **kwargs)
   else:
-    return FileArchive(archive_filename, must_exists=must_exists)
+    return FileArchive(archive_filename, must_exists=must_exists, **kwargs)
 
 
 def is_sprint_cache_file(filename):
@@ -990,16 +990,19 @@ class SprintCacheDataset(CachedDataset2):
     """
     Helper class to read a Sprint cache directly.
     """
-    def __init__(self, data_key, filename, data_type=None, allophone_labeling=None):
+    def __init__(self, data_key, filename, data_type=None, allophone_labeling=None,
+                 use_mmap=False, index_cache_dir=None):
       """
       :param str data_key: e.g. "data" or "classes"
       :param str filename: to Sprint cache archive
       :param str|None data_type: "feat" or "align"
       :param dict[str] allophone_labeling: kwargs for :class:`AllophoneLabeling`
+      :param bool use_mmap: see :class:`SprintCache.FileArchive`
+      :param str|None index_cache_dir: see :class:`SprintCache.FileArchive`
       """
       self.data_key = data_key
       from SprintCache import open_file_archive
-      self.sprint_cache = open_file_archive(filename)
+      self.sprint_cache = open_file_archive(filename, use_mmap=use_mmap, index_cache_dir=index_cache_dir)
       if not data_type:
         if data_key == "data":
           data_type = "feat"
@@ -1061,12 +1064,13 @@ class SprintCacheDataset(CachedDataset2):
       """
       res = self.sprint_cache.read(name, typ=self.type)
       if self.type == "align":
-        label_seq = numpy.array([self.allophone_labeling.get_label_idx(a, s) for (t, a, s) in res], dtype=self.dtype)
+        label_seq = numpy.array(
+          [self.allophone_labeling.get_label_idx(a, s) for (a, s) in res[:, 1:].tolist()], dtype=self.dtype)
         assert label_seq.shape == (len(res),)
         return label_seq
       elif self.type == "align_raw":
         label_seq = numpy.array(
-          [self.allophone_labeling.state_tying_by_allo_state_idx[a] for (t, a, s) in res], dtype=self.dtype)
+          [self.allophone_labeling.state_tying_by_allo_state_idx[a] for a in res[:, 1].tolist()], dtype=self.dtype)
         assert label_seq.shape == (len(res),)
         return label_seq
       elif self.type == "feat":
@@ -1132,6 +1136,13 @@ class SprintCacheDataset(CachedDataset2):
     self.seq_list_ordered = [self.seq_list_original[s] for s in seq_index]
     return True
 
+  def _init_worker_proc(self):
+    """
+    Called in the forked worker process. See :class:`CachedDataset2`.
+    """
+    for d in self.data.values():
+      d.sprint_cache.reopen()
+
   def get_dataset_seq_for_name(self, name, seq_idx=-1):
     """
     :param str name:
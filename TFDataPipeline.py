@@ -121,7 +121,7 @@ try:
 except ImportError:
   # noinspection PyCompatibility,PyUnresolvedReferences
   from queue import Queue
-from threading import Thread, Condition
+from threading import Thread, Condition, Lock
 
 import numpy
 import tensorflow as tf
@@ -209,16 +209,85 @@ class DataProviderBase(object):
     """
     raise NotImplementedError
 
+  def get_queue_fill_level(self):
+    """
+    :return: (num batches in the queue, capacity of the queue), or None if there is no such queue.
+      Used for the step timing stats of the runner, to detect pipeline stalls.
+    :rtype: (int,int)|None
+    """
+    return None
+
+
+class BatchBufferRing(object):
+  """
+  A ring of preallocated batch buffers, used by :class:`FeedDictDataProvider`.
+  Every slot has one flat buffer per key, which grows to the max batch size seen so far.
+  This avoids the allocation of new arrays for every batch.
+  A slot is acquired by the producer, and released after the consumer is done with the batch.
+  """
+
+  def __init__(self, num_slots):
+    """
+    :param int num_slots:
+    """
+    self.num_slots = num_slots
+    self.free_slots = Queue()
+    for i in range(num_slots):
+      self.free_slots.put(i)
+    self.buffers = [{} for _ in range(num_slots)]  # type: typing.List[typing.Dict[str,numpy.ndarray]]
+
+  def acquire(self):
+    """
+    Blocks until some slot is free.
+
+    :return: slot
+    :rtype: int
+    """
+    return self.free_slots.get()
+
+  def release(self, slot):
+    """
+    :param int slot:
+    """
+    self.free_slots.put(slot)
+
+  def get_zeros(self, slot, key, shape, dtype):
+    """
+    :param int slot:
+    :param str key:
+    :param tuple[int]|list[int] shape:
+    :param str dtype:
+    :return: like numpy.zeros(shape, dtype), but a (contiguous) view into the buffer of the slot
+    :rtype: numpy.ndarray
+    """
+    size = int(numpy.prod(shape))
+    buf = self.buffers[slot].get(key)
+    if buf is None or buf.dtype != numpy.dtype(dtype) or buf.size < size:
+      if buf is not None and buf.dtype == numpy.dtype(dtype):
+        size = max(size, buf.size * 2)  # grow exponentially, to not reallocate too often
+      buf = numpy.empty((size,), dtype=dtype)
+      self.buffers[slot][key] = buf
+    res = buf[:int(numpy.prod(shape))].reshape(shape)
+    res.fill(0)
+    return res
+
 
 class FeedDictDataProvider(DataProviderBase):
   """
   This class will fill all the placeholders used for training or forwarding or evaluation etc.
   of a `TFNetwork.Network`.
-  It will run a background thread which reads the data from a dataset and puts it into a queue.
+  It will run background threads which read the data from a dataset and put it into a queue.
+
+  Reading from the dataset (load_seqs, get_data) is done sequentially.
+  Assembling the batches (copying the seqs into the batch arrays) is done without holding the dataset lock,
+  and can run in multiple threads (num_threads).
+  In that case, the seq data is copied out of the dataset first,
+  as it can be a view into some dataset-internal buffer (e.g. in :class:`CachedDataset`).
+  The batch arrays are taken from a :class:`BatchBufferRing`.
   """
 
   def __init__(self, tf_session, dataset, batches, enforce_min_len1=False, capacity=10, tf_queue=None,
-               batch_slice=None, **kwargs):
+               batch_slice=None, num_threads=1, **kwargs):
     """
     :param TFCompat.v1.Session|TFCompat.v1.InteractiveSession tf_session:
     :param Dataset dataset:
@@ -229,6 +298,7 @@ class FeedDictDataProvider(DataProviderBase):
     :param int capacity:
     :param TFDataQueues|None tf_queue:
     :param slice|None batch_slice: select a subset of the batches
+    :param int num_threads: number of threads which assemble the batches
     """
     super(FeedDictDataProvider, self).__init__(**kwargs)
     self.tf_session = tf_session
@@ -241,41 +311,74 @@ class FeedDictDataProvider(DataProviderBase):
     self.tf_queue = tf_queue
     if not self.tf_queue:
       self.queue = Queue(maxsize=capacity)
-    self.thread = None  # type: typing.Optional[Thread]
+    assert num_threads >= 1
+    self.num_threads = num_threads
+    # The queue holds at most capacity batches, the consumer one more, and every thread one in assembly.
+    self.buffer_ring = BatchBufferRing(num_slots=capacity + num_threads + 1)
+    self.threads = []  # type: typing.List[Thread]
     self.thread_finished = False
+    self.num_threads_finished = 0
     self.cur_batch_idx = 0
     self.reached_end = False
+    self._fetch_lock = Lock()  # for the batches and the dataset
+    self._enqueue_cond = Condition()  # to enqueue the batches in order
+    self._next_fetch_idx = 0
+    self._next_enqueue_idx = 0
+    self._producer_failed = False
+    self._consumer_buffer_slot = None  # type: typing.Optional[int]
 
   def start_threads(self, session):
     """
-    Start the thread.
+    Start the threads.
 
     :param TFCompat.v1.Session session:
     """
-    thread = Thread(target=self._thread_main, name="DataProvider thread")
-    thread.daemon = True  # Thread will close when parent quits.
-    thread.start()
-    self.thread = thread
+    for i in range(self.num_threads):
+      thread = Thread(
+        target=self._thread_main,
+        name="DataProvider thread" + (" %i/%i" % (i + 1, self.num_threads) if self.num_threads > 1 else ""))
+      thread.daemon = True  # Thread will close when parent quits.
+      thread.start()
+      self.threads.append(thread)
 
   def stop_threads(self):
     """
-    Stop the thread.
+    Stop the threads.
     """
     self.dataset.finish_epoch()
-    if not self.thread:
+    if not self.threads:
       return
     self.coord.request_stop()
     self._flush_all_data()
-    self.thread.join()
+    for thread in self.threads:
+      thread.join()
 
-  def get_next_batch(self, consider_batch_slice):
+  def get_next_batch(self, consider_batch_slice, buffer_slot=None):
     """
     This assumes that we have more data, i.e. self.batches.has_more().
 
     :param bool consider_batch_slice:
+    :param int|None buffer_slot: if given, use the buffers of this slot of self.buffer_ring. otherwise new arrays
     :returns: batch-data-value-dict or None. if not consider_batch_slice, will never be None
     :rtype: dict[str,numpy.ndarray]|None
     """
+    fetched = self._fetch_next_batch(consider_batch_slice=consider_batch_slice)
+    if fetched is None:
+      return None
+    return self._assemble_batch(*fetched, buffer_slot=buffer_slot)
+
+  def _fetch_next_batch(self, consider_batch_slice):
+    """
+    Gets the next batch, and all the data of its seqs from the dataset.
+    The data is not copied into the batch arrays yet, see :func:`_assemble_batch`.
+    With multiple threads, the seq data is copied here while holding the dataset lock.
+    This assumes that we have more data, i.e. self.batches.has_more().
+
+    :param bool consider_batch_slice:
+    :return: (batch, shapes, seqs) or None (if skipped via batch_slice),
+      where seqs is a list of (seq, seq_tag, data) with data being key -> numpy.ndarray
+    :rtype: (Batch, dict[str,list[int]], list[(BatchSeqCopyPart,str,dict[str,numpy.ndarray])])|None
+    """
     # See EngineUtil.assign_dev_data() for reference.
     cur_batch_idx = self.cur_batch_idx
     batch, = self.batches.peek_next_n(1)
@@ -291,7 +394,7 @@ class FeedDictDataProvider(DataProviderBase):
         return None
       if step > 1 and (cur_batch_idx - start) % step != 0:
         return None
-    from Dataset import Batch, shapes_for_batches
+    from Dataset import Batch, shapes_for_batches, get_packed_seqs_base_key
     assert isinstance(batch, Batch)
     # In Returnn with Theano, we usually have the shape (time,batch,feature).
     # In TensorFlow, the default is (batch,time,feature).
@@ -299,22 +402,12 @@ class FeedDictDataProvider(DataProviderBase):
     # This must match the Data specification in TFNetwork.ExternData.init_from_config().
     shapes = shapes_for_batches(
       [batch], data_keys=self.data_keys, extern_data=self.extern_data, enforce_min_len1=self.enforce_min_len1)
-    data = {k: numpy.zeros(shape=shapes[k], dtype=self.extern_data.data[k].dtype)
-            for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
-    # Numpy cannot handle "string" dtype. Just make it a list[str], which is what TF can handle.
-    data.update({k: [""] * batch.num_slices
-                 for k in self.data_keys if self.extern_data.data[k].dtype == "string"})
-    data.update({"seq_idx": [-1] * batch.num_slices, "seq_tag": [""] * batch.num_slices})
-    seq_lens = {k: numpy.zeros(shape=(shapes[k][0],), dtype=self.extern_data.data[k].size_dtype)
-                for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
-    self.dataset.load_seqs(batch.start_seq, batch.end_seq)
-    from Util import slice_pad_zeros
+    self.dataset.load_seqs(*batch.get_load_seqs_range())
+    seqs = []
     with self.dataset.lock:
       for seq in batch.seqs:
-        o = seq.batch_frame_offset
-        q = seq.batch_slice
-        length = seq.frame_length
         # input-data, input-index will also be set in this loop. That is data-key "data".
+        seq_data = {}
         for k in self.data_keys:
           # Some special cases first, such as "seq_idx" and "seq_tag".
           # See also :func:`TFNetwork.get_extern_data`.
@@ -322,23 +415,82 @@ class FeedDictDataProvider(DataProviderBase):
             continue  # handled below. will always be added
           if k in self.extern_data.extra_added_keys:
             continue
+          if get_packed_seqs_base_key(k):
+            continue  # handled in _assemble_batch
           if self.extern_data.data[k].have_time_axis():
-            if length.get(k) in [0, None]:
+            if seq.frame_length.get(k) in [0, None]:
               continue
           v = self.dataset.get_data(seq.seq_idx, k)
-          if self.extern_data.data[k].have_time_axis():
-            v = slice_pad_zeros(v, begin=seq.seq_start_frame[k], end=seq.seq_end_frame[k])
-            ls = v.shape[0]
-            if ls != length[k]:
-              raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
-                ls, length[k], seq.seq_start_frame, seq.seq_end_frame, seq.seq_idx,
-                self.dataset.get_seq_length(seq.seq_idx)))
-            data[k][q, o[k]:o[k] + ls] = v
-            seq_lens[k][q] = max(seq_lens[k][q], o[k] + ls)
-          else:  # no time-axis
-            data[k][q] = v
-        data["seq_idx"][q] = seq.seq_idx
-        data["seq_tag"][q] = self.dataset.get_tag(seq.seq_idx)
+          if self.num_threads > 1:
+            # The data can be a view into some dataset buffer, e.g. the cache of CachedDataset,
+            # which can be modified once we release the lock. So copy it while we hold the lock.
+            v = numpy.array(v)
+          seq_data[k] = v
+        seqs.append((seq, self.dataset.get_tag(seq.seq_idx), seq_data))
+    return batch, shapes, seqs
+
+  def _assemble_batch(self, batch, shapes, seqs, buffer_slot=None):
+    """
+    Copies the seqs into the batch arrays. This does not access the dataset (except for error reporting).
+
+    :param Batch batch:
+    :param dict[str,list[int]] shapes:
+    :param list[(BatchSeqCopyPart,str,dict[str,numpy.ndarray])] seqs: from :func:`_fetch_next_batch`
+    :param int|None buffer_slot: see :func:`get_next_batch`
+    :returns: batch-data-value-dict
+    :rtype: dict[str,numpy.ndarray]
+    """
+    def zeros(key, shape, dtype):
+      """
+      :param str key:
+      :param list[int] shape:
+      :param str dtype:
+      :rtype: numpy.ndarray
+      """
+      if buffer_slot is None:
+        return numpy.zeros(shape=shape, dtype=dtype)
+      return self.buffer_ring.get_zeros(slot=buffer_slot, key=key, shape=shape, dtype=dtype)
+
+    data = {k: zeros(k, shapes[k], self.extern_data.data[k].dtype)
+            for k in self.data_keys if self.extern_data.data[k].dtype != "string"}
+    # Numpy cannot handle "string" dtype. Just make it a list[str], which is what TF can handle.
+    data.update({k: [""] * batch.num_slices
+                 for k in self.data_keys if self.extern_data.data[k].dtype == "string"})
+    data.update({"seq_idx": [-1] * batch.num_slices, "seq_tag": [""] * batch.num_slices})
+    seq_lens = {k: zeros("%s_seq_lens" % k, (shapes[k][0],), self.extern_data.data[k].size_dtype)
+                for k in self.data_keys if self.extern_data.data[k].have_time_axis()}
+    from Util import slice_pad_zeros
+    from Dataset import get_packed_seqs_base_key
+    packed_seqs_keys = {
+      k: get_packed_seqs_base_key(k) for k in self.data_keys
+      if get_packed_seqs_base_key(k) and k not in self.extern_data.extra_added_keys}
+    segment_idx = {}  # (base key, batch slice) -> last segment id
+    for seq, seq_tag, seq_data in seqs:
+      o = seq.batch_frame_offset
+      q = seq.batch_slice
+      length = seq.frame_length
+      for k, base_key in sorted(packed_seqs_keys.items()):
+        ls = length[base_key]
+        if k.endswith("_segment_ids"):
+          segment_idx[(base_key, q)] = segment_idx.get((base_key, q), 0) + 1
+          data[k][q, o[base_key]:o[base_key] + ls] = segment_idx[(base_key, q)]
+        else:  # positions
+          data[k][q, o[base_key]:o[base_key] + ls] = numpy.arange(ls)
+        seq_lens[k][q] = max(seq_lens[k][q], o[base_key] + ls)
+      for k, v in seq_data.items():
+        if self.extern_data.data[k].have_time_axis():
+          v = slice_pad_zeros(v, begin=seq.seq_start_frame[k], end=seq.seq_end_frame[k])
+          ls = v.shape[0]
+          if ls != length[k]:
+            raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
+              ls, length[k], seq.seq_start_frame, seq.seq_end_frame, seq.seq_idx,
+              self.dataset.get_seq_length(seq.seq_idx)))
+          data[k][q, o[k]:o[k] + ls] = v
+          seq_lens[k][q] = max(seq_lens[k][q], o[k] + ls)
+        else:  # no time-axis
+          data[k][q] = v
+      data["seq_idx"][q] = seq.seq_idx
+      data["seq_tag"][q] = seq_tag
     for k in seq_lens.keys():
       data["%s_seq_lens" % k] = seq_lens[k]
     return data
@@ -348,26 +500,52 @@ class FeedDictDataProvider(DataProviderBase):
       import better_exchook
       better_exchook.install()
 
-      while self.batches.has_more() and not self.coord.should_stop():
-        enqueue_args = self.get_next_batch(consider_batch_slice=True)
-        if enqueue_args is not None:
-          if self.queue:
-            self.queue.put(enqueue_args)
-          else:
-            self.tf_queue.enqueue(tf_session=self.tf_session, data=enqueue_args)
+      while True:
+        buffer_slot = self.buffer_ring.acquire()
+        try:
+          with self._fetch_lock:
+            if not self.batches.has_more() or self.coord.should_stop() or self._producer_failed:
+              break
+            batch_idx = self._next_fetch_idx
+            self._next_fetch_idx += 1
+            fetched = self._fetch_next_batch(consider_batch_slice=True)
+            self.batches.advance(1)
+          enqueue_args = self._assemble_batch(*fetched, buffer_slot=buffer_slot) if fetched else None
+          # Enqueue in the same order as we fetched.
+          with self._enqueue_cond:
+            while self._next_enqueue_idx != batch_idx and not self._producer_failed:
+              self._enqueue_cond.wait()
+            if self._producer_failed:
+              break
+            if enqueue_args is not None:
+              if self.queue:
+                self.queue.put((buffer_slot, enqueue_args))
+                buffer_slot = None  # released by the consumer
+              else:
+                self.tf_queue.enqueue(tf_session=self.tf_session, data=enqueue_args)
+            self._next_enqueue_idx += 1
+            self._enqueue_cond.notify_all()
+        finally:
+          if buffer_slot is not None:
+            self.buffer_ring.release(buffer_slot)
         with self.state_change_cond:
           self.state_change_cond.notifyAll()
-        self.batches.advance(1)
 
-      self.reached_end = not self.batches.has_more()
+      with self._fetch_lock:
+        self.reached_end = not self.batches.has_more()
 
     except Exception as exc:
       print("Exception in DataProvider thread: %r" % exc, file=log.v1)
       sys.excepthook(*sys.exc_info())
+      with self._enqueue_cond:
+        self._producer_failed = True
+        self._enqueue_cond.notify_all()
 
     finally:
       with self.state_change_cond:
-        self.thread_finished = True
+        self.num_threads_finished += 1
+        if self.num_threads_finished == self.num_threads:
+          self.thread_finished = True
         self.state_change_cond.notifyAll()
 
   def have_more_data(self, session):
@@ -387,19 +565,29 @@ class FeedDictDataProvider(DataProviderBase):
           return True
         if self.thread_finished:
           return False
-        if not self.thread.is_alive:
+        if not any([thread.is_alive() for thread in self.threads]):
           return False
-        # The thread is alive and working. Wait for a change.
+        # The threads are alive and working. Wait for a change.
         self.state_change_cond.wait()
 
+  def _release_consumer_buffer_slot(self):
+    """
+    The consumer is done with the last batch.
+    """
+    if self._consumer_buffer_slot is not None:
+      self.buffer_ring.release(self._consumer_buffer_slot)
+      self._consumer_buffer_slot = None
+
   def _flush_all_data(self):
     """
     This is supposed to be called by the consumer thread after a call to coord.request_stop().
-    The data provider thread (self.thread_main()) could currently block in the queue put if it was full.
+    The data provider threads (self._thread_main()) could currently block in the queue put if it was full.
     """
+    self._release_consumer_buffer_slot()
     while self.have_more_data(None):
       if self.queue:
-        self.queue.get()
+        buffer_slot, _ = self.queue.get()
+        self.buffer_ring.release(buffer_slot)
       else:
         raise NotImplementedError
 
@@ -407,7 +595,8 @@ class FeedDictDataProvider(DataProviderBase):
     """
     Gets the feed dict for TF session run().
     Note that this will block if there is nothing in the queue.
-    The queue gets filled by the other thread, via self.thread_main().
+    The queue gets filled by the other threads, via self._thread_main().
+    The returned arrays are only valid until the next call, as their buffers are reused.
 
     :param bool single_threaded: whether to not use the queue
     :returns: we dequeue one batch from the queue and provide it for all placeholders of our external data,
@@ -416,12 +605,14 @@ class FeedDictDataProvider(DataProviderBase):
     """
     if self.tf_queue:
       return {}  # not needed to feed anything, it gets it via the queues
+    # The previous batch was consumed (session run() is done), thus we can reuse its buffers now.
+    self._release_consumer_buffer_slot()
     if single_threaded:
       assert self.batches.has_more()
       assert self.batch_slice is None
       output = self.get_next_batch(consider_batch_slice=False)
     else:
-      output = self.queue.get()
+      self._consumer_buffer_slot, output = self.queue.get()
     assert isinstance(output, dict)
     # The data itself.
     d = {
@@ -460,6 +651,14 @@ class FeedDictDataProvider(DataProviderBase):
     """
     return self.batches.completed_frac()
 
+  def get_queue_fill_level(self):
+    """
+    :rtype: (int,int)|None
+    """
+    if not self.queue:
+      return None
+    return self.queue.qsize(), self.queue.maxsize
+
 
 class InputContext(object):
   """
@@ -16,6 +16,7 @@ import os
 import sys
 import time
 import typing
+from collections import OrderedDict
 try:
   # noinspection PyCompatibility
   from Queue import Queue
@@ -33,7 +34,7 @@ from LearningRateControl import load_learning_rate_control_from_config, Learning
 from Log import log
 from Pretrain import pretrain_from_config
 import TFCompat
-from TFNetwork import TFNetwork, ExternData, help_on_tf_exception
+from TFNetwork import TFNetwork, ExternData, help_on_tf_exception, AsyncCheckpointSaver
 from TFUpdater import Updater
 from TFDataPipeline import FeedDictDataProvider, DatasetDataProvider
 from Util import hms, NumbersDict, BackendEngine
@@ -85,6 +86,12 @@ class Runner(object):
     self._should_eval = eval
     self.store_metadata_mod_step = engine.config.int("store_metadata_mod_step", 0)
     self.reset_updater_vars_mod_step = engine.config.int("reset_updater_vars_mod_step", 0)
+    self.log_step_timings = engine.config.bool("log_step_timings", False)
+    self.profile_steps = self._parse_profile_steps(engine.config.typed_value("profile_steps", None))
+    self.profile_max_num_layers = engine.config.int("profile_max_num_layers", 30)
+    self._profile_stats = None  # type: typing.Optional[TFUtil.RunMetadataStatsByScope]
+    self.step_timings_accumulated = NumbersDict()  # entries like "data_wait" or "session_run", in secs
+    self._step_timings_file = None  # type: typing.Optional[typing.TextIO]
     self.finalized = False
     self.cancel_flag = False
     self.run_exception = None
@@ -196,6 +203,113 @@ class Runner(object):
       from Util import progress_bar
       progress_bar(complete, hms(remaining_estimated))
 
+  def _handle_step_timings(self, writer, step, global_step, timings, fetches_results, queue_fill_level):
+    """
+    Accumulates the step timings, and writes them to the TF summary writer and the step timings file.
+
+    :param TFCompat.v1.summary.FileWriter|None writer:
+    :param int step: local step in this epoch
+    :param int global_step:
+    :param dict[str,float] timings: "data_wait", "feed_build", "session_run", "fetch_handling", in secs
+    :param dict[str,numpy.ndarray|None] fetches_results: results of calculations, see self._get_fetches_dict()
+    :param (int,int)|None queue_fill_level: see :func:`DataProviderBase.get_queue_fill_level`
+    """
+    self.step_timings_accumulated += NumbersDict(timings)
+    step_duration = sum(timings.values())
+    num_seqs = int(self._get_batch_dim_from_fetches(fetches_results))
+    num_frames = int(self._step_seq_len(fetches_results, self.engine.network.extern_data.default_input))
+    stats = {key: float(value) for (key, value) in timings.items()}  # no Numpy types, for JSON
+    stats.update({
+      "step_duration": float(step_duration),
+      "num_seqs": num_seqs,
+      "num_frames": num_frames,
+      "seqs_per_sec": (num_seqs / step_duration) if step_duration > 0 else 0.0,
+      "frames_per_sec": (num_frames / step_duration) if step_duration > 0 else 0.0})
+    if queue_fill_level:
+      stats["queue_size"], stats["queue_capacity"] = [int(x) for x in queue_fill_level]
+    if writer:
+      writer.add_summary(
+        TFCompat.v1.Summary(value=[
+          TFCompat.v1.Summary.Value(tag="step_timings/%s" % key, simple_value=value)
+          for (key, value) in sorted(stats.items())]),
+        global_step)
+    if self._step_timings_file:
+      import json
+      stats.update({
+        "dataset": self.data_provider.get_dataset_name(), "epoch": self.engine.epoch,
+        "step": int(step), "global_step": int(global_step)})  # global_step is a Numpy int
+      self._step_timings_file.write(json.dumps(stats, sort_keys=True) + "\n")
+      self._step_timings_file.flush()
+
+  def _print_step_timings(self, report_prefix):
+    """
+    :param str report_prefix:
+    """
+    total = sum(self.step_timings_accumulated.values())
+    if total <= 0:
+      return
+    print("%s, step timings: %s" % (report_prefix, ", ".join([
+      "%s %.1f%%" % (key, value / total * 100.)
+      for (key, value) in sorted(self.step_timings_accumulated.items())])), file=log.v3)
+
+  @staticmethod
+  def _parse_profile_steps(profile_steps):
+    """
+    :param int|str|list[int]|tuple[int,int]|None profile_steps: e.g. 10, "10-20" or (10, 20). steps in each epoch
+    :return: (first step, last step) (inclusive), or None
+    :rtype: (int,int)|None
+    """
+    if profile_steps is None:
+      return None
+    if isinstance(profile_steps, int):
+      return profile_steps, profile_steps
+    if isinstance(profile_steps, str):
+      profile_steps = profile_steps.split("-")
+      if len(profile_steps) == 1:
+        profile_steps = profile_steps * 2
+    first, last = profile_steps
+    first, last = int(first), int(last)
+    assert 0 <= first <= last, "invalid profile_steps %r" % (profile_steps,)
+    return first, last
+
+  def _is_profile_step(self, step):
+    """
+    :param int step: local step in this epoch
+    :rtype: bool
+    """
+    return bool(self.profile_steps) and self.profile_steps[0] <= step <= self.profile_steps[1]
+
+  def _handle_profile_run_metadata(self, run_metadata, logdir, global_step):
+    """
+    Writes the Chrome trace (see chrome://tracing) of this step to the log dir,
+    and collects the per-layer stats, see :func:`_print_profile_stats`.
+
+    :param tf.compat.v1.RunMetadata run_metadata: from a run with FULL_TRACE
+    :param str|None logdir:
+    :param int global_step:
+    """
+    from TFUtil import RunMetadataStatsByScope
+    if self._profile_stats is None:
+      self._profile_stats = RunMetadataStatsByScope(scopes=self.engine.network.get_layer_name_scopes())
+    self._profile_stats.add_run_metadata(run_metadata)
+    # noinspection PyProtectedMember
+    if logdir and self.engine._do_save():
+      tl = timeline.Timeline(run_metadata.step_stats)
+      timeline_path = os.path.join(logdir, "timeline_step_%i.json" % global_step)
+      with open(timeline_path, "w") as f:
+        f.write(tl.generate_chrome_trace_format(show_memory=True))
+      print("Wrote Chrome trace of step %i to %s." % (global_step, timeline_path), file=log.v4)
+
+  def _print_profile_stats(self, report_prefix):
+    """
+    :param str report_prefix:
+    """
+    if not self._profile_stats or not self._profile_stats.num_steps:
+      return
+    print("%s, profile of %i steps (%i-%i), per layer:" % (
+      report_prefix, self._profile_stats.num_steps, self.profile_steps[0], self.profile_steps[1]), file=log.v3)
+    self._profile_stats.dump(file=log.v3, prefix="  ", max_num_names=self.profile_max_num_layers)
+
   def _print_finish_process(self):
     if self._show_interactive_process_bar:
       from Util import progress_bar
@@ -405,23 +519,16 @@ class Runner(object):
     # noinspection PyUnresolvedReferences,PyPackageRequirements
     import horovod.tensorflow as hvd
     from TFUtil import global_tensor
-    have_more_data_placeholder = global_tensor(
-      lambda: TFCompat.v1.placeholder(tf.int32, shape=(), name="horovod_have_more_data_placeholder"),
-      name="horovod_have_more_data_placeholder")  # 0 or 1
-    sum_have_data_t = global_tensor(
-      lambda: hvd.allreduce(have_more_data_placeholder, average=False),
-      name="horovod_sum_have_data")  # 0..size
-    have_error_placeholder = global_tensor(
-      lambda: TFCompat.v1.placeholder(tf.int32, shape=(), name="horovod_have_error_placeholder"),
-      name="horovod_have_error_placeholder")  # 0 or 1
-    sum_have_error_t = global_tensor(
-      lambda: hvd.allreduce(have_error_placeholder, average=False),
-      name="horovod_sum_have_error")  # 0..size
+    # Both flags in one tensor, such that we need only a single allreduce (i.e. a single sync) per step.
+    have_data_and_error_placeholder = global_tensor(
+      lambda: TFCompat.v1.placeholder(tf.int32, shape=(2,), name="horovod_have_data_and_error_placeholder"),
+      name="horovod_have_data_and_error_placeholder")  # (have more data, have error), each 0 or 1
+    sum_have_data_and_error_t = global_tensor(
+      lambda: hvd.allreduce(have_data_and_error_placeholder, average=False),
+      name="horovod_sum_have_data_and_error")  # each 0..size
     sum_have_data, sum_have_error = self.engine.tf_session.run(
-      (sum_have_data_t, sum_have_error_t),
-      feed_dict={
-        have_more_data_placeholder: 1 if have_more_data else 0,
-        have_error_placeholder: 1 if error else 0})
+      sum_have_data_and_error_t,
+      feed_dict={have_data_and_error_placeholder: [1 if have_more_data else 0, 1 if error else 0]})
     stop = False
     if sum_have_data < hvd.size() or sum_have_error > 0:
       # Some of the peers do not have data anymore. Or some peer had an error.
@@ -499,6 +606,9 @@ class Runner(object):
       if self.engine._do_save():
         log_runtime_info_to_dir(logdir, config=self.engine.config)
       writer = TFCompat.v1.summary.FileWriter(logdir)
+      # noinspection PyProtectedMember
+      if self.log_step_timings and self.engine._do_save():
+        self._step_timings_file = open(os.path.join(logdir, "step_timings.jsonl"), "a")
     else:
       writer = None
     print("TF: log_dir: %s" % logdir, file=log.v5)
@@ -530,13 +640,17 @@ class Runner(object):
       if writer:
         writer.add_graph(sess.graph)
       hvd_stop = hvd_error = False
+      step_start_time = time.time()  # including the wait for data
       while self.data_provider.have_more_data(session=sess):
+        queue_fill_level = self.data_provider.get_queue_fill_level()
         hvd_stop, hvd_error = self._horovod_signal_have_more_data()
         if hvd_error:
           raise Exception("Some other Horovod peer failed.")
         if hvd_stop:
           # Some other peer does not have data anymore, but no error occurred.
+          print("%s, another Horovod rank has no more data, stopping in step %i." % (report_prefix, step), file=log.v4)
           break
+        feed_start_time = time.time()
         feed_dict, meta_step_info = self.data_provider.get_feed_dict()
         if isinstance(self.engine.network.train_flag, tf.Tensor):
           feed_dict[self.engine.network.train_flag] = self._train_flag
@@ -564,7 +678,9 @@ class Runner(object):
 
         # Now do one calculation step. Optionally with metadata.
         try:
-          if self.store_metadata_mod_step and step % self.store_metadata_mod_step == 0:
+          store_metadata = bool(self.store_metadata_mod_step and step % self.store_metadata_mod_step == 0)
+          profile_step = self._is_profile_step(step)
+          if store_metadata or profile_step:
             # Slow run that stores extra information for debugging.
             print('Storing metadata', file=log.v5)
             run_options = TFCompat.v1.RunOptions(
@@ -576,18 +692,26 @@ class Runner(object):
               feed_dict=feed_dict,
               options=run_options,
               run_metadata=run_metadata)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
-            writer.add_summary(fetches_results["summary"], step + step_offset)
-            writer.add_run_metadata(run_metadata, 'step_{:04d}'.format(step + step_offset))
-            tl = timeline.Timeline(run_metadata.step_stats)
-            timeline_path = os.path.join(logdir, 'timeline.trace')
-            with open(timeline_path, 'w') as f:
-              f.write(tl.generate_chrome_trace_format(show_memory=True))
+            session_run_duration = time.time() - session_run_start_time
+            elapsed_time_tf += session_run_duration
+            if writer:
+              if "summary" in fetches_results:
+                writer.add_summary(fetches_results["summary"], step + step_offset)
+              writer.add_run_metadata(run_metadata, 'step_{:04d}'.format(step + step_offset))
+            if store_metadata:
+              tl = timeline.Timeline(run_metadata.step_stats)
+              timeline_path = os.path.join(logdir, 'timeline.trace')
+              with open(timeline_path, 'w') as f:
+                f.write(tl.generate_chrome_trace_format(show_memory=True))
+            if profile_step:
+              self._handle_profile_run_metadata(
+                run_metadata=run_metadata, logdir=logdir, global_step=step + step_offset)
           else:
             session_run_start_time = time.time()
             fetches_results = sess.run(
               fetches_dict, feed_dict=feed_dict)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
+            session_run_duration = time.time() - session_run_start_time
+            elapsed_time_tf += session_run_duration
             if writer and "summary" in fetches_results:
               writer.add_summary(fetches_results["summary"], step + step_offset)
         except tf.errors.OpError as exc:
@@ -602,8 +726,18 @@ class Runner(object):
         eval_info = self._collect_eval_info(fetches_results=fetches_results)
         self._maybe_handle_extra_fetches(fetches_results)
         elapsed_time_tf += self._horovod_sync_params(local_step=step)
-        duration = time.time() - start_time
+        step_end_time = time.time()
+        duration = step_end_time - start_time
         self._print_process(report_prefix=report_prefix, step=step, step_duration=duration, eval_info=eval_info)
+        if self.log_step_timings:
+          self._handle_step_timings(
+            writer=writer, step=step, global_step=step + step_offset,
+            timings={
+              "data_wait": feed_start_time - step_start_time,
+              "feed_build": start_time - feed_start_time,
+              "session_run": session_run_duration,
+              "fetch_handling": step_end_time - start_time - session_run_duration},
+            fetches_results=fetches_results, queue_fill_level=queue_fill_level)
 
         if self.engine.config.bool("stop_on_nonfinite_train_score", True):
           score_values = self._results_accumulated.values()
@@ -615,6 +749,7 @@ class Runner(object):
         step += 1
         if self.cancel_flag:
           raise CancelTrainingException("cancel_flag is set")
+        step_start_time = time.time()
 
       self._print_finish_process()
 
@@ -637,6 +772,9 @@ class Runner(object):
       elapsed_tf_percentage = (elapsed_time_tf / elapsed) if (elapsed > 0) else 0.0
       print("%s, finished after %i steps, %s elapsed (%.1f%% computing time)" % (
         report_prefix, step, hms(elapsed), (elapsed_tf_percentage * 100.)), file=log.v3)
+      if self.log_step_timings:
+        self._print_step_timings(report_prefix=report_prefix)
+      self._print_profile_stats(report_prefix=report_prefix)
 
     except KeyboardInterrupt as exc:
       print("KeyboardInterrupt in step %r." % step)
@@ -661,6 +799,9 @@ class Runner(object):
       if writer:
         try_and_ignore_exception(writer.close)
         try_and_ignore_exception(lambda: stop_event_writer_thread(writer.event_writer))
+      if self._step_timings_file:
+        try_and_ignore_exception(self._step_timings_file.close)
+        self._step_timings_file = None
       try_and_ignore_exception(coord.request_stop)
       try_and_ignore_exception(lambda: coord.join(threads))
       try_and_ignore_exception(self.data_provider.stop_threads)
@@ -705,15 +846,24 @@ class Engine(EngineBase):
     self.use_eval_flag = config.value("task", None) != "forward"
     self.learning_rate = 0.0  # set in init_train_epoch
     self._const_cache = {}  # type: typing.Dict[str,tf.Tensor]
+    # See _init_network. Graph cache key -> dict with graph, session, network, etc.
+    self._graph_cache = OrderedDict()  # type: typing.Dict[str,typing.Dict[str]]
+    self._graph_cache_key = None  # type: typing.Optional[str]  # of the current network
+    self._async_checkpoint_saver = None  # type: typing.Optional[AsyncCheckpointSaver]  # see save_model
     self.preload_from_files = None  # type: typing.Optional[typing.Dict[str,typing.Dict[str]]]
     self.max_seqs = None  # type: typing.Optional[int]
 
   def finalize(self):
     """
     Finalizes the TF session, network, graph.
+    Raises an exception if some model failed to save in the background (see ``save_model_async``).
     """
-    self._close_tf_session()
-    self._reset_graph()
+    try:
+      self.wait_for_saved_models(raise_on_failure=True)
+    finally:
+      self._close_tf_session()
+      self._reset_graph()
+      self._clear_graph_cache()
 
   def get_const_tensor(self, key, value):
     """
@@ -800,6 +950,99 @@ class Engine(EngineBase):
     self._const_cache.clear()
     self.network = None
     self.updater = None
+    self._graph_cache_key = None
+
+  def _use_graph_cache(self):
+    """
+    :return: whether we keep the graphs of previous networks to reuse them, see :func:`_init_network`
+    :rtype: bool
+    """
+    if self.config.int("graph_cache_size", 0) <= 0:
+      return False
+    # These keep further state outside of the graph and network.
+    if self.config.is_true("dataset_pipeline") or self.config.is_true("use_horovod"):
+      return False
+    return True
+
+  def _get_graph_cache_key(self, net_desc):
+    """
+    :param dict[str,dict[str]] net_desc: layer name -> layer description dict
+    :return: hash over everything which determines the network construction in :func:`_init_network`
+    :rtype: str
+    """
+    import hashlib
+    from Util import better_repr
+    key = better_repr({
+      "net_dict": net_desc,
+      "flags": (self.use_dynamic_train_flag, self.use_eval_flag, self.use_search_flag),
+      # The config is used in many places during the construction (e.g. extern_data, the optimizer settings),
+      # and pretraining can modify it.
+      "config": self.config.typed_dict,
+      "config_str": self.config.dict})
+    return hashlib.sha256(key.encode("utf8")).hexdigest()
+
+  def _move_graph_to_cache(self):
+    """
+    Stores the current graph with session, network, etc. in the graph cache,
+    and leaves a new empty default graph, i.e. the same state as after :func:`_reset_graph`.
+    """
+    if not self.network or self._graph_cache_key is None or self.network.get_graph_reset_callbacks():
+      # Graph reset callbacks would need to be called now. Just don't cache such networks.
+      self._close_tf_session()
+      self._reset_graph()
+      return
+    self._graph_cache[self._graph_cache_key] = {
+      "graph": self.tf_session.graph,
+      "session": self.tf_session,
+      "network": self.network,
+      "updater": self.updater,
+      "merge_all_summaries": self._merge_all_summaries,
+      "const_cache": self._const_cache}
+    self.tf_session = None
+    self.network = None
+    self.updater = None
+    self._merge_all_summaries = None
+    self._const_cache = {}
+    self._checked_uninitialized_vars = False
+    self._graph_cache_key = None
+    TFCompat.v1.reset_default_graph()
+    max_size = self.config.int("graph_cache_size", 0)
+    while len(self._graph_cache) > max_size:
+      _, entry = self._graph_cache.popitem(last=False)  # the least recently used
+      entry["session"].close()
+
+  def _restore_graph_from_cache(self, key):
+    """
+    Opposite of :func:`_move_graph_to_cache`.
+    The params (and optimizer vars) are initialized again, like for a newly constructed network.
+
+    :param str key: see :func:`_get_graph_cache_key`
+    """
+    from TFUtil import set_default_graph
+    entry = self._graph_cache.pop(key)
+    print("Reuse cached graph for network, skip construction.", file=log.v3)
+    set_default_graph(entry["graph"])
+    self.tf_session = entry["session"]
+    self.network = entry["network"]
+    self.updater = entry["updater"]
+    self._merge_all_summaries = entry["merge_all_summaries"]
+    self._const_cache = entry["const_cache"]
+    self._checked_uninitialized_vars = False
+    self._graph_cache_key = key
+    self.network.initialize_params(session=self.tf_session)
+    self.network.declare_train_params()
+    if self.updater:
+      self.updater.set_trainable_vars(self.network.get_trainable_params())
+      if self.updater.optimizer_init_vars_op is not None:
+        self.updater.init_optimizer_vars(session=self.tf_session)
+
+  def _clear_graph_cache(self):
+    """
+    Closes all cached sessions.
+    """
+    for entry in self._graph_cache.values():
+      entry["session"].close()
+    self._graph_cache.clear()
 
   def get_eval_datasets(self):
     """
@@ -849,8 +1092,23 @@ class Engine(EngineBase):
     if epoch:
       assert not filename
       filename = self.get_epoch_model_filename(epoch=epoch)
+    self.wait_for_saved_models()  # the model might be saved in the background just now
     print("Load model %s" % (filename,), file=log.v4)
-    self.network.load_params_from_file(filename, session=self.tf_session)
+    self.network.load_params_from_file(filename, session=self.tf_session, **self._get_checkpoint_loader_opts())
+
+  def _get_checkpoint_loader_opts(self):
+    """
+    Options ``load_params_num_threads`` and ``load_params_mmap``.
+    If one of them is set, the models are loaded via :class:`CustomCheckpointLoader`,
+    which reads the tensors with multiple threads and assigns them in few ``session.run`` calls.
+    The mmap mode shares the memory with other processes (e.g. multiple search jobs) reading the same checkpoint.
+
+    :return: kwargs for :func:`TFNetwork.load_params_from_file` or :class:`CustomCheckpointLoader`
+    :rtype: dict[str]
+    """
+    return {
+      "num_threads": self.config.int("load_params_num_threads", 0) or None,
+      "mmap": self.config.bool("load_params_mmap", False)}
 
   def save_model(self, filename=None):
     """
@@ -861,7 +1119,38 @@ class Engine(EngineBase):
     if not filename:
       filename = self.get_epoch_model_filename()
     print("Save model under %s" % (filename,), file=log.v4)
-    self.network.save_params_to_file(filename, session=self.tf_session)
+    self.network.save_params_to_file(filename, session=self.tf_session, async_saver=self._get_async_checkpoint_saver())
+
+  def _get_async_checkpoint_saver(self):
+    """
+    With option ``save_model_async``, the model is written in the background, see :class:`AsyncCheckpointSaver`.
+    ``save_model_async_max_in_flight`` (default 1) limits the number of checkpoints not written yet.
+
+    :rtype: AsyncCheckpointSaver|None
+    """
+    if not self.config.bool("save_model_async", False):
+      return None
+    if not self._async_checkpoint_saver:
+      self._async_checkpoint_saver = AsyncCheckpointSaver(
+        max_in_flight=self.config.int("save_model_async_max_in_flight", 1))
+    return self._async_checkpoint_saver
+
+  def wait_for_saved_models(self, raise_on_failure=False):
+    """
+    Waits until the models saved in the background (see ``save_model_async``) are written.
+
+    :param bool raise_on_failure: if some model (so far) failed to save, raise an exception
+      (e.g. at the end of training, such that we do not quit successfully without the final model).
+      Otherwise just print a warning.
+    """
+    if not self._async_checkpoint_saver:
+      return
+    if not self._async_checkpoint_saver.wait():
+      msg = "%i models (or cleanups) failed to save in the background, see log above." % (
+        self._async_checkpoint_saver.num_failed)
+      if raise_on_failure:
+        raise Exception(msg)
+      print("Warning: %s" % msg, file=log.v1)
 
   @staticmethod
   def delete_model(filename):
@@ -900,6 +1189,13 @@ class Engine(EngineBase):
       set_config_num_inputs_outputs_from_dataset(config=config, dataset=train_data or dev_data or eval_data)
     self.use_dynamic_train_flag = True
     self.train_data = train_data
+    if train_data and config.is_true("use_horovod") and (
+          config.value("horovod_dataset_distribution", "shard") == "dataset_shard"):
+      # noinspection PyPackageRequirements,PyUnresolvedReferences
+      import horovod.tensorflow as hvd
+      # Each rank only uses its own part of the seqs, see Dataset.get_seq_order_for_epoch.
+      train_data.num_shards = hvd.size()
+      train_data.shard_index = hvd.rank()
     self.eval_datasets.clear()
     if dev_data:
       self.eval_datasets["dev"] = dev_data
@@ -1010,7 +1306,8 @@ class Engine(EngineBase):
           params_prefix=self_prefix, load_if_prefix=load_if_prefix,
           ignore_missing=opts.get("ignore_missing", False),
           ignore_params=opts.get("ignore_params", ()),
-          ignore_params_prefixes=opts.get("ignore_params_prefixes", ()))
+          ignore_params_prefixes=opts.get("ignore_params_prefixes", ()),
+          **self._get_checkpoint_loader_opts())
         # `set_as_custom_init` is also a marker for the vars, that they are preloaded,
         # such that further checkpoint loaders will not load them again.
         loader.set_as_custom_init()
@@ -1019,7 +1316,8 @@ class Engine(EngineBase):
     if model_epoch_filename:
       print("loading weights from", model_epoch_filename, file=log.v2)
       try:
-        self.network.load_params_from_file(model_epoch_filename, session=self.tf_session)
+        self.network.load_params_from_file(
+          model_epoch_filename, session=self.tf_session, **self._get_checkpoint_loader_opts())
       except tf.errors.NotFoundError:
         print("Exiting now because model cannot be loaded.", file=log.v1)
         sys.exit(1)
@@ -1110,8 +1408,18 @@ class Engine(EngineBase):
     """
     if epoch is None:
       epoch = self.epoch
+    graph_cache_key = None
+    if self._use_graph_cache():
+      # E.g. in pretraining, or with reinit_network_each_epoch, we might get the same network again.
+      # The construction can take quite long for big networks, so reuse the graph in that case.
+      graph_cache_key = self._get_graph_cache_key(net_desc)
+      self._move_graph_to_cache()
+      if graph_cache_key in self._graph_cache:
+        self._restore_graph_from_cache(graph_cache_key)
+        return
     self._close_tf_session()
     self._reset_graph()
+    self._graph_cache_key = graph_cache_key
     # The new session will by default use the newly created default graph.
     self._make_tf_session()
     tf_random_seed = 42
@@ -1292,6 +1600,7 @@ class Engine(EngineBase):
       # Save last model, in case it was not saved yet (depends on save_model_epoch_interval).
       if self.model_filename:
         self.save_model(self.get_epoch_model_filename())
+      self.wait_for_saved_models(raise_on_failure=True)
 
       if self.epoch != self.final_epoch:
         print("Stopped after epoch %i and not %i as planned." % (self.epoch, self.final_epoch), file=log.v3)
@@ -1399,6 +1708,7 @@ class Engine(EngineBase):
       if trainer.device_crash_batch is not None:  # Otherwise we got an unexpected exception - a bug in our code.
         if self.model_filename:
           self.save_model(self.get_epoch_model_filename() + ".crash_%i" % trainer.device_crash_batch)
+      self.wait_for_saved_models()
       print("Trainer not finalized, quitting.", file=log.v1)
       sys.exit(1)
 
@@ -1407,6 +1717,7 @@ class Engine(EngineBase):
       if self.config.bool("stop_on_nonfinite_train_score", True):
         if self.model_filename:
           self.save_model(self.get_epoch_model_filename() + ".broken")
+          self.wait_for_saved_models()
         sys.exit(1)
 
     should_call_graph_reset_callbacks = False
@@ -1447,7 +1758,11 @@ class Engine(EngineBase):
       self.save_model(self.get_epoch_model_filename())
 
     if self.config.bool_or_other("cleanup_old_models", None):
-      self.cleanup_old_models()
+      if self._get_async_checkpoint_saver():
+        # After the models saved so far are written. Also, do not block the training.
+        self._async_checkpoint_saver.add_task("cleanup_old_models", self.cleanup_old_models)
+      else:
+        self.cleanup_old_models()
 
   # noinspection PyMethodMayBeStatic
   def format_score(self, score):
@@ -1757,13 +2072,14 @@ class Engine(EngineBase):
     keep_epochs.update(epochs[-keep_last_n:])
     score_keys = set()  # e.g. "dev_error", "dev_score", etc.
     # Collect all possible score keys. Note that we could have different ones for different epochs.
-    for data in lr_control.epoch_data.values():
+    epoch_data = dict(lr_control.epoch_data)  # copy, as this might run in the background, see save_model_async
+    for data in epoch_data.values():
       score_keys.update(data.error.keys())
     assert score_keys
     score_keys = sorted(score_keys)
     score_values = {key: [] for key in score_keys}
     for epoch in epochs:
-      epoch_scores = lr_control.epoch_data[epoch].error
+      epoch_scores = epoch_data[epoch].error
       for key in epoch_scores.keys():
         score_values[key].append(epoch_scores[key])
     for key in list(score_keys):
@@ -1777,7 +2093,7 @@ class Engine(EngineBase):
     worst_score_values = {key: max(scores) for (key, scores) in score_values.items()}
     for key in score_keys:
       scores = sorted([
-        (lr_control.epoch_data[epoch].error.get(key, worst_score_values[key]), epoch) for epoch in epochs])
+        (epoch_data[epoch].error.get(key, worst_score_values[key]), epoch) for epoch in epochs])
       scores = scores[:keep_best_n]
       keep_epochs.update([v[1] for v in scores])
     keep_epochs.intersection_update(epochs)
@@ -1850,7 +2166,7 @@ class Engine(EngineBase):
           # noinspection PyPackageRequirements,PyUnresolvedReferences
           import horovod.tensorflow as hvd
           batch_slice = slice(hvd.rank(), None, hvd.size())
-        elif ds_dist_opt == "random_seed_offset":
+        elif ds_dist_opt in ("random_seed_offset", "dataset_shard"):
           pass  # nothing needed to be done here
         else:
           raise Exception("invalid horovod_dataset_distribution %r" % ds_dist_opt)
@@ -1859,7 +2175,8 @@ class Engine(EngineBase):
         data_keys=self.network.get_used_data_keys(),
         dataset=dataset, batches=batches,
         batch_slice=batch_slice,
-        enforce_min_len1=self.config.is_true("enforce_min_len1", False))
+        enforce_min_len1=self.config.is_true("enforce_min_len1", False),
+        num_threads=self.config.int("data_provider_num_threads", 1))
       return data_provider
 
   def get_specific_feed_dict(self, dataset, seq_idx):
@@ -1947,6 +2264,7 @@ class Engine(EngineBase):
     :param LayerBase output_layer:
     """
     from HDFDataset import SimpleHDFWriter
+    from Util import AsyncTaskQueue
 
     if not output_layer:
       output_layer = self._get_output_layer()
@@ -1970,7 +2288,23 @@ class Engine(EngineBase):
     else:
       assert not os.path.exists(output_file)
     print("Forward output:", output, file=log.v3)
-    writer = SimpleHDFWriter(filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels)
+    # We write to output_file + ".partial", such that the seqs written so far are kept in case of a crash.
+    resume = self.config.bool("forward_resume_hdf_output", False)
+    writer = SimpleHDFWriter(
+      filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels, partial_file=True, resume=resume)
+    if resume:
+      seq_tags_done = writer.get_seq_tags()
+      if seq_tags_done:
+        print("Resume forwarding, skip %i seqs which are already in %r." % (
+          len(seq_tags_done), writer.tmp_filename), file=log.v2)
+        data.seq_tags_exclude = set(seq_tags_done)
+        data.init_seq_order(epoch=self.epoch)
+        if not data.is_less_than_num_seqs(0):
+          print("All seqs are already forwarded.", file=log.v2)
+          writer.close()
+          return
+    # The HDF writing is done in the background, such that it does not block the computation.
+    writer_queue = AsyncTaskQueue(name="forward_to_hdf writer")
 
     def extra_fetches_cb(inputs, seq_tag, **kwargs):
       """
@@ -1985,7 +2319,7 @@ class Engine(EngineBase):
       # noinspection PyShadowingNames
       seq_len = {i: kwargs["seq_len_%i" % i] for i in output.size_placeholder.keys()}
       assert all([len(v) == n_batch for v in seq_len.values()])
-      writer.insert_batch(inputs=inputs, seq_len=seq_len, seq_tag=seq_tag)
+      writer_queue.add(lambda: writer.insert_batch(inputs=inputs, seq_len=seq_len, seq_tag=seq_tag))
 
     extra_fetches = {
       'inputs': output.placeholder,
@@ -2004,8 +2338,10 @@ class Engine(EngineBase):
       extra_fetches=extra_fetches,
       extra_fetches_callback=extra_fetches_cb)
     forwarder.run(report_prefix=self.get_epoch_str() + " forward")
+    # Write out all pending batches, also in case of an error, to keep as much as possible in the partial file.
+    writer_queue.close()
     if not forwarder.finalized:
-      print("Error happened. Exit now.")
+      print("Error happened. Exit now. The seqs so far are in %r." % writer.tmp_filename)
       sys.exit(1)
 
     writer.close()
@@ -2062,15 +2398,20 @@ class Engine(EngineBase):
       sys.exit(1)
     return analyzer
 
-  def search(self, dataset, do_eval=True, output_layer_names="output", output_file=None, output_file_format="txt"):
+  def search(self, dataset, do_eval=True, output_layer_names="output", output_file=None, output_file_format="txt",
+             output_file_resume=False):
     """
     :param Dataset dataset:
     :param bool do_eval: calculate errors. can only be done if we have the reference target
     :param str|list[str] output_layer_names:
     :param str output_file:
-    :param str output_file_format: "txt" or "py"
+    :param str output_file_format: "txt", "py" or "jsonl".
+      "jsonl" writes one JSON object per seq and line, continuously in the background while searching.
+    :param bool output_file_resume: only for "jsonl". if output_file exists, skip the seqs which are already in it
     """
+    import json
     from TFNetworkLayer import LayerBase
+    from Util import AsyncTaskQueue
     print("Search with network on %r." % dataset, file=log.v1)
     if not self.use_search_flag or not self.network or self.use_dynamic_train_flag:
       self.use_search_flag = True
@@ -2085,7 +2426,11 @@ class Engine(EngineBase):
       # It's constructed lazily and it will set used_data_keys, so make sure that we have it now.
       self.network.maybe_construct_objective()
     if output_file:
-      if dataset.have_corpus_seq_idx():
+      if output_file_format == "jsonl":
+        # Every line contains the seq tag, thus the order does not matter.
+        print("Output file format jsonl, i.e. the dataset will be sorted for optimal performance.", file=log.v3)
+        dataset.seq_ordering = "sorted_reverse"
+      elif dataset.have_corpus_seq_idx():
         # We can sort it. Sort it in reverse to make sure that we have enough memory right at the beginning.
         print("Dataset have_corpus_seq_idx == True, i.e. it will be sorted for optimal performance.", file=log.v3)
         dataset.seq_ordering = "sorted_reverse"
@@ -2097,7 +2442,16 @@ class Engine(EngineBase):
     assert not max_seq_length, (
       "Set max_seq_length = 0 for search (i.e. no maximal length). We want to keep all source sentences.")
 
+    if output_file and output_file_format == "jsonl" and os.path.exists(output_file):
+      assert output_file_resume, "Output file %r exists. Set search_output_file_resume to continue it." % output_file
+      seq_tags_done = self._read_search_output_jsonl_seq_tags(output_file)
+      print("Resume search, skip %i seqs which are already in %r." % (len(seq_tags_done), output_file), file=log.v2)
+      dataset.seq_tags_exclude = seq_tags_done
+
     dataset.init_seq_order(epoch=self.epoch)
+    if not dataset.is_less_than_num_seqs(0) and dataset.seq_tags_exclude:
+      print("All seqs are already in the output file.", file=log.v1)
+      return
     batches = dataset.generate_batches(
       recurrent_net=self.network.recurrent,
       batch_size=self.config.int('batch_size', 1),
@@ -2130,18 +2484,24 @@ class Engine(EngineBase):
       target_keys.append(output_layer.target or self.network.extern_data.default_target)
 
     out_cache = None
+    out_writer_queue = None  # type: typing.Optional[AsyncTaskQueue]
     seq_idx_to_tag = {}
     if output_file:
-      assert output_file_format in {"txt", "py"}
+      assert output_file_format in {"txt", "py", "jsonl"}
       if output_is_dict:
-        assert output_file_format == "py", "Text format not supported in the case of multiple output layers."
+        assert output_file_format != "txt", "Text format not supported in the case of multiple output layers."
       assert all(dataset.can_serialize_data(target_key) for target_key in target_keys)
-      assert not os.path.exists(output_file)
       print("Will write outputs to: %s" % output_file, file=log.v2)
-      output_file = open(output_file, "w")
-      # corpus-seq-idx -> str|list[(float,str)]|dict[str -> str|list[(float,str)]],
-      # depending on output_is_dict and whether output is after decision
-      out_cache = {}
+      if output_file_format == "jsonl":
+        # Appending, in case we resume. The lines are written in the background, see write_jsonl_lines.
+        output_file = open(output_file, "a")
+        out_writer_queue = AsyncTaskQueue(name="search output writer")
+      else:
+        assert not os.path.exists(output_file)
+        output_file = open(output_file, "w")
+        # corpus-seq-idx -> str|list[(float,str)]|dict[str -> str|list[(float,str)]],
+        # depending on output_is_dict and whether output is after decision
+        out_cache = {}
     if not log.verbose[4]:
       print("Set log_verbosity to level 4 or higher to see seq info on stdout.", file=log.v2)
 
@@ -2179,14 +2539,21 @@ class Engine(EngineBase):
           # Interpret output as bytes/utf8-string.
           outputs[target_idx] = bytearray(outputs[target_idx]).decode("utf8")
 
+      out_jsonl_lines = []
       for batch_idx in range(len(seq_idx)):
         corpus_seq_idx = None
+        out_record = None
         if out_cache is not None:
           corpus_seq_idx = dataset.get_corpus_seq_idx(seq_idx[batch_idx])
           assert corpus_seq_idx not in out_cache
           seq_idx_to_tag[corpus_seq_idx] = seq_tag[batch_idx]
           if output_is_dict:
             out_cache[corpus_seq_idx] = {}
+        if out_writer_queue is not None:
+          tag = seq_tag[batch_idx]
+          if isinstance(tag, bytes):  # TF string
+            tag = tag.decode("utf8")
+          out_record = {"seq_tag": tag, "output": {} if output_is_dict else None}
 
         # noinspection PyShadowingNames
         for target_idx in range(num_targets):
@@ -2215,7 +2582,7 @@ class Engine(EngineBase):
                   dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx + beam_idx]),
                   file=log.v4)
 
-            if out_cache is not None:
+            if out_cache is not None or out_record is not None:
               if out_beam_sizes[target_idx] is None:
                   out_data = dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx])
               else:
@@ -2225,13 +2592,35 @@ class Engine(EngineBase):
                      dataset.serialize_data(key=target_keys[target_idx], data=outputs[target_idx][out_idx + beam_idx]))
                     for beam_idx in range(out_beam_sizes[target_idx])]
 
-              if output_is_dict:
+              if out_record is not None:
+                if out_beam_sizes[target_idx] is not None:
+                  out_data = [(float(score), hyp) for (score, hyp) in out_data]  # JSON does not know numpy types
+                if output_is_dict:
+                  out_record["output"][output_layer_names[target_idx]] = out_data
+                else:
+                  out_record["output"] = out_data
+              elif output_is_dict:
                 assert output_layer_names[target_idx] not in out_cache[corpus_seq_idx]
                 out_cache[corpus_seq_idx][output_layer_names[target_idx]] = out_data
               else:
                 assert corpus_seq_idx not in out_cache
                 out_cache[corpus_seq_idx] = out_data
 
+        if out_record is not None:
+          out_jsonl_lines.append(json.dumps(out_record) + "\n")
+
+      if out_jsonl_lines:
+        out_writer_queue.add(lambda: write_jsonl_lines(out_jsonl_lines))
+
+    def write_jsonl_lines(lines):
+      """
+      Called in the background thread of out_writer_queue.
+
+      :param list[str] lines:
+      """
+      output_file.write("".join(lines))
+      output_file.flush()
+
     train = self._maybe_prepare_train_in_eval(targets_via_search=True)
 
     extra_fetches = {
@@ -2251,12 +2640,16 @@ class Engine(EngineBase):
       extra_fetches=extra_fetches,
       extra_fetches_callback=extra_fetches_callback)
     runner.run(report_prefix=self.get_epoch_str() + " search")
+    if out_writer_queue is not None:
+      # Write out all pending lines, also in case of an error, such that we can resume.
+      out_writer_queue.close()
+      output_file.close()
     if not runner.finalized:
       print("Error happened (%s). Exit now." % runner.run_exception)
       sys.exit(1)
     print("Search done. Num steps %i, Final: score %s error %s" % (
       runner.num_steps, self.format_score(runner.score), self.format_score(runner.error)), file=log.v1)
-    if output_file:
+    if output_file and out_cache is not None:
       assert out_cache
       assert 0 in out_cache
       assert len(out_cache) - 1 in out_cache
@@ -2273,6 +2666,34 @@ class Engine(EngineBase):
         raise Exception("invalid output_file_format %r" % output_file_format)
       output_file.close()
 
+  @staticmethod
+  def _read_search_output_jsonl_seq_tags(filename):
+    """
+    For resuming :func:`search` with output file format "jsonl".
+    An incomplete last line (e.g. after a crash while writing) is removed from the file.
+
+    :param str filename:
+    :return: seq tags which are already in the file
+    :rtype: set[str]
+    """
+    import json
+    seq_tags = set()
+    valid_size = 0
+    with open(filename, "rb") as f:
+      for line in f:
+        if not line.endswith(b"\n"):
+          break
+        try:
+          seq_tags.add(json.loads(line.decode("utf8"))["seq_tag"])
+        except ValueError:
+          break
+        valid_size += len(line)
+    if valid_size < os.path.getsize(filename):
+      print("Search output file %r: remove incomplete data at the end." % filename, file=log.v2)
+      with open(filename, "r+b") as f:
+        f.truncate(valid_size)
+    return seq_tags
+
   def search_single(self, dataset, seq_idx, output_layer_name=None):
     """
     Performs search.
@@ -2438,6 +2859,9 @@ class Engine(EngineBase):
     """
     Starts a web-server with a simple API to forward data through the network
     (or search if the flag is set).
+    Concurrent requests are grouped into batches (see :class:`Util.RequestBatcher`),
+    configured via ``web_server_max_batch_seqs``, ``web_server_max_batch_frames`` and ``web_server_max_batch_wait``.
+    A GET request on ``/stats`` returns the throughput and latency stats as JSON.
 
     :param int port: for the http server
     :return:
@@ -2445,7 +2869,11 @@ class Engine(EngineBase):
     assert sys.version_info[0] >= 3, "only Python 3 supported"
     # noinspection PyCompatibility
     from http.server import HTTPServer, BaseHTTPRequestHandler
+    # noinspection PyCompatibility
+    from socketserver import ThreadingMixIn
+    import json
     from GeneratingDataset import StaticDataset, Vocabulary, BytePairEncoding, ExtractAudioFeatures
+    from Util import RequestBatcher
 
     if not self.use_search_flag or not self.network or self.use_dynamic_train_flag:
       self.use_search_flag = True
@@ -2495,10 +2923,58 @@ class Engine(EngineBase):
       print("Given output %r has beam size %i." % (output_layer, out_beam_size), file=log.v1)
       output_layer_beam_scores_t = output_layer.get_search_choices().beam_scores
 
+    def process_batch(features_list):
+      """
+      :param list[numpy.ndarray] features_list: for every request
+      :return: for every request: outputs (beam,time), seq lens (beam,), beam scores (beam,) or None
+      :rtype: list[(numpy.ndarray,numpy.ndarray,numpy.ndarray|None)]
+      """
+      targets = numpy.array([], dtype="int32")  # empty...
+      dataset = StaticDataset(
+        data=[{input_data.name: features, output_data.name: targets} for features in features_list],
+        output_dim=num_outputs)
+      dataset.init_seq_order(epoch=1)
+      start_time_ = time.time()
+      output_d = engine.run_single(dataset=dataset, seq_idx=-1, output_dict={
+        "output": output_t,
+        "seq_lens": output_seq_lens_t,
+        "beam_scores": output_layer_beam_scores_t})
+      print("Took %.3f secs for decoding %i seqs." % (time.time() - start_time_, len(features_list)), file=log.v4)
+      beam_size = out_beam_size or 1
+      assert len(output_d["output"]) == len(output_d["seq_lens"]) == len(features_list) * beam_size
+      if out_beam_size:
+        assert output_d["beam_scores"].shape == (len(features_list), out_beam_size)  # (batch, beam)
+      # The batch dim of the output is (batch * beam), i.e. the beam is the inner dim.
+      return [
+        (output_d["output"][i * beam_size:(i + 1) * beam_size],
+         output_d["seq_lens"][i * beam_size:(i + 1) * beam_size],
+         output_d["beam_scores"][i] if out_beam_size else None)
+        for i in range(len(features_list))]
+
+    batcher = RequestBatcher(
+      process_batch=process_batch,
+      max_batch_seqs=self.config.int("web_server_max_batch_seqs", 1),
+      max_batch_frames=self.config.int("web_server_max_batch_frames", 0) or None,
+      max_wait_time=self.config.float("web_server_max_batch_wait", 0.01),
+      name="web_server batcher")
+
     class Handler(BaseHTTPRequestHandler):
       """
-      Handle POST requests.
+      Handle POST requests, and GET on /stats.
       """
+      # noinspection PyPep8Naming
+      def do_GET(self):
+        """
+        Handle GET request.
+        """
+        if self.path.rstrip("/") != "/stats":
+          self.send_error(404)
+          return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(batcher.get_stats(), sort_keys=True).encode("utf8"))
+
       # noinspection PyPep8Naming
       def do_POST(self):
         """
@@ -2539,30 +3015,17 @@ class Engine(EngineBase):
           seq = input_vocab.get_seq(sentence)
           print("Input seq:", input_vocab.get_seq_labels(seq), file=log.v4)
           features = numpy.array(seq, dtype="int32")
-        targets = numpy.array([], dtype="int32")  # empty...
-        dataset = StaticDataset(
-          data=[{input_data.name: features, output_data.name: targets}], output_dim=num_outputs)
-        dataset.init_seq_order(epoch=1)
 
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
         start_time = time.time()
-        output_d = engine.run_single(dataset=dataset, seq_idx=0, output_dict={
-          "output": output_t,
-          "seq_lens": output_seq_lens_t,
-          "beam_scores": output_layer_beam_scores_t})
+        output, seq_lens, beam_scores = batcher(features, num_frames=len(features))
         delta_time = time.time() - start_time
-        print("Took %.3f secs for decoding." % delta_time, file=log.v4)
+        print("Took %.3f secs for the request." % delta_time, file=log.v4)
         if audio_len:
           print("Real-time-factor: %.3f" % (delta_time / audio_len), file=log.v4)
-        output = output_d["output"]
-        seq_lens = output_d["seq_lens"]
-        beam_scores = output_d["beam_scores"]
-        assert len(output) == len(seq_lens) == (out_beam_size or 1)
-        if out_beam_size:
-          assert beam_scores.shape == (1, out_beam_size)  # (batch, beam)
 
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain')
+        self.end_headers()
         first_best_txt = output_vocab.get_seq_labels(output[0][:seq_lens[0]])
         print("Best output: %s" % first_best_txt, file=log.v4)
 
@@ -2570,18 +3033,27 @@ class Engine(EngineBase):
           self.wfile.write(b"[\n")
           for i in range(out_beam_size):
             txt = output_vocab.get_seq_labels(output[i][:seq_lens[i]])
-            score = beam_scores[0][i]
+            score = beam_scores[i]
             self.wfile.write(("(%r, %r)\n" % (score, txt)).encode("utf8"))
           self.wfile.write(b"]\n")
 
         else:
           self.wfile.write(("%r\n" % first_best_txt).encode("utf8"))
 
+    class ThreadingServer(ThreadingMixIn, HTTPServer):
+      """
+      Handles every request in a separate thread, such that the requests can be batched.
+      """
+      daemon_threads = True
+
     print("Simple search web server, listening on port %i." % port, file=log.v2)
     server_address = ('', port)
     # noinspection PyAttributeOutsideInit
-    self.httpd = HTTPServer(server_address, Handler)
-    self.httpd.serve_forever()
+    self.httpd = ThreadingServer(server_address, Handler)
+    try:
+      self.httpd.serve_forever()
+    finally:
+      batcher.stop()
 
 
 def get_global_engine():
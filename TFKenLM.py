@@ -26,6 +26,7 @@ def kenlm_checked_out():
 # https://github.com/tensorflow/tensorflow/blob/master/tensorflow/core/lib/strings/str_util.h
 _src_code = """
 #include <exception>
+#include <cstring>
 #include "tensorflow/core/framework/op.h"
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
@@ -103,6 +104,52 @@ REGISTER_OP("KenLmAbsScoreBpeStringsDense")
   " dense output, for all possible succeeding labels.");
 
 
+REGISTER_OP("KenLmScoreNext")
+.Input("handle: resource")
+.Input("bpe_merge_symbol: string")
+.Input("states: string")
+.Input("pending: string")
+.Input("committed_scores: float32")
+.Input("tokens: string")
+.Output("new_states: string")
+.Output("new_pending: string")
+.Output("new_committed_scores: float32")
+.Output("scores: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+  for(int i = 0; i < 4; ++i)
+    c->set_output(i, c->input(2));
+  return Status::OK();
+})
+.Doc("KenLmScoreNext: incremental variant of KenLmAbsScoreBpeStrings."
+  " states are the serialized KenLM states (empty string for the begin of sentence),"
+  " pending is the not yet finished (raw) text after the last word boundary,"
+  " committed_scores are the +log10 scores of all finished words."
+  " Appends the tokens, scores all newly finished words, and returns the new states"
+  " and the abs score like KenLmAbsScoreBpeStrings in +log space (natural log, not base 10).");
+
+
+REGISTER_OP("KenLmScoreNextDense")
+.Input("handle: resource")
+.Input("bpe_merge_symbol: string")
+.Input("states: string")
+.Input("pending: string")
+.Input("committed_scores: float32")
+.Input("labels: string")
+.Output("scores: float32")
+.Output("dense_scores: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+  c->set_output(0, c->input(2));
+  ::tensorflow::shape_inference::ShapeHandle out_shape;
+  TF_RETURN_IF_ERROR(c->Concatenate(c->input(2), c->input(5), &out_shape));
+  c->set_output(1, out_shape);
+  return Status::OK();
+})
+.Doc("KenLmScoreNextDense: incremental variant of KenLmAbsScoreBpeStringsDense,"
+  " for the state as returned by KenLmScoreNext."
+  " returns in +log space (natural log, not base 10)."
+  " dense output, for all possible succeeding labels.");
+
+
 // https://github.com/kpu/kenlm/blob/master/lm/model.hh
 // https://github.com/kpu/kenlm/blob/master/lm/virtual_interface.hh
 // https://github.com/kpu/kenlm/blob/master/python/kenlm.pyx
@@ -166,6 +213,105 @@ struct KenLmModel : public ResourceBase {
     return total_score * logf(10.);
   }
 
+  // Incremental scoring, see KenLmScoreNext.
+  // The state is the KenLM state after all finished (committed) words, serialized as raw bytes.
+  bool load_state(const ::tstring& serialized, lm::ngram::State* state) {
+    memset(state, 0, sizeof(lm::ngram::State));
+    if(serialized.empty()) {
+      model_.BeginSentenceWrite(state);
+      return true;
+    }
+    if(serialized.size() != sizeof(lm::ngram::State))
+      return false;
+    memcpy(state, serialized.data(), sizeof(lm::ngram::State));
+    return true;
+  }
+
+  static std::string dump_state(const lm::ngram::State& state) {
+    return std::string(reinterpret_cast<const char*>(&state), sizeof(lm::ngram::State));
+  }
+
+  // Appends the token to the pending text, and scores all words which are finished by that.
+  // This does the same BPE merging as KenLmAbsScoreBpeStrings (replace "<bpe_merge_symbol> " by "")
+  // but we keep the raw pending text, i.e. everything after the last word boundary.
+  // Returns false if the state is invalid.
+  bool score_next(
+        const ::tstring& state_in, const ::tstring& pending_in, float committed_in,
+        const ::tstring& token, const std::string& bpe_merge_symbol,
+        std::string* state_out, std::string* pending_out, float* committed_out, float* abs_score_out) {
+    mutex_lock l(mu_);
+    lm::ngram::State state, out_state;
+    if(!load_state(state_in, &state))
+      return false;
+    memset(&out_state, 0, sizeof(lm::ngram::State));
+    float committed = committed_in;
+    std::string raw = std::string(pending_in.data(), pending_in.size()) + std::string(token.data(), token.size());
+    std::string word;
+    size_t word_start = 0;
+    size_t i = 0;
+    while(i < raw.size()) {
+      if(!bpe_merge_symbol.empty()
+          && raw.compare(i, bpe_merge_symbol.size(), bpe_merge_symbol) == 0
+          && i + bpe_merge_symbol.size() < raw.size()
+          && raw[i + bpe_merge_symbol.size()] == ' ') {
+        i += bpe_merge_symbol.size() + 1;
+        continue;
+      }
+      if(raw[i] == ' ') {
+        if(!word.empty()) {
+          auto word_idx = model_.BaseVocabulary().Index(word);
+          committed += model_.FullScore(state, word_idx, out_state).prob;
+          state = out_state;
+          word.clear();
+        }
+        word_start = ++i;
+        continue;
+      }
+      word += raw[i++];
+    }
+    float total_score = committed;
+    if(!word.empty()) {
+      auto word_idx = model_.BaseVocabulary().Index(word);
+      total_score += model_.FullScore(state, word_idx, out_state).prob;
+    }
+    *state_out = dump_state(state);
+    *pending_out = raw.substr(word_start);
+    *committed_out = committed;
+    // KenLM returns score in +log10 space. See abs_score.
+    *abs_score_out = total_score * logf(10.);
+    return true;
+  }
+
+  // Like abs_score_dense, but for the state as returned by score_next.
+  // Returns false if the state is invalid.
+  bool score_next_dense(
+        const ::tstring& state_in, const ::tstring& pending_in, float committed,
+        const std::string& bpe_merge_symbol,
+        const TTypes<::tstring>::ConstFlat labels, TTypes<float>::UnalignedFlat out_dense_scores,
+        float* abs_score_out) {
+    assert(labels.size() == out_dense_scores.size());
+    mutex_lock l(mu_);
+    lm::ngram::State state, out_state;
+    if(!load_state(state_in, &state))
+      return false;
+    std::string last_word(pending_in.data(), pending_in.size());
+    if(!bpe_merge_symbol.empty())
+      last_word = tensorflow::str_util::StringReplace(last_word, bpe_merge_symbol + " ", "", /* replace_all */ true);
+    for(int i = 0; i < labels.size(); ++i) {
+      std::string word = last_word + std::string(labels(i).data(), labels(i).size());
+      auto word_idx = model_.BaseVocabulary().Index(word);
+      float score = model_.FullScore(state, word_idx, out_state).prob;
+      out_dense_scores(i) = (committed + score) * logf(10.);
+    }
+    float total_score = committed;
+    if(!last_word.empty()) {
+      auto word_idx = model_.BaseVocabulary().Index(last_word + bpe_merge_symbol);
+      total_score += model_.FullScore(state, word_idx, out_state).prob;
+    }
+    *abs_score_out = total_score * logf(10.);
+    return true;
+  }
+
   string DebugString()
 #if (TF_MAJOR_VERSION == 1 && TF_MINOR_VERSION >= 14) || (TF_MAJOR_VERSION > 1)
 const
@@ -339,6 +485,127 @@ class KenLmAbsScoreBpeStringsDenseOp : public OpKernel {
 
 REGISTER_KERNEL_BUILDER(Name("KenLmAbsScoreBpeStringsDense").Device(DEVICE_CPU), KenLmAbsScoreBpeStringsDenseOp);
 
+
+class KenLmScoreNextOp : public OpKernel {
+ public:
+  using OpKernel::OpKernel;
+
+  void Compute(OpKernelContext* context) override {
+    KenLmModel* lm;
+    {
+      const Tensor* handle;
+      OP_REQUIRES_OK(context, context->input("handle", &handle));
+      OP_REQUIRES_OK(context, GetResourceFromContext(context, "handle", &lm));
+    }
+    core::ScopedUnref unref(lm);
+
+    OP_REQUIRES(context, context->input(1).NumElements() == 1,
+      errors::InvalidArgument(
+        "bpe_merge_symbol must be a single element but got shape ",
+        context->input(1).shape().DebugString()));
+    const ::tstring& bpe_merge_symbol_ = context->input(1).flat<::tstring>()(0);
+    const std::string bpe_merge_symbol(bpe_merge_symbol_.data(), bpe_merge_symbol_.size());
+
+    const Tensor& states_tensor = context->input(2);
+    for(int j = 3; j <= 5; ++j)
+      OP_REQUIRES(context, context->input(j).shape() == states_tensor.shape(),
+        errors::InvalidArgument(
+          "input ", j, " shape ", context->input(j).shape().DebugString(),
+          " does not match states shape ", states_tensor.shape().DebugString()));
+    auto states_flat = states_tensor.flat<::tstring>();
+    auto pending_flat = context->input(3).flat<::tstring>();
+    auto committed_flat = context->input(4).flat<float>();
+    auto tokens_flat = context->input(5).flat<::tstring>();
+
+    Tensor* new_states_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(0, states_tensor.shape(), &new_states_tensor));
+    auto new_states_flat = new_states_tensor->flat<::tstring>();
+    Tensor* new_pending_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(1, states_tensor.shape(), &new_pending_tensor));
+    auto new_pending_flat = new_pending_tensor->flat<::tstring>();
+    Tensor* new_committed_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(2, states_tensor.shape(), &new_committed_tensor));
+    auto new_committed_flat = new_committed_tensor->flat<float>();
+    Tensor* output_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(3, states_tensor.shape(), &output_tensor));
+    auto output_flat = output_tensor->flat<float>();
+
+    for(int i = 0; i < states_flat.size(); ++i) {
+      std::string new_state, new_pending;
+      OP_REQUIRES(context,
+        lm->score_next(
+          states_flat(i), pending_flat(i), committed_flat(i), tokens_flat(i), bpe_merge_symbol,
+          &new_state, &new_pending, &new_committed_flat(i), &output_flat(i)),
+        errors::InvalidArgument("invalid KenLM state at index ", i));
+      new_states_flat(i) = new_state;
+      new_pending_flat(i) = new_pending;
+    }
+  }
+};
+
+REGISTER_KERNEL_BUILDER(Name("KenLmScoreNext").Device(DEVICE_CPU), KenLmScoreNextOp);
+
+
+class KenLmScoreNextDenseOp : public OpKernel {
+ public:
+  using OpKernel::OpKernel;
+
+  void Compute(OpKernelContext* context) override {
+    KenLmModel* lm;
+    {
+      const Tensor* handle;
+      OP_REQUIRES_OK(context, context->input("handle", &handle));
+      OP_REQUIRES_OK(context, GetResourceFromContext(context, "handle", &lm));
+    }
+    core::ScopedUnref unref(lm);
+
+    OP_REQUIRES(context, context->input(1).NumElements() == 1,
+      errors::InvalidArgument(
+        "bpe_merge_symbol must be a single element but got shape ",
+        context->input(1).shape().DebugString()));
+    const ::tstring& bpe_merge_symbol_ = context->input(1).flat<::tstring>()(0);
+    const std::string bpe_merge_symbol(bpe_merge_symbol_.data(), bpe_merge_symbol_.size());
+
+    const Tensor& states_tensor = context->input(2);
+    for(int j = 3; j <= 4; ++j)
+      OP_REQUIRES(context, context->input(j).shape() == states_tensor.shape(),
+        errors::InvalidArgument(
+          "input ", j, " shape ", context->input(j).shape().DebugString(),
+          " does not match states shape ", states_tensor.shape().DebugString()));
+    auto states_flat = states_tensor.flat<::tstring>();
+    auto pending_flat = context->input(3).flat<::tstring>();
+    auto committed_flat = context->input(4).flat<float>();
+
+    const Tensor& labels_tensor = context->input(5);
+    auto labels_flat = labels_tensor.flat<::tstring>();
+
+    Tensor* output_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(0, states_tensor.shape(), &output_tensor));
+    auto output_flat = output_tensor->flat<float>();
+
+    Tensor* output_dense_tensor = NULL;
+    TensorShape output_dense_shape(states_tensor.shape());
+    output_dense_shape.AppendShape(labels_tensor.shape());
+    OP_REQUIRES_OK(context, context->allocate_output(1, output_dense_shape, &output_dense_tensor));
+    Tensor output_dense_flat_tensor;
+    OP_REQUIRES(context,
+      output_dense_flat_tensor.CopyFrom(
+        *output_dense_tensor,
+        TensorShape({states_tensor.NumElements(), labels_tensor.NumElements()})),
+      errors::Internal("CopyFrom failed"));
+
+    for(int i = 0; i < states_flat.size(); ++i) {
+      OP_REQUIRES(context,
+        lm->score_next_dense(
+          states_flat(i), pending_flat(i), committed_flat(i), bpe_merge_symbol,
+          labels_flat, output_dense_flat_tensor.Slice(i, i + 1).unaligned_flat<float>(), &output_flat(i)),
+        errors::InvalidArgument("invalid KenLM state at index ", i));
+    }
+  }
+};
+
+REGISTER_KERNEL_BUILDER(Name("KenLmScoreNextDense").Device(DEVICE_CPU), KenLmScoreNextDenseOp);
+
 """
 
 _kenlm_src_code_workarounds = """
@@ -400,7 +667,7 @@ def get_tf_mod(verbose=False):
   src_code += _src_code
 
   compiler = OpCodeCompiler(
-    base_name="KenLM", code_version=1, code=src_code,
+    base_name="KenLM", code_version=2, code=src_code,
     include_paths=(kenlm_dir, kenlm_dir + "/util/double-conversion"),
     c_macro_defines={"NDEBUG": 1, "KENLM_MAX_ORDER": 6, "HAVE_ZLIB": 1},
     ld_flags=["-l%s" % lib for lib in libs],
@@ -456,6 +723,61 @@ def ken_lm_abs_score_bpe_strings_dense(handle, bpe_merge_symbol, strings, labels
     handle=handle, bpe_merge_symbol=bpe_merge_symbol, strings=strings, labels=labels)
 
 
+def ken_lm_score_next(handle, bpe_merge_symbol, states, pending, committed_scores, tokens):
+  """
+  Incremental variant of :func:`ken_lm_abs_score_bpe_strings`.
+  Instead of the accumulated string, this gets the state of the previous step,
+  and the cost per step does not depend on the length of the seq so far.
+  The initial state is given by :func:`ken_lm_initial_state`.
+  As all state is in plain tensors, you can reorder it as you like (e.g. for the beam search).
+
+  :param tf.Tensor handle: TF resource handle returned by :func:`ken_lm_load`
+  :param str|tf.Tensor bpe_merge_symbol: e.g. "@@", or "" for no BPE merging
+  :param tf.Tensor states: string, serialized KenLM state (after all finished words)
+  :param tf.Tensor pending: string, same shape as `states`. raw text after the last finished word
+  :param tf.Tensor committed_scores: float32, same shape as `states`. +log10 score of all finished words
+  :param tf.Tensor tokens: string, same shape as `states`. appended to the text, e.g. "word " or "subword@@ "
+  :return: (new_states, new_pending, new_committed_scores, abs_scores), all with same shape as `states`.
+    abs_scores is the same as :func:`ken_lm_abs_score_bpe_strings` would return for the accumulated string
+  :rtype: (tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor)
+  """
+  return get_tf_mod().ken_lm_score_next(
+    handle=handle, bpe_merge_symbol=bpe_merge_symbol,
+    states=states, pending=pending, committed_scores=committed_scores, tokens=tokens)
+
+
+def ken_lm_score_next_dense(handle, bpe_merge_symbol, states, pending, committed_scores, labels):
+  """
+  Incremental variant of :func:`ken_lm_abs_score_bpe_strings_dense`,
+  for the state as returned by :func:`ken_lm_score_next`.
+
+  :param tf.Tensor handle: TF resource handle returned by :func:`ken_lm_load`
+  :param str|tf.Tensor bpe_merge_symbol: e.g. "@@", or "" for no BPE merging
+  :param tf.Tensor states: string, serialized KenLM state
+  :param tf.Tensor pending: string, same shape as `states`
+  :param tf.Tensor committed_scores: float32, same shape as `states`
+  :param tf.Tensor|tf.Variable labels:
+  :return: (abs_scores, dense_scores), abs_scores with the same shape as `states`,
+    dense_scores with shape `states.shape + labels.shape`
+  :rtype: (tf.Tensor, tf.Tensor)
+  """
+  return get_tf_mod().ken_lm_score_next_dense(
+    handle=handle, bpe_merge_symbol=bpe_merge_symbol,
+    states=states, pending=pending, committed_scores=committed_scores, labels=labels)
+
+
+def ken_lm_initial_state(shape):
+  """
+  :param tf.Tensor|list[int|tf.Tensor] shape:
+  :return: (states, pending, committed_scores) for :func:`ken_lm_score_next`, i.e. the begin of sentence
+  :rtype: (tf.Tensor, tf.Tensor, tf.Tensor)
+  """
+  return (
+    tf.zeros(shape, dtype=tf.string),
+    tf.zeros(shape, dtype=tf.string),
+    tf.zeros(shape, dtype=tf.float32))
+
+
 if __name__ == "__main__":
   import better_exchook
   better_exchook.install()
@@ -114,6 +114,9 @@ class ExternData(object):
         continue  # special cases, ignored for now
       if key in self.extra_added_keys:
         continue
+      from Dataset import get_packed_seqs_base_key
+      if get_packed_seqs_base_key(key) and key not in dataset.get_data_keys():
+        continue  # provided by the data provider, see get_extern_data
       data = self.data[key]
       data_sparse = dataset.is_data_sparse(key)
       # If data.dim is None, it's ok to ignore.
@@ -794,6 +797,16 @@ class TFNetwork(object):
     if key == "seq_tag" and key not in self.extern_data.data:
       self.extern_data.data[key] = Data(
         name="seq_tag", shape=(), dtype="string", auto_create_placeholders=True)
+    from Dataset import get_packed_seqs_base_key
+    base_key = get_packed_seqs_base_key(key)
+    if base_key and key not in self.extern_data.data and base_key in self.extern_data.data:
+      # With packed_batching in the dataset, for the seqs packed into one batch row, see get_packed_seqs_base_key.
+      base_data = self.get_extern_data(base_key, mark_data_key_as_used=mark_data_key_as_used)
+      assert base_data.have_time_axis(), "%s: %r needs a time axis for %r" % (self, base_key, key)
+      self.extern_data.data[key] = Data(
+        name=key, shape=(None,), dtype="int32", sparse=False, dim=None,
+        size_placeholder={0: base_data.get_sequence_lengths()},
+        available_for_inference=base_data.available_for_inference, auto_create_placeholders=True)
     return self.extern_data.get_data(key)
 
   def get_used_data_keys(self, exclude_extra_added=True):
@@ -1075,6 +1088,23 @@ class TFNetwork(object):
     raise Exception("multiple targets %r and default_target %r not in list. set 'target' in config" %
                     (targets, default_target))
 
+  def get_layer_name_scopes(self):
+    """
+    :return: TF name scope prefix (e.g. "output/") -> absolute layer name (e.g. "output"),
+      including the layers of sub networks (e.g. of :class:`RecLayer`)
+    :rtype: dict[str,str]
+    """
+    scopes = {}
+    for _, layer in sorted(self.layers.items()):
+      scopes[layer.get_absolute_name_scope_prefix()] = layer.get_absolute_name()
+      cell = getattr(layer, "cell", None)
+      for sub_net in [
+            getattr(layer, "subnetwork", None), getattr(cell, "net", None),
+            getattr(cell, "input_layers_net", None), getattr(cell, "output_layers_net", None)]:
+        if isinstance(sub_net, TFNetwork) and sub_net is not self:
+          scopes.update(sub_net.get_layer_name_scopes())
+    return scopes
+
   def get_output_layers(self):
     """
     :rtype: list[LayerBase]
@@ -1390,13 +1420,15 @@ class TFNetwork(object):
       self.saver = TFCompat.v1.train.Saver(
         var_list=self.get_saveable_params_list(), max_to_keep=2 ** 31 - 1)
 
-  def save_params_to_file(self, filename, session):
+  def save_params_to_file(self, filename, session, async_saver=None):
     """
     Will save the model parameters to the filename.
     Note that the model parameters live inside the current TF session.
 
     :param str filename:
     :param TFCompat.v1.Session session:
+    :param AsyncCheckpointSaver|None async_saver: if given, only takes a snapshot of the params,
+      and the checkpoint is written in the background
     """
     import os
     filename = os.path.abspath(filename)  # TF needs absolute path
@@ -1404,35 +1436,28 @@ class TFNetwork(object):
     maybe_make_dirs(os.path.dirname(filename))
     if not self.saver:
       self._create_saver()
-    # We add some extra logic to try again for DiskQuota and other errors.
-    # This could save us multiple hours of computation.
-    try_again_wait_time = 10
-    while True:
-      try:
-        self.saver.save(sess=session, save_path=filename)
-        break
-      except IOError as e:
-        import errno
-        import time
-        if e.errno in [errno.EBUSY, errno.EDQUOT, errno.EIO, errno.ENOSPC]:
-          print("Exception while saving:", e, file=log.v3)
-          print("Trying again in %s secs." % try_again_wait_time, file=log.v3)
-          time.sleep(try_again_wait_time)
-          continue
-        raise
+    if async_saver:
+      async_saver.save(
+        filename=filename, session=session, saveable_params=self.get_saveable_params_list(),
+        meta_graph_def=self.saver.export_meta_graph())
+      return
+    _retry_on_io_error(lambda: self.saver.save(sess=session, save_path=filename))
 
-  def load_params_from_file(self, filename, session):
+  def load_params_from_file(self, filename, session, num_threads=None, mmap=False):
     """
     Will load the model parameters from the filename.
     Note that the model parameters live inside the current TF session.
 
     :param str filename:
     :param TFCompat.v1.Session session:
+    :param int|None num_threads: if given, uses :class:`CustomCheckpointLoader` with that many reader threads
+    :param bool mmap: if True, uses :class:`CustomCheckpointLoader` and reads via mmap
     """
-    if any([layer.custom_param_importer for layer in self.layers.values()]):
+    if num_threads or mmap or any([layer.custom_param_importer for layer in self.layers.values()]):
       # Need to use CustomCheckpointLoader because only that handles custom_param_importer correctly.
       loader = CustomCheckpointLoader(
-        filename=filename, saveable_params=self.get_saveable_params_list(), network=self)
+        filename=filename, saveable_params=self.get_saveable_params_list(), network=self,
+        num_threads=num_threads, mmap=mmap)
       loader.load_now(session=session)
       return
     if not self.saver:
@@ -2556,7 +2581,7 @@ class CustomCheckpointLoader:
 
   def __init__(self, filename, saveable_params, params_prefix="", load_if_prefix="", ignore_missing=False,
                ignore_params=(), ignore_params_prefixes=(),
-               network=None):
+               network=None, num_threads=None, mmap=False):
     """
     :param str filename: filepattern for NewCheckpointReader
     :param list[tf.Variable|tensorflow.python.training.saver.BaseSaverBuilder.SaveableObject] saveable_params:
@@ -2568,6 +2593,9 @@ class CustomCheckpointLoader:
     :param typing.Container[str] ignore_params: these param (by name) will not be loaded
     :param typing.Iterable[str] ignore_params_prefixes: these param (by prefix name) will not be loaded
     :param TFNetwork network:
+    :param int|None num_threads: for reading the tensors from the checkpoint in :func:`load_now`.
+      by default min(4, num CPUs)
+    :param bool mmap: read the tensors via :class:`TFUtil.CheckpointMmapReader`
     """
     self.filename = filename
     self.network = network
@@ -2593,7 +2621,12 @@ class CustomCheckpointLoader:
         continue
       self.saveable_params.append(param)
     assert count > 0, "%s: no saveable vars" % self
-    self.reader = TFCompat.v1.train.NewCheckpointReader(filename)
+    if num_threads is None:
+      import multiprocessing
+      num_threads = min(4, multiprocessing.cpu_count())
+    self.num_threads = num_threads
+    self.mmap = mmap
+    self.reader = self._ThreadLocalReader(filename=filename, mmap=mmap)
     self.net_vars = [v for v in self.saveable_params if isinstance(v, tf.Variable)]
     self.net_saveables = [v for v in self.saveable_params if not isinstance(v, tf.Variable)]
     # All variables in the checkpoint:
@@ -2609,11 +2642,60 @@ class CustomCheckpointLoader:
       for layer in network.layers.values() if layer.custom_param_importer] if network else []
 
   def __repr__(self):
-    keys = ["filename", "params_prefix", "load_if_prefix", "ignore_missing", "network"]
+    keys = ["filename", "params_prefix", "load_if_prefix", "ignore_missing", "network", "num_threads", "mmap"]
     return "%s(%s)" % (
       self.__class__.__name__,
       ", ".join(["%s=%r" % (key, getattr(self, key, "<unset>")) for key in keys]))
 
+  class _ThreadLocalReader:
+    """
+    ``NewCheckpointReader`` is not thread-safe, so every thread gets its own reader.
+    :class:`TFUtil.CheckpointMmapReader` is thread-safe and thus shared.
+    """
+
+    def __init__(self, filename, mmap=False):
+      """
+      :param str filename:
+      :param bool mmap:
+      """
+      import threading
+      from TFUtil import CheckpointMmapReader
+      self.filename = filename
+      self._local = threading.local()
+      self._shared_reader = CheckpointMmapReader(filename) if mmap else None
+      self._main_reader = self._get_reader()
+
+    def _get_reader(self):
+      """
+      :rtype: tensorflow.python.training.py_checkpoint_reader.CheckpointReader|TFUtil.CheckpointMmapReader
+      """
+      if self._shared_reader:
+        return self._shared_reader
+      reader = getattr(self._local, "reader", None)
+      if reader is None:
+        reader = TFCompat.v1.train.NewCheckpointReader(self.filename)
+        self._local.reader = reader
+      return reader
+
+    def get_tensor(self, name):
+      """
+      :param str name:
+      :rtype: numpy.ndarray
+      """
+      return self._get_reader().get_tensor(name)
+
+    def get_variable_to_shape_map(self):
+      """
+      :rtype: dict[str,list[int]]
+      """
+      return self._main_reader.get_variable_to_shape_map()
+
+    def debug_string(self):
+      """
+      :rtype: bytes
+      """
+      return self._main_reader.debug_string()
+
   class CustomParamImporter:
     """
     Helper class for custom param loading.
@@ -2704,43 +2786,65 @@ class CustomCheckpointLoader:
   class VariableValue:
     """
     Helper to assign some variable.
+    The value is only read from the checkpoint when needed.
     """
 
-    def __init__(self, value=None, custom_param_importer=None):
+    def __init__(self, value_getter=None, custom_param_importer=None):
       """
-      :param numpy.ndarray|None value:
+      :param (()->numpy.ndarray)|None value_getter:
       :param CustomCheckpointLoader.CustomParamImporter custom_param_importer:
       """
-      assert value is not None or custom_param_importer
-      self.value = value
+      assert value_getter or custom_param_importer
+      self.value_getter = value_getter
       self.custom_param_importer = custom_param_importer
 
+    def get_value(self):
+      """
+      :rtype: numpy.ndarray
+      """
+      assert self.value_getter
+      return self.value_getter()
+
     def assign_var(self, var, session):
       """
       :param tf.Variable var:
       :param TFCompat.v1.Session session:
       """
-      if self.value is not None:
-        VariableAssigner(var=var).assign(value=self.value, session=session)
+      if self.value_getter:
+        VariableAssigner(var=var).assign(value=self.get_value(), session=session)
       else:
         self.custom_param_importer.assign_var(var=var, session=session)
 
   def get_variable_value_map(self):
     """
-    :return: var -> numpy array
+    :return: var -> value (lazily read)
     :rtype: dict[tf.Variable,CustomCheckpointLoader.VariableValue]
     """
+    reader = self.reader
+
+    # noinspection PyShadowingNames
+    def make_load_renamed(old_name):
+      """
+      :param str old_name:
+      :rtype: () -> numpy.ndarray
+      """
+      def load_old():
+        """
+        :rtype: numpy.ndarray
+        """
+        return reader.get_tensor(old_name)
+
+      return load_old
+
     variable_values = {}
     if not self.missing_var_names and not self.custom_param_importers:
       # Fast path.
       for v in self.saveable_params:
         assert isinstance(v, tf.Variable), "not yet implemented otherwise..."
         v_name = self._get_param_name(v)
-        value = self.reader.get_tensor(v_name)
-        variable_values[v] = self.VariableValue(value=value)
+        variable_values[v] = self.VariableValue(value_getter=make_load_renamed(v_name))
       return variable_values
 
-    reader = self.reader
     net_vars = self.net_vars
     net_saveables = self.net_saveables
     var_ckpt_names = self.var_ckpt_names
@@ -2761,20 +2865,6 @@ class CustomCheckpointLoader:
 
     var_name_map = {}  # type: typing.Dict[str,typing.Callable[[],numpy.ndarray]]  # current name -> value-loader
 
-    # noinspection PyShadowingNames
-    def make_load_renamed(old_name):
-      """
-      :param str old_name:
-      :rtype: () -> numpy.ndarray
-      """
-      def load_old():
-        """
-        :rtype: numpy.ndarray
-        """
-        return reader.get_tensor(old_name)
-
-      return load_old
-
     def make_load_weights_nativelstm_to_basic(new_name):
       """
       :param str new_name:
@@ -2969,14 +3059,14 @@ class CustomCheckpointLoader:
         if custom_importer:
           variable_values[v] = self.VariableValue(custom_param_importer=custom_importer)
         elif v_name in var_ckpt_names:
-          variable_values[v] = self.VariableValue(value=reader.get_tensor(v_name))
+          variable_values[v] = self.VariableValue(value_getter=make_load_renamed(v_name))
         else:
           if self.ignore_missing and v_name not in var_name_map:
             print(
               "Warning, did not find match for var %r (%r, params_prefix %r, load_if_prefix %r) in checkpoint %r." % (
                 v, v_name, self.params_prefix, self.load_if_prefix, self.filename), file=log.v3)
             continue
-          variable_values[v] = self.VariableValue(value=var_name_map[v_name]())
+          variable_values[v] = self.VariableValue(value_getter=var_name_map[v_name])
       assert variable_values, "no vars to load; saveable vars are %r. load_if_prefix %r." % (
         self.saveable_params, self.load_if_prefix)
       print("Successfully loaded all variables. Any new save will use the updated variable names.", file=log.v3)
@@ -3015,11 +3105,28 @@ class CustomCheckpointLoader:
 
   def load_now(self, session):
     """
+    Reads the values with multiple threads (see ``num_threads``),
+    and assigns them in only few ``session.run`` calls.
+
     :param TFCompat.v1.Session session:
     :return: nothing, will assign the variables in the session
     """
-    for var, value in self.get_variable_value_map().items():
-      value.assign_var(var=var, session=session)
+    from TFUtil import assign_vars
+    var_values = sorted(self.get_variable_value_map().items(), key=lambda item: item[0].name)
+    for var, value in var_values:
+      if value.custom_param_importer:
+        value.assign_var(var=var, session=session)
+    var_values = [(var, value) for (var, value) in var_values if not value.custom_param_importer]
+    if self.num_threads > 1 and len(var_values) > 1:
+      from multiprocessing.pool import ThreadPool
+      pool = ThreadPool(min(self.num_threads, len(var_values)))
+      try:
+        values = pool.imap(lambda item: item[1].get_value(), var_values)
+        assign_vars(zip([var for (var, _) in var_values], values), session=session)
+      finally:
+        pool.terminate()
+    else:
+      assign_vars(((var, value.get_value()) for (var, value) in var_values), session=session)
 
   def set_as_custom_init(self):
     """
@@ -3054,6 +3161,196 @@ class CustomCheckpointLoader:
       set_custom_post_init(var=var, func=make_var_post_init(var))
 
 
+class AsyncCheckpointSaver:
+  """
+  Saves checkpoints in the background.
+  :func:`save` only takes a snapshot of the params (a copy in host memory) and returns,
+  while a background thread writes the checkpoint to temporary files and then renames them to the final name.
+  The ".index" file comes last, so an incomplete checkpoint is never found by :func:`EngineBase.get_existing_models`.
+  Other tasks which depend on the written checkpoints (e.g. :func:`Engine.cleanup_old_models`)
+  can run after them via :func:`add_task`.
+  """
+
+  def __init__(self, max_in_flight=1):
+    """
+    :param int max_in_flight: max num of checkpoints in memory which are not written yet.
+      :func:`save` will wait if there are already that many.
+    """
+    assert max_in_flight >= 1
+    import threading
+    self.max_in_flight = max_in_flight
+    self.num_failed = 0
+    self._cond = threading.Condition()
+    self._tasks = []  # type: typing.List[typing.Tuple[str,typing.Callable[[],None]]]  # (description, func)
+    self._num_in_flight = 0  # includes the current task
+    self._specs_cache = None  # type: typing.Optional[typing.Tuple[typing.List[tf.Variable],typing.List[typing.Tuple[str,str,tf.Tensor]]]]  # nopep8
+    self._thread = threading.Thread(target=self._thread_main, name="AsyncCheckpointSaver")
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _get_specs(self, saveable_params):
+    """
+    :param list[tf.Variable|tensorflow.python.training.saver.BaseSaverBuilder.SaveableObject] saveable_params:
+    :rtype: list[(str,str,tf.Tensor)]
+    """
+    if self._specs_cache:
+      cached_params, specs = self._specs_cache
+      if len(cached_params) == len(saveable_params) and all([a is b for (a, b) in zip(cached_params, saveable_params)]):
+        return specs
+    with tf.name_scope("async_checkpoint_saver"):
+      specs = TFUtil.get_saveable_specs(saveable_params)
+    self._specs_cache = (list(saveable_params), specs)
+    return specs
+
+  def save(self, filename, session, saveable_params, meta_graph_def=None):
+    """
+    Takes the snapshot of the params and returns right after that.
+
+    :param str filename: absolute checkpoint prefix
+    :param TFCompat.v1.Session session:
+    :param list[tf.Variable|tensorflow.python.training.saver.BaseSaverBuilder.SaveableObject] saveable_params:
+    :param tensorflow.core.protobuf.meta_graph_pb2.MetaGraphDef|None meta_graph_def: will be stored as ".meta"
+    """
+    import time
+    specs = self._get_specs(saveable_params)
+    with self._cond:
+      while self._num_in_flight >= self.max_in_flight:
+        self._cond.wait()
+      self._num_in_flight += 1
+    try:
+      start_time = time.time()
+      values = session.run([tensor for (_, _, tensor) in specs])
+      print("Took snapshot of params for %s in %.2f secs, writing in background." % (
+        filename, time.time() - start_time), file=log.v4)
+    except BaseException:
+      with self._cond:
+        self._num_in_flight -= 1
+        self._cond.notify_all()
+      raise
+    meta_graph_bytes = meta_graph_def.SerializeToString() if meta_graph_def is not None else None
+    self._add_task(
+      "save %s" % filename,
+      lambda: self._write(filename=filename, specs=specs, values=values, meta_graph_bytes=meta_graph_bytes),
+      in_flight=True)
+
+  def add_task(self, description, func):
+    """
+    :param str description:
+    :param ()->None func: will run in the background thread after all previously added saves and tasks
+    """
+    self._add_task(description, func, in_flight=False)
+
+  def _add_task(self, description, func, in_flight):
+    """
+    :param str description:
+    :param ()->None func:
+    :param bool in_flight: whether _num_in_flight was already increased for this
+    """
+    with self._cond:
+      if not in_flight:
+        self._num_in_flight += 1
+      self._tasks.append((description, func))
+      self._cond.notify_all()
+
+  def wait(self):
+    """
+    Waits until all saves and tasks are done.
+
+    :return: whether all saves and tasks succeeded so far
+    :rtype: bool
+    """
+    with self._cond:
+      while self._num_in_flight > 0:
+        self._cond.wait()
+    return self.num_failed == 0
+
+  def _thread_main(self):
+    import time
+    while True:
+      with self._cond:
+        while not self._tasks:
+          self._cond.wait()
+        description, func = self._tasks.pop(0)
+      start_time = time.time()
+      try:
+        func()
+        print("Background %s done in %.2f secs." % (description, time.time() - start_time), file=log.v4)
+      except Exception as exc:
+        print("Background %s failed: %r" % (description, exc), file=log.v1)
+        sys.excepthook(*sys.exc_info())
+        self.num_failed += 1
+      finally:
+        with self._cond:
+          self._num_in_flight -= 1
+          self._cond.notify_all()
+
+  @staticmethod
+  def _write(filename, specs, values, meta_graph_bytes):
+    """
+    Runs in the background thread. Uses its own graph and session, i.e. does not touch the main session.
+
+    :param str filename:
+    :param list[(str,str,tf.Tensor)] specs:
+    :param list[numpy.ndarray] values:
+    :param bytes|None meta_graph_bytes:
+    """
+    import os
+    from glob import glob
+    from tensorflow.python.ops import gen_io_ops
+    tmp_filename = filename + ".tmp-async-save"
+    graph = tf.Graph()
+    with graph.as_default():
+      filename_placeholder = TFCompat.v1.placeholder(tf.string, shape=(), name="filename")
+      value_placeholders = [
+        TFCompat.v1.placeholder(tensor.dtype.base_dtype, name="value_%i" % i)
+        for (i, (_, _, tensor)) in enumerate(specs)]
+      save_op = gen_io_ops.save_v2(
+        prefix=filename_placeholder,
+        tensor_names=[name for (name, _, _) in specs],
+        shape_and_slices=[slice_spec for (_, slice_spec, _) in specs],
+        tensors=value_placeholders)
+    with TFCompat.v1.Session(graph=graph, config=TFCompat.v1.ConfigProto(device_count={"GPU": 0})) as session:
+      feed_dict = dict(zip(value_placeholders, values))
+      feed_dict[filename_placeholder] = tmp_filename
+      _retry_on_io_error(lambda: session.run(save_op, feed_dict=feed_dict))
+    if meta_graph_bytes is not None:
+      def write_meta():
+        """
+        Write meta graph.
+        """
+        with open(tmp_filename + ".meta", "wb") as f:
+          f.write(meta_graph_bytes)
+      _retry_on_io_error(write_meta)
+    # Rename the ".index" last. That marks the checkpoint as complete.
+    tmp_fns = sorted(glob(tmp_filename + ".*"), key=lambda fn: (fn.endswith(".index"), fn))
+    assert tmp_fns and tmp_fns[-1].endswith(".index"), "%r: unexpected files %r" % (filename, tmp_fns)
+    for tmp_fn in tmp_fns:
+      os.rename(tmp_fn, filename + tmp_fn[len(tmp_filename):])
+
+
+def _retry_on_io_error(func, try_again_wait_time=10):
+  """
+  We add some extra logic to try again for DiskQuota and other errors.
+  This could save us multiple hours of computation.
+
+  :param ()->None func:
+  :param int|float try_again_wait_time: in secs
+  """
+  while True:
+    try:
+      func()
+      return
+    except IOError as e:
+      import errno
+      import time
+      if e.errno in [errno.EBUSY, errno.EDQUOT, errno.EIO, errno.ENOSPC]:
+        print("Exception while saving:", e, file=log.v3)
+        print("Trying again in %s secs." % try_again_wait_time, file=log.v3)
+        time.sleep(try_again_wait_time)
+        continue
+      raise
+
+
 def set_custom_post_init(var, func):
   """
   It registers the provided `func` such that it gets called for this variable
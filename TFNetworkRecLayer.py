@@ -1227,12 +1227,14 @@ class _SubnetworkRecCell(object):
                 allow_construct_in_call_nrs={0}, allow_uninitialized_template=True, parent=lself, parent_name=_name),
               GetLayer(
                 safe=True, allow_uninitialized_template=True, parent=lself, parent_name=_name)]
+          constructed_by_default_get_layer = False
           for get_layer in get_layer_candidates:
             # noinspection PyBroadException
             try:
               self.net.construct_layer(
                 net_dict=self.net_dict, name=name,
                 get_layer=get_layer, add_layer=get_layer.add_templated_layer)
+              constructed_by_default_get_layer = get_layer is default_get_layer
               break  # we did it, so get out of the loop
             except Exception:
               # Pretty generic exception handling but anything could happen.
@@ -1255,13 +1257,17 @@ class _SubnetworkRecCell(object):
                   ConstructCtx.collected_exceptions[exc_key] = out.getvalue()
           # Now, do again, but with full recursive layer construction, to determine the dependencies.
           ConstructCtx.most_recent = list(ConstructCtx.layers)
-          try:
+          if (constructed_by_default_get_layer
+                  and default_get_layer.got_uninitialized_deps_count == 0
+                  and layer_ not in ConstructCtx.partially_finished):
+            # We already did exactly that, and all deps were final, so it would give the same result again.
+            # This can save a lot of time for big networks.
+            pass
+          else:
             default_get_layer.reset()
             self.net.construct_layer(
               net_dict=self.net_dict, name=name,
               get_layer=default_get_layer, add_layer=default_get_layer.add_templated_layer)
-          except Exception:
-            raise
         finally:
           assert ConstructCtx.layers[-1] is layer_, "invalid stack %r, expected top layer %r" % (
             ConstructCtx.layers, layer_)
@@ -6038,12 +6044,17 @@ class KenLmStateLayer(_ConcatInputLayer):
   returns score (+log space, natural base e) of sequence,
   using KenLM (http://kheafield.com/code/kenlm/) (see :mod:`TFKenLM`).
   EOS (</s>) token must be used explicitly.
+
+  With ``incremental=True``, instead of the accumulated string,
+  we keep the KenLM state (see :func:`TFKenLM.ken_lm_score_next`),
+  and only score the new words in each frame, i.e. the cost per frame does not grow with the seq length.
+  The scores are the same.
   """
   layer_class = "kenlm"
   recurrent = True
 
   def __init__(self, lm_file, vocab_file=None, vocab_unknown_label="UNK", bpe_merge_symbol=None,
-               input_step_offset=0, dense_output=False,
+               input_step_offset=0, dense_output=False, incremental=False,
                debug=False,
                **kwargs):
     """
@@ -6053,6 +6064,7 @@ class KenLmStateLayer(_ConcatInputLayer):
     :param str|None bpe_merge_symbol: e.g. "@@" if you want to apply BPE merging
     :param int input_step_offset: if provided, will consider the input only from this step onwards
     :param bool dense_output: whether we output the score for all possible succeeding tokens
+    :param bool incremental: keep the KenLM state instead of the accumulated string, and only score new words
     :param bool debug: prints debug info
     """
     if callable(lm_file):
@@ -6095,12 +6107,38 @@ class KenLmStateLayer(_ConcatInputLayer):
       new_input = tf.where(
         tf.greater_equal(prev_step, input_step_offset),
         new_input, tf.zeros_like(new_input))
-    # See :class:`CumsumLayer` for comparison.
-    prev_strings = self._rec_previous_layer.rec_vars_outputs["state"]
-    next_strings = prev_strings + new_input
-    self.rec_vars_outputs["state"] = next_strings
     prev_scores = self._rec_previous_layer.rec_vars_outputs["scores"]
-    if dense_output:
+    if incremental:
+      # The rec vars are reordered for the beam search like all other rec vars, thus nothing special needed here.
+      next_lm_states, next_pending, next_committed_scores, new_abs_scores = TFKenLM.ken_lm_score_next(
+        handle=self.lm_handle,
+        bpe_merge_symbol=bpe_merge_symbol or "",
+        states=self._rec_previous_layer.rec_vars_outputs["lm_state"],
+        pending=self._rec_previous_layer.rec_vars_outputs["pending"],
+        committed_scores=self._rec_previous_layer.rec_vars_outputs["committed_scores"],
+        tokens=new_input)
+      self.rec_vars_outputs["lm_state"] = next_lm_states
+      self.rec_vars_outputs["pending"] = next_pending
+      self.rec_vars_outputs["committed_scores"] = next_committed_scores
+      next_strings = next_pending  # only for debug output
+    else:
+      # See :class:`CumsumLayer` for comparison.
+      prev_strings = self._rec_previous_layer.rec_vars_outputs["state"]
+      next_strings = prev_strings + new_input
+      self.rec_vars_outputs["state"] = next_strings
+    if dense_output and incremental:
+      assert self.tf_vocab is not None, "%s: provide vocab_file" % self
+      new_abs_scores, new_abs_scores_dense = TFKenLM.ken_lm_score_next_dense(
+        handle=self.lm_handle,
+        bpe_merge_symbol=bpe_merge_symbol or "",
+        states=next_lm_states,
+        pending=next_pending,
+        committed_scores=next_committed_scores,
+        labels=self.tf_vocab)
+      new_abs_scores_bc = expand_multiple_dims(
+        new_abs_scores, [i + new_abs_scores.get_shape().ndims for i in range(self.tf_vocab.get_shape().ndims)])
+      new_rel_scores = new_abs_scores_dense - new_abs_scores_bc
+    elif dense_output:
       assert self.tf_vocab is not None, "%s: provide vocab_file" % self
       new_abs_scores, new_abs_scores_dense = TFKenLM.ken_lm_abs_score_bpe_strings_dense(
         handle=self.lm_handle,
@@ -6110,6 +6148,8 @@ class KenLmStateLayer(_ConcatInputLayer):
       new_abs_scores_bc = expand_multiple_dims(
         new_abs_scores, [i + new_abs_scores.get_shape().ndims for i in range(self.tf_vocab.get_shape().ndims)])
       new_rel_scores = new_abs_scores_dense - new_abs_scores_bc
+    elif incremental:
+      new_rel_scores = new_abs_scores - prev_scores
     else:
       new_abs_scores = TFKenLM.ken_lm_abs_score_bpe_strings(
         handle=self.lm_handle,
@@ -6124,7 +6164,8 @@ class KenLmStateLayer(_ConcatInputLayer):
         "; input shape: ", tf.shape(self.input_data.placeholder), str(self.input_data),
         "; input: ", self.input_data.placeholder,
         "; strings shape: ", tf.shape(next_strings),
-        "; strings: ", "'" + next_strings + "'", "; new_abs_scores: ", new_abs_scores,
+        "; pending strings: " if incremental else "; strings: ", "'" + next_strings + "'",
+        "; new_abs_scores: ", new_abs_scores,
         "; sparse rel scores: ", new_abs_scores - prev_scores,
         "; min/max/mean rel scores: ",
         tf.reduce_min(new_rel_scores), "/", tf.reduce_max(new_rel_scores), "/", tf.reduce_mean(new_rel_scores)] +
@@ -6162,17 +6203,27 @@ class KenLmStateLayer(_ConcatInputLayer):
     return data
 
   @classmethod
-  def get_rec_initial_extra_outputs(cls, batch_dim, rec_layer, sources=(), **kwargs):
+  def get_rec_initial_extra_outputs(cls, batch_dim, rec_layer, sources=(), incremental=False, **kwargs):
     """
     :param tf.Tensor batch_dim:
     :param RecLayer|LayerBase rec_layer:
     :param list[LayerBase] sources:
+    :param bool incremental:
     :rtype: dict[str,tf.Tensor]
     """
     data = get_concat_sources_data_template(sources)
     # Assume inside RecLayer.
     assert all(data.shape)
     batch_shape = data.get_batch_shape(batch_dim=batch_dim)
+    if incremental:
+      import TFKenLM
+      lm_states, pending, committed_scores = TFKenLM.ken_lm_initial_state(batch_shape)
+      return {
+        "lm_state": lm_states,
+        "pending": pending,
+        "committed_scores": committed_scores,
+        "step": tf.constant(0, dtype=tf.int32),
+        "scores": tf.zeros(batch_shape, dtype=tf.float32)}
     return {
       "state": tf.zeros(batch_shape, dtype=tf.string),
       "step": tf.constant(0, dtype=tf.int32),
@@ -4669,6 +4669,224 @@ class VariableAssigner(object):
     session.run(self.assign_op, feed_dict={self.assign_op.inputs[1]: value})
 
 
+def assign_vars(var_values, session, max_bytes_per_run=2 ** 28):
+  """
+  Like :class:`VariableAssigner`, but for multiple vars, in only few ``session.run`` calls.
+
+  :param typing.Iterable[(tf.Variable,numpy.ndarray)] var_values:
+  :param TFCompat.v1.Session session:
+  :param int max_bytes_per_run: the values are fed together until this size is reached
+  """
+  assign_ops, feed_dict, num_bytes = [], {}, 0
+  for var, value in var_values:
+    assign_op = VariableAssigner(var=var).assign_op
+    assign_ops.append(assign_op)
+    feed_dict[assign_op.inputs[1]] = value
+    num_bytes += getattr(value, "nbytes", 0)
+    if num_bytes >= max_bytes_per_run:
+      session.run(assign_ops, feed_dict=feed_dict)
+      assign_ops, feed_dict, num_bytes = [], {}, 0
+  if assign_ops:
+    session.run(assign_ops, feed_dict=feed_dict)
+
+
+class CheckpointMmapReader:
+  """
+  Reads tensors from a TF checkpoint (V2 tensor bundle format) via mmap of the data files.
+  Thus, the tensors are not read into memory before they are used,
+  and the memory (page cache) is shared with other processes which read the same checkpoint.
+  This is thread-safe.
+
+  Provides the API of ``tf.compat.v1.train.NewCheckpointReader``, as far as we use it.
+  Tensors which cannot be read this way (e.g. strings or partitioned vars)
+  are read via ``NewCheckpointReader``.
+  """
+
+  TableMagicNumber = 0xdb4775248b80fb57
+  TableFooterLen = 48
+
+  def __init__(self, filename):
+    """
+    :param str filename: checkpoint prefix, i.e. without ".index"
+    """
+    import threading
+    from tensorflow.core.protobuf import tensor_bundle_pb2
+    self.filename = filename
+    self._lock = threading.Lock()
+    with open(filename + ".index", "rb") as f:
+      entries = self._read_table(bytearray(f.read()))
+    header = tensor_bundle_pb2.BundleHeaderProto()
+    header.ParseFromString(entries.pop(b""))
+    self.num_shards = header.num_shards
+    self._native_endianness = (
+      (header.endianness == tensor_bundle_pb2.BundleHeaderProto.LITTLE) == (sys.byteorder == "little"))
+    self._entries = {}  # type: typing.Dict[str,tensor_bundle_pb2.BundleEntryProto]
+    for key, value in entries.items():
+      if key.startswith(b"\x00"):  # slice of a partitioned var
+        continue
+      entry = tensor_bundle_pb2.BundleEntryProto()
+      entry.ParseFromString(value)
+      self._entries[key.decode("utf8")] = entry
+    self._data_files = {}  # type: typing.Dict[int,numpy.memmap]  # shard id -> data
+    self._fallback_local = threading.local()  # NewCheckpointReader is not thread-safe, thus one per thread
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, self.filename)
+
+  @staticmethod
+  def _decode_varint(data, pos):
+    """
+    :param bytearray data:
+    :param int pos:
+    :return: value, new pos
+    :rtype: (int,int)
+    """
+    res = shift = 0
+    while True:
+      b = data[pos]
+      pos += 1
+      res |= (b & 0x7f) << shift
+      if not b & 0x80:
+        return res, pos
+      shift += 7
+
+  @classmethod
+  def _read_table_block(cls, data, offset, size):
+    """
+    :param bytearray data: table file content
+    :param int offset:
+    :param int size:
+    :return: (key, value) entries of the block
+    :rtype: list[(bytes,bytes)]
+    """
+    import struct
+    if data[offset + size] != 0:  # the type in the block trailer
+      raise NotImplementedError("%s: compressed table blocks not supported" % cls.__name__)
+    block = data[offset:offset + size]
+    num_restarts, = struct.unpack("<I", bytes(block[-4:]))
+    end = len(block) - (num_restarts + 1) * 4
+    res = []
+    pos, key = 0, b""
+    while pos < end:
+      shared, pos = cls._decode_varint(block, pos)
+      non_shared, pos = cls._decode_varint(block, pos)
+      value_len, pos = cls._decode_varint(block, pos)
+      key = key[:shared] + bytes(block[pos:pos + non_shared])
+      pos += non_shared
+      res.append((key, bytes(block[pos:pos + value_len])))
+      pos += value_len
+    return res
+
+  @classmethod
+  def _read_table(cls, data):
+    """
+    :param bytearray data: table file content (LevelDB table format, as used for the checkpoint index)
+    :rtype: dict[bytes,bytes]
+    """
+    import struct
+    footer = data[-cls.TableFooterLen:]
+    magic, = struct.unpack("<Q", bytes(footer[-8:]))
+    assert magic == cls.TableMagicNumber, "%s: not a table file" % cls.__name__
+    pos = 0
+    _, pos = cls._decode_varint(footer, pos)  # metaindex offset
+    _, pos = cls._decode_varint(footer, pos)  # metaindex size
+    index_offset, pos = cls._decode_varint(footer, pos)
+    index_size, pos = cls._decode_varint(footer, pos)
+    res = {}
+    for _, handle in cls._read_table_block(data, index_offset, index_size):
+      handle = bytearray(handle)
+      offset, pos = cls._decode_varint(handle, 0)
+      size, pos = cls._decode_varint(handle, pos)
+      res.update(cls._read_table_block(data, offset, size))
+    return res
+
+  def _get_fallback_reader(self):
+    """
+    :return: reader for the current thread
+    :rtype: tensorflow.python.training.py_checkpoint_reader.CheckpointReader
+    """
+    import TFCompat
+    reader = getattr(self._fallback_local, "reader", None)
+    if reader is None:
+      reader = TFCompat.v1.train.NewCheckpointReader(self.filename)
+      self._fallback_local.reader = reader
+    return reader
+
+  def _get_data_file(self, shard_id):
+    """
+    :param int shard_id:
+    :rtype: numpy.memmap
+    """
+    import numpy
+    with self._lock:
+      if shard_id not in self._data_files:
+        self._data_files[shard_id] = numpy.memmap(
+          "%s.data-%05d-of-%05d" % (self.filename, shard_id, self.num_shards), dtype="uint8", mode="r")
+      return self._data_files[shard_id]
+
+  def _get_numpy_dtype(self, entry):
+    """
+    :param tensorflow.core.protobuf.tensor_bundle_pb2.BundleEntryProto entry:
+    :return: numpy dtype if the tensor can be read directly, otherwise None
+    :rtype: numpy.dtype|None
+    """
+    import numpy
+    if entry.slices or not self._native_endianness:
+      return None
+    dtype = tf.as_dtype(entry.dtype)
+    if dtype == tf.bfloat16:
+      return None
+    try:
+      np_dtype = numpy.dtype(dtype.as_numpy_dtype)
+    except TypeError:  # e.g. resource or variant
+      return None
+    if np_dtype.kind not in "biufc":
+      return None
+    return np_dtype
+
+  def get_variable_to_shape_map(self):
+    """
+    :rtype: dict[str,list[int]]
+    """
+    return {name: [dim.size for dim in entry.shape.dim] for (name, entry) in self._entries.items()}
+
+  def get_variable_to_dtype_map(self):
+    """
+    :rtype: dict[str,tf.DType]
+    """
+    return {name: tf.as_dtype(entry.dtype) for (name, entry) in self._entries.items()}
+
+  def has_tensor(self, name):
+    """
+    :param str name:
+    :rtype: bool
+    """
+    return name in self._entries
+
+  def get_tensor(self, name):
+    """
+    :param str name:
+    :return: read-only view into the mmapped data file if possible
+    :rtype: numpy.ndarray
+    """
+    entry = self._entries.get(name)
+    np_dtype = self._get_numpy_dtype(entry) if entry is not None else None
+    if np_dtype is None:
+      return self._get_fallback_reader().get_tensor(name)
+    data = self._get_data_file(entry.shard_id)
+    value = data[entry.offset:entry.offset + entry.size].view(np_dtype)
+    return value.reshape([dim.size for dim in entry.shape.dim])
+
+  def debug_string(self):
+    """
+    :return: like ``NewCheckpointReader.debug_string``
+    :rtype: bytes
+    """
+    return "".join([
+      "%s (%s) %s\n" % (name, tf.as_dtype(entry.dtype).name, [dim.size for dim in entry.shape.dim])
+      for (name, entry) in sorted(self._entries.items())]).encode("utf8")
+
+
 def _get_tf_gcc_path(bin_name):
   """
   :param str bin_name: e.g. "gcc" or "g++"
@@ -6091,6 +6309,23 @@ def global_tensor(f, name):
   return v
 
 
+def set_default_graph(graph):
+  """
+  Sets the global default graph, i.e. what :func:`tf.compat.v1.get_default_graph` returns
+  outside of any ``graph.as_default()`` context.
+  Like :func:`tf.compat.v1.reset_default_graph`, but to an existing graph.
+  E.g. used by the graph cache in :class:`TFEngine.Engine`.
+
+  :param tf.Graph graph:
+  """
+  from tensorflow.python.framework import ops
+  # noinspection PyProtectedMember
+  graph_stack = ops._default_graph_stack
+  assert not graph_stack.stack, "set_default_graph: not allowed inside a graph.as_default() context"
+  # noinspection PyProtectedMember
+  graph_stack._global_default_graph = graph
+
+
 def get_global_train_flag_placeholder():
   """
   Also consider :func:`TFNetwork.get_current_network().train_flag`,
@@ -9030,3 +9265,160 @@ class FetchHelper:
     self.most_recent_value = value
     self.callback_count += 1
     return 0
+
+
+class RunMetadataStatsByScope:
+  """
+  Accumulates the op compute times and output memory from ``tf.RunMetadata`` (session run with FULL_TRACE),
+  grouped by name scopes, e.g. the RETURNN layers (see :func:`TFNetwork.get_layer_name_scopes`).
+  Gradient ops (``.../gradients/<scope>/...``, e.g. ``optimize/gradients/output/...``)
+  are counted separately for their scope.
+  Ops in no given scope are grouped by their top-level name scope, like ``<optimize>``.
+  """
+
+  def __init__(self, scopes):
+    """
+    :param dict[str,str] scopes: name scope prefix (e.g. "output/") -> name (e.g. "output")
+    """
+    self.scopes = scopes
+    self._prefixes = sorted(scopes.keys(), key=len, reverse=True)  # longest match first
+    self._node_name_cache = {}  # type: typing.Dict[str,typing.Tuple[str,bool]]
+    self.num_steps = 0
+    self.time_micros = {}  # type: typing.Dict[str,int]  # name -> total over steps
+    self.grad_time_micros = {}  # type: typing.Dict[str,int]
+    self.output_bytes = {}  # type: typing.Dict[str,int]
+    self.num_ops = {}  # type: typing.Dict[str,int]
+
+  def get_name_for_node_name(self, node_name):
+    """
+    :param str node_name: e.g. "output/linear/MatMul"
+      or "optimize/gradients/output/linear/MatMul_grad/MatMul:MatMul"
+    :return: (name, is_grad)
+    :rtype: (str,bool)
+    """
+    import re
+    if node_name in self._node_name_cache:
+      return self._node_name_cache[node_name]
+    name = node_name.split(":")[0]  # GPU stream stats add the op type
+    is_grad = False
+    scopes = name.split("/")
+    for i, scope in enumerate(scopes[:-1]):
+      if re.match(r"^gradients(_[0-9]+)?$", scope):
+        is_grad = True
+        name = "/".join(scopes[i + 1:])
+        break
+    for prefix in self._prefixes:
+      if name.startswith(prefix):
+        res = (self.scopes[prefix], is_grad)
+        break
+    else:
+      first_scope = name.split("/")[0]
+      res = ("<%s>" % (first_scope if "/" in name else "other"), is_grad)
+    self._node_name_cache[node_name] = res
+    return res
+
+  @staticmethod
+  def _select_devices(dev_names):
+    """
+    On GPU, the kernel times are in the ".../stream:all" device, the GPU device itself only has the launch times.
+    Also, the memory is only in the GPU device itself.
+
+    :param list[str] dev_names:
+    :return: (device names for time, device names for memory)
+    :rtype: (set[str],set[str])
+    """
+    have_stream_all = set([dev[:-len("/stream:all")] for dev in dev_names if dev.endswith("/stream:all")])
+    time_devs, mem_devs = set(), set()
+    for dev in dev_names:
+      if "/stream:" in dev or dev.endswith("/memcpy"):
+        if dev.endswith("/stream:all"):
+          time_devs.add(dev)
+        elif dev.rsplit("/", 1)[0] not in have_stream_all:
+          time_devs.add(dev)
+        continue
+      mem_devs.add(dev)
+      if dev not in have_stream_all:
+        time_devs.add(dev)
+    return time_devs, mem_devs
+
+  def add_run_metadata(self, run_metadata):
+    """
+    :param tf.compat.v1.RunMetadata run_metadata: from a session run with FULL_TRACE
+    """
+    self.num_steps += 1
+    dev_stats = list(run_metadata.step_stats.dev_stats)
+    time_devs, mem_devs = self._select_devices([dev_stat.device for dev_stat in dev_stats])
+    for dev_stat in dev_stats:
+      for node_stat in dev_stat.node_stats:
+        name, is_grad = self.get_name_for_node_name(node_stat.node_name)
+        if dev_stat.device in time_devs:
+          times = self.grad_time_micros if is_grad else self.time_micros
+          times[name] = times.get(name, 0) + node_stat.all_end_rel_micros
+          self.num_ops[name] = self.num_ops.get(name, 0) + 1
+        if dev_stat.device in mem_devs:
+          num_bytes = sum([
+            output.tensor_description.allocation_description.allocated_bytes for output in node_stat.output])
+          if num_bytes:
+            self.output_bytes[name] = self.output_bytes.get(name, 0) + num_bytes
+
+  def get_names(self):
+    """
+    :return: all names, sorted by total time, descending
+    :rtype: list[str]
+    """
+    names = set(self.time_micros.keys()) | set(self.grad_time_micros.keys()) | set(self.output_bytes.keys())
+    return sorted(names, key=lambda name: (-self.time_micros.get(name, 0) - self.grad_time_micros.get(name, 0), name))
+
+  def dump(self, file=sys.stdout, prefix="", max_num_names=None):
+    """
+    Prints a table with the avg time and output memory per step.
+
+    :param typing.TextIO|Log.Stream file:
+    :param str prefix:
+    :param int|None max_num_names:
+    """
+    from Util import human_bytes_size
+    if not self.num_steps:
+      return
+    names = self.get_names()
+    total = float(sum(self.time_micros.values()) + sum(self.grad_time_micros.values())) or 1.
+    name_width = max([len("name")] + [len(name) for name in names])
+    print("%s%s  %12s  %12s  %6s  %10s  %6s" % (
+      prefix, "name".ljust(name_width), "time/step", "grad/step", "total", "out mem", "ops"), file=file)
+    for name in names[:max_num_names]:
+      time_micros = self.time_micros.get(name, 0)
+      grad_time_micros = self.grad_time_micros.get(name, 0)
+      print("%s%s  %10.2fms  %10.2fms  %5.1f%%  %10s  %6i" % (
+        prefix, name.ljust(name_width),
+        time_micros / 1000. / self.num_steps, grad_time_micros / 1000. / self.num_steps,
+        (time_micros + grad_time_micros) / total * 100.,
+        human_bytes_size(self.output_bytes.get(name, 0) // self.num_steps),
+        self.num_ops.get(name, 0) // self.num_steps), file=file)
+    if max_num_names is not None and len(names) > max_num_names:
+      print("%s... (%i more)" % (prefix, len(names) - max_num_names), file=file)
+
+
+def get_saveable_specs(var_list):
+  """
+  :param list[tf.Variable|tensorflow.python.training.saver.BaseSaverBuilder.SaveableObject] var_list:
+    like for :class:`tf.compat.v1.train.Saver`
+  :return: list of (name in checkpoint, slice spec, tensor), as the saver would save them
+  :rtype: list[(str,str,tf.Tensor)]
+  """
+  try:
+    # noinspection PyProtectedMember
+    from tensorflow.python.training.saving import saveable_object_util
+    saveables = saveable_object_util.validate_and_slice_inputs(saveable_object_util.op_list_to_dict(var_list))
+  except ImportError:  # older TF
+    from tensorflow.python.training import saver
+    builder = saver.BaseSaverBuilder()
+    # noinspection PyProtectedMember
+    saveables = builder._ValidateAndSliceInputs(saver.BaseSaverBuilder.OpListToDict(var_list))
+  res = []
+  for saveable in saveables:
+    for spec in saveable.specs:
+      tensor = spec.tensor
+      if callable(tensor):
+        tensor = tensor()
+      res.append((spec.name, spec.slice_spec, tensor))
+  return res
@@ -1060,7 +1060,7 @@ def init_thread_join_hack():
       # them for delayed handling to the main thread which hangs.
       # See CPython signalmodule.c.
       # Currently the best solution I can think of:
-      while thread_obj.isAlive():
+      while thread_obj.is_alive():
         join_orig(thread_obj, timeout=0.1)
     elif thread.get_ident() == main_thread_id and timeout > 0.1:
       # Limit the timeout. This should not matter for the underlying code.
@@ -1239,6 +1239,351 @@ def wrap_async_func(f):
     interrupt_main()
 
 
+class AsyncTaskQueue(object):
+  """
+  Runs the added functions one after another in a background daemon thread, in the order they were added.
+  E.g. this is used to write the outputs in :func:`TFEngine.Engine.search` and :func:`TFEngine.Engine.forward_to_hdf`
+  such that the disk I/O does not block the main loop.
+  If the queue is full, :func:`add` blocks, i.e. the producer will not run too far ahead.
+  If some function raises an exception, all further functions are skipped,
+  and the exception is reported in the main thread by the next :func:`add`, :func:`wait` or :func:`close`.
+  """
+
+  def __init__(self, name, max_queue_size=10):
+    """
+    :param str name: for the thread, and for error messages
+    :param int max_queue_size: 0 means unlimited
+    """
+    try:
+      # noinspection PyCompatibility
+      from queue import Queue
+    except ImportError:  # Python 2
+      # noinspection PyUnresolvedReferences,PyCompatibility
+      from Queue import Queue
+    self.name = name
+    self.exception = None  # type: typing.Optional[BaseException]
+    self._queue = Queue(maxsize=max_queue_size)
+    self._thread = threading.Thread(name=name, target=self._thread_main)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def __repr__(self):
+    return "<%s %r>" % (self.__class__.__name__, self.name)
+
+  def _thread_main(self):
+    while True:
+      func = self._queue.get()
+      try:
+        if func is None:
+          return
+        if self.exception is None:
+          func()
+      except BaseException as exc:
+        from Log import log
+        print("%s: exception in background task:" % self, file=log.v3)
+        sys.excepthook(*sys.exc_info())
+        self.exception = exc
+      finally:
+        self._queue.task_done()
+
+  def _check_exception(self):
+    if self.exception is not None:
+      raise Exception("%s: background task failed: %s: %s" % (
+        self, self.exception.__class__.__name__, self.exception))
+
+  def add(self, func):
+    """
+    :param ()->None func: will be called in the background thread
+    """
+    self._check_exception()
+    assert self._thread.is_alive(), "%s: already closed" % self
+    self._queue.put(func)
+
+  def wait(self):
+    """
+    Waits until all added functions are done.
+    """
+    self._queue.join()
+    self._check_exception()
+
+  def close(self):
+    """
+    Waits until all added functions are done, and stops the thread.
+    """
+    if self._thread.is_alive():
+      self._queue.put(None)
+      self._thread.join()
+    self._check_exception()
+
+
+class RequestQueueFullException(Exception):
+  """
+  Raised by :func:`RequestBatcher.add_request` when too many requests are pending.
+  """
+
+
+class RequestCancelledException(Exception):
+  """
+  Result of a request which was cancelled via :func:`RequestBatcher.cancel`.
+  """
+
+
+class BatchedRequest(object):
+  """
+  A single request of :class:`RequestBatcher`.
+  """
+
+  def __init__(self, data, num_frames=1):
+    """
+    :param T data: whatever the process_batch function of the batcher expects
+    :param int num_frames: e.g. the seq len, for the max_batch_frames limit
+    """
+    self.data = data
+    self.num_frames = num_frames
+    self.start_time = time.time()
+    self.end_time = None  # type: typing.Optional[float]
+    self.result = None
+    self.exception = None  # type: typing.Optional[BaseException]
+    self.done = threading.Event()  # set after all done callbacks were called
+    self._lock = threading.Lock()
+    self._has_result = False
+    self._done_callbacks = []  # type: typing.List[typing.Callable[[BatchedRequest],None]]
+
+  def set_result(self, result=None, exception=None):
+    """
+    :param R|None result:
+    :param BaseException|None exception:
+    """
+    with self._lock:
+      self.result = result
+      self.exception = exception
+      self.end_time = time.time()
+      self._has_result = True
+      callbacks, self._done_callbacks = self._done_callbacks, []
+    try:
+      for callback in callbacks:
+        callback(self)
+    finally:
+      self.done.set()
+
+  def add_done_callback(self, callback):
+    """
+    :param (BatchedRequest)->None callback: called in the processing thread (or directly if already done)
+    """
+    with self._lock:
+      if not self._has_result:
+        self._done_callbacks.append(callback)
+        return
+    callback(self)
+
+  def wait(self):
+    """
+    Blocks until the request was processed.
+
+    :return: result. if the processing failed, this raises the exception
+    :rtype: R
+    """
+    while not self.done.is_set():  # the wait can return early, e.g. with init_thread_join_hack
+      self.done.wait()
+    if self.exception is not None:
+      raise self.exception
+    return self.result
+
+
+class RequestBatcher(object):
+  """
+  Requests can come from multiple threads, and get queued.
+  A background thread groups them into batches and processes them via a single ``process_batch`` call.
+  A batch is processed when ``max_batch_seqs`` or ``max_batch_frames`` is reached,
+  or when the first request in the queue waited ``max_wait_time`` secs.
+  With ``num_threads > 1``, multiple batches can be processed in parallel.
+  This is used by :func:`TFEngine.Engine.web_server` and :class:`Server.Model`.
+  """
+
+  def __init__(self, process_batch, max_batch_seqs=1, max_batch_frames=None, max_wait_time=0.0,
+               num_threads=1, max_queue_size=None,
+               num_latencies_for_stats=10000, name="RequestBatcher"):
+    """
+    :param (list[T])->list[R] process_batch: gets the data of all requests of the batch, returns the results
+    :param int max_batch_seqs:
+    :param int|None max_batch_frames: a single request with more frames is processed alone
+    :param float max_wait_time: in secs
+    :param int num_threads: number of threads which call process_batch
+    :param int|None max_queue_size: if that many requests are pending, :func:`add_request` raises
+      :class:`RequestQueueFullException`
+    :param int num_latencies_for_stats: over how much of the last requests we calculate the latency percentiles
+    :param str name: for the threads
+    """
+    assert max_batch_seqs >= 1 and num_threads >= 1
+    self.process_batch = process_batch
+    self.max_batch_seqs = max_batch_seqs
+    self.max_batch_frames = max_batch_frames
+    self.max_wait_time = max_wait_time
+    self.max_queue_size = max_queue_size
+    self.queue = deque()  # type: typing.Deque[BatchedRequest]
+    self.cond = threading.Condition()
+    self.start_time = time.time()
+    self.num_requests = 0
+    self.num_failed_requests = 0
+    self.num_cancelled_requests = 0
+    self.num_rejected_requests = 0
+    self.num_batches = 0
+    self.num_frames = 0
+    self.process_time = 0.0
+    self.latencies = deque(maxlen=num_latencies_for_stats)  # type: typing.Deque[float]
+    self._quit = False
+    self.threads = [
+      threading.Thread(target=self._thread_main, name=name + (" %i" % i if num_threads > 1 else ""))
+      for i in range(num_threads)]
+    for thread_ in self.threads:
+      thread_.daemon = True
+      thread_.start()
+
+  def add_request(self, data, num_frames=1):
+    """
+    :param T data:
+    :param int num_frames:
+    :return: the request, use :func:`BatchedRequest.wait` to get the result
+    :rtype: BatchedRequest
+    """
+    request = BatchedRequest(data=data, num_frames=num_frames)
+    with self.cond:
+      assert not self._quit
+      if self.max_queue_size and len(self.queue) >= self.max_queue_size:
+        self.num_rejected_requests += 1
+        raise RequestQueueFullException("%i requests pending" % len(self.queue))
+      self.queue.append(request)
+      self.cond.notify_all()
+    return request
+
+  def __call__(self, data, num_frames=1):
+    """
+    Adds the request and waits for the result.
+
+    :param T data:
+    :param int num_frames:
+    :rtype: R
+    """
+    return self.add_request(data=data, num_frames=num_frames).wait()
+
+  def cancel(self, request):
+    """
+    Cancels the request, if it is still pending.
+    Its result will then be a :class:`RequestCancelledException`.
+
+    :param BatchedRequest request:
+    :return: whether it was cancelled. if False, it is already being processed or done
+    :rtype: bool
+    """
+    with self.cond:
+      if request not in self.queue:
+        return False
+      self.queue.remove(request)
+      self.num_cancelled_requests += 1
+    request.set_result(exception=RequestCancelledException())
+    return True
+
+  def stop(self):
+    """
+    Processes all pending requests, and then stops the threads.
+    """
+    with self.cond:
+      self._quit = True
+      self.cond.notify_all()
+    for thread_ in self.threads:
+      thread_.join()
+
+  def _is_batch_full(self):
+    """
+    :rtype: bool
+    """
+    if len(self.queue) >= self.max_batch_seqs:
+      return True
+    if self.max_batch_frames and sum([request.num_frames for request in self.queue]) >= self.max_batch_frames:
+      return True
+    return False
+
+  def _get_next_batch(self):
+    """
+    :return: next batch, or None if we should quit
+    :rtype: list[BatchedRequest]|None
+    """
+    with self.cond:
+      while not self.queue:
+        if self._quit:
+          return None
+        self.cond.wait()
+      while self.queue and not self._quit and not self._is_batch_full():
+        remaining = self.queue[0].start_time + self.max_wait_time - time.time()
+        if remaining <= 0:
+          break
+        self.cond.wait(remaining)
+      if not self.queue:  # cancelled, or taken by another thread
+        return []
+      batch = [self.queue.popleft()]
+      num_frames = batch[0].num_frames
+      while self.queue and len(batch) < self.max_batch_seqs:
+        if self.max_batch_frames and num_frames + self.queue[0].num_frames > self.max_batch_frames:
+          break
+        batch.append(self.queue.popleft())
+        num_frames += batch[-1].num_frames
+      return batch
+
+  def _thread_main(self):
+    while True:
+      batch = self._get_next_batch()
+      if batch is None:
+        break
+      if not batch:
+        continue
+      start_time = time.time()
+      # noinspection PyBroadException
+      try:
+        results = self.process_batch([request.data for request in batch])
+        assert len(results) == len(batch), "process_batch returned %i results for %i requests" % (
+          len(results), len(batch))
+      except Exception as exc:
+        sys.excepthook(*sys.exc_info())
+        for request in batch:
+          request.set_result(exception=exc)
+        results = None
+      else:
+        for request, result in zip(batch, results):
+          request.set_result(result=result)
+      with self.cond:
+        self.process_time += time.time() - start_time
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        self.num_frames += sum([request.num_frames for request in batch])
+        if results is None:
+          self.num_failed_requests += len(batch)
+        self.latencies.extend([request.end_time - request.start_time for request in batch])
+
+  def get_stats(self):
+    """
+    :return: counters, throughput (per sec since start), latency percentiles (in secs) over the last requests
+    :rtype: dict[str,int|float|None]
+    """
+    import numpy
+    with self.cond:
+      elapsed = time.time() - self.start_time
+      latencies = numpy.array(self.latencies)
+      return {
+        "num_requests": self.num_requests,
+        "num_failed_requests": self.num_failed_requests,
+        "num_cancelled_requests": self.num_cancelled_requests,
+        "num_rejected_requests": self.num_rejected_requests,
+        "num_pending_requests": len(self.queue),
+        "num_batches": self.num_batches,
+        "avg_batch_seqs": (float(self.num_requests) / self.num_batches) if self.num_batches else None,
+        "requests_per_sec": (self.num_requests / elapsed) if elapsed > 0 else None,
+        "frames_per_sec": (self.num_frames / elapsed) if elapsed > 0 else None,
+        "process_time_fraction": (self.process_time / elapsed) if elapsed > 0 else None,
+        "latency_p50": float(numpy.percentile(latencies, 50)) if len(latencies) else None,
+        "latency_p99": float(numpy.percentile(latencies, 99)) if len(latencies) else None,
+        "latency_max": float(numpy.max(latencies)) if len(latencies) else None}
+
+
 def try_run(func, args=(), catch_exc=Exception, default=None):
   """
   :param ((X)->T) func:
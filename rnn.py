@@ -495,7 +495,8 @@ def execute_main_task():
       do_eval=config.bool("search_do_eval", True),
       output_layer_names=config.typed_value("search_output_layer", "output"),
       output_file=config.value("search_output_file", ""),
-      output_file_format=config.value("search_output_file_format", "txt"))
+      output_file_format=config.value("search_output_file_format", "txt"),
+      output_file_resume=config.bool("search_output_file_resume", False))
   elif task == 'compute_priors':
     assert train_data is not None, 'train data for priors should be provided'
     engine.init_network_from_config(config)
@@ -11,6 +11,7 @@ from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_i
 from GeneratingDataset import GeneratingDataset, DummyDataset, DummyDatasetMultipleSequenceLength
 from EngineBatch import Batch
 from Dataset import DatasetSeq
+from CachedDataset2 import CachedDataset2
 from Util import NumbersDict
 import numpy as np
 
@@ -326,6 +327,330 @@ def test_task12ax_window():
   assert_equal(list(data2a[-1, 2]), [0] * input_dim)  # zero-padded right
 
 
+def _get_all_batches_from_dataset(dataset, **kwargs):
+  """
+  :param Dataset.Dataset dataset:
+  :return: list of batches as simple comparable structures
+  :rtype: list[(list,dict,int)]
+  """
+  dataset.init_seq_order(1)
+  batch_gen = dataset.generate_batches(**kwargs)
+  res = []
+  while batch_gen.has_more():
+    batch, = batch_gen.peek_next_n(1)
+    seqs = [
+      (s.seq_idx, s.seq_start_frame.dict, s.seq_start_frame.value, s.seq_end_frame.dict, s.seq_end_frame.value,
+       s.batch_slice, s.batch_frame_offset.dict, s.batch_frame_offset.value)
+      for s in batch.seqs]
+    res.append((seqs, batch.max_num_frames_per_slice.dict, batch.max_num_frames_per_slice.value, batch.num_slices))
+    batch_gen.advance(1)
+  return res
+
+
+def test_generate_batches_vectorized_same():
+  from GeneratingDataset import TaskNumberBaseConvertDataset, Task12AXDataset
+  opts_list = [
+    dict(batch_size=50, max_seqs=3),
+    dict(batch_size=100, max_seqs=-1),
+    dict(batch_size={"data": 30, "classes": 50}, max_seqs=10),
+    dict(batch_size=200, max_seqs=20, max_pad_size=10),
+    dict(batch_size=0, max_seqs=7, max_seq_length=15),
+    dict(batch_size=60, max_seqs=5, max_seq_length={"classes": 20}, min_seq_length=3),
+    dict(batch_size=60, max_seqs=5, seq_drop=0.3),
+    dict(batch_size=80, max_seqs=50, max_total_num_seqs=123),
+  ]
+  for dataset_cls, dataset_opts in [
+        (TaskNumberBaseConvertDataset, dict(num_seqs=1234, min_input_seq_len=1, max_input_seq_len=20)),
+        (Task12AXDataset, dict(num_seqs=23, chunking="5:3")),
+        (Task12AXDataset, dict(num_seqs=23, chunking="5:3", context_window=3))]:
+    for opts in opts_list:
+      print("dataset:", dataset_cls.__name__, dataset_opts, "batch opts:", opts)
+      dataset = dataset_cls(**dataset_opts)
+      dataset_vec = dataset_cls(vectorized_batching=True, **dataset_opts)
+      batches = _get_all_batches_from_dataset(dataset, recurrent_net=True, **opts)
+      batches_vec = _get_all_batches_from_dataset(dataset_vec, recurrent_net=True, **opts)
+      assert len(batches) > 1
+      assert_equal(batches, batches_vec)
+
+
+def test_get_seq_order_for_epoch_seq_lens_same():
+  from Dataset import Dataset
+  num_seqs = 1000
+  rnd = np.random.RandomState(42)
+  seq_lens_int = rnd.randint(1, 50, size=(num_seqs,))  # many duplicates, to test that the sorting is stable
+  seq_lens_float = [float(x) for x in rnd.randint(10, 50, size=(num_seqs,)) / 10.]  # e.g. durations
+  for seq_lens in [seq_lens_int, seq_lens_float]:
+    for seq_ordering in [
+          "default", "reverse", "sorted", "sorted_reverse", "random", "random:3",
+          "sort_bin_shuffle", "sort_bin_shuffle:.20", "sort_bin_shuffle_x2:10", "laplace:7", "laplace:.100:2"]:
+      dataset = Dataset(seq_ordering=seq_ordering)
+      for epoch in [1, 2, 5]:
+        seq_order = dataset.get_seq_order_for_epoch(
+          epoch=epoch, num_seqs=num_seqs, get_seq_len=lambda i: seq_lens[i])
+        seq_order_vec = dataset.get_seq_order_for_epoch(epoch=epoch, num_seqs=num_seqs, seq_lens=seq_lens)
+        assert_equal(sorted(seq_order), list(range(num_seqs)))
+        assert_equal(list(seq_order), list(seq_order_vec))
+
+
+def test_SeqIndexCache():
+  import tempfile
+  import shutil
+  from Dataset import SeqIndexCache
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    corpus_fn = "%s/corpus.txt" % tmp_dir
+    with open(corpus_fn, "w") as f:
+      f.write("hello\n")
+    opts = {"a": 1, "b": "x"}
+    cache = SeqIndexCache(name="Test", opts=opts, files=[corpus_fn], cache_dir=tmp_dir + "/cache")
+    assert cache.load() is None
+    cache.save({"seq_tags": ["seq-0", "seq-1"], "seq_lens": {"data": np.array([3, 5])}})
+    cache = SeqIndexCache(name="Test", opts=opts, files=[corpus_fn], cache_dir=tmp_dir + "/cache")
+    content = cache.load()
+    assert_equal(content["seq_tags"], ["seq-0", "seq-1"])
+    assert_equal(content["seq_lens"]["data"].tolist(), [3, 5])
+    cache = SeqIndexCache(name="Test", opts={"a": 2, "b": "x"}, files=[corpus_fn], cache_dir=tmp_dir + "/cache")
+    assert cache.load() is None
+    with open(corpus_fn, "a") as f:
+      f.write("world\n")
+    cache = SeqIndexCache(name="Test", opts=opts, files=[corpus_fn], cache_dir=tmp_dir + "/cache")
+    assert cache.load() is None
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+class _RandomSeqsDataset(CachedDataset2):
+  """
+  Seq data only depends on the epoch and seq idx. The num seqs is not known in advance.
+  """
+
+  def __init__(self, end_seq_idx, **kwargs):
+    super(_RandomSeqsDataset, self).__init__(**kwargs)
+    self.num_inputs = 3
+    self.num_outputs = {"data": (3, 2), "classes": (5, 1)}
+    self.end_seq_idx = end_seq_idx
+
+  def _collect_single_seq(self, seq_idx):
+    if seq_idx >= self.end_seq_idx:
+      return None
+    rnd = np.random.RandomState(self.epoch * 1000 + seq_idx)
+    seq_len = rnd.randint(1, 20)
+    return DatasetSeq(
+      seq_idx=seq_idx, seq_tag="seq-%i" % seq_idx,
+      features={
+        "data": rnd.normal(size=(seq_len, 3)).astype("float32"),
+        "classes": rnd.randint(0, 5, size=(seq_len,)).astype("int32")})
+
+
+def test_CachedDataset2_num_workers_same():
+  results = []
+  for num_workers in [0, 2]:
+    dataset = _RandomSeqsDataset(end_seq_idx=17, num_workers=num_workers, num_prefetch_seqs=5)
+    epochs = []
+    for epoch in [1, 2]:
+      dataset.init_seq_order(epoch=epoch)
+      seqs = []
+      seq_idx = 0
+      while dataset.is_less_than_num_seqs(seq_idx):
+        dataset.load_seqs(seq_idx, seq_idx + 1)
+        seqs.append((
+          dataset.get_tag(seq_idx), dataset.get_data(seq_idx, "data"), dataset.get_data(seq_idx, "classes")))
+        seq_idx += 1
+      dataset.finish_epoch()
+      epochs.append(seqs)
+    results.append(epochs)
+  for seqs_ref, seqs in zip(*results):
+    assert_equal(len(seqs), 17)
+    assert_equal(len(seqs_ref), 17)
+    for (tag_ref, data_ref, classes_ref), (tag, data, classes) in zip(seqs_ref, seqs):
+      assert_equal(tag_ref, tag)
+      assert_equal(data_ref.tolist(), data.tolist())
+      assert_equal(classes_ref.tolist(), classes.tolist())
+  assert_true(results[0][0][0][1].tolist() != results[0][1][0][1].tolist())
+
+
+def test_LmDataset_token_corpus_same():
+  import tempfile
+  import shutil
+  import os
+  from LmDataset import LmDataset, TokenCorpusWriter
+  tmp_dir = tempfile.mkdtemp()
+  corpus_file = os.path.join(tmp_dir, "corpus.txt")
+  with open(corpus_file, "w") as f:
+    f.write("hello world\nabc\n</s>\nhallo welt\nworld world\n")
+  symbols_file = os.path.join(tmp_dir, "symbols.txt")
+  with open(symbols_file, "w") as f:
+    f.write("\n".join(["[END]", "[UNKNOWN]", "hello", "world", "hallo", "welt"]) + "\n")
+  opts = dict(
+    orth_symbols_file=symbols_file, word_based=True, error_on_invalid_seq=False, log_skipped_seqs=False)
+  text_dataset = LmDataset(corpus_file=corpus_file, **opts)
+  text_dataset.init_seq_order(epoch=1)
+  tokens_file = os.path.join(tmp_dir, "corpus.tokens")
+  seqs_ref = []
+  with TokenCorpusWriter(tokens_file) as writer:
+    seq_idx = 0
+    while text_dataset.is_less_than_num_seqs(seq_idx):
+      text_dataset.load_seqs(seq_idx, seq_idx + 1)
+      while writer.num_seqs < text_dataset.get_corpus_seq_idx(seq_idx):
+        writer.add_seq([])
+      writer.add_seq(text_dataset.get_data(seq_idx, "data"))
+      seqs_ref.append((text_dataset.get_tag(seq_idx), text_dataset.get_data(seq_idx, "data").tolist()))
+      seq_idx += 1
+    assert_equal(seq_idx, 3)  # "abc" (missing symbol) and "</s>" skipped
+  token_dataset = LmDataset(corpus_file=tokens_file, **opts)
+  assert_equal(token_dataset.get_total_num_seqs(), 5)  # including the skipped (empty) seqs
+  token_dataset.init_seq_order(epoch=1)
+  for seq_idx, (tag_ref, data_ref) in enumerate(seqs_ref):
+    token_dataset.load_seqs(seq_idx, seq_idx + 1)
+    assert_equal(token_dataset.get_tag(seq_idx), tag_ref)
+    assert_equal(token_dataset.get_data(seq_idx, "data").tolist(), data_ref)
+  assert not token_dataset.is_less_than_num_seqs(3)
+  shutil.rmtree(tmp_dir)
+
+
+def test_SeqTagIndex():
+  from MetaDataset import SeqTagIndex
+  tags = ["seq-%i" % i for i in range(20)]
+  index = SeqTagIndex(tags)
+  assert_equal(len(index), 20)
+  assert_equal(index.get_idxs(["seq-3", "seq-17", "seq-0"]).tolist(), [3, 17, 0])
+  assert_equal(index.get_tags([3, 17, 0]), ["seq-3", "seq-17", "seq-0"])
+  assert_equal(index.get_idxs([]).tolist(), [])
+  try:
+    index.get_idxs(["seq-3", "seq-20"])
+  except KeyError:
+    pass
+  else:
+    assert False, "KeyError expected"
+
+
+def test_MetaDataset_num_threads_same():
+  from MetaDataset import MetaDataset
+  from test_HDFDataset import generate_hdf_from_other
+  hdf_a = generate_hdf_from_other({"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 11})
+  hdf_b = generate_hdf_from_other(
+    {"class": "DummyDatasetMultipleSequenceLength", "input_dim": 2, "output_dim": 3, "num_seqs": 11})
+
+  def create(num_threads):
+    """
+    :param int|None num_threads:
+    :rtype: MetaDataset
+    """
+    return MetaDataset(
+      datasets={"a": hdf_a, "b": hdf_b},
+      data_map={"data": ("a", "data"), "classes": ("a", "classes"), "b_data": ("b", "data")},
+      seq_ordering="random", num_threads=num_threads)
+
+  datasets = [create(num_threads=1), create(num_threads=None)]
+  assert_equal(datasets[1].num_threads, 2)
+  seq_list = ["seq-7", "seq-2", "seq-9"]
+  for epoch, epoch_seq_list in [(1, None), (2, seq_list)]:
+    for dataset in datasets:
+      dataset.init_seq_order(epoch=epoch, seq_list=epoch_seq_list)
+      dataset.load_seqs(0, dataset.num_seqs)
+    if epoch_seq_list:
+      assert_equal(datasets[1].num_seqs, len(seq_list))
+    for seq_idx in range(datasets[0].num_seqs):
+      assert_equal(datasets[0].get_tag(seq_idx), datasets[1].get_tag(seq_idx))
+      if epoch_seq_list:
+        assert_equal(datasets[1].get_tag(seq_idx), seq_list[seq_idx])
+      for key in ["data", "classes", "b_data"]:
+        assert_equal(datasets[0].get_data(seq_idx, key).tolist(), datasets[1].get_data(seq_idx, key).tolist())
+
+
+def test_get_seq_order_for_epoch_shards():
+  from Dataset import Dataset
+  num_seqs = 101
+  seq_lens = np.random.RandomState(42).randint(1, 100, size=(num_seqs,))
+  for seq_ordering in ["random", "laplace:.10"]:
+    full_dataset = Dataset(seq_ordering=seq_ordering)
+    full_order = full_dataset.get_seq_order_for_epoch(epoch=3, num_seqs=num_seqs, seq_lens=seq_lens)
+    shard_orders = []
+    for shard_index in range(4):
+      dataset = Dataset(seq_ordering=seq_ordering, num_shards=4, shard_index=shard_index)
+      shard_orders.append(dataset.get_seq_order_for_epoch(epoch=3, num_seqs=num_seqs, seq_lens=seq_lens))
+    assert_equal(sorted(sum(shard_orders, [])), list(range(num_seqs)))
+    for shard_order in shard_orders:
+      assert_equal(shard_order, [i for i in full_order if i in set(shard_order)])  # order is kept
+    shard_num_frames = [sum(seq_lens[shard_order]) for shard_order in shard_orders]
+    assert max(shard_num_frames) - min(shard_num_frames) <= max(seq_lens)
+  # Seq lens not given and not needed for the ordering -> balance num seqs.
+  shard_orders = [
+    Dataset(seq_ordering="random", num_shards=4, shard_index=shard_index).get_seq_order_for_epoch(
+      epoch=3, num_seqs=num_seqs, get_seq_len=lambda i: seq_lens[i])
+    for shard_index in range(4)]
+  assert_equal(sorted(sum(shard_orders, [])), list(range(num_seqs)))
+  assert max(map(len, shard_orders)) - min(map(len, shard_orders)) <= 1
+
+
+def test_generate_batches_bucketed():
+  from GeneratingDataset import TaskNumberBaseConvertDataset
+  dataset_opts = dict(num_seqs=1234, min_input_seq_len=1, max_input_seq_len=20)
+  for bucket_batching, bucket_batching_window in [(4, 500), ([5, 10, 15], None)]:
+    dataset = TaskNumberBaseConvertDataset(**dataset_opts)
+    dataset_bucketed = TaskNumberBaseConvertDataset(
+      bucket_batching=bucket_batching, bucket_batching_window=bucket_batching_window, **dataset_opts)
+    batches = _get_all_batches_from_dataset(dataset, recurrent_net=True, batch_size=100, max_seqs=20)
+    batches_bucketed = _get_all_batches_from_dataset(
+      dataset_bucketed, recurrent_net=True, batch_size=100, max_seqs=20)
+    assert_equal(batches_bucketed, _get_all_batches_from_dataset(
+      dataset_bucketed, recurrent_net=True, batch_size=100, max_seqs=20))  # deterministic
+
+    def get_seq_idxs(batches_):
+      """
+      :param list[(list,dict,int)] batches_:
+      :rtype: list[int]
+      """
+      return sorted([seq[0] for batch in batches_ for seq in batch[0]])
+
+    def get_num_padded_frames(batches_):
+      """
+      :param list[(list,dict,int)] batches_:
+      :rtype: int
+      """
+      return sum([batch[1]["data"] * batch[3] for batch in batches_])
+
+    assert_equal(get_seq_idxs(batches), get_seq_idxs(batches_bucketed))
+    for batch in batches_bucketed:
+      assert batch[3] <= 20 and batch[1]["data"] * batch[3] <= 100
+    assert get_num_padded_frames(batches_bucketed) < get_num_padded_frames(batches)
+
+
+def test_generate_batches_packed():
+  from GeneratingDataset import TaskNumberBaseConvertDataset, StaticDataset
+  dataset_opts = dict(num_seqs=500, min_input_seq_len=1, max_input_seq_len=20)
+  dataset = TaskNumberBaseConvertDataset(**dataset_opts)
+  dataset_packed = TaskNumberBaseConvertDataset(packed_batching=40, **dataset_opts)
+  batches = _get_all_batches_from_dataset(dataset, recurrent_net=True, batch_size=400, max_seqs=20)
+  batches_packed = _get_all_batches_from_dataset(dataset_packed, recurrent_net=True, batch_size=400, max_seqs=20)
+  packed_seq_idxs = [seq[0] for batch in batches_packed for seq in batch[0]]
+  assert_equal(packed_seq_idxs, list(range(500)))  # every seq exactly once, in order
+  assert_equal(sorted([seq[0] for batch in batches for seq in batch[0]]), packed_seq_idxs)
+  for seqs, max_num_frames, _, num_slices in batches_packed:
+    assert num_slices <= 20 and max_num_frames["data"] * num_slices <= 400
+    for key in ["data", "classes"]:
+      row_lens = [0] * num_slices
+      row_num_seqs = [0] * num_slices
+      for seq in seqs:
+        assert_equal(seq[6][key], row_lens[seq[5]])  # consecutive in the row
+        row_lens[seq[5]] += seq[3][key]
+        row_num_seqs[seq[5]] += 1
+      for row_len, row_num_seqs_ in zip(row_lens, row_num_seqs):
+        # A single seq longer than packed_batching gets its own row.
+        assert row_num_seqs_ == 1 or row_len <= 40
+      assert_equal(max(row_lens), max_num_frames[key])
+  assert len(batches_packed) < len(batches)
+
+  # The last seq would fit into the first row (packed_batching), but then the batch would exceed batch_size.
+  dataset = StaticDataset(
+    data=[{"data": np.zeros((n, 1), dtype="float32")} for n in [30, 30, 30, 10]],
+    output_dim={"data": (1, 2)}, packed_batching=40)
+  batches = _get_all_batches_from_dataset(dataset, recurrent_net=True, batch_size=100, max_seqs=20)
+  for seqs, max_num_frames, _, num_slices in batches:
+    assert max_num_frames["data"] * num_slices <= 100
+  assert_equal([[seq[0] for seq in batch[0]] for batch in batches], [[0, 1, 2], [3]])
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
@@ -144,6 +144,106 @@ def test_BytePairEncoding_unicode():
     u"råt råt iz ďër iz ďër ám à@@ n iz ďër ë låk ë k@@ o@@ d áv d@@ r@@ e@@ s w@@ ër yù w@@ ê@@ k dù ďë à@@ s@@ k")
 
 
+def test_BytePairEncoding_cache():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  opts = dict(
+    bpe_file="%s/bpe-unicode-demo.codes" % my_dir,
+    vocab_file="%s/bpe-unicode-demo.vocab" % my_dir,
+    unknown_label="<unk>")
+  sentences = [u"råt iz ďër", u"kod áv dres", u"wër yù wêk", u"kod dres kod"]
+  try:
+    ref_bpe = BytePairEncoding(**opts)
+    ref_seqs = [ref_bpe.get_seq(sentence) for sentence in sentences]
+    bpe = BytePairEncoding(cache_size=3, cache_file="%s/bpe-cache.pkl" % tmp_dir, **opts)
+    assert_equal(bpe.get_seqs(sentences), ref_seqs)
+    assert_equal([bpe.get_seq(sentence) for sentence in sentences], ref_seqs)
+    assert_equal(len(bpe._bpe_encode_cache), 3)
+    assert_equal(list(bpe._bpe_encode_cache.keys()), [u"wêk", u"dres", u"kod"])  # least recently used first
+    bpe.save_cache()
+    bpe2 = BytePairEncoding(cache_size=3, cache_file="%s/bpe-cache.pkl" % tmp_dir, **opts)
+    assert_equal(dict(bpe2._bpe_encode_cache), dict(bpe._bpe_encode_cache))
+    assert_equal([bpe2.get_seq(sentence) for sentence in sentences], ref_seqs)
+    # Only the last instance is stored at exit.
+    assert BytePairEncoding._cache_files_to_save["%s/bpe-cache.pkl" % tmp_dir] is bpe2
+    bpe2.save_cache()  # otherwise it would be saved at exit
+
+    # A changed BPE codes file is parsed again.
+    bpe_file = "%s/bpe.codes" % tmp_dir
+    shutil.copy(opts["bpe_file"], bpe_file)
+    os.utime(bpe_file, (0, 0))
+    bpe3 = BytePairEncoding(bpe_file=bpe_file, vocab_file=opts["vocab_file"], unknown_label="<unk>")
+    assert_equal(bpe3._bpe_codes[("n", "d</w>")], 1)
+    with open(bpe_file, "a") as f:
+      f.write("k o\n")
+    os.utime(bpe_file, (1, 1))
+    bpe3 = BytePairEncoding(bpe_file=bpe_file, vocab_file=opts["vocab_file"], unknown_label="<unk>")
+    assert_equal(bpe3._bpe_codes[("k", "o")], len(bpe3._bpe_codes) - 1)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_OggZipDataset_text_only_seq_index_cache():
+  import tempfile
+  import shutil
+  import zipfile
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    zip_fn = "%s/corpus.zip" % tmp_dir
+    entries = [
+      {"text": "hello world", "duration": 2.3, "seq_name": "seq-0"},
+      {"text": "foo", "duration": 0.7, "seq_name": "seq-1"},
+      {"text": "bar baz", "duration": 1.5, "seq_name": "seq-2"}]
+    with zipfile.ZipFile(zip_fn, "w") as zip_file:
+      zip_file.writestr("corpus.txt", repr(entries))
+    cache_dir = "%s/cache" % tmp_dir
+    tags = []
+    for _ in range(2):  # first time the cache is filled, second time it is used
+      dataset = OggZipDataset(
+        path=zip_fn, audio=None, targets=None, seq_ordering="sorted", seq_index_cache=cache_dir)
+      dataset.init_seq_order(epoch=1)
+      tags.append([dataset.get_tag(i) for i in range(dataset.num_seqs)])
+      assert_equal(len(os.listdir(cache_dir)), 1)
+    assert_equal(tags[0], ["seq-1", "seq-2", "seq-0"])
+    assert_equal(tags[0], tags[1])
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_ExtractAudioFeatures_cache():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    cache_dir = "%s/cache" % tmp_dir
+    rnd = numpy.random.RandomState(42)
+    audios = {"seq-%i" % i: rnd.uniform(-0.5, 0.5, size=(1000 + i * 100,)) for i in range(5)}
+    extractor = ExtractAudioFeatures(features="raw", cache_dir=cache_dir)
+    ref = {tag: extractor.get_audio_features(audio.copy(), sample_rate=16000) for (tag, audio) in audios.items()}
+    for _ in range(2):  # first time the cache is filled, second time it is used
+      for tag, audio in sorted(audios.items()):
+        features = extractor.get_audio_features(audio.copy(), sample_rate=16000, seq_name=tag)
+        assert_equal(features.tolist(), ref[tag].tolist())
+    assert_is_instance(extractor.cache.get("seq-0"), numpy.memmap)
+    # Other options, other cache entries.
+    other_extractor = ExtractAudioFeatures(features="raw", peak_normalization=False, cache_dir=cache_dir)
+    assert other_extractor.cache.get("seq-0") is None
+    other_extractor = ExtractAudioFeatures(features="raw", random_permute=True, cache_dir=cache_dir)
+    assert_false(other_extractor._is_cache_used("seq-0"))
+    # Size limit, least recently used entries are removed.
+    extractor = ExtractAudioFeatures(features="raw", cache_dir=cache_dir, cache_byte_size_limit=25000)
+    for tag in ["seq-0", "seq-3", "seq-4"]:
+      assert extractor.cache.get(tag) is not None
+    extractor.cache.put("seq-x", numpy.zeros((1000, 1), dtype="float32"))
+    for tag in ["seq-1", "seq-2"]:
+      assert extractor.cache.get(tag) is None
+    for tag in ["seq-0", "seq-3", "seq-4", "seq-x"]:
+      assert extractor.cache.get(tag) is not None
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
@@ -316,6 +316,47 @@ def test_SimpleHDFWriter_small():
     print(repr(gzip.compress(open(fn, "rb").read())))
 
 
+def test_SimpleHDFWriter_resume():
+  fn = get_test_tmp_file(suffix=".hdf")
+  os.remove(fn)  # SimpleHDFWriter expects that the file does not exist
+  n_dim = 3
+  seq_lens1 = [2, 3]
+  seq_lens2 = [4, 1, 2]
+  writer = SimpleHDFWriter(filename=fn, dim=n_dim, labels=None, partial_file=True)
+  writer.insert_batch(
+    inputs=numpy.random.normal(size=(len(seq_lens1), max(seq_lens1), n_dim)).astype("float32"),
+    seq_len=seq_lens1,
+    seq_tag=["seq-%i" % i for i in range(len(seq_lens1))])
+  writer._file.close()  # simulate a crash
+  writer._file = None
+  assert not os.path.exists(fn)
+  assert os.path.exists(fn + ".partial")
+
+  writer = SimpleHDFWriter(filename=fn, dim=n_dim, labels=None, resume=True)
+  assert_equal(writer.get_seq_tags(), ["seq-0", "seq-1"])
+  writer.insert_batch(
+    inputs=numpy.random.normal(size=(len(seq_lens2), max(seq_lens2), n_dim)).astype("float32"),
+    seq_len=seq_lens2,
+    seq_tag=["seq-%i" % (i + len(seq_lens1)) for i in range(len(seq_lens2))])
+  writer.close()
+  assert not os.path.exists(fn + ".partial")
+  seq_lens = seq_lens1 + seq_lens2
+
+  dataset = HDFDataset(files=[fn])
+  reader = DatasetTestReader(dataset=dataset)
+  reader.read_all()
+  assert_equal(reader.num_seqs, len(seq_lens))
+  for i, seq_len in enumerate(seq_lens):
+    assert reader.seq_lens[i]["data"] == seq_len
+  assert_equal(reader.seq_tags, ["seq-%i" % i for i in range(reader.num_seqs)])
+
+  dataset = HDFDataset(files=[fn])
+  dataset.seq_tags_exclude = {"seq-1", "seq-3"}
+  reader = DatasetTestReader(dataset=dataset)
+  reader.read_all()
+  assert_equal(reader.seq_tags, ["seq-0", "seq-2", "seq-4"])
+
+
 def test_read_simple_hdf():
   if sys.version_info[0] <= 2:  # gzip.decompress is >=PY3
     raise unittest.SkipTest
@@ -674,6 +715,23 @@ def test_HDFDataset_no_cache_efficiency():
   # TODO... check alloc intervals etc
 
 
+def test_HDFDataset_use_mmap():
+  hdf_fn = generate_hdf_from_other({"class": "TaskNumberBaseConvertDataset", "num_seqs": 5})
+  hdf = HDFDataset(files=[hdf_fn])
+  hdf_mmap = HDFDataset(files=[hdf_fn], use_mmap=True)
+  assert set(hdf_mmap._mmap_data[0].keys()) == {"data", "classes"}
+  hdf_reader = DatasetTestReader(hdf)
+  hdf_mmap_reader = DatasetTestReader(hdf_mmap)
+  hdf_reader.read_all()
+  hdf_mmap_reader.read_all()
+  assert hdf_reader.num_seqs == hdf_mmap_reader.num_seqs == 5
+  for seq_idx in range(5):
+    for key in hdf_reader.data_keys:
+      data = hdf_mmap_reader.data[key][seq_idx]
+      assert isinstance(data, numpy.memmap)  # view, not a copy
+      assert_equal(hdf_reader.data[key][seq_idx].tolist(), data.tolist())
+
+
 def test_siamese_triplet_sampling():
   datasets_path = generate_dummy_hdf(3)
   dataset = SiameseHDFDataset(input_stream_name="features", seq_label_stream="classes", files=datasets_path)
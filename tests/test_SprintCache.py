@@ -0,0 +1,151 @@
+import sys
+sys.path += ["."]  # Python 3 hack
+
+from nose.tools import assert_equal, assert_is_instance, assert_in, assert_not_in, assert_true, assert_false
+from SprintCache import FileArchive, FileInfo
+from struct import pack
+import numpy
+import os
+import tempfile
+import shutil
+import zlib
+import unittest
+import better_exchook
+
+
+def _add_alignment(archive, filename, records, num_frames, compress=False):
+  """
+  :param FileArchive archive:
+  :param str filename:
+  :param list[(int,list[int])] records: (n, mixes) RLE records, see FileArchive._decode_rle_alignment
+  :param int num_frames:
+  :param bool compress:
+  """
+  content = pack("I", len("flow-alignment")) + b"flow-alignment" + pack("i", 0) + b"ALIGNRLE" + pack("I", num_frames)
+  for n, mixes in records:
+    content += pack("b", n) + b"".join([pack("i", mix) for mix in mixes])
+  archive.write_U32(archive.start_recovery_tag)
+  archive.write_u32(len(filename))
+  archive.write_str(filename)
+  pos = archive.f.tell()
+  archive.write_u32(len(content))
+  if compress:
+    compressed = zlib.compress(content)
+    archive.write_u32(len(compressed))
+    archive.write_u32(0)
+    archive.f.write(compressed)
+  else:
+    archive.write_u32(0)
+    archive.write_u32(0)
+    archive.f.write(content)
+  archive.ft[filename] = FileInfo(filename, pos, len(content), 0, len(archive.ft))
+  archive.write_U32(archive.end_recovery_tag)
+
+
+def test_FileArchive_feat():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    fn = "%s/feat.cache" % tmp_dir
+    rnd = numpy.random.RandomState(42)
+    feats = rnd.normal(size=(13, 5)).astype("float32")
+    times = numpy.array([(i * 0.01, (i + 1) * 0.01) for i in range(13)])
+    archive = FileArchive(fn, must_exists=False)
+    archive.add_feature_cache("corpus/seq-0", feats, times)
+    archive.finalize()
+    del archive
+    archive = FileArchive(fn)
+    times_, feats_ = archive.read("corpus/seq-0", "feat")
+    assert_is_instance(feats_, numpy.ndarray)
+    assert_equal(feats_.shape, (13, 5))
+    assert_equal(times_.shape, (13, 2))
+    assert_equal(feats_.tolist(), feats.tolist())
+    assert_equal(times_.tolist(), times.tolist())
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_FileArchive_align():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    fn = "%s/align.cache" % tmp_dir
+    allophone_fn = "%s/allophones" % tmp_dir
+    with open(allophone_fn, "w") as f:
+      f.write("# allophones\na\nb\nc\n")
+    records = [(-3, [1 + (1 << 26)]), (2, [2, 0 + (2 << 26)]), (0, [10]), (-2, [1])]
+    archive = FileArchive(fn, must_exists=False)
+    _add_alignment(archive, "corpus/seq-0", records=records, num_frames=7)
+    _add_alignment(archive, "corpus/seq-1", records=records, num_frames=7, compress=True)
+    archive.finalize()
+    del archive
+    for use_mmap in [False, True]:
+      archive = FileArchive(fn, use_mmap=use_mmap)
+      archive.set_allophones(allophone_fn)
+      for seq_name in ["corpus/seq-0", "corpus/seq-1"]:
+        align = archive.read(seq_name, "align")
+        assert_is_instance(align, numpy.ndarray)
+        assert_equal(
+          align.tolist(),
+          [[0, 1, 1], [1, 1, 1], [2, 1, 1], [3, 2, 0], [4, 0, 2], [10, 1, 0], [11, 1, 0]])
+        align_raw = archive.read(seq_name, "align_raw")
+        assert_equal(align_raw[:, 1].tolist(), [1 + (1 << 26)] * 3 + [2, 2 << 26, 1, 1])
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_FileArchiveBundle_mmap_index_cache():
+  from SprintCache import open_file_archive
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    rnd = numpy.random.RandomState(42)
+    feats = {}
+    archive_fns = []
+    for i in range(5):
+      fn = "%s/feat.cache.%i" % (tmp_dir, i)
+      archive = FileArchive(fn, must_exists=False)
+      for j in range(3):
+        seq_name = "corpus/seq-%i-%i" % (i, j)
+        feats[seq_name] = rnd.normal(size=(7 + j, 4)).astype("float32")
+        archive.add_feature_cache(seq_name, feats[seq_name], [(t * 0.01, (t + 1) * 0.01) for t in range(7 + j)])
+      archive.finalize()
+      del archive
+      archive_fns.append(fn)
+    bundle_fn = "%s/feat.bundle" % tmp_dir
+    with open(bundle_fn, "w") as f:
+      f.write("".join(["%s\n" % fn for fn in archive_fns]))
+    index_cache_dir = "%s/index" % tmp_dir
+    for _ in range(2):  # first time the index is created, second time it is used
+      bundle = open_file_archive(bundle_fn, use_mmap=True, index_cache_dir=index_cache_dir)
+      assert_equal(sorted([fn for fn in bundle.file_list() if not fn.endswith(".attribs")]), sorted(feats.keys()))
+      for seq_name, feat in sorted(feats.items()):
+        times, feat_ = bundle.read(seq_name, "feat")
+        assert_equal(feat_.tolist(), feat.tolist())
+      assert_equal(len(os.listdir(index_cache_dir)), len(archive_fns))
+    archive = FileArchive(archive_fns[0], use_mmap=True)
+    assert_true(archive._load_index(archive._get_index_filename(index_cache_dir)))
+    os.utime(archive_fns[0], (0, 0))
+    assert_false(archive._load_index(archive._get_index_filename(index_cache_dir)))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
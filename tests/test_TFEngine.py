@@ -19,7 +19,7 @@ from TFEngine import *
 import TFUtil
 from TFNetwork import ExternData
 from Config import Config
-from nose.tools import assert_equal, assert_is_instance
+from nose.tools import assert_equal, assert_is_instance, assert_raises
 import unittest
 import numpy
 import numpy.testing
@@ -153,6 +153,92 @@ def test_FeedDictDataProvider():
   assert_equal(classes.tolist(), [[1, 2, 0, 1, 2]])
 
 
+def test_FeedDictDataProvider_num_threads():
+  from GeneratingDataset import Task12AXDataset
+  from TFDataPipeline import FeedDictDataProvider
+  dataset = Task12AXDataset(num_seqs=50)
+  extern_data = ExternData()
+  extern_data.init_from_dataset(dataset)
+  results = []
+  for num_threads in [1, 3]:
+    dataset.init_seq_order(epoch=1)
+    batches = dataset.generate_batches(recurrent_net=True, batch_size=100, max_seqs=4)
+    data_provider = FeedDictDataProvider(
+      tf_session=session, extern_data=extern_data,
+      data_keys=["data", "classes"],
+      dataset=dataset, batches=batches, capacity=2, num_threads=num_threads)
+    data_provider.start_threads(session)
+    res = []
+    while data_provider.have_more_data(session):
+      feed_dict, meta = data_provider.get_feed_dict()
+      # The buffers get reused, thus copy.
+      res.append((
+        feed_dict[extern_data.data["data"].placeholder].copy(),
+        feed_dict[extern_data.data["classes"].size_placeholder[0]].copy(),
+        list(meta["seq_idx"])))
+    assert data_provider.have_reached_end()
+    data_provider.stop_threads()
+    results.append(res)
+  assert_equal(len(results[0]), len(results[1]))
+  assert len(results[0]) > 5
+  for (data1, size1, seq_idx1), (data2, size2, seq_idx2) in zip(*results):
+    assert_equal(seq_idx1, seq_idx2)
+    assert_equal(size1.tolist(), size2.tolist())
+    assert_equal(data1.tolist(), data2.tolist())
+
+
+def test_FeedDictDataProvider_num_threads_CachedDataset():
+  from GeneratingDataset import Task12AXDataset
+  from HDFDataset import HDFDataset, HDFDatasetWriter
+  from TFDataPipeline import FeedDictDataProvider
+  hdf_fn = _get_tmp_file(suffix=".hdf")
+  hdf_writer = HDFDatasetWriter(hdf_fn)
+  hdf_writer.dump_from_dataset(Task12AXDataset(num_seqs=50))
+  hdf_writer.close()
+  ref_dataset = HDFDataset(files=[hdf_fn], cache_byte_size=0)
+  ref_dataset.initialize()
+  ref_dataset.init_seq_order(epoch=1)
+  ref_dataset.load_seqs(0, ref_dataset.num_seqs)
+  ref_data = [ref_dataset.get_data(seq_idx, "data").copy() for seq_idx in range(ref_dataset.num_seqs)]
+  for num_threads in [1, 3]:
+    # Small cache, such that the seqs get evicted and reloaded while the batches are assembled.
+    dataset = HDFDataset(files=[hdf_fn], cache_byte_size=2000)
+    dataset.initialize()
+    assert dataset.cache_byte_size_limit_at_start > 0
+    dataset.init_seq_order(epoch=1)
+    extern_data = ExternData()
+    extern_data.init_from_dataset(dataset)
+    # The dataset returns views into its cache, which must be copied while holding the lock with multiple threads.
+    data_provider = FeedDictDataProvider(
+      tf_session=session, extern_data=extern_data,
+      data_keys=["data", "classes"],
+      dataset=dataset, batches=dataset.generate_batches(recurrent_net=True, batch_size=100, max_seqs=4),
+      num_threads=num_threads)
+    _, _, fetched_seqs = data_provider._fetch_next_batch(consider_batch_slice=False)
+    for _, _, seq_data in fetched_seqs:
+      shares_cache = any(
+        numpy.shares_memory(seq_data["data"], alloc_data) for _, _, alloc_data in dataset.alloc_intervals)
+      assert_equal(shares_cache, num_threads == 1)
+    batches = dataset.generate_batches(recurrent_net=True, batch_size=100, max_seqs=4)
+    data_provider = FeedDictDataProvider(
+      tf_session=session, extern_data=extern_data,
+      data_keys=["data", "classes"],
+      dataset=dataset, batches=batches, capacity=2, num_threads=num_threads)
+    data_provider.start_threads(session)
+    covered_seqs = []
+    while data_provider.have_more_data(session):
+      feed_dict, meta = data_provider.get_feed_dict()
+      data = feed_dict[extern_data.data["data"].placeholder]
+      data_size = feed_dict[extern_data.data["data"].size_placeholder[0]]
+      for i, seq_idx in enumerate(meta["seq_idx"]):
+        assert_equal(data_size[i], len(ref_data[seq_idx]))
+        numpy.testing.assert_array_equal(data[i, :data_size[i]], ref_data[seq_idx])
+        covered_seqs.append(seq_idx)
+    assert data_provider.have_reached_end()
+    data_provider.stop_threads()
+    assert_equal(sorted(covered_seqs), list(range(ref_dataset.num_seqs)))
+
+
 def test_DatasetDataProvider():
   from GeneratingDataset import DummyDataset
   seq_len = 5
@@ -247,6 +333,177 @@ def test_engine_train():
   engine.finalize()
 
 
+def test_engine_train_log_step_timings():
+  from GeneratingDataset import DummyDataset
+  import json
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  tmp_dir = _get_tmp_dir()
+  config = Config()
+  config.update({
+    "model": "%s/model" % tmp_dir,
+    "tf_log_dir": "%s/tf-log" % tmp_dir,
+    "log_step_timings": True,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "batch_size": 10,
+    "max_seqs": 2,
+    "start_epoch": 1,
+    "num_epochs": 1
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+  engine.train()
+  engine.finalize()
+
+  log_dirs = os.listdir("%s/tf-log" % tmp_dir)
+  assert_equal(len(log_dirs), 1)
+  with open("%s/tf-log/%s/step_timings.jsonl" % (tmp_dir, log_dirs[0])) as f:
+    lines = [json.loads(line) for line in f.read().splitlines()]
+  pprint(lines)
+  assert_equal([info["step"] for info in lines], [0, 1])
+  for info in lines:
+    for key in ["data_wait", "feed_build", "session_run", "fetch_handling", "seqs_per_sec", "frames_per_sec"]:
+      assert info[key] >= 0
+    assert_equal(info["num_seqs"], 1)  # not a recurrent net, thus the seqs are concatenated
+    assert_equal(info["num_frames"], 10)
+    assert_equal(info["queue_capacity"], 10)
+
+
+def test_engine_train_save_model_async():
+  from GeneratingDataset import DummyDataset
+  import glob
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  tmp_dir = _get_tmp_dir()
+  config = Config()
+  config.update({
+    "model": "%s/model" % tmp_dir,
+    "save_model_async": True,
+    "save_model_async_max_in_flight": 2,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "start_epoch": 1,
+    "num_epochs": 3
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+  engine.train()
+  params = engine.network.get_params_serialized(engine.tf_session)
+  assert_equal(sorted(engine.get_existing_models(config).keys()), [1, 2, 3])
+  assert not glob.glob("%s/*.tmp-async-save*" % tmp_dir)
+  engine.load_model(epoch=3)
+  params_loaded = engine.network.get_params_serialized(engine.tf_session)
+  for param_name, value in params.values_dict["output"].items():
+    numpy.testing.assert_array_equal(value, params_loaded.values_dict["output"][param_name])
+  engine.finalize()
+
+
+def test_engine_train_save_model_async_failure():
+  from GeneratingDataset import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "save_model_async": True,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "start_epoch": 1,
+    "num_epochs": 2
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+
+  def failing_write(**kwargs):
+    raise IOError("failing_write: %r" % kwargs["filename"])
+
+  engine._get_async_checkpoint_saver()._write = failing_write
+  # Training must not end successfully without the models.
+  assert_raises(Exception, engine.train)
+  assert_equal(engine.get_existing_models(config), {})
+  assert_raises(Exception, engine.finalize)
+  assert not engine.tf_session
+
+
+def test_engine_graph_cache_pretrain():
+  from GeneratingDataset import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "graph_cache_size": 2,
+    "reinit_network_each_epoch": True,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {
+      "hidden": {"class": "linear", "activation": "tanh", "n_out": 7},
+      "output": {"class": "softmax", "loss": "ce", "from": "hidden"}},
+    "start_epoch": 1,
+    "num_epochs": 3
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+  network = engine.network
+  engine.train()
+  # reinit_network_each_epoch with the same net dict, thus we should have used the cached graph.
+  assert engine.network is network
+  assert TFCompat.v1.get_default_graph() is engine.tf_session.graph
+  params = engine.network.get_params_serialized(engine.tf_session)
+  engine.load_model(epoch=3)
+  params_loaded = engine.network.get_params_serialized(engine.tf_session)
+  for param_name, value in params.values_dict["output"].items():
+    numpy.testing.assert_array_equal(value, params_loaded.values_dict["output"][param_name])
+
+  # A different net dict must not use the cached graph.
+  net_dict = dict(network.layers_desc)
+  net_dict["hidden2"] = {"class": "linear", "activation": "tanh", "n_out": 7, "from": "hidden"}
+  net_dict["output"] = dict(net_dict["output"], **{"from": "hidden2"})
+  engine.init_new_network(net_dict)
+  assert engine.network is not network
+  assert "hidden2" in engine.network.layers
+  engine.finalize()
+
+
+def test_engine_load_params_num_threads_mmap():
+  from GeneratingDataset import DummyDataset
+  train_data = DummyDataset(input_dim=2, output_dim=3, num_seqs=4, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  config = Config()
+  config.update({
+    "model": "%s/model" % _get_tmp_dir(),
+    "load_params_num_threads": 2,
+    "load_params_mmap": True,
+    "num_outputs": 3,
+    "num_inputs": 2,
+    "network": {
+      "hidden": {"class": "linear", "activation": "tanh", "n_out": 7},
+      "output": {"class": "softmax", "loss": "ce", "from": "hidden"}},
+    "start_epoch": 1,
+    "num_epochs": 1
+  })
+  _cleanup_old_models(config)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+  engine.train()
+  params = engine.network.get_params_serialized(engine.tf_session)
+  engine.network.initialize_params(engine.tf_session)  # reset
+  engine.load_model(epoch=1)
+  params_loaded = engine.network.get_params_serialized(engine.tf_session)
+  for layer_name in ["hidden", "output"]:
+    for param_name, value in params.values_dict[layer_name].items():
+      numpy.testing.assert_array_equal(value, params_loaded.values_dict[layer_name][param_name])
+  engine.finalize()
+
+
 def test_engine_train_new_dataset_pipeline():
   from GeneratingDataset import DummyDataset
   seq_len = 5
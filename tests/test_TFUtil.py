@@ -2381,6 +2381,54 @@ def test_kenlm_bpe():
   print("Scores are as expected.")
 
 
+def test_kenlm_score_next():
+  import TFKenLM
+  if not TFKenLM.kenlm_checked_out():
+    raise unittest.SkipTest("KenLM not checked out")
+  input_tokens = [
+    "be@@ yond imm@@ edi@@ ate conc@@ erns </s>".split(),
+    "beyond immediate concerns </s>".split(),
+    "be@@ yond <unk> be@@ yond".split()]
+  max_len = max([len(tokens) for tokens in input_tokens])
+  test_lm_file = TFKenLM.kenlm_dir + "/lm/test.arpa"
+  assert os.path.exists(test_lm_file)
+  labels = sorted(set(sum(input_tokens, [])))
+  lm_tf = TFKenLM.ken_lm_load(filename=test_lm_file)
+  input_strings_tf = TFCompat.v1.placeholder(tf.string, [None])
+  ref_scores_tf, ref_dense_scores_tf = TFKenLM.ken_lm_abs_score_bpe_strings_dense(
+    handle=lm_tf, strings=input_strings_tf, bpe_merge_symbol="@@", labels=labels)
+  ref_scores_sparse_tf = TFKenLM.ken_lm_abs_score_bpe_strings(
+    handle=lm_tf, strings=input_strings_tf, bpe_merge_symbol="@@")
+  states_tf = TFCompat.v1.placeholder(tf.string, [None])
+  pending_tf = TFCompat.v1.placeholder(tf.string, [None])
+  committed_tf = TFCompat.v1.placeholder(tf.float32, [None])
+  tokens_tf = TFCompat.v1.placeholder(tf.string, [None])
+  next_tf = TFKenLM.ken_lm_score_next(
+    handle=lm_tf, bpe_merge_symbol="@@",
+    states=states_tf, pending=pending_tf, committed_scores=committed_tf, tokens=tokens_tf)
+  next_dense_tf = TFKenLM.ken_lm_score_next_dense(
+    handle=lm_tf, bpe_merge_symbol="@@",
+    states=next_tf[0], pending=next_tf[1], committed_scores=next_tf[2], labels=labels)
+  with TFCompat.v1.Session() as session:
+    states, pending, committed = session.run(TFKenLM.ken_lm_initial_state([len(input_tokens)]))
+    strings = [""] * len(input_tokens)
+    for t in range(max_len):
+      tokens = [(seq[t] + " ") if t < len(seq) else "" for seq in input_tokens]
+      strings = [s + token for (s, token) in zip(strings, tokens)]
+      (states, pending, committed, scores), (scores_dense_abs, scores_dense) = session.run(
+        (next_tf, next_dense_tf),
+        feed_dict={states_tf: states, pending_tf: pending, committed_tf: committed, tokens_tf: tokens})
+      ref_scores, ref_scores_dense_abs, ref_scores_dense = session.run(
+        (ref_scores_sparse_tf, ref_scores_tf, ref_dense_scores_tf), feed_dict={input_strings_tf: strings})
+      print("step %i, strings %r, pending %r, scores %r" % (t, strings, pending, scores))
+      assert_equal(scores.tolist(), ref_scores.tolist())
+      assert_equal(scores_dense_abs.tolist(), ref_scores_dense_abs.tolist())
+      assert_equal(scores_dense.tolist(), ref_scores_dense.tolist())
+  assert_almost_equal(scores[0], -9.251298)  # example from above
+  assert_equal(scores[0], scores[1])
+  print("Scores are as expected.")
+
+
 def test_openfst():
   import TFOpenFst
   if not TFOpenFst.openfst_checked_out():
@@ -3363,6 +3411,74 @@ def test_get_rnnt_linear_aligned_output():
     [[1, 2]])
 
 
+def test_RunMetadataStatsByScope():
+  from TFNetwork import TFNetwork, ExternData
+  from TFUpdater import Updater
+  from Config import Config
+  with tf.Graph().as_default() as graph:
+    with TFCompat.v1.Session(graph=graph) as session_:
+      extern_data = ExternData({"data": {"dim": 5}, "classes": {"dim": 3, "sparse": True}})
+      network = TFNetwork(extern_data=extern_data, train_flag=True)
+      network.construct_from_dict({
+        "layer1": {"class": "linear", "activation": "tanh", "n_out": 7},
+        "output": {"class": "softmax", "loss": "ce", "target": "classes", "from": "layer1"}})
+      network.initialize_params(session=session_)
+      updater = Updater(config=Config(), network=network)
+      updater.set_learning_rate(0.1, session=session_)
+      updater.set_trainable_vars(network.get_trainable_params())
+      updater.init_optimizer_vars(session=session_)
+      optim_op = updater.get_optim_op()
+      stats = RunMetadataStatsByScope(scopes=network.get_layer_name_scopes())
+      # The gradients are created by the updater, e.g. in "optimize/gradients/...".
+      grad_ops = [op for op in graph.get_operations() if "/gradients/layer1/" in "/" + op.name]
+      assert grad_ops
+      for op in grad_ops:
+        assert_equal(stats.get_name_for_node_name(op.name), ("layer1", True))
+      assert_equal(stats.get_name_for_node_name("layer1/linear/MatMul:MatMul"), ("layer1", False))
+      assert_equal(stats.get_name_for_node_name("_SOURCE"), ("<other>", False))
+      rnd = numpy.random.RandomState(42)
+      feed_dict = {
+        extern_data.data["data"].placeholder: rnd.normal(size=(2, 11, 5)),
+        extern_data.data["data"].size_placeholder[0]: [11, 7],
+        extern_data.data["classes"].placeholder: rnd.randint(0, 3, size=(2, 11)),
+        extern_data.data["classes"].size_placeholder[0]: [11, 7]}
+      for _ in range(2):
+        run_metadata = TFCompat.v1.RunMetadata()
+        session_.run(
+          optim_op, feed_dict=feed_dict,
+          options=TFCompat.v1.RunOptions(trace_level=TFCompat.v1.RunOptions.FULL_TRACE), run_metadata=run_metadata)
+        stats.add_run_metadata(run_metadata)
+  assert_equal(stats.num_steps, 2)
+  assert_in("layer1", stats.time_micros)
+  assert_in("layer1", stats.grad_time_micros)
+  assert_in("output", stats.grad_time_micros)
+  stats.dump(prefix="  ")
+
+
+def test_CheckpointMmapReader():
+  import tempfile
+  tmp_dir = tempfile.mkdtemp("tmp-checkpoint")
+  with tf.Graph().as_default() as graph:
+    with TFCompat.v1.Session(graph=graph) as sess:
+      v1 = tf.Variable(numpy.arange(12, dtype="float32").reshape((3, 4)), name="v1")
+      v2 = tf.Variable(numpy.array([1, -2, 3], dtype="int64"), name="scope/v2")
+      v3 = tf.Variable(2.5, dtype=tf.float64, name="v3")
+      sess.run(TFCompat.v1.global_variables_initializer())
+      saver = TFCompat.v1.train.Saver(var_list=[v1, v2, v3])
+      saver.save(sess=sess, save_path=tmp_dir + "/model")
+      var_values = sess.run({"v1": v1, "scope/v2": v2, "v3": v3})
+      reader = CheckpointMmapReader(tmp_dir + "/model")
+      reader_tf = TFCompat.v1.train.NewCheckpointReader(tmp_dir + "/model")
+      assert_equal(reader.get_variable_to_shape_map(), reader_tf.get_variable_to_shape_map())
+      for name, value in var_values.items():
+        value_mmap = reader.get_tensor(name)
+        assert_equal(value_mmap.dtype, value.dtype)
+        numpy.testing.assert_array_equal(value_mmap, value)
+        numpy.testing.assert_array_equal(value_mmap, reader_tf.get_tensor(name))
+      assign_vars([(v1, reader.get_tensor("v1") * 2), (v2, reader.get_tensor("scope/v2"))], session=sess)
+      numpy.testing.assert_array_equal(sess.run(v1), var_values["v1"] * 2)
+
+
 if __name__ == "__main__":
   try:
     better_exchook.install()
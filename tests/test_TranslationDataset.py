@@ -18,7 +18,7 @@ sys.path += ["."]  # Python 3 hack
 sys.path += [os.path.dirname(os.path.abspath(__file__)) + "/.."]
 
 import better_exchook
-from LmDataset import TranslationDataset, TranslationFactorsDataset
+from LmDataset import TranslationDataset, TranslationFactorsDataset, TokenCorpus, TokenCorpusWriter
 from Util import init_thread_join_hack
 
 better_exchook.install()
@@ -116,6 +116,46 @@ def test_translation_dataset():
   shutil.rmtree(dummy_dataset)
 
 
+def test_translation_dataset_token_corpus():
+  """
+  Converts the text files to token corpora, and checks that we get the same data via the token corpora.
+  """
+  dummy_dataset = tempfile.mkdtemp()
+  with open(os.path.join(dummy_dataset, "source.test"), "wb") as source_file:
+    source_file.write(dummy_source_text.encode("utf-8"))
+  with open(os.path.join(dummy_dataset, "target.test"), "wb") as target_file:
+    target_file.write(dummy_target_text.encode("utf-8"))
+  for prefix, text in [("source", dummy_source_text), ("target", dummy_target_text)]:
+    vocabulary, _ = create_vocabulary(text + " </S>")
+    with open(os.path.join(dummy_dataset, "%s.vocab.pkl" % prefix), "wb") as vocabulary_file:
+      pickle.dump(vocabulary, vocabulary_file)
+
+  opts = dict(path=dummy_dataset, file_postfix="test", source_postfix=" </S>", target_postfix=" </S>")
+  text_dataset = TranslationDataset(**opts)
+  text_dataset.init_seq_order(epoch=1)
+  text_dataset.load_seqs(0, 10)
+  num_seqs = len(dummy_source_text.splitlines())
+  assert_equal(text_dataset.num_seqs, num_seqs)
+  for prefix, key in [("source", "data"), ("target", "classes")]:
+    with TokenCorpusWriter(os.path.join(dummy_dataset, "%s.test.tokens" % prefix)) as writer:
+      for seq_idx in range(num_seqs):
+        writer.add_seq(text_dataset.get_data(seq_idx, key))
+  os.remove(os.path.join(dummy_dataset, "source.test"))  # make sure that we do not read it anymore
+
+  token_dataset = TranslationDataset(**opts)
+  assert token_dataset._token_corpora
+  assert isinstance(token_dataset._token_corpora["source"], TokenCorpus)
+  token_dataset.init_seq_order(epoch=1)
+  token_dataset.load_seqs(0, 10)
+  assert_equal(token_dataset.num_seqs, num_seqs)
+  for seq_idx in range(num_seqs):
+    assert_equal(token_dataset.get_tag(seq_idx), text_dataset.get_tag(seq_idx))
+    for key in ["data", "classes"]:
+      assert_equal(token_dataset.get_data(seq_idx, key).tolist(), text_dataset.get_data(seq_idx, key).tolist())
+
+  shutil.rmtree(dummy_dataset)
+
+
 num_source_factors = 2
 dummy_source_text_factor_0 = ("This is some example text.\n"
                               "The factors here have no meaning\n")
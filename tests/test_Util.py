@@ -284,6 +284,129 @@ def test_CollectionReadCheckCovered():
   assert x and x.truth_value
 
 
+def test_RequestBatcher():
+  batch_sizes = []
+
+  def process_batch(batch):
+    batch_sizes.append(len(batch))
+    time.sleep(0.01)
+    return [x * 2 for x in batch]
+
+  batcher = RequestBatcher(process_batch=process_batch, max_batch_seqs=4, max_batch_frames=10, max_wait_time=0.5)
+  requests = [batcher.add_request(i, num_frames=2) for i in range(10)]
+  assert_equal([request.wait() for request in requests], [i * 2 for i in range(10)])
+  # Limited by max_batch_seqs, and the rest after max_wait_time.
+  assert_equal(batch_sizes, [4, 4, 2])
+  requests = [batcher.add_request(i, num_frames=3) for i in range(4)]
+  assert_equal([request.wait() for request in requests], [i * 2 for i in range(4)])
+  # Limited by max_batch_frames.
+  assert_equal(batch_sizes[3:], [3, 1])
+  stats = batcher.get_stats()
+  assert_equal(stats["num_requests"], 14)
+  assert_equal(stats["num_batches"], 5)
+  assert_equal(stats["num_pending_requests"], 0)
+  assert 0 < stats["latency_p50"] <= stats["latency_p99"] <= stats["latency_max"]
+  batcher.stop()
+
+
+def test_RequestBatcher_threads_exception():
+  def process_batch(batch):
+    if -1 in batch:
+      raise ValueError("invalid")
+    return batch
+
+  batcher = RequestBatcher(process_batch=process_batch, max_batch_seqs=100, max_wait_time=0.1)
+  results = {}
+
+  def request(x):
+    try:
+      results[x] = batcher(x)
+    except ValueError as exc:
+      results[x] = exc
+
+  threads = [threading.Thread(target=request, args=(x,)) for x in range(-1, 5)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  batcher.stop()
+  assert_equal(sorted(results.keys()), list(range(-1, 5)))
+  if isinstance(results[0], ValueError):  # all in the same batch as -1
+    assert_equal(batcher.num_failed_requests, 6)
+  assert_true(isinstance(results[-1], ValueError))
+  assert_equal(batcher.num_requests, 6)
+
+
+def test_RequestBatcher_cancel_queue_full():
+  processing = threading.Event()
+  cont = threading.Event()
+
+  def process_batch(batch):
+    processing.set()
+    cont.wait()
+    return batch
+
+  batcher = RequestBatcher(process_batch=process_batch, max_batch_seqs=1, max_queue_size=2)
+  first = batcher.add_request(0)
+  processing.wait()  # first is being processed now, i.e. not in the queue anymore
+  requests = [batcher.add_request(i) for i in range(1, 3)]
+  assert_raises(RequestQueueFullException, lambda: batcher.add_request(3))
+  assert_true(batcher.cancel(requests[0]))
+  assert_true(not batcher.cancel(first))
+  assert_raises(RequestCancelledException, requests[0].wait)
+  done = []
+  requests[1].add_done_callback(done.append)
+  cont.set()
+  assert_equal(first.wait(), 0)
+  assert_equal(requests[1].wait(), 2)
+  assert_equal(done, [requests[1]])
+  batcher.stop()
+  stats = batcher.get_stats()
+  assert_equal(stats["num_cancelled_requests"], 1)
+  assert_equal(stats["num_rejected_requests"], 1)
+
+
+def test_RequestBatcher_num_threads():
+  lock = threading.Lock()
+  active = [0, 0]  # current, max
+
+  def process_batch(batch):
+    with lock:
+      active[0] += 1
+      active[1] = max(active)
+    time.sleep(0.05)
+    with lock:
+      active[0] -= 1
+    return batch
+
+  batcher = RequestBatcher(process_batch=process_batch, max_batch_seqs=1, num_threads=3)
+  requests = [batcher.add_request(i) for i in range(6)]
+  assert_equal([request.wait() for request in requests], list(range(6)))
+  batcher.stop()
+  assert_true(1 <= active[1] <= 3, "max num active: %r" % active[1])  # exact value depends on timing
+
+
+def test_AsyncTaskQueue():
+  results = []
+  queue = AsyncTaskQueue(name="test", max_queue_size=2)
+  for i in range(10):
+    queue.add(lambda i=i: results.append(i))
+  queue.wait()
+  assert_equal(results, list(range(10)))
+
+  cont = threading.Event()
+
+  def fail():
+    cont.wait()  # such that the next task is added before the failure, and add() does not raise
+    raise ValueError("test fail")
+
+  queue.add(fail)
+  queue.add(lambda: results.append(10))  # skipped after the failure
+  cont.set()
+  assert_raises(Exception, queue.close)
+  assert_equal(results, list(range(10)))
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
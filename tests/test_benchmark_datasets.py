@@ -0,0 +1,73 @@
+
+import sys
+sys.path += ["."]  # Python 3 hack
+sys.path += ["tools"]
+
+from benchmark_datasets import *
+from nose.tools import assert_equal, assert_greater
+import tempfile
+import shutil
+import unittest
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+from Log import log
+from Util import BackendEngine
+
+
+log.initialize()
+BackendEngine.select_engine(engine=BackendEngine.TensorFlow)
+
+
+def test_benchmark_datasets():
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    fixtures = create_fixtures(tmp_dir, num_seqs=11, avg_seq_len=10)
+    results = run_benchmarks(fixtures)
+    assert_equal(list(results.keys()), list(Benchmarks.keys()))
+    for name, stats in results.items():
+      if "skipped" in stats:
+        print("%s skipped: %s" % (name, stats["skipped"]))
+        continue
+      print("%s: %r" % (name, stats))
+      assert_equal(stats["num_seqs"], 22 if name == "CombinedDataset" else 11)
+      assert_greater(stats["num_frames"], 0)
+      assert_greater(stats["seqs_per_sec"], 0)
+      assert_greater(stats["peak_rss"], 0)
+    assert_equal(results["LmDataset"]["num_seqs"], 11)
+    assert_equal(results["TranslationDataset"]["num_seqs"], 11)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_compare_results():
+  base = {"HDFDataset": {"seqs_per_sec": 100., "frames_per_sec": 1000., "time_to_first_batch": 1., "peak_rss": 1000}}
+  assert_equal(compare_results(base, base), [])
+  results = {
+    "HDFDataset": {"seqs_per_sec": 80., "frames_per_sec": 1050., "time_to_first_batch": 1.5, "peak_rss": 1000},
+    "OggZipDataset": {"skipped": "missing modules soundfile"}}
+  assert_equal(
+    [(name, key) for (name, key, _) in compare_results(base, results)],
+    [("HDFDataset", "seqs_per_sec"), ("HDFDataset", "time_to_first_batch")])
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
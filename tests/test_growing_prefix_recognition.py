@@ -0,0 +1,113 @@
+
+import logging
+logging.getLogger('tensorflow').disabled = True
+
+import sys
+sys.path += ["."]  # Python 3 hack
+sys.path += ["tools"]
+
+from growing_prefix_recognition import *
+from Config import Config
+from nose.tools import assert_equal, assert_less_equal
+import numpy
+import unittest
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+from Log import log
+from Util import BackendEngine
+
+
+log.initialize(verbosity=[5])
+BackendEngine.select_engine(engine=BackendEngine.TensorFlow)
+
+
+def _make_config(causal_encoder=False, end_label=0):
+  """
+  :param bool causal_encoder: if True, the decoder only gets the encoder output of the first frame,
+    i.e. it does not change when more input comes in
+  :param int end_label: the hyp ends when this label is chosen. -1 means that it never ends (only max_seq_len)
+  :rtype: Config
+  """
+  config = Config()
+  config.update({
+    "num_inputs": 3,
+    "num_outputs": 5,
+    "network": {
+      "encoder": {"class": "linear", "activation": "tanh", "n_out": 8, "from": "data"},
+      "enc_first": {"class": "slice", "axis": "T", "slice_end": 1, "from": "encoder"},
+      "enc_mean": {
+        "class": "reduce", "mode": "mean", "axis": "T", "from": "enc_first" if causal_encoder else "encoder"},
+      "output": {
+        "class": "rec", "from": [], "max_seq_len": 10, "target": "classes",
+        "unit": {
+          "embed": {"class": "linear", "activation": None, "n_out": 4, "from": "output"},
+          "s": {"class": "linear", "activation": "tanh", "n_out": 8, "from": ["prev:embed", "base:enc_mean"]},
+          "prob": {"class": "softmax", "from": "s", "target": "classes"},
+          "output": {"class": "choice", "beam_size": 3, "from": "prob", "target": "classes", "initial_output": 0},
+          "end": {"class": "compare", "from": "output", "value": end_label}}},
+      "decision": {"class": "decide", "from": "output", "target": "classes"}
+    }
+  })
+  return config
+
+
+def test_GrowingPrefixRecognizer_chunks_same_as_full():
+  # The decoder does not depend on the future input, and the hyps never end before max_seq_len,
+  # thus the decoder steps done after the intermediate chunks must be the same as with the full input.
+  recognizer = GrowingPrefixRecognizer(
+    config=_make_config(causal_encoder=True, end_label=-1), beam_size=3, min_frames_per_label=2)
+  features = numpy.random.RandomState(42).normal(size=(20, 3)).astype("float32")
+  full_hyp = recognizer.feed(features, final=True)
+  print("full:", full_hyp)
+  assert_equal(len(full_hyp), 10)
+  recognizer.reset()
+  hyp = None
+  for t in range(0, 20, 5):
+    hyp = recognizer.feed(features[t:t + 5], final=t + 5 >= 20)
+    print("frames %i: %r" % (t + 5, hyp))
+    if t + 5 < 20:
+      assert_equal(recognizer.num_steps, (t + 5) // 2)
+      assert_equal(len(hyp), recognizer.num_steps)  # labels are emitted before the input is final
+  print("chunked:", hyp)
+  assert_equal(hyp, full_hyp)
+  recognizer.close()
+
+
+def test_GrowingPrefixRecognizer_partial_hyps():
+  recognizer = GrowingPrefixRecognizer(config=_make_config(), beam_size=3, min_frames_per_label=2)
+  features = numpy.random.RandomState(43).normal(size=(20, 3)).astype("float32")
+  for t in range(0, 20, 4):
+    hyp = recognizer.feed(features[t:t + 4], final=t + 4 >= 20)
+    print("frames %i: %r" % (t + 4, hyp))
+    assert_equal(recognizer.num_frames, t + 4)
+    assert_less_equal(recognizer.num_steps, 10)
+    if t + 4 < 20:
+      assert_less_equal(recognizer.num_steps, (t + 4) // 2)
+      assert not recognizer.ended[0]
+  hyps = recognizer.get_hypotheses()
+  assert_equal(hyps[0][1], recognizer.get_best_hypothesis())
+  assert_equal([score for (score, _) in hyps], sorted([score for (score, _) in hyps], reverse=True))
+  recognizer.close()
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks how fast various dataset classes can produce batches.
+The datasets read synthetic fixtures which are created in some local temp dir (deterministic, via a fixed seed),
+thus the results are comparable across commits, and data-path regressions can be caught.
+
+For every dataset, it measures seqs/sec, frames/sec (of the "data" key), time to first batch
+(including the dataset initialization) and the peak RSS of the process.
+By default, every benchmark runs in its own subprocess, such that the peak RSS is meaningful.
+
+Example::
+
+  tools/benchmark_datasets.py --out base.json
+  ... (some change) ...
+  tools/benchmark_datasets.py --compare base.json
+
+See also analyze-dataset-batches.py and dump-dataset.py.
+"""
+
+from __future__ import print_function, division
+
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import tempfile
+import shutil
+from collections import OrderedDict
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path.insert(0, returnn_dir)
+
+import better_exchook
+from Log import log
+import Util
+from Util import BackendEngine
+
+
+# Benchmark name -> modules which are required, besides the standard RETURNN dependencies.
+Benchmarks = OrderedDict([
+  ("HDFDataset", ["h5py"]),
+  ("OggZipDataset", ["soundfile"]),
+  ("ExtractAudioFeatures", ["soundfile", "librosa"]),
+  ("LmDataset", []),
+  ("TranslationDataset", []),
+  ("MetaDataset", ["h5py"]),
+  ("CombinedDataset", ["h5py"]),
+])
+
+# Keys of the results which are compared (see compare_results), and whether higher is better.
+ComparedKeys = OrderedDict([
+  ("seqs_per_sec", True),
+  ("frames_per_sec", True),
+  ("time_to_first_batch", False),
+  ("peak_rss", False),
+])
+
+_Words = [
+  "the", "a", "of", "to", "and", "in", "is", "it", "that", "for", "speech", "recognition", "model", "network",
+  "data", "set", "batch", "sequence", "frame", "feature", "audio", "text", "word", "label", "train", "test"]
+
+
+def _get_missing_modules(names):
+  """
+  :param list[str] names:
+  :return: subset of names which cannot be imported
+  :rtype: list[str]
+  """
+  import importlib
+  missing = []
+  for name in names:
+    try:
+      importlib.import_module(name)
+    except ImportError:
+      missing.append(name)
+  return missing
+
+
+def _get_peak_rss():
+  """
+  :return: peak resident set size of this process, in bytes
+  :rtype: int
+  """
+  import resource
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform != "darwin":
+    peak_rss *= 1024  # kilobytes on Linux
+  return peak_rss
+
+
+def _write_wav(filename, audio, sample_rate):
+  """
+  :param str filename:
+  :param numpy.ndarray audio: float in [-1,1], shape (time,)
+  :param int sample_rate:
+  """
+  import numpy
+  import wave
+  f = wave.open(filename, "wb")
+  f.setnchannels(1)
+  f.setsampwidth(2)
+  f.setframerate(sample_rate)
+  f.writeframes((audio * (2 ** 15 - 1)).astype("int16").tobytes())
+  f.close()
+
+
+def create_fixtures(path, num_seqs=100, avg_seq_len=100, seed=42):
+  """
+  Creates all the files needed by the benchmarks.
+  Only the fixtures for which the required modules are available are created.
+
+  :param str path: existing directory
+  :param int num_seqs:
+  :param int avg_seq_len: avg num frames of the "data" key for feature-based datasets
+  :param int seed:
+  :return: benchmark name -> dataset opts (see :func:`Dataset.init_dataset`)
+  :rtype: dict[str,dict[str]]
+  """
+  import numpy
+  import pickle
+  rnd = numpy.random.RandomState(seed)
+  seq_tags = ["seq-%i" % i for i in range(num_seqs)]
+  seq_lens = rnd.randint(avg_seq_len // 2, avg_seq_len * 3 // 2 + 1, size=(num_seqs,))
+  texts = [
+    " ".join([_Words[i] for i in rnd.randint(0, len(_Words), size=(rnd.randint(5, 30),))])
+    for _ in range(num_seqs)]
+  words = _Words + ["[END]", "[UNKNOWN]"]
+  vocab = {word: i for (i, word) in enumerate(words)}
+  vocab_filename = "%s/vocab.pkl" % path
+  with open(vocab_filename, "wb") as f:
+    pickle.dump(vocab, f)
+  fixtures = OrderedDict()
+
+  if not _get_missing_modules(["h5py"]):
+    from HDFDataset import SimpleHDFWriter
+    hdf_filename = "%s/data.hdf" % path
+    writer = SimpleHDFWriter(filename=hdf_filename, dim=40)
+    for seq_tag, seq_len in zip(seq_tags, seq_lens):
+      writer.insert_batch(
+        inputs=rnd.normal(size=(1, seq_len, 40)).astype("float32"), seq_len=[seq_len], seq_tag=[seq_tag],
+        extra={"classes": rnd.randint(0, 100, size=(1, seq_len)).astype("int32")})
+    writer.close()
+    fixtures["HDFDataset"] = {"class": "HDFDataset", "files": [hdf_filename]}
+    fixtures["MetaDataset"] = {
+      "class": "MetaDataset",
+      "datasets": {"features": fixtures["HDFDataset"], "alignment": fixtures["HDFDataset"]},
+      "data_map": {"data": ("features", "data"), "classes": ("alignment", "classes")},
+      "seq_order_control_dataset": "features"}
+
+  if not _get_missing_modules(["soundfile"]):
+    import zipfile
+    sample_rate = 16000
+    name = "audio"
+    zip_filename = "%s/%s.zip" % (path, name)
+    zip_file = zipfile.ZipFile(zip_filename, "w")
+    meta = []
+    for seq_tag, seq_len, text in zip(seq_tags, seq_lens, texts):
+      # Audio length such that we get seq_len frames with the default 10ms window shift.
+      audio = rnd.uniform(-0.5, 0.5, size=(seq_len * sample_rate // 100,))
+      wav_filename = "%s/%s.wav" % (path, seq_tag)
+      _write_wav(wav_filename, audio, sample_rate=sample_rate)
+      zip_file.write(wav_filename, arcname="%s/%s.wav" % (name, seq_tag))
+      os.remove(wav_filename)
+      meta.append({"text": text, "duration": seq_len / 100., "file": "%s.wav" % seq_tag, "seq_name": seq_tag})
+    zip_file.writestr("%s.txt" % name, repr(meta))
+    zip_file.close()
+    targets = {"vocab_file": vocab_filename, "unknown_label": "[UNKNOWN]"}
+    fixtures["OggZipDataset"] = {
+      "class": "OggZipDataset", "path": zip_filename, "audio": {"features": "raw"}, "targets": targets}
+    fixtures["ExtractAudioFeatures"] = {
+      "class": "OggZipDataset", "path": zip_filename, "audio": {"features": "mfcc"}, "targets": targets}
+
+  lm_corpus_filename = "%s/lm.txt" % path
+  with open(lm_corpus_filename, "w") as f:
+    f.write("".join(["%s\n" % text for text in texts]))
+  lm_symbols_filename = "%s/lm.symbols" % path
+  with open(lm_symbols_filename, "w") as f:
+    f.write("".join(["%s %i\n" % (word, i) for (i, word) in enumerate(words)]))
+  fixtures["LmDataset"] = {
+    "class": "LmDataset", "corpus_file": lm_corpus_filename, "orth_symbols_map_file": lm_symbols_filename,
+    "word_based": True}
+
+  translation_path = "%s/translation" % path
+  os.mkdir(translation_path)
+  for prefix in ["source", "target"]:
+    with open("%s/%s.train" % (translation_path, prefix), "w") as f:
+      # Target is just the reversed source, that is enough for the benchmark.
+      f.write("".join(["%s\n" % (text if prefix == "source" else " ".join(text.split()[::-1])) for text in texts]))
+    with open("%s/%s.vocab.pkl" % (translation_path, prefix), "wb") as f:
+      pickle.dump(vocab, f)
+  fixtures["TranslationDataset"] = {
+    "class": "TranslationDataset", "path": translation_path, "file_postfix": "train", "target_postfix": " [END]",
+    "unknown_label": "[UNKNOWN]"}
+
+  if "HDFDataset" in fixtures:
+    fixtures["CombinedDataset"] = {
+      "class": "CombinedDataset",
+      "datasets": {"hdf": fixtures["HDFDataset"], "translation": fixtures["TranslationDataset"]},
+      "data_map": {
+        ("hdf", "data"): "data", ("hdf", "classes"): "classes",
+        ("translation", "data"): "source_text", ("translation", "classes"): "target_text"},
+      "seq_ordering": "random_dataset"}
+
+  return fixtures
+
+
+def benchmark_dataset(dataset_opts, batch_size=5000, max_seqs=20, epoch=1, data_key="data"):
+  """
+  Goes through one epoch of the dataset, like the :class:`TFDataPipeline.FeedDictDataProvider`,
+  i.e. generates the batches, loads the seqs and gets the data for all keys of every seq.
+
+  :param dict[str] dataset_opts: see :func:`Dataset.init_dataset`
+  :param int batch_size:
+  :param int max_seqs:
+  :param int epoch:
+  :param str data_key: the frames of this data key are counted
+  :return: stats, with keys "num_seqs", "num_frames", "num_batches", "elapsed", "time_to_first_batch",
+    "seqs_per_sec", "frames_per_sec", "peak_rss"
+  :rtype: dict[str,int|float]
+  """
+  from Dataset import init_dataset
+  start_time = time.time()
+  dataset = init_dataset(dataset_opts)
+  dataset.init_seq_order(epoch=epoch)
+  data_keys = dataset.get_data_keys()
+  batches = dataset.generate_batches(
+    recurrent_net=True, batch_size=batch_size, max_seqs=max_seqs, used_data_keys=data_keys)
+  num_seqs = num_frames = num_batches = 0
+  time_to_first_batch = None
+  while batches.has_more():
+    batch, = batches.peek_next_n(1)
+    dataset.load_seqs(batch.start_seq, batch.end_seq)
+    for seq in batch.seqs:
+      for key in data_keys:
+        data = dataset.get_data(seq.seq_idx, key)
+        if key == data_key:
+          num_frames += data.shape[0] if data.ndim >= 1 else 1
+    num_seqs += len(batch.seqs)
+    num_batches += 1
+    if time_to_first_batch is None:
+      time_to_first_batch = time.time() - start_time
+    batches.advance(1)
+  dataset.finish_epoch()
+  elapsed = time.time() - start_time
+  return {
+    "num_seqs": num_seqs,
+    "num_frames": num_frames,
+    "num_batches": num_batches,
+    "elapsed": elapsed,
+    "time_to_first_batch": time_to_first_batch if time_to_first_batch is not None else elapsed,
+    "seqs_per_sec": (num_seqs / elapsed) if elapsed > 0 else 0.0,
+    "frames_per_sec": (num_frames / elapsed) if elapsed > 0 else 0.0,
+    "peak_rss": _get_peak_rss()}
+
+
+def _load_fixtures(path):
+  """
+  :param str path: dir with fixtures.txt, see :func:`create_fixtures`
+  :return: benchmark name -> dataset opts. this is a Python dict literal, because the data maps have tuples as keys
+  :rtype: dict[str,dict[str]]
+  """
+  with open("%s/fixtures.txt" % path) as f:
+    return eval(f.read())
+
+
+def _run_benchmark_in_subprocess(name, fixtures_path, options):
+  """
+  :param str name: benchmark name
+  :param str fixtures_path: where we can find fixtures.txt
+  :param argparse.Namespace options:
+  :return: stats, see :func:`benchmark_dataset`
+  :rtype: dict[str,int|float]
+  """
+  out = subprocess.check_output([
+    sys.executable, os.path.abspath(__file__),
+    "--run_single", name, "--fixtures", fixtures_path,
+    "--batch_size", str(options.batch_size), "--max_seqs", str(options.max_seqs)])
+  return json.loads(out.decode("utf8").splitlines()[-1])
+
+
+def run_benchmarks(fixtures, names=None, repeat=1, use_subprocess=False, options=None, fixtures_path=None):
+  """
+  :param dict[str,dict[str]] fixtures: see :func:`create_fixtures`
+  :param list[str]|None names: benchmark names. by default all
+  :param int repeat: every benchmark is run this often, and the run with the best throughput is taken
+  :param bool use_subprocess: if True, run every benchmark in its own subprocess (then the peak RSS is meaningful)
+  :param argparse.Namespace|None options: for the subprocess
+  :param str|None fixtures_path: for the subprocess
+  :return: benchmark name -> stats. skipped benchmarks have the key "skipped" with the reason
+  :rtype: dict[str,dict[str]]
+  """
+  results = OrderedDict()
+  for name, requirements in Benchmarks.items():
+    if names and name not in names:
+      continue
+    missing = _get_missing_modules(requirements)
+    if missing or name not in fixtures:
+      print("%s: skipped, missing modules %s" % (name, ", ".join(missing)), file=log.v2)
+      results[name] = {"skipped": "missing modules %s" % ", ".join(missing)}
+      continue
+    best = None
+    for _ in range(repeat):
+      if use_subprocess:
+        stats = _run_benchmark_in_subprocess(name, fixtures_path=fixtures_path, options=options)
+      else:
+        kwargs = {}
+        if options:
+          kwargs.update({"batch_size": options.batch_size, "max_seqs": options.max_seqs})
+        stats = benchmark_dataset(fixtures[name], **kwargs)
+      if best is None or stats["seqs_per_sec"] > best["seqs_per_sec"]:
+        best = stats
+    print("%s: %.1f seqs/sec, %.1f frames/sec, time to first batch %.3f sec, peak RSS %s" % (
+      name, best["seqs_per_sec"], best["frames_per_sec"], best["time_to_first_batch"],
+      Util.human_bytes_size(best["peak_rss"])), file=log.v2)
+    results[name] = best
+  return results
+
+
+def compare_results(base_results, results, threshold=0.1):
+  """
+  :param dict[str,dict[str]] base_results: benchmark name -> stats, e.g. from an earlier commit
+  :param dict[str,dict[str]] results: benchmark name -> stats
+  :param float threshold: relative change which counts as regression
+  :return: list of regressions, as (benchmark name, key, relative change)
+  :rtype: list[(str,str,float)]
+  """
+  regressions = []
+  for name, stats in results.items():
+    base_stats = base_results.get(name)
+    if not base_stats or "skipped" in base_stats or "skipped" in stats:
+      continue
+    info = []
+    for key, higher_is_better in ComparedKeys.items():
+      if not base_stats.get(key):
+        continue
+      rel_change = (stats[key] - base_stats[key]) / base_stats[key]
+      info.append("%s %+.1f%%" % (key, rel_change * 100.))
+      if (-rel_change if higher_is_better else rel_change) > threshold:
+        regressions.append((name, key, rel_change))
+    print("%s: %s" % (name, ", ".join(info)), file=log.v2)
+  return regressions
+
+
+def main():
+  """
+  Main entry.
+  """
+  argparser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  argparser.add_argument("--datasets", nargs="*", help="benchmark names (default: all): %s" % ", ".join(Benchmarks))
+  argparser.add_argument("--num_seqs", type=int, default=500)
+  argparser.add_argument("--avg_seq_len", type=int, default=200)
+  argparser.add_argument("--batch_size", type=int, default=5000)
+  argparser.add_argument("--max_seqs", type=int, default=20)
+  argparser.add_argument("--repeat", type=int, default=3, help="takes the best run")
+  argparser.add_argument("--no_subprocess", action="store_true", help="peak RSS is then accumulated")
+  argparser.add_argument("--fixtures", help="dir for the fixtures. by default a new temp dir")
+  argparser.add_argument("--out", help="write results to this JSON file")
+  argparser.add_argument("--compare", help="compare to results from this JSON file. exit code 1 on regressions")
+  argparser.add_argument("--regression_threshold", type=float, default=0.1)
+  argparser.add_argument("--run_single", help=argparse.SUPPRESS)  # internal, for the subprocess
+  argparser.add_argument("--verbosity", type=int, default=2)
+  args = argparser.parse_args()
+  log.initialize(verbosity=[args.verbosity if not args.run_single else 0])
+  BackendEngine.select_engine(engine=BackendEngine.TensorFlow)  # for the dtypes of the datasets
+
+  if args.run_single:
+    fixtures = _load_fixtures(args.fixtures)
+    stats = benchmark_dataset(fixtures[args.run_single], batch_size=args.batch_size, max_seqs=args.max_seqs)
+    print(json.dumps(stats))
+    return
+
+  fixtures_path = args.fixtures
+  remove_fixtures = False
+  if not fixtures_path:
+    fixtures_path = tempfile.mkdtemp(prefix="returnn-benchmark-datasets-")
+    remove_fixtures = True
+  try:
+    if not os.path.exists("%s/fixtures.txt" % fixtures_path):
+      if not os.path.exists(fixtures_path):
+        os.makedirs(fixtures_path)
+      print("Create fixtures in %s." % fixtures_path, file=log.v2)
+      fixtures = create_fixtures(fixtures_path, num_seqs=args.num_seqs, avg_seq_len=args.avg_seq_len)
+      with open("%s/fixtures.txt" % fixtures_path, "w") as f:
+        f.write(repr(dict(fixtures)))
+    fixtures = _load_fixtures(fixtures_path)
+    results = run_benchmarks(
+      fixtures, names=args.datasets, repeat=args.repeat, use_subprocess=not args.no_subprocess,
+      options=args, fixtures_path=fixtures_path)
+  finally:
+    if remove_fixtures:
+      shutil.rmtree(fixtures_path)
+
+  if args.out:
+    with open(args.out, "w") as f:
+      json.dump({
+        "returnn_version": Util.describe_returnn_version(),
+        "settings": {
+          key: getattr(args, key) for key in ["num_seqs", "avg_seq_len", "batch_size", "max_seqs", "repeat"]},
+        "results": results}, f, indent=2, sort_keys=True)
+    print("Wrote results to %s." % args.out, file=log.v2)
+  if args.compare:
+    base = json.load(open(args.compare))
+    print("Compare to %s (%s):" % (args.compare, base.get("returnn_version")), file=log.v2)
+    regressions = compare_results(base["results"], results, threshold=args.regression_threshold)
+    if regressions:
+      print("Regressions:", file=log.v1)
+      for name, key, rel_change in regressions:
+        print("  %s %s: %+.1f%%" % (name, key, rel_change * 100.), file=log.v1)
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  better_exchook.install()
+  main()
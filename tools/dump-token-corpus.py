@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+Converts the sparse data of some dataset (e.g. :class:`LmDataset` or :class:`TranslationDataset` on text files)
+into a binary pre-tokenized corpus (:class:`LmDataset.TokenCorpus`), which can then be used directly
+as ``corpus_file`` of :class:`LmDataset`, or is picked up by :class:`TranslationDataset`
+(``<path>/source.<file_postfix>.tokens`` for key "data", ``<path>/target.<file_postfix>.tokens`` for key "classes").
+
+The seqs are stored by their corpus seq idx. Seqs which are skipped by the dataset are stored as empty seqs.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path.insert(0, returnn_dir)
+
+import rnn
+from Log import log
+import argparse
+from Util import Stats, hms
+from Dataset import Dataset, init_dataset
+from LmDataset import TokenCorpusWriter
+import Util
+
+
+def dump_token_corpus(dataset, key, writer):
+  """
+  :param Dataset dataset: with default seq ordering, initialized for some epoch
+  :param str key: data key, e.g. "data" or "classes"
+  :param TokenCorpusWriter writer:
+  """
+  assert dataset.is_data_sparse(key), "%s: data key %r is not sparse" % (dataset, key)
+  start_time = time.time()
+  seq_len_stats = Stats()
+  interactive = Util.is_tty() and not log.verbose[5]
+  print("Iterating over %r." % dataset, file=log.v2)
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    corpus_seq_idx = dataset.get_corpus_seq_idx(seq_idx) if dataset.have_corpus_seq_idx() else seq_idx
+    assert corpus_seq_idx >= writer.num_seqs, "%s: expected default seq ordering" % dataset
+    while writer.num_seqs < corpus_seq_idx:
+      writer.add_seq([])  # skipped by the dataset
+    data = dataset.get_data(seq_idx, key)
+    writer.add_seq(data)
+    seq_len_stats.collect([len(data)])
+    if interactive:
+      Util.progress_bar_with_time(dataset.get_complete_frac(seq_idx), prefix="%i" % seq_idx)
+    elif log.verbose[5]:
+      print("seq %i, tag %r, len %i" % (seq_idx, dataset.get_tag(seq_idx), len(data)))
+    seq_idx += 1
+  try:
+    total_num_seqs = dataset.get_total_num_seqs()
+  except NotImplementedError:
+    total_num_seqs = writer.num_seqs
+  while writer.num_seqs < total_num_seqs:
+    writer.add_seq([])
+  print("Done. Num seqs %i, stored %i, num tokens %i. Total time %s." % (
+    seq_idx, writer.num_seqs, writer.num_tokens, hms(time.time() - start_time)), file=log.v1)
+  seq_len_stats.dump(stream_prefix="Seq-length %r " % (key,), stream=log.v2)
+
+
+def init(config_filename, log_verbosity):
+  """
+  :param str|None config_filename: filename to config-file
+  :param int log_verbosity:
+  """
+  rnn.init_better_exchook()
+  rnn.init_thread_join_hack()
+  if config_filename:
+    print("Using config file %r." % config_filename)
+    assert os.path.exists(config_filename)
+  rnn.init_config(config_filename=config_filename, command_line_options=[])
+  global config
+  config = rnn.config
+  config.set("task", "dump")
+  config.set("log", None)
+  config.set("log_verbosity", log_verbosity)
+  rnn.init_log()
+  print("Returnn dump-token-corpus starting up.", file=log.v1)
+  rnn.returnn_greeting()
+  rnn.init_faulthandler()
+
+
+def main(argv):
+  """
+  Main entry.
+  """
+  argparser = argparse.ArgumentParser(description='Dump sparse data of a dataset as binary token corpus.')
+  argparser.add_argument('--config', help="filename to config-file. will use dataset 'train' from it")
+  argparser.add_argument("--dataset", help="dataset, overwriting config")
+  argparser.add_argument("--key", default="data", help="data-key, e.g. 'data' or 'classes'. (default: 'data')")
+  argparser.add_argument("--verbosity", default=4, type=int, help="5 for all seqs (default: 4)")
+  argparser.add_argument("--out", required=True, help="out-file, by convention ending with '.tokens'")
+  args = argparser.parse_args(argv[1:])
+  assert args.config or args.dataset
+
+  init(config_filename=args.config, log_verbosity=args.verbosity)
+  dataset = init_dataset(
+    args.dataset or config.opt_typed_value("train"), extra_kwargs={"seq_ordering": "default", "partition_epoch": 1})
+  dataset.init_seq_order(epoch=1)
+
+  try:
+    with TokenCorpusWriter(args.out) as writer:
+      dump_token_corpus(dataset=dataset, key=args.key, writer=writer)
+    print("Done. Wrote to %r." % args.out)
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
+  finally:
+    rnn.finalize()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
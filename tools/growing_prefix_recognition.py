@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+"""
+Recognition with a :class:`RecLayer` decoder on a growing input prefix.
+The input (features, or raw audio) is fed in chunks, and after every chunk,
+the features and the encoder are recomputed on the whole input prefix so far,
+and we get the current best (partial) hypothesis.
+This is not real streaming: an utterance with n chunks costs O(n^2) feature and encoder time.
+Only the decoder is incremental, i.e. it continues from its previous state on the new encoder output.
+This works for any encoder (also bidirectional ones), as in general, neither the encoder
+nor the feature extraction (e.g. with peak normalization, deltas or mean/variance normalization)
+can be computed incrementally.
+Thus the chunks should not be too small, and the utterances should not be too long.
+
+This uses the same state var logic as ``compile_tf_graph.py --rec_step_by_step``
+(see :class:`RecStepByStepLayer`), but within the same process, and the beam search is done in Python.
+All the state (encoder output, decoder state, choices) is kept in TF variables between the calls.
+Note that decoder state which depends on the encoder length (e.g. accumulated attention weights)
+is not supported by this.
+
+Example::
+
+  tools/growing_prefix_recognition.py config --dataset dev --chunk_len 50
+
+"""
+
+from __future__ import print_function
+
+import typing
+import os
+import sys
+import time
+import argparse
+import numpy
+import tensorflow as tf
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path.insert(0, returnn_dir)
+sys.path.insert(0, my_dir)
+
+import rnn
+from Log import log
+from Config import Config
+import Util
+import TFCompat
+from compile_tf_graph import RecStepByStepLayer
+
+
+class GrowingPrefixRecognizer:
+  """
+  Keeps the state of a single utterance.
+  Use :func:`feed` for every new chunk of input, and :func:`reset` to start a new utterance.
+  """
+
+  def __init__(self, config, rec_layer_name="output", beam_size=12, model_filename=None,
+               min_frames_per_label=0, audio_feature_opts=None, sample_rate=16000):
+    """
+    :param Config config: with "network"
+    :param str rec_layer_name: the decoder
+    :param int beam_size:
+    :param str|None model_filename: checkpoint. if not given, random init
+    :param int min_frames_per_label: before the input is final, the decoder does not do more steps
+      than input frames / min_frames_per_label. 0 means no such restriction.
+    :param dict[str]|None audio_feature_opts: if given, we are fed with raw audio,
+      and use :class:`GeneratingDataset.ExtractAudioFeatures` with these options
+    :param int sample_rate: for the raw audio
+    """
+    from TFEngine import Engine
+    from TFNetworkRecLayer import RecLayer
+    self.beam_size = beam_size
+    self.min_frames_per_label = min_frames_per_label
+    self.sample_rate = sample_rate
+    self.audio_feature_extractor = None
+    if audio_feature_opts is not None:
+      from GeneratingDataset import ExtractAudioFeatures
+      self.audio_feature_extractor = ExtractAudioFeatures(**audio_feature_opts)
+    net_dict = Util.deepcopy(config.typed_value("network"))
+    RecStepByStepLayer.prepare_compile(rec_layer_name=rec_layer_name, net_dict=net_dict)
+    self.graph = tf.Graph()
+    with self.graph.as_default():
+      TFCompat.v1.set_random_seed(42)
+      self.network, _ = Engine.create_network(
+        config=config, rnd_seed=1, train_flag=False, eval_flag=False, search_flag=False, net_dict=net_dict)
+      self.rec_layer = self.network.layers[rec_layer_name]  # type: RecStepByStepLayer
+      assert isinstance(self.rec_layer, RecStepByStepLayer)
+      self.input_data = self.network.extern_data.get_default_input_data()
+      assert self.input_data.batch_dim_axis == 0 and self.input_data.time_dim_axis == 1
+      self._build_ops()
+      self.session = TFCompat.v1.Session(graph=self.graph)
+      self.network.initialize_params(session=self.session)
+      if model_filename:
+        self.network.load_params_from_file(model_filename, session=self.session)
+      else:
+        print("GrowingPrefixRecognizer: no model filename given, using random init", file=log.v2)
+    self.stochastic_var_order = list(self.rec_layer.stochastic_var_order)
+    if "output" in self.stochastic_var_order:
+      self.output_stochastic_var = "output"
+    else:
+      self.output_stochastic_var = self.stochastic_var_order[-1]
+    self.input_chunks = []  # type: typing.List[numpy.ndarray]
+    self.num_frames = 0
+    self.num_steps = 0
+    self.finished = False
+    self.beam_scores = None  # type: typing.Optional[numpy.ndarray]  # (beam,)
+    self.ended = None  # type: typing.Optional[numpy.ndarray]  # (beam,), bool
+    self.hyps = None  # type: typing.Optional[typing.Dict[str,typing.List[typing.List[int]]]]  # var -> beam -> seq
+
+  def _build_ops(self):
+    """
+    Like :func:`RecStepByStepLayer.post_compile`, but we separate the base (encoder) and the decoder state vars.
+    """
+    state_vars = self.rec_layer.state_vars
+    base_vars = [v for (name, v) in sorted(state_vars.items()) if name.startswith("base_")]
+    decoder_vars = [
+      v for (name, v) in sorted(state_vars.items())
+      if not name.startswith("base_") and not name.startswith("stochastic_var_")]
+    self._decoder_vars = decoder_vars
+    self._tile_repetitions = TFCompat.v1.placeholder(name="tile_batch_repetitions", shape=(), dtype=tf.int32)
+    self._src_beams = TFCompat.v1.placeholder(name="src_beams", shape=(None, None), dtype=tf.int32)
+    with tf.name_scope("growing_prefix_recognition"):
+      self._init_op = tf.group(*[v.init_op() for v in base_vars + decoder_vars], name="init_op")
+      self._init_base_op = tf.group(*[v.init_op() for v in base_vars], name="init_base_op")
+      self._tile_op = tf.group(
+        *[v.tile_batch_op(self._tile_repetitions) for v in base_vars + decoder_vars], name="tile_batch_op")
+      self._tile_base_op = tf.group(
+        *[v.tile_batch_op(self._tile_repetitions) for v in base_vars], name="tile_batch_base_op")
+      self._select_src_beams_op = tf.group(
+        *[v.select_src_beams_op(src_beams=self._src_beams) for v in decoder_vars], name="select_src_beams_op")
+      self._next_step_op = tf.group(*[v.final_op() for v in decoder_vars], name="next_step_op")
+      self._cond = state_vars["cond"].final_value
+      self._end_flag_var = state_vars["end_flag"].var if "end_flag" in state_vars else None
+      # To undo a decoder step.
+      self._decoder_state_placeholders = {}  # type: typing.Dict[str,tf.Tensor]
+      decoder_state_assign_ops = []
+      for v in decoder_vars:
+        placeholder = TFCompat.v1.placeholder(
+          name="set_%s" % v.name, dtype=v.var.dtype.base_dtype, shape=v.var_data_shape.batch_shape)
+        self._decoder_state_placeholders[v.name] = placeholder
+        decoder_state_assign_ops.append(TFCompat.v1.assign(v.var, placeholder, validate_shape=False).op)
+      self._set_decoder_state_op = tf.group(*decoder_state_assign_ops, name="set_decoder_state_op")
+      self._stochastic_vars = {}  # type: typing.Dict[str,typing.Dict[str,typing.Union[tf.Tensor,tf.Operation]]]
+      for name in self.rec_layer.stochastic_var_order:
+        scores_var = state_vars["stochastic_var_scores_%s" % name]
+        choice_var = state_vars["stochastic_var_choice_%s" % name]
+        choice_placeholder = TFCompat.v1.placeholder(
+          name="choice_%s" % name, dtype=choice_var.var.dtype.base_dtype, shape=(None,))
+        self._stochastic_vars[name] = {
+          "calc_scores_op": scores_var.final_op(),
+          "scores": scores_var.var,
+          "choice_placeholder": choice_placeholder,
+          "set_choice_op": TFCompat.v1.assign(choice_var.var, choice_placeholder, validate_shape=False).op}
+
+  def reset(self):
+    """
+    Starts a new utterance.
+    """
+    self.input_chunks = []
+    self.num_frames = 0
+    self.num_steps = 0
+    self.finished = False
+    self.beam_scores = None
+    self.ended = None
+    self.hyps = None
+
+  def close(self):
+    """
+    Closes the session.
+    """
+    self.session.close()
+
+  def _get_features(self):
+    """
+    :return: features of all the input so far, (time,dim)
+    :rtype: numpy.ndarray
+    """
+    if not self.audio_feature_extractor:
+      return numpy.concatenate(self.input_chunks, axis=0)
+    audio = numpy.concatenate(self.input_chunks, axis=0)
+    window_len = int(self.audio_feature_extractor.window_len * self.sample_rate)
+    if len(audio) < window_len:
+      return audio[:0]  # not enough for a single frame
+    return self.audio_feature_extractor.get_audio_features(audio=audio, sample_rate=self.sample_rate)
+
+  def feed(self, chunk, final=False):
+    """
+    Note that this recomputes the features and the encoder on all the input so far (see the module docstring),
+    and only the decoder continues from its current state.
+
+    :param numpy.ndarray chunk: features (time,dim), or raw audio (time,) if audio_feature_opts were given
+    :param bool final: whether this is the last chunk of the utterance
+    :return: current best hypothesis (of the output stochastic var, usually "output"), label indices
+    :rtype: list[int]
+    """
+    assert not self.finished, "call reset() first"
+    self.input_chunks.append(chunk)
+    features = self._get_features()
+    if len(features) == 0 and not final:
+      return self.get_best_hypothesis()
+    feed_dict = {
+      self.input_data.placeholder: features[None, ...],
+      self.input_data.size_placeholder[0]: [len(features)]}
+    if self.beam_scores is None:
+      # Batch dim 1 for the init, and then tile it to the beam size.
+      # Only the first hyp is active in the beginning.
+      self.session.run(self._init_op, feed_dict=feed_dict)
+      self.session.run(self._tile_op, feed_dict={self._tile_repetitions: self.beam_size})
+      self.beam_scores = numpy.array([0.] + [-1e30] * (self.beam_size - 1), dtype="float32")
+      self.ended = numpy.zeros((self.beam_size,), dtype="bool")
+      self.hyps = {name: [[] for _ in range(self.beam_size)] for name in self.stochastic_var_order}
+    else:
+      self.session.run(self._init_base_op, feed_dict=feed_dict)
+      self.session.run(self._tile_base_op, feed_dict={self._tile_repetitions: self.beam_size})
+    self.num_frames = len(features)
+    self.finished = final
+    self._decode()
+    return self.get_best_hypothesis()
+
+  def _decode(self):
+    """
+    Does decoder steps as far as possible with the current input.
+    """
+    while not self.ended.all():
+      if not self.finished and self.min_frames_per_label:
+        if self.num_frames < (self.num_steps + 1) * self.min_frames_per_label:
+          break
+      if not self.session.run(self._cond):
+        break
+      if not self._decode_step():
+        break
+
+  def _decode_step(self):
+    """
+    A single decoder step, i.e. a choice for every stochastic var, and then the update of the decoder state.
+    If the input is not final yet, and the best hyp would end in this step, we undo the step,
+    because the end of the input is not known yet.
+
+    :return: whether we did the step
+    :rtype: bool
+    """
+    prev_state = None
+    if not self.finished:
+      prev_state = self.session.run({v.name: v.var for v in self._decoder_vars})
+    beam_scores = self.beam_scores
+    ended = self.ended
+    hyps = {name: list(seqs) for (name, seqs) in self.hyps.items()}
+    for name in self.stochastic_var_order:
+      var = self._stochastic_vars[name]
+      self.session.run(var["calc_scores_op"])
+      scores = self.session.run(var["scores"])  # (beam,dim), log probs
+      assert scores.shape[0] == self.beam_size
+      # Ended hyps are kept as they are.
+      scores[ended] = -1e30
+      scores[ended, 0] = 0.
+      scores = beam_scores[:, None] + scores
+      best = numpy.argsort(-scores.flatten(), kind="stable")[:self.beam_size]
+      src_beams, labels = numpy.divmod(best, scores.shape[1])
+      beam_scores = scores.flatten()[best]
+      for name_ in self.stochastic_var_order:
+        hyps[name_] = [list(hyps[name_][src_beam]) for src_beam in src_beams]
+      for i, src_beam in enumerate(src_beams):
+        if not ended[src_beam]:
+          hyps[name][i].append(int(labels[i]))
+      ended = ended[src_beams]
+      self.session.run(var["set_choice_op"], feed_dict={var["choice_placeholder"]: labels})
+      self.session.run(self._select_src_beams_op, feed_dict={self._src_beams: src_beams[None, :]})
+    self.session.run(self._next_step_op)
+    if self._end_flag_var is not None:
+      ended = self.session.run(self._end_flag_var).astype("bool")
+    if prev_state is not None and ended[0]:
+      self.session.run(self._set_decoder_state_op, feed_dict={
+        self._decoder_state_placeholders[name]: value for (name, value) in prev_state.items()})
+      return False
+    self.beam_scores = beam_scores
+    self.ended = ended
+    self.hyps = hyps
+    self.num_steps += 1
+    return True
+
+  def get_best_hypothesis(self, stochastic_var=None):
+    """
+    :param str|None stochastic_var: by default "output" (or the last one)
+    :return: label indices
+    :rtype: list[int]
+    """
+    if self.hyps is None:
+      return []
+    return list(self.hyps[stochastic_var or self.output_stochastic_var][0])
+
+  def get_hypotheses(self, stochastic_var=None):
+    """
+    :param str|None stochastic_var: by default "output" (or the last one)
+    :return: beam of (score, label indices), best first
+    :rtype: list[(float,list[int])]
+    """
+    if self.hyps is None:
+      return []
+    seqs = self.hyps[stochastic_var or self.output_stochastic_var]
+    return [
+      (float(self.beam_scores[i]), list(seqs[i]))
+      for i in range(self.beam_size) if self.beam_scores[i] > -1e29]
+
+
+def main(argv):
+  """
+  Main entry.
+  """
+  arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  arg_parser.add_argument("config", help="filename to config-file")
+  arg_parser.add_argument("--dataset", default="dev", help="config key or dataset dict/str")
+  arg_parser.add_argument("--rec_layer", default="output")
+  arg_parser.add_argument("--beam_size", type=int, default=12)
+  arg_parser.add_argument("--chunk_len", type=int, default=50, help="in input frames")
+  arg_parser.add_argument("--min_frames_per_label", type=int, default=0)
+  arg_parser.add_argument("--max_seqs", type=int, default=-1)
+  arg_parser.add_argument("--verbosity", default=4, type=int)
+  args = arg_parser.parse_args(argv[1:])
+  rnn.init_better_exchook()
+  rnn.init_config(config_filename=args.config, extra_updates={
+    "use_tensorflow": True,
+    "log": None,
+    "log_verbosity": args.verbosity,
+    "task": __file__,  # just extra info for the config
+  })
+  config = rnn.config
+  rnn.init_log()
+  rnn.init_backend_engine()
+  assert Util.BackendEngine.is_tensorflow_selected(), "this is only for TensorFlow"
+  rnn.init_config_json_network()
+  from TFEngine import Engine
+  from Dataset import init_dataset
+  _, model_filename = Engine.get_epoch_model(config)
+  dataset = init_dataset(config.typed_value(args.dataset) if config.has(args.dataset) else args.dataset)
+  dataset.init_seq_order(epoch=1)
+  recognizer = GrowingPrefixRecognizer(
+    config=config, rec_layer_name=args.rec_layer, beam_size=args.beam_size, model_filename=model_filename,
+    min_frames_per_label=args.min_frames_per_label)
+  input_key = recognizer.input_data.name
+  target_key = recognizer.network.extern_data.default_target
+  labels = dataset.labels.get(target_key) if dataset.labels else None
+
+  def labels_to_str(seq):
+    """
+    :param list[int] seq:
+    :rtype: str
+    """
+    if labels:
+      return " ".join([labels[idx] for idx in seq])
+    return repr(seq)
+
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx) and (args.max_seqs < 0 or seq_idx < args.max_seqs):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    features = dataset.get_data(seq_idx, input_key)
+    print("Seq %i, %s, %i frames:" % (seq_idx, dataset.get_tag(seq_idx), len(features)))
+    recognizer.reset()
+    first_label_frame = None
+    start_time = time.time()
+    for t in range(0, max(len(features), 1), args.chunk_len):
+      chunk_start_time = time.time()
+      hyp = recognizer.feed(
+        features[t:t + args.chunk_len], final=t + args.chunk_len >= len(features))
+      if hyp and first_label_frame is None:
+        first_label_frame = min(t + args.chunk_len, len(features))
+      print("  frames %i, %.3f secs: %s" % (
+        min(t + args.chunk_len, len(features)), time.time() - chunk_start_time, labels_to_str(hyp)))
+    print("  final: %s" % labels_to_str(recognizer.get_best_hypothesis()))
+    print("  total %.3f secs, first label after %s frames" % (time.time() - start_time, first_label_frame))
+    seq_idx += 1
+  recognizer.close()
+  rnn.finalize()
+
+
+if __name__ == '__main__':
+  main(sys.argv)